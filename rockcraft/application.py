@@ -24,7 +24,7 @@ from craft_application import Application, AppMetadata, errors
 from typing_extensions import override
 
 from rockcraft import plugins
-from rockcraft.models import project
+from rockcraft.models import config, project
 
 if TYPE_CHECKING:
     from craft_parts.plugins.plugins import PluginType
@@ -33,6 +33,7 @@ APP_METADATA = AppMetadata(
     name="rockcraft",
     summary="A tool to create OCI images",
     ProjectClass=project.Project,
+    ConfigModel=config.RockcraftConfig,
     source_ignore_patterns=["*.rock"],
     docs_url="https://documentation.ubuntu.com/rockcraft/{version}",
     check_supported_base=True,
@@ -47,9 +48,15 @@ class Rockcraft(Application):
     @override
     def _configure_services(self, provider_name: str | None) -> None:
         self.services.update_kwargs(
-            "image", work_dir=self._work_dir, project_dir=self.project_dir
+            "image",
+            work_dir=self._work_dir,
+            project_dir=self.project_dir,
+            blob_cache_dir=self.cache_dir / "image-blobs",
         )
         self.services.update_kwargs("init", default_name="my-rock-name")
+        self.services.update_kwargs(
+            "package", layer_cache_dir=self._work_dir / "layer-cache"
+        )
         super()._configure_services(provider_name)
 
     @override
@@ -0,0 +1,231 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Local caches of the layer and image blobs used by Rockcraft."""
+
+import json
+import os
+import shutil
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from craft_cli import emit
+
+# Bump when the cache keys or the entry format change.
+CACHE_VERSION = 1
+
+DEFAULT_MAX_SIZE = 2 * 1024**3
+
+DEFAULT_BLOB_CACHE_MAX_SIZE = 10 * 1024**3
+
+_BLOB_NAME = "blob"
+_METADATA_NAME = "metadata.json"
+
+
+@dataclass(frozen=True)
+class CachedBlob:
+    """A blob found in the cache.
+
+    :param path: The path to the cached blob. It must not be modified.
+    :param metadata: The metadata stored along with the blob.
+    """
+
+    path: Path
+    metadata: dict[str, Any]
+
+
+class LayerCache:
+    """A size-bounded cache of layer blobs, keyed by the fingerprint of their inputs.
+
+    Each entry is a directory holding the blob and its metadata. The entries that
+    were least recently used are evicted when the blobs take more than
+    ``max_size`` bytes.
+
+    :param directory: The directory holding the cache.
+    :param max_size: The maximum total size of the cached blobs, in bytes.
+    """
+
+    def __init__(self, directory: Path, *, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.directory = directory / f"v{CACHE_VERSION}"
+        self.max_size = max_size
+
+    def get(self, key: str) -> CachedBlob | None:
+        """Get the blob stored with ``key``, marking it as recently used.
+
+        :param key: The fingerprint of the blob's inputs.
+        :returns: The cached blob, or None if there is no valid entry for ``key``.
+        """
+        entry_dir = self.directory / key
+        blob = entry_dir / _BLOB_NAME
+        metadata_file = entry_dir / _METADATA_NAME
+        try:
+            metadata = json.loads(metadata_file.read_text())
+        except (OSError, ValueError):
+            return None
+        if not blob.is_file():
+            return None
+
+        metadata_file.touch()
+        return CachedBlob(path=blob, metadata=metadata)
+
+    def put(self, key: str, blob: Path, metadata: dict[str, Any]) -> None:
+        """Store a copy of ``blob`` with ``key``, evicting old entries if needed.
+
+        :param key: The fingerprint of the blob's inputs.
+        :param blob: The blob to store. It is hard-linked into the cache when
+            possible, so it must not be modified afterwards.
+        :param metadata: JSON-serializable data to store along with the blob.
+        """
+        if blob.stat().st_size > self.max_size:
+            emit.debug(f"Not caching {blob}, as it is larger than the cache")
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry_dir = self.directory / key
+        temp_dir = self.directory / f".{key}.{os.getpid()}"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        temp_dir.mkdir()
+        try:
+            link_or_copy(blob, temp_dir / _BLOB_NAME)
+            (temp_dir / _METADATA_NAME).write_text(json.dumps(metadata))
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            temp_dir.rename(entry_dir)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        emit.debug(f"Cached {blob} as {key}")
+        self._evict()
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries until the cache fits its size."""
+        entries: list[tuple[float, int, Path]] = []
+        for entry_dir in self.directory.iterdir():
+            try:
+                used = (entry_dir / _METADATA_NAME).stat().st_mtime
+                size = (entry_dir / _BLOB_NAME).stat().st_size
+            except OSError:
+                # Incomplete entries (or other processes' temporary directories).
+                continue
+            entries.append((used, size, entry_dir))
+
+        _evict_oldest(entries, self.max_size, cache_name="the layer cache")
+
+
+class BlobCache:
+    """A size-bounded, content-addressable store of image blobs.
+
+    The blobs are stored by digest in the layout of an OCI "shared blob
+    directory" (``<algorithm>/<hex>``), so that image copy tools can read and
+    write them directly. Blobs are hard-linked into the OCI layouts that use
+    them, so evicting a blob never affects an existing layout.
+
+    :param directory: The directory holding the cache.
+    :param max_size: The maximum total size of the cached blobs, in bytes.
+    """
+
+    def __init__(
+        self, directory: Path, *, max_size: int = DEFAULT_BLOB_CACHE_MAX_SIZE
+    ) -> None:
+        self.directory = directory / f"v{CACHE_VERSION}"
+        self.max_size = max_size
+
+    def get_path(self, digest: str) -> Path:
+        """Get the path of the blob with ``digest``, which may not exist.
+
+        :param digest: The blob digest, in ``<algorithm>:<hex>`` format.
+        """
+        algorithm, _, encoded = digest.partition(":")
+        if not encoded or "/" in digest or algorithm.startswith("."):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        return self.directory / algorithm / encoded
+
+    def link_to(self, digests: Iterable[str], blobs_path: Path) -> None:
+        """Link cached blobs into the blobs directory of an OCI layout.
+
+        The linked blobs are marked as recently used.
+
+        :param digests: The digests of the blobs to link.
+        :param blobs_path: The ``blobs`` directory of the OCI layout.
+        """
+        now = time.time()
+        for digest in digests:
+            cached = self.get_path(digest)
+            dest = blobs_path / cached.parent.name / cached.name
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            if not dest.exists():
+                link_or_copy(cached, dest)
+            os.utime(cached, (now, now))
+
+    def evict(self, *, keep: Iterable[str] = ()) -> None:
+        """Remove the least recently used blobs until the cache fits its size.
+
+        :param keep: The digests of blobs that must not be removed.
+        """
+        if not self.directory.is_dir():
+            return
+
+        kept = {self.get_path(digest) for digest in keep}
+        entries: list[tuple[float, int, Path]] = []
+        for algorithm_dir in self.directory.iterdir():
+            # Skip the staging layouts of image copies in progress.
+            if not algorithm_dir.is_dir() or algorithm_dir.name.startswith("."):
+                continue
+            for blob in algorithm_dir.iterdir():
+                try:
+                    stat = blob.stat()
+                except OSError:
+                    continue
+                if blob in kept:
+                    # Count it, but never evict it.
+                    entries.append((float("inf"), stat.st_size, blob))
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, blob))
+
+        _evict_oldest(entries, self.max_size, cache_name="the image blob cache")
+
+
+def _evict_oldest(
+    entries: list[tuple[float, int, Path]], max_size: int, *, cache_name: str
+) -> None:
+    """Remove the oldest entries until the total size is at most ``max_size``.
+
+    :param entries: The last use time, size and path of each cache entry.
+    :param max_size: The maximum total size of the entries, in bytes.
+    :param cache_name: The name of the cache, for logging.
+    """
+    total_size = sum(size for _, size, _ in entries)
+    entries.sort()
+    while total_size > max_size and entries:
+        used, size, path = entries.pop(0)
+        if used == float("inf"):
+            break
+        emit.debug(f"Evicting {path.name} from {cache_name}")
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+        total_size -= size
+
+
+def link_or_copy(source: Path, destination: Path) -> None:
+    """Hard-link ``source`` to ``destination``, or copy it across filesystems."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
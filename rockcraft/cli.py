@@ -34,7 +34,11 @@ COMMAND_GROUPS: list[CommandGroup] = [
             commands.ExpandExtensionsCommand,
         ],
     ),
-    CommandGroup("Lifecycle", [appcommands.TestCommand, appcommands.RemoteBuild]),
+    CommandGroup(
+        "Lifecycle",
+        [commands.PackCommand, appcommands.TestCommand, appcommands.RemoteBuild],
+    ),
+    CommandGroup("Publishing", [commands.PushCommand]),
 ]
 
 
@@ -21,9 +21,13 @@ from .extensions import (
     ExtensionsCommand,
     ListExtensionsCommand,
 )
+from .pack import PackCommand
+from .push import PushCommand
 
 __all__ = [
     "ExpandExtensionsCommand",
     "ExtensionsCommand",
     "ListExtensionsCommand",
+    "PackCommand",
+    "PushCommand",
 ]
@@ -0,0 +1,150 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Rockcraft's pack command."""
+
+import argparse
+import pathlib
+from typing import TYPE_CHECKING, Any, cast
+
+from craft_application import util
+from craft_application.commands import lifecycle
+from craft_cli import emit
+from typing_extensions import override
+
+from rockcraft import timing
+from rockcraft.compression import LayerCompression
+
+if TYPE_CHECKING:
+    from rockcraft.services import RockcraftPackageService
+
+
+def _layer_compression(value: str) -> LayerCompression:
+    """Parse the value of the ``--compression`` option."""
+    try:
+        return LayerCompression.from_string(value)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err)) from err
+
+
+class PackCommand(lifecycle.PackCommand):
+    """Pack the rock, optionally overriding the layer compression.
+
+    With ``--multi-arch``, the rocks of all the platforms are also combined into
+    a single rock, once every platform is packed. The platforms are still built
+    one after the other, each with its own base. With ``--oci-layout``, each
+    rock is written as an OCI image layout directory instead of an archive. With
+    ``--coalesce-layers``, the files generated by Rockcraft go in a single layer.
+    With ``--timings``, the time taken by each phase of the build is written as
+    a Chrome trace.
+    """
+
+    @override
+    def _fill_parser(self, parser: argparse.ArgumentParser) -> None:
+        super()._fill_parser(parser)
+
+        parser.add_argument(
+            "--compression",
+            type=_layer_compression,
+            metavar="ALGORITHM[:LEVEL]",
+            help=(
+                "Compression for the rock's layers: 'gzip' or 'zstd', optionally "
+                "followed by a level (e.g. 'zstd:19'). Overrides the project's "
+                "'compression' key."
+            ),
+        )
+        parser.add_argument(
+            "--coalesce-layers",
+            action="store_true",
+            help=(
+                "Add the rock's user, Pebble layer and metadata as a single layer, "
+                "instead of one layer each."
+            ),
+        )
+        parser.add_argument(
+            "--timings",
+            type=pathlib.Path,
+            metavar="FILE",
+            help=(
+                "Write the time taken by each phase of the build to FILE, as a "
+                "Chrome trace that can be loaded in Perfetto or chrome://tracing."
+            ),
+        )
+        output_group = parser.add_mutually_exclusive_group()
+        output_group.add_argument(
+            "--multi-arch",
+            action="store_true",
+            help=(
+                "Also combine the rocks of all the built platforms into a single "
+                "multi-architecture rock, once they are all packed."
+            ),
+        )
+        output_group.add_argument(
+            "--oci-layout",
+            action="store_true",
+            help=(
+                "Write each rock as an OCI image layout directory, instead of "
+                "a .rock archive."
+            ),
+        )
+
+    @override
+    def _run(
+        self,
+        parsed_args: argparse.Namespace,
+        step_name: str | None = None,
+        **kwargs: Any,
+    ) -> None:
+        super()._run(parsed_args, step_name=step_name, **kwargs)
+
+        # Managed instances only build one platform: the rocks are combined by
+        # the process that ran them all.
+        if getattr(parsed_args, "multi_arch", False) and not util.is_managed_mode():
+            package_service = cast(
+                "RockcraftPackageService", self._services.get("package")
+            )
+            output_dir = getattr(parsed_args, "output", pathlib.Path())
+            rock = package_service.pack_multi_arch(output_dir)
+            emit.progress(f"Packed {rock.name}", permanent=True)
+
+    @override
+    def _run_real(
+        self,
+        parsed_args: argparse.Namespace,
+        step_name: str | None = None,
+    ) -> None:
+        package_service = cast("RockcraftPackageService", self._services.get("package"))
+        compression = getattr(parsed_args, "compression", None)
+        if compression is not None:
+            package_service.set_layer_compression(compression)
+        if getattr(parsed_args, "oci_layout", False):
+            package_service.enable_oci_layout()
+        if getattr(parsed_args, "coalesce_layers", False):
+            package_service.enable_layer_coalescing()
+
+        timings = getattr(parsed_args, "timings", None)
+        if timings is None:
+            super()._run_real(parsed_args, step_name=step_name)
+            return
+
+        timing.enable()
+        try:
+            with timing.span("pack", "command", step=step_name or "pack"):
+                super()._run_real(parsed_args, step_name=step_name)
+        finally:
+            timing.write(timings)
+            timing.disable()
+            emit.progress(f"Wrote timings to {timings}", permanent=True)
@@ -0,0 +1,93 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Rockcraft's push command."""
+
+import argparse
+import pathlib
+import tempfile
+import textwrap
+
+from craft_application.commands import AppCommand
+from craft_cli import emit
+from typing_extensions import override
+
+from rockcraft import oci
+
+
+class PushCommand(AppCommand):
+    """Push a rock to an OCI registry."""
+
+    name = "push"
+    help_msg = "Push a rock to an OCI registry."
+    overview = textwrap.dedent(
+        """
+        Push a rock, or an OCI layout created with "pack --oci-layout", to an
+        OCI registry, like "registry.example.com/my-rock:1.0".
+
+        Blobs that the registry already has are not uploaded again. With
+        --mount-from, blobs are also mounted from another repository of the
+        registry when it has them, such as a mirror of the rock's base.
+
+        The credentials for the registry are read from the ROCKCRAFT_REGISTRY_USERNAME
+        and ROCKCRAFT_REGISTRY_PASSWORD environment variables, if set.
+        """
+    )
+
+    @override
+    def fill_parser(self, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "rock",
+            type=pathlib.Path,
+            help="The .rock file or OCI layout directory to push.",
+        )
+        parser.add_argument(
+            "destination",
+            help="The image to push to, as <registry>/<repository>[:<tag>].",
+        )
+        parser.add_argument(
+            "--mount-from",
+            metavar="REPOSITORY",
+            help="A repository of the same registry to mount existing blobs from.",
+        )
+
+    @override
+    def run(self, parsed_args: argparse.Namespace) -> None:
+        config = self._services.get("config")
+        username = config.get("registry_username")
+        password = config.get("registry_password")
+        credentials = (username, password or "") if username else None
+        destination = parsed_args.destination.removeprefix("docker://")
+
+        with tempfile.TemporaryDirectory(prefix="rockcraft-push-") as temp_dir:
+            rock: pathlib.Path = parsed_args.rock
+            if rock.is_dir():
+                image = oci.Image.from_oci_layout(rock)
+            else:
+                emit.progress(f"Reading {rock.name}")
+                image = oci.Image.from_oci_archive(
+                    rock, image_dir=pathlib.Path(temp_dir)
+                )
+
+            emit.progress(f"Pushing {rock.name} to {destination}")
+            digest = image.to_registry(
+                image.image_name.split(":", 1)[1],
+                destination,
+                mount_from=parsed_args.mount_from,
+                credentials=credentials,
+            )
+
+        emit.message(f"Pushed {rock.name} to {destination} ({digest})")
@@ -0,0 +1,261 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Multi-threaded compression of rock layers."""
+
+import contextlib
+import os
+import struct
+import zlib
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from types import TracebackType
+from typing import BinaryIO, Literal, cast, get_args
+
+import zstandard
+from typing_extensions import Self
+
+Algorithm = Literal["gzip", "zstd"]
+
+MEDIA_TYPES: dict[str, str] = {
+    "gzip": "application/vnd.oci.image.layer.v1.tar+gzip",
+    "zstd": "application/vnd.oci.image.layer.v1.tar+zstd",
+}
+
+# The gzip default is the level used by umoci (Go's gzip.DefaultCompression),
+# and the zstd default is the one used by the zstd CLI.
+DEFAULT_LEVELS: dict[str, int] = {"gzip": 6, "zstd": 3}
+
+LEVEL_RANGES: dict[str, tuple[int, int]] = {"gzip": (1, 9), "zstd": (1, 22)}
+
+# The amount of uncompressed data that each gzip worker compresses at a time.
+GZIP_BLOCK_SIZE = 1024 * 1024
+
+# The size of the deflate window; each gzip block is primed with this much
+# data from the end of the previous block, so the ratio is close to the one
+# of a single-threaded stream.
+_GZIP_DICT_SIZE = 32 * 1024
+
+
+@dataclass(frozen=True)
+class LayerCompression:
+    """The compression algorithm and level used for new layer blobs.
+
+    :param algorithm: Either "gzip" or "zstd".
+    :param level: The compression level. If None, the algorithm's default is used.
+    """
+
+    algorithm: Algorithm = "gzip"
+    level: int | None = None
+
+    def __post_init__(self) -> None:
+        if self.algorithm not in get_args(Algorithm):
+            raise ValueError(
+                f"unknown compression algorithm {self.algorithm!r}, "
+                f"must be one of: {', '.join(get_args(Algorithm))}"
+            )
+        if self.level is not None:
+            low, high = LEVEL_RANGES[self.algorithm]
+            if not low <= self.level <= high:
+                raise ValueError(
+                    f"{self.algorithm} compression level must be between "
+                    f"{low} and {high}, got {self.level}"
+                )
+
+    def __str__(self) -> str:
+        return f"{self.algorithm}:{self.compression_level}"
+
+    @classmethod
+    def from_string(cls, value: str) -> "LayerCompression":
+        """Create a LayerCompression from an ``algorithm[:level]`` string.
+
+        :raises ValueError: If the algorithm or the level are invalid.
+        """
+        algorithm, _, level = value.partition(":")
+        try:
+            level_value = int(level) if level else None
+        except ValueError:
+            raise ValueError(f"invalid compression level {level!r}") from None
+        return cls(algorithm=cast(Algorithm, algorithm), level=level_value)
+
+    @property
+    def compression_level(self) -> int:
+        """The effective compression level."""
+        if self.level is None:
+            return DEFAULT_LEVELS[self.algorithm]
+        return self.level
+
+    @property
+    def media_type(self) -> str:
+        """The OCI media type of layers compressed with this algorithm."""
+        return MEDIA_TYPES[self.algorithm]
+
+    @contextlib.contextmanager
+    def open_writer(
+        self, fileobj: BinaryIO, *, threads: int | None = None
+    ) -> Iterator[BinaryIO]:
+        """Open a writer that compresses into ``fileobj`` using multiple threads.
+
+        The compressed stream is complete once the context manager exits;
+        ``fileobj`` itself is not closed.
+
+        :param fileobj: The binary stream receiving the compressed data.
+        :param threads: The number of compression threads. Defaults to the
+            number of available processors.
+        """
+        threads = threads or os.cpu_count() or 1
+
+        if self.algorithm == "zstd":
+            # Always use zstd's multi-threaded mode (even with a single worker):
+            # its output does not depend on the number of workers, unlike the
+            # single-threaded mode's.
+            compressor = zstandard.ZstdCompressor(
+                level=self.compression_level, threads=threads
+            )
+            with compressor.stream_writer(fileobj, closefd=False) as zstd_writer:
+                yield cast(BinaryIO, zstd_writer)
+            return
+
+        with ParallelGzipWriter(
+            fileobj, level=self.compression_level, threads=threads
+        ) as gzip_writer:
+            yield cast(BinaryIO, gzip_writer)
+
+
+class ParallelGzipWriter:
+    """Write-only file object producing a gzip stream with multiple threads.
+
+    As in pigz, the input is split into blocks that are deflated concurrently,
+    each one primed with the last 32KiB of the previous block and ended with a
+    sync flush, so that the concatenated blocks form a single valid gzip member.
+    The output only depends on the input, the level and the block size, never
+    on the number of threads.
+
+    :param fileobj: The binary stream receiving the compressed data.
+    :param level: The deflate compression level.
+    :param threads: The number of compression threads.
+    :param block_size: The amount of uncompressed data in each block.
+    """
+
+    def __init__(
+        self,
+        fileobj: BinaryIO,
+        *,
+        level: int,
+        threads: int,
+        block_size: int = GZIP_BLOCK_SIZE,
+    ) -> None:
+        self._fileobj = fileobj
+        self._level = level
+        self._block_size = block_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="rockcraft-gzip"
+        )
+        # Bound the memory use by only keeping a few blocks in flight.
+        self._max_pending = threads * 2
+        self._pending: deque[Future[bytes]] = deque()
+        self._buffer = bytearray()
+        self._dictionary = b""
+        self._crc = 0
+        self._size = 0
+        self._closed = False
+
+        self._fileobj.write(_gzip_header(level))
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._closed = True
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def write(self, data: bytes) -> int:
+        """Queue ``data`` for compression."""
+        if self._closed:
+            raise ValueError("write to closed file")
+
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[: self._block_size])
+            del self._buffer[: self._block_size]
+            self._submit(block, last=False)
+        return len(data)
+
+    def flush(self) -> None:
+        """Do nothing; blocks are written out as soon as they are compressed."""
+
+    def close(self) -> None:
+        """Compress the remaining data and write the gzip trailer."""
+        if self._closed:
+            return
+        self._closed = True
+
+        try:
+            self._submit(bytes(self._buffer), last=True)
+            self._buffer.clear()
+            while self._pending:
+                self._fileobj.write(self._pending.popleft().result())
+            self._fileobj.write(struct.pack("<II", self._crc, self._size & 0xFFFFFFFF))
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, block: bytes, *, last: bool) -> None:
+        self._crc = zlib.crc32(block, self._crc)
+        self._size += len(block)
+        self._pending.append(
+            self._executor.submit(
+                _deflate_block, block, self._level, self._dictionary, last=last
+            )
+        )
+        self._dictionary = block[-_GZIP_DICT_SIZE:]
+
+        while len(self._pending) > self._max_pending:
+            self._fileobj.write(self._pending.popleft().result())
+
+
+def _gzip_header(level: int) -> bytes:
+    """Create a reproducible gzip header (no file name and a zero mtime)."""
+    # Use the same "extra flags" as Python's gzip module.
+    if level == 9:  # noqa: PLR2004 (magic value)
+        extra_flags = 2
+    elif level == 1:
+        extra_flags = 4
+    else:
+        extra_flags = 0
+    # ID1, ID2, CM=deflate, FLG=0, MTIME=0, XFL, OS=unknown
+    return struct.pack("<BBBBIBB", 0x1F, 0x8B, 8, 0, 0, extra_flags, 255)
+
+
+def _deflate_block(block: bytes, level: int, dictionary: bytes, *, last: bool) -> bytes:
+    """Deflate ``block`` as a chunk of a larger raw deflate stream."""
+    if dictionary:
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary
+        )
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(block)
+    return data + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
@@ -43,9 +43,21 @@ class ProjectLoadError(RockcraftError):
     """Error loading rockcraft.yaml."""
 
 
+class BaseLockError(RockcraftError):
+    """Error when the base image does not match the project's lock file."""
+
+
+class RegistryError(RockcraftError):
+    """Error when communicating with an OCI registry."""
+
+
 class LayerArchivingError(RockcraftError):
     """Error when creating the archive for the new layer."""
 
 
+class ImageExtractionError(RockcraftError):
+    """Error when unpacking an image's layers to a root filesystem."""
+
+
 class ExtensionError(RockcraftError):
     """Error related to extension handling."""
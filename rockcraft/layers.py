@@ -16,10 +16,22 @@
 
 """Handling of files and directories for rocks image layers."""
 
+import errno
+import functools
+import hashlib
+import json
 import os
+import posixpath
+import stat
 import tarfile
-from collections import defaultdict
+import time
+from collections import defaultdict, deque
+from collections.abc import Iterator
+from collections.abc import Set as AbstractSet
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Any, BinaryIO, cast
 
 from craft_cli import emit
 from craft_parts.executor.collisions import paths_collide
@@ -27,35 +39,366 @@ from craft_parts.overlays import overlays
 from craft_parts.permissions import Permissions
 
 from rockcraft import errors
+from rockcraft.rootfs import RootfsEntry, RootfsIndex, file_sha256
+
+_SCAN_AHEAD = 16
+"""The number of directories scanned ahead of the walk, at each level of the tree."""
+
+_MAX_ALIAS_DEPTH = 4
+"""The number of symlinks to directories that a path of a new layer is looked up
+through, to find the directories that are symlinks in the base (like ``lib/x``,
+when ``lib`` and ``usr/lib/x`` are symlinks)."""
+
+_FINGERPRINT_AHEAD = 64
+"""The number of files hashed ahead of the fingerprint of a layer."""
 
 
 def archive_layer(
     new_layer_dir: Path,
-    temp_tar_file: Path,
+    temp_tar_file: Path | BinaryIO,
     base_layer_dir: Path | None = None,
+    *,
+    base_index: RootfsIndex | None = None,
+    include: AbstractSet[str] | None = None,
+    exclude: AbstractSet[str] = frozenset(),
 ) -> None:
     """Prepare new OCI layer by archiving its content into tar file.
 
     :param new_layer_dir: path to the content to be archived into a layer.
-    :param temp_tar_file: path to the temporary tar file holding the archived content.
+    :param temp_tar_file: path to the temporary tar file holding the archived content,
+        or a writable binary stream that the tar content is written into sequentially.
     :param base_layer_dir: optional path to the filesystem containing the extracted
         base below this new layer. Used to preserve lower-level directory symlinks,
         like the ones from Debian/Ubuntu's usrmerge.
+    :param base_index: optional index of ``base_layer_dir``, queried instead of
+        the filesystem.
+    :param include: optional paths, relative to ``new_layer_dir``, to archive
+        instead of all of its contents. The parent directories of archived
+        paths are always archived.
+    :param exclude: paths, relative to ``new_layer_dir``, not to archive.
     """
-    candidates = _gather_layer_paths(new_layer_dir, base_layer_dir)
-    layer_paths = _merge_layer_paths(candidates)
-
-    with tarfile.open(temp_tar_file, mode="w") as tar_file:
-        # Iterate on sorted keys, so that the directories are always listed before
-        # any files that they contain (otherwise tools like Docker might choke on
-        # the layer tarball).
-        for arcname in sorted(layer_paths):
-            filepath = layer_paths[arcname]
+    layer_paths = collect_layer_paths(
+        new_layer_dir,
+        base_layer_dir,
+        base_index=base_index,
+        include=include,
+        exclude=exclude,
+    )
+    write_layer(layer_paths, temp_tar_file)
+
+
+class LayerPaths:
+    """The contents of a layer, listed in the order they are archived.
+
+    The paths are not stored: each iteration walks ``new_layer_dir`` again and
+    yields the name of each entry in the layer along with its path. Besides the
+    names of the archived entries, the memory used depends on the depth and the
+    width of the tree, not on its number of files.
+
+    See ``archive_layer()`` for the parameters.
+    """
+
+    def __init__(
+        self,
+        new_layer_dir: Path,
+        base_layer_dir: Path | None = None,
+        *,
+        base_index: RootfsIndex | None = None,
+        include: AbstractSet[str] | None = None,
+        exclude: AbstractSet[str] = frozenset(),
+    ) -> None:
+        self._new_layer_dir = new_layer_dir
+        self._base_layer_dir = base_layer_dir
+        self._base_index = base_index
+        self._include = include
+        self._exclude = exclude
+
+    def __iter__(self) -> Iterator[tuple[str, Path]]:
+        with ThreadPoolExecutor(thread_name_prefix="rockcraft-scan") as executor:
+            walker = _LayerWalker(
+                self._new_layer_dir,
+                base_index=self._base,
+                include=self._include,
+                exclude=self._exclude,
+                executor=executor,
+            )
+            yield from walker.walk()
+
+    @functools.cached_property
+    def _base(self) -> RootfsIndex | None:
+        """The index of the base layer, built from ``base_layer_dir`` if needed."""
+        if self._base_index is not None or self._base_layer_dir is None:
+            return self._base_index
+        emit.debug(f"Indexing base layer directory {self._base_layer_dir}")
+        return RootfsIndex.build(self._base_layer_dir, digest="")
+
+    @functools.cached_property
+    def directory_mtime(self) -> int | None:
+        """The mtime used for all the directories of a partial layer.
+
+        The directories in the prime directory are recreated on each build, and
+        their mtimes change when other parts add entries to them, but a partial
+        layer's digest should only depend on its own files. Its directories get
+        the newest mtime of its other entries instead.
+        """
+        if self._include is None and not self._exclude:
+            return None
+        return max(
+            (int(path.lstat().st_mtime) for _, path in self if not _is_real_dir(path)),
+            default=0,
+        )
+
+
+def collect_layer_paths(
+    new_layer_dir: Path,
+    base_layer_dir: Path | None = None,
+    *,
+    base_index: RootfsIndex | None = None,
+    include: AbstractSet[str] | None = None,
+    exclude: AbstractSet[str] = frozenset(),
+) -> LayerPaths:
+    """Get the paths that make up a new layer, without archiving them.
+
+    See ``archive_layer()`` for the parameters.
+    """
+    return LayerPaths(
+        new_layer_dir,
+        base_layer_dir,
+        base_index=base_index,
+        include=include,
+        exclude=exclude,
+    )
+
+
+def write_layer(layer_paths: LayerPaths, temp_tar_file: Path | BinaryIO) -> None:
+    """Archive the paths collected by ``collect_layer_paths()`` into a tar file.
+
+    See ``archive_layer()`` for the parameters.
+    """
+    directory_mtime = layer_paths.directory_mtime
+    # When writing into a stream the target is never seeked, so it can be a
+    # compressor or a hashing pipe.
+    with (
+        tarfile.open(temp_tar_file, mode="w")
+        if isinstance(temp_tar_file, Path)
+        else tarfile.open(fileobj=temp_tar_file, mode="w|")
+    ) as tar_file:
+        # The entries come sorted by name, so that the directories are always
+        # listed before any files that they contain (otherwise tools like Docker
+        # might choke on the layer tarball).
+        for arcname, filepath in layer_paths:
             emit.debug(f"Adding to layer: {filepath} as '{arcname}'")
-            tar_file.add(filepath, arcname=arcname, recursive=False)
+            # The tar file keeps track of the inodes it archived, so a file that
+            # is hard-linked to an earlier entry is added as a link to it.
+            tar_info = tar_file.gettarinfo(filepath, arcname=arcname)
+            if not tar_info.isreg():
+                if directory_mtime is not None and tar_info.isdir():
+                    tar_info.mtime = directory_mtime
+                tar_file.addfile(tar_info)
+                continue
+
+            with filepath.open("rb") as file:
+                data_regions = _get_data_regions(file, tar_info.size)
+                if data_regions is None:
+                    tar_file.addfile(tar_info, file)
+                else:
+                    _add_sparse_file(tar_file, tar_info, file, data_regions)
+
+
+def _get_data_regions(file: BinaryIO, size: int) -> list[tuple[int, int]] | None:
+    """Get the regions of a sparse file that hold data.
+
+    :param file: The open file.
+    :param size: The apparent size of the file.
+    :returns: The offset and size of each data region, or None if the file
+        isn't sparse (or holes can't be detected on this system).
+    """
+    file_stat = os.fstat(file.fileno())
+    if not hasattr(os, "SEEK_DATA") or file_stat.st_blocks * 512 >= size:
+        return None
+
+    regions: list[tuple[int, int]] = []
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(file.fileno(), offset, os.SEEK_DATA)
+            except OSError as err:
+                if err.errno == errno.ENXIO:  # only a hole until the end
+                    break
+                raise
+            offset = min(os.lseek(file.fileno(), start, os.SEEK_HOLE), size)
+            regions.append((start, offset - start))
+    except OSError:
+        return None
+    finally:
+        file.seek(0)
+
+    if regions == [(0, size)]:
+        return None
+    if offset < size:
+        # Like GNU tar, end a trailing hole with an empty region, as some
+        # extractors only extend the file up to the end of the last region.
+        regions.append((size, 0))
+    return regions
+
+
+def _add_sparse_file(
+    tar_file: tarfile.TarFile,
+    tar_info: tarfile.TarInfo,
+    file: BinaryIO,
+    data_regions: list[tuple[int, int]],
+) -> None:
+    """Add a sparse file to a tar file, without the contents of its holes.
 
+    The file is stored in the GNU sparse format 1.0 for pax archives: the entry
+    starts with a map of the data regions, followed by the data of each region.
+    Like GNU tar, the name in the header is replaced with a placeholder so that
+    tools unaware of the format don't extract the map as the file's contents.
+
+    :param tar_file: The tar file to add the file to.
+    :param tar_info: The file's tar header, as returned by ``gettarinfo()``.
+    :param file: The open file.
+    :param data_regions: The offset and size of each data region of the file.
+    """
+    sparse_map = "".join(
+        [f"{len(data_regions)}\n", *(f"{o}\n{s}\n" for o, s in data_regions)]
+    ).encode()
+    sparse_map += b"\0" * (-len(sparse_map) % tarfile.BLOCKSIZE)
+
+    name = tar_info.name
+    parent, _, basename = name.rpartition("/")
+    placeholder = f"{parent}/GNUSparseFile.0/{basename}".lstrip("/")
+    tar_info.pax_headers = {
+        "path": placeholder,
+        "GNU.sparse.major": "1",
+        "GNU.sparse.minor": "0",
+        "GNU.sparse.name": name,
+        "GNU.sparse.realsize": str(tar_info.size),
+    }
+    tar_info.name = placeholder
+    tar_info.size = len(sparse_map) + sum(size for _, size in data_regions)
+
+    emit.debug(f"Adding {name} as a sparse file with {len(data_regions)} regions")
+    tar_file.addfile(
+        tar_info, cast(BinaryIO, _SparseReader(sparse_map, file, data_regions))
+    )
+
+
+class _SparseReader:
+    """Read-only file object with the stored contents of a sparse tar entry."""
+
+    def __init__(
+        self, sparse_map: bytes, file: BinaryIO, data_regions: list[tuple[int, int]]
+    ) -> None:
+        self._pending = sparse_map
+        self._file = file
+        self._regions = iter(data_regions)
+        self._remaining = 0
+
+    def read(self, size: int) -> bytes:
+        """Read ``size`` bytes of the map and then of the data regions.
+
+        Fewer bytes are only returned at the end of the contents.
+        """
+        chunks: list[bytes] = []
+        while size > 0:
+            if self._pending:
+                data, self._pending = self._pending[:size], self._pending[size:]
+            elif self._remaining:
+                data = self._file.read(min(size, self._remaining))
+                if not data:
+                    break
+                self._remaining -= len(data)
+            else:
+                region = next(self._regions, None)
+                if region is None:
+                    break
+                offset, self._remaining = region
+                self._file.seek(offset)
+                continue
+            chunks.append(data)
+            size -= len(data)
+        return b"".join(chunks)
+
+
+def fingerprint_layer(layer_paths: LayerPaths) -> str:
+    """Compute a hash of the contents of a layer.
+
+    The entries are hashed in the order they are archived, each from its name,
+    type, mode, owner and contents (plus the target of symlinks and the first
+    entry hard-linked to it). Timestamps are ignored, so re-priming the same
+    files gives the same fingerprint.
+
+    :returns: The hex digest of the layer's entries.
+    """
+    layer_hash = hashlib.sha256()
+    # Regular files are hashed by a pool of threads, a window at a time.
+    pending: deque[tuple[list[Any], Future[str] | None]] = deque()
+    inodes: dict[tuple[int, int], str] = {}
+    count = 0
+
+    def hash_pending(limit: int) -> None:
+        while len(pending) > limit:
+            node, content_hash = pending.popleft()
+            if content_hash is not None:
+                node.append(content_hash.result())
+            layer_hash.update(json.dumps(node).encode())
+            layer_hash.update(b"\n")
+
+    with ThreadPoolExecutor(thread_name_prefix="rockcraft-fingerprint") as executor:
+        for arcname, path in layer_paths:
+            path_stat = path.lstat()
+            node: list[Any] = [
+                arcname,
+                stat.S_IFMT(path_stat.st_mode),
+                stat.S_IMODE(path_stat.st_mode),
+                path_stat.st_uid,
+                path_stat.st_gid,
+            ]
+            content_hash: Future[str] | None = None
+            if stat.S_ISREG(path_stat.st_mode):
+                if path_stat.st_nlink > 1:
+                    inode = (path_stat.st_dev, path_stat.st_ino)
+                    first = inodes.setdefault(inode, arcname)
+                    if first != arcname:
+                        node.append(["hardlink", first])
+                content_hash = executor.submit(file_sha256, path)
+            elif stat.S_ISLNK(path_stat.st_mode):
+                node.append(str(path.readlink()))
+            elif not stat.S_ISDIR(path_stat.st_mode):
+                node.append(path_stat.st_rdev)
+
+            pending.append((node, content_hash))
+            count += 1
+            hash_pending(_FINGERPRINT_AHEAD)
+        hash_pending(0)
+
+    emit.debug(f"Fingerprinted {count} layer entries")
+    return layer_hash.hexdigest()
+
+
+@dataclass(frozen=True)
+class PruneStats:
+    """Summary of a ``prune_prime_files()`` run.
+
+    :param files: The number of pruned files.
+    :param size: The total size of the pruned files, in bytes.
+    :param duration: The time spent pruning, in seconds.
+    """
 
-def prune_prime_files(prime_dir: Path, files: set[str], base_layer_dir: Path) -> None:
+    files: int
+    size: int
+    duration: float
+
+
+def prune_prime_files(
+    prime_dir: Path,
+    files: set[str],
+    base_layer_dir: Path,
+    *,
+    base_index: RootfsIndex | None = None,
+) -> PruneStats:
     """Remove (prune) files in a prime directory if they exist in the base layer.
 
     Given a set of filenames ``files``, this function will remove (prune) all those
@@ -67,183 +410,473 @@ def prune_prime_files(prime_dir: Path, files: set[str], base_layer_dir: Path) ->
     "{base_layer_dir}/dir/subdir/file1" exists and has the same contents, owner,
     group, and permission bits.
 
+    Files are first compared by their metadata (type, mode, owner and size), and
+    only the remaining candidates have their contents hashed, concurrently.
+
     :param prime_dir: The directory containing the lifecycle's primed contents.
     :param files: The set of filenames added to ``prime_dir``, as provided by
         the corresponding post_step lifecycle callback.
     :param base_layer_dir: The directory where the base layer was extracted.
+    :param base_index: An optional index of ``base_layer_dir``. If set, the
+        base layer's metadata and content hashes are taken from the index
+        instead of the filesystem.
+    :returns: How many files and bytes were pruned, and how long it took.
     """
     emit.debug("Pruning primed files that already exist on base layer...")
-    for filename in files:
-        base_layer_file = base_layer_dir / filename
-        if base_layer_file.is_file():
-            prime_file = prime_dir / filename
-            if _all_compatible_files([base_layer_file, prime_file]):
-                emit.debug(f"Pruning: {prime_file} as it exists on the base")
-                prime_file.unlink()
-            else:
-                emit.debug(
-                    f"{prime_file} exists on the base but with different contents or permissions"
-                )
+    start = time.monotonic()
 
+    prunable: list[str] = []
+    to_compare: list[str] = []
+    for filename in sorted(files):
+        base_file = _get_base_file(filename, base_layer_dir, base_index)
+        if base_file is None:
+            continue
 
-def _gather_layer_paths(
-    new_layer_dir: Path, base_layer_dir: Path | None = None
-) -> dict[str, list[Path]]:
-    """Map paths in ``new_layer_dir`` to names in a layer file.
+        compatible = _compatible_metadata(prime_dir / filename, *base_file)
+        if compatible is None:
+            to_compare.append(filename)
+        elif compatible:
+            prunable.append(filename)
+        else:
+            emit.debug(
+                f"{prime_dir / filename} exists on the base but with different "
+                "contents or permissions"
+            )
 
-    See ``_archive_layer()`` for the parameters.
+    if to_compare:
+        if base_index is not None:
+            # The base's pkg-config files are read, and may not be extracted yet.
+            base_index.materialise(name for name in to_compare if name.endswith(".pc"))
+        with ThreadPoolExecutor(thread_name_prefix="rockcraft-prune") as executor:
+            same_contents = executor.map(
+                lambda name: _same_contents(
+                    prime_dir / name, name, base_layer_dir, base_index
+                ),
+                to_compare,
+            )
+            for filename, same in zip(to_compare, same_contents, strict=True):
+                if same:
+                    prunable.append(filename)
+                else:
+                    emit.debug(
+                        f"{prime_dir / filename} exists on the base but with "
+                        "different contents"
+                    )
+
+    pruned_size = 0
+    for filename in sorted(prunable):
+        prime_file = prime_dir / filename
+        emit.debug(f"Pruning: {prime_file} as it exists on the base")
+        pruned_size += prime_file.lstat().st_size
+        prime_file.unlink()
+
+    stats = PruneStats(
+        files=len(prunable), size=pruned_size, duration=time.monotonic() - start
+    )
+    emit.debug(
+        f"Pruned {stats.files} files ({stats.size} bytes) that exist on the base "
+        f"in {stats.duration:.3f}s"
+    )
+    return stats
+
+
+@dataclass(frozen=True)
+class _ScannedDir:
+    """The contents of a directory in a new layer, as seen by ``_scan_dir()``.
+
+    :param subdirs: The sorted names of the subdirectories to descend into.
+    :param redirected_subdirs: The subdirectories that are symlinks to other
+        directories in the base layer, with their targets. Their contents are
+        added to the targets.
+    :param filenames: The sorted names of all other entries, including the
+        symlinks to directories.
+    """
 
-    :return:
-      A dict where the value is a path (file or dir) in ``new_layer_dir`` and the
-      key is the name that this path should have in the tarball for the layer.
+    subdirs: list[str]
+    redirected_subdirs: dict[str, str]
+    filenames: list[str]
+
+
+@dataclass
+class _WalkFrame:
+    """A directory of the new layer, while its entries are walked.
+
+    :param prefix: The name of the directory in the layer, followed by a slash
+        (or empty, for the root directory).
+    :param events: The directory's entries (keyed by their names) and
+        subdirectories to descend into (keyed by their names and a slash), with
+        their paths relative to the new layer's directory, in sorted order.
+    :param upcoming: The paths of the subdirectories that are not scanned yet,
+        in the order they are walked.
+    :param scans: The scans of the subdirectories scanned ahead of the walk.
+    :param deferred: The entries of subdirectories that were not selected,
+        which are only archived if one of their entries is.
+    :param entry: The directory's own deferred entry, if any.
     """
-    # pylint: disable=too-many-locals
-
-    class LayerLinker:
-        """Helper to keep track of paths between the upper and lower layer."""
-
-        upper_prefix: str = ""
-        lower_prefix: str = ""
-
-        def reset(self, upper_prefix: str, lower_prefix: str) -> None:
-            """Set a correspondence between a path in the upper layer and a path the lower layer.
-
-            For example, if in the lower layer `bin` is a symlink to `usr/bin`,
-            calling ``reset("bin", "usr/bin")`` will let this LayerLinker convert
-            upper layer paths in "bin" to "usr/bin" when calling ``get_target_path()``.
-            """
-            self.upper_prefix = upper_prefix
-            self.lower_prefix = lower_prefix
-
-        def get_target_path(self, path: Path) -> Path:
-            """Get the path that should be used when adding ``path`` to the archive.
-
-            :return:
-                If ``path`` starts with ``upper_prefix``, the returned Path is ``path``
-                with that prefix replaced with ``lower_prefix``. Otherwise, the return
-                is ``path`` unchanged.
-            """
-            if not self.upper_prefix:
-                return path
-
-            str_path = str(path)
-            if str_path.startswith(self.upper_prefix):
-                return Path(str_path.replace(self.upper_prefix, self.lower_prefix, 1))
-            return path
-
-    layer_linker = LayerLinker()
-    result: defaultdict[str, list[Path]] = defaultdict(list)
-    for dirpath, subdirs, filenames in os.walk(new_layer_dir):
-        # Sort `subdirs` in-place, to ensure that `os.walk()` iterates on
-        # them in sorted order.
-        subdirs.sort()
-
-        upper_subpath = Path(dirpath)
-
-        # The path with `new_layer_dir` as the "root"
-        relative_path = upper_subpath.relative_to(new_layer_dir)
-
-        # Handle adding an entry for the directory. We skip this IF:
-        # - The directory is the root (to skip a spurious "." entry), OR
-        # - The directory is NOT an opaque OCI entry AND
-        # - The directory's exists on ``base_layer_dir`` as a symlink to another
-        #   directory (like in usrmerge).
-        if upper_subpath != new_layer_dir:
-            upper_is_not_opaque_dir = not overlays.is_oci_opaque_dir(upper_subpath)
-            lower_symlink_target = _symlink_target_in_base_layer(
-                relative_path, base_layer_dir
-            )
-            lower_is_symlink = lower_symlink_target is not None
 
-            if upper_is_not_opaque_dir and lower_is_symlink:
-                emit.debug(
-                    f"Skipping {upper_subpath} because it exists as a symlink on the lower layer"
-                )
-                layer_linker.reset(str(relative_path), str(lower_symlink_target))
-            else:
-                lower_path = layer_linker.get_target_path(relative_path)
-                result[f"{lower_path}"].append(upper_subpath)
+    prefix: str
+    events: Iterator[tuple[str, list[Path], bool]]
+    upcoming: Iterator[Path]
+    scans: dict[Path, "Future[_ScannedDir]"] = field(default_factory=dict)
+    deferred: dict[str, list[Path]] = field(default_factory=dict)
+    entry: tuple[str, list[Path]] | None = None
 
-        # Add each file in the directory.
-        for name in filenames:
-            archive_path = layer_linker.get_target_path(relative_path / name)
-            result[f"{archive_path}"].append(upper_subpath / name)
 
-        # Add each subdir in the directory if it's a symlink, because the os.walk()
-        # call will not enter them.
-        for subdir in subdirs:
-            upper_subdir_path = upper_subpath / subdir
-            if upper_subdir_path.is_symlink():
-                archive_path = layer_linker.get_target_path(relative_path / subdir)
-                result[f"{archive_path}"].append(upper_subdir_path)
+class _LayerWalker:
+    """Walk the directory of a new layer, yielding its entries in sorted order.
 
-    return result
+    Directories are walked one at a time, depth first. The entries of each one
+    are merged with the entries of all the directories that have the same name
+    in the layer (because a directory is a symlink in the base layer, like with
+    usrmerge), and sorted so that the names of the whole walk come out sorted.
+    Only the directories on the path being walked are kept in memory, along
+    with a few subdirectories that are scanned ahead by a pool of threads, and
+    the names of the entries already yielded.
 
+    See ``archive_layer()`` for the parameters.
+    """
 
-def _merge_layer_paths(candidate_paths: dict[str, list[Path]]) -> dict[str, Path]:
-    """Merge ``candidate_paths`` into a single path per name.
+    def __init__(
+        self,
+        new_layer_dir: Path,
+        *,
+        base_index: RootfsIndex | None,
+        include: AbstractSet[str] | None,
+        exclude: AbstractSet[str],
+        executor: ThreadPoolExecutor,
+    ) -> None:
+        self._new_layer_dir = new_layer_dir
+        self._base_index = base_index
+        self._include = include
+        self._exclude = exclude
+        self._executor = executor
+        # The directories that must be walked to reach the included paths.
+        self._include_parents: set[str] | None = None
+        if include is not None:
+            self._include_parents = {
+                parent for name in include for parent in _get_parents(name)
+            }
+        # The directories that are symlinks in the base layer, by target.
+        self._redirects: defaultdict[str, list[Path]] = defaultdict(list)
+        # The redirected directories found before the walk.
+        self._found_redirects: set[Path] = set()
+        # The names of the yielded entries.
+        self._yielded: set[str] = set()
+
+    def walk(self) -> Iterator[tuple[str, Path]]:
+        """Yield the name in the layer and the path of each entry to archive."""
+        self._find_redirects()
+        stack = [self._open_dir("", [Path()], parent=None)]
+        while stack:
+            frame = stack[-1]
+            event = next(frame.events, None)
+            if event is None:
+                stack.pop()
+                if not stack and self._redirects:
+                    # Only the redirects that were not found before the walk
+                    # can point to a directory that was already walked.
+                    target = min(self._redirects)
+                    emit.debug(f"Adding the entries pointing to '{target}' last")
+                    sources = self._redirects.pop(target)
+                    stack.append(self._open_dir(f"{target}/", sources, parent=None))
+                continue
+
+            key, paths, is_parent = event
+            if key.endswith("/"):
+                name = key[:-1]
+                sources = sorted(
+                    [*paths, *self._redirects.pop(frame.prefix + name, [])],
+                    key=lambda path: path.parts,
+                )
+                subdir = self._open_dir(frame.prefix + key, sources, parent=frame)
+                deferred = frame.deferred.pop(name, None)
+                if deferred is not None:
+                    subdir.entry = (frame.prefix + name, deferred)
+                self._scan_ahead(frame)
+                stack.append(subdir)
+                continue
+
+            selected = [path for path in paths if self._is_selected(path)]
+            if not selected:
+                if is_parent:
+                    frame.deferred[key] = paths
+                continue
+
+            # Parent directories are needed for the layer to be extracted with
+            # the right ownership and permissions.
+            for parent_frame in stack:
+                if parent_frame.entry is not None:
+                    yield from self._get_entry(*parent_frame.entry)
+                    parent_frame.entry = None
+            yield from self._get_entry(frame.prefix + key, selected)
+
+    def _find_redirects(self) -> None:
+        """Find the directories of the new layer that are symlinks in the base.
+
+        Their entries go in the directory their symlink points to, which can
+        come before their parent in the walk (like ``run`` for ``var/run``).
+        Finding them before the walk lets their entries be merged in order
+        with the others of the directory they point to.
+        """
+        base_index = self._base_index
+        if base_index is None:
+            return
+        symlinks = base_index.symlinks()
+        dir_symlinks: dict[str, str] = {}
+        for symlink in symlinks:
+            target = base_index.resolve(symlink)
+            entry = base_index.get(symlink)
+            if target is not None and entry is not None and entry.type == "dir":
+                dir_symlinks[symlink] = target
+
+        for symlink in symlinks:
+            for alias in sorted(_get_aliases(symlink, dir_symlinks)):
+                path = Path(alias)
+                if not self._must_walk(path) or not self._is_walked_dir(path):
+                    continue
+                if os.path.lexists(self._new_layer_dir / overlays.oci_opaque_dir(path)):
+                    continue
+                target = _symlink_target_in_base_layer(path, base_index)
+                if target is None:
+                    continue
+                self._redirects[target].append(path)
+                self._found_redirects.add(path)
+
+    def _open_dir(
+        self, prefix: str, sources: list[Path], parent: _WalkFrame | None
+    ) -> _WalkFrame:
+        """List the merged entries of the ``sources`` directories."""
+        prefetched = parent.scans if parent else {}
+        scans = [
+            prefetched.pop(source)
+            if source in prefetched
+            else self._executor.submit(self._scan, source)
+            for source in sources
+        ]
+
+        entries: defaultdict[str, list[Path]] = defaultdict(list)
+        subdirs: defaultdict[str, list[Path]] = defaultdict(list)
+        for source, scan in zip(sources, scans, strict=True):
+            scanned = scan.result()
+            for name in scanned.filenames:
+                entries[name].append(source / name)
+            for name in scanned.subdirs:
+                entries[name].append(source / name)
+                if self._must_walk(source / name):
+                    subdirs[name].append(source / name)
+            for name, target in scanned.redirected_subdirs.items():
+                subdir = source / name
+                if self._must_walk(subdir) and subdir not in self._found_redirects:
+                    self._redirects[target].append(subdir)
+
+        # The targets of redirected directories are walked even if they are not
+        # in the new layer.
+        for redirect in self._redirects:
+            if redirect.startswith(prefix):
+                name = redirect[len(prefix) :].split("/", 1)[0]
+                if name not in ("", ".", ".."):
+                    subdirs.setdefault(name, [])
+
+        events = [(name, paths, name in subdirs) for name, paths in entries.items()]
+        events.extend((f"{name}/", paths, False) for name, paths in subdirs.items())
+        events.sort(key=lambda event: event[0])
+        frame = _WalkFrame(
+            prefix=prefix,
+            events=iter(events),
+            upcoming=(
+                path for key, paths, _ in events for path in paths if key[-1:] == "/"
+            ),
+        )
+        self._scan_ahead(frame)
+        return frame
+
+    def _scan_ahead(self, frame: _WalkFrame) -> None:
+        """Start scanning the next subdirectories of ``frame``."""
+        while len(frame.scans) < _SCAN_AHEAD:
+            source = next(frame.upcoming, None)
+            if source is None:
+                break
+            frame.scans[source] = self._executor.submit(self._scan, source)
+
+    def _scan(self, relative_path: Path) -> _ScannedDir:
+        return _scan_dir(self._new_layer_dir, relative_path, self._base_index)
+
+    def _get_entry(self, name: str, paths: list[Path]) -> Iterator[tuple[str, Path]]:
+        """Merge the paths of an entry into the one to archive."""
+        full_paths = [self._new_layer_dir / path for path in paths]
+        if name in self._yielded:
+            # An entry added last, which was already yielded by the walk.
+            existing = self._new_layer_dir / name
+            if os.path.lexists(existing):
+                _merge_paths(name, [existing, *full_paths])
+            return
+        self._yielded.add(name)
+        yield name, _merge_paths(name, full_paths)
+
+    def _is_selected(self, path: Path) -> bool:
+        name = path.as_posix()
+        return (self._include is None or name in self._include) and (
+            name not in self._exclude
+        )
 
-    This function handles the case where multiple paths refer to the same name
-    in the new layer; if all paths are directories with the same ownership and
-    permissions then a single one is used (they are all equivalent). All other
-    cases (directories with different attributes, files) will raise an error.
+    def _must_walk(self, path: Path) -> bool:
+        return self._include_parents is None or path.as_posix() in self._include_parents
 
-    :return:
-        A dict where the values are Paths and the keys are the names those paths
-        correspond to in the new layer.
-    """
-    result: dict[str, Path] = {}
+    def _is_walked_dir(self, path: Path) -> bool:
+        """Whether ``path`` is a directory reached by the walk of the new layer.
 
-    for name, paths in candidate_paths.items():
-        if len(paths) == 1:
-            result[name] = paths[0]
-            continue
+        The walk doesn't follow symlinks, so neither ``path`` nor any of its
+        parents can be one.
+        """
+        full_path = self._new_layer_dir / path
+        return full_path.is_dir() and (
+            full_path.resolve() == self._new_layer_dir.resolve() / path
+        )
 
-        if _all_compatible_directories(paths):
-            emit.debug(
-                f"Multiple directories pointing to '{name}': {', '.join(map(str, paths))}"
-            )
-            result[name] = paths[0]
-            continue
 
-        if _all_compatible_files(paths):
-            emit.debug(
-                f"Multiple files pointing to '{name}': {', '.join(map(str, paths))}"
-            )
-            result[name] = paths[0]
-            continue
+def _get_aliases(path: str, symlinks: dict[str, str]) -> set[str]:
+    """Get the paths that lead to ``path`` through symlinks to directories.
+
+    :param path: A path without symlinks.
+    :param symlinks: The symlinks to directories, with the directories they
+        resolve to.
+    :returns: ``path`` and the paths it can be reached through, up to a few
+        levels of symlinks.
+    """
+    aliases = {path}
+    pending = {path}
+    for _ in range(_MAX_ALIAS_DEPTH):
+        found: set[str] = set()
+        for alias in pending:
+            for symlink, target in symlinks.items():
+                if alias.startswith(f"{target}/"):
+                    found.add(symlink + alias[len(target) :])
+        pending = found - aliases
+        if not pending:
+            break
+        aliases.update(pending)
+    return aliases
+
+
+def _get_parents(name: str) -> Iterator[str]:
+    """Get the parent directories of a relative path, as strings."""
+    parent = name.rpartition("/")[0]
+    while parent:
+        yield parent
+        parent = parent.rpartition("/")[0]
+
+
+def _scan_dir(
+    new_layer_dir: Path,
+    relative_path: Path,
+    base_index: RootfsIndex | None,
+) -> _ScannedDir:
+    """Scan a single directory of a new layer.
+
+    The file types come from the directory entries, so in most filesystems
+    no extra ``stat()`` calls are needed. Like ``os.walk()``, symlinks to
+    directories are not followed.
+    """
+    subdirs: list[str] = []
+    redirected_subdirs: dict[str, str] = {}
+    filenames: list[str] = []
+
+    try:
+        with os.scandir(new_layer_dir / relative_path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                if not is_dir or entry.is_symlink():
+                    filenames.append(entry.name)
+                    continue
+
+                # Skip the directories that exist as symlinks to other
+                # directories on the base layer (like with usrmerge), unless
+                # they are opaque OCI entries.
+                subdir = relative_path / entry.name
+                target = _symlink_target_in_base_layer(subdir, base_index)
+                if target is not None and not os.path.lexists(
+                    new_layer_dir / overlays.oci_opaque_dir(subdir)
+                ):
+                    emit.debug(
+                        f"Skipping {new_layer_dir / subdir} because it exists as a symlink on the lower layer"
+                    )
+                    redirected_subdirs[entry.name] = target
+                else:
+                    subdirs.append(entry.name)
+    except OSError as err:
+        # Unreadable directories are skipped, as in ``os.walk()``.
+        emit.debug(f"Cannot scan {new_layer_dir / relative_path}: {err}")
+
+    return _ScannedDir(
+        subdirs=sorted(subdirs),
+        redirected_subdirs=redirected_subdirs,
+        filenames=sorted(filenames),
+    )
+
+
+def _is_real_dir(path: Path) -> bool:
+    """Whether ``path`` is a directory, and not a symlink to one."""
+    return path.is_dir() and not path.is_symlink()
+
+
+def _merge_paths(name: str, paths: list[Path]) -> Path:
+    """Merge the ``paths`` that have the same ``name`` in the new layer.
+
+    If all paths are directories with the same ownership and permissions, or
+    files with the same attributes and contents, then the first one is used
+    (they are all equivalent). All other cases raise an error.
+
+    :return: The path to archive.
+    """
+    if len(paths) == 1:
+        return paths[0]
 
-        # We currently don't try to do any kind of path conflict resolution; if
-        # the paths aren't all directories with the same ownership and permissions,
-        # bail out with an error.
-        raise errors.LayerArchivingError(
-            f"Conflicting paths pointing to '{name}': {', '.join(map(str, paths))}"
+    if _all_compatible_directories(paths):
+        emit.debug(
+            f"Multiple directories pointing to '{name}': {', '.join(map(str, paths))}"
         )
+        return paths[0]
 
-    return result
+    if _all_compatible_files(paths):
+        emit.debug(f"Multiple files pointing to '{name}': {', '.join(map(str, paths))}")
+        return paths[0]
+
+    # We currently don't try to do any kind of path conflict resolution; if
+    # the paths aren't all directories with the same ownership and permissions,
+    # bail out with an error.
+    raise errors.LayerArchivingError(
+        f"Conflicting paths pointing to '{name}': {', '.join(map(str, paths))}"
+    )
 
 
 def _symlink_target_in_base_layer(
-    relative_path: Path, base_layer_dir: Path | None
-) -> Path | None:
-    """If `relative_path` is a dir symlink in `base_layer_dir`, return its 'target'.
+    relative_path: Path, base_index: RootfsIndex | None
+) -> str | None:
+    """If `relative_path` is a symlink in the base layer, return its 'target'.
 
-    This function checks if `relative_path` exists in the base `base_layer_dir` as
-    a symbolic link to another directory; if it does, the function will return the
-    symlink target. In all other cases, the function returns None.
+    This function checks if `relative_path` exists in the base layer as a
+    symbolic link; if it does, the function will return the path of the
+    directory it points to, without symlinks. In all other cases, the function
+    returns None.
 
     :param relative_path: The subpath to check.
-    :param base_layer_dir: The directory with the contents of the base layer.
+    :param base_index: The index of the base layer.
     """
-    if base_layer_dir is None:
+    if base_index is None:
         return None
 
-    lower_path = base_layer_dir / relative_path
-
-    if lower_path.is_symlink():
-        return lower_path.readlink()
+    path = relative_path.as_posix()
+    target = base_index.readlink(path)
+    if target is None:
+        return None
 
-    return None
+    # A dangling symlink still points to the path it would resolve to.
+    resolved = base_index.resolve(path)
+    return resolved if resolved is not None else posixpath.normpath(target).lstrip("/")
 
 
 def _all_compatible_directories(paths: list[Path]) -> bool:
@@ -293,6 +926,95 @@ def _all_compatible_files(paths: list[Path]) -> bool:
     return True
 
 
+def _get_base_file(
+    filename: str, base_layer_dir: Path, base_index: RootfsIndex | None
+) -> tuple[RootfsEntry, str | None] | None:
+    """Get the metadata of ``filename`` in the base, if it is a regular file.
+
+    :returns: None if ``filename`` is not a regular file (after following
+        symlinks) in the base. Otherwise, its entry and, if ``filename`` is
+        itself a symlink, its target.
+    """
+    if base_index is not None:
+        entry = base_index.get(filename)
+        if entry is None or entry.type != "file":
+            return None
+        return entry, base_index.readlink(filename)
+
+    base_file = base_layer_dir / filename
+    if not base_file.is_file():
+        return None
+    base_stat = base_file.stat()
+    entry = RootfsEntry(
+        type="file",
+        mode=base_stat.st_mode,
+        uid=base_stat.st_uid,
+        gid=base_stat.st_gid,
+        size=base_stat.st_size,
+    )
+    target = str(base_file.readlink()) if base_file.is_symlink() else None
+    return entry, target
+
+
+def _compatible_metadata(
+    prime_file: Path, base_entry: RootfsEntry, base_target: str | None
+) -> bool | None:
+    """Compare ``prime_file`` with a base file without reading their contents.
+
+    The rules are the same as ``_all_compatible_files()``'s.
+
+    :returns: Whether the files are compatible, or None if the decision
+        depends on their contents.
+    """
+    if not prime_file.is_file():
+        return False
+
+    # As in paths_collide(), symlinks are only compatible with symlinks that
+    # have the same target (regardless of what the target is).
+    prime_is_link = prime_file.is_symlink()
+    if base_target is not None or prime_is_link:
+        return (
+            base_target is not None
+            and prime_is_link
+            and Path(base_target) == prime_file.readlink()
+        )
+
+    prime_stat = prime_file.stat()
+    if (base_entry.mode, base_entry.uid, base_entry.gid) != (
+        prime_stat.st_mode,
+        prime_stat.st_uid,
+        prime_stat.st_gid,
+    ):
+        return False
+
+    # pkg-config files can differ in their prefix, so their size can't be used.
+    if prime_file.suffix != ".pc" and base_entry.size != prime_stat.st_size:
+        return False
+
+    return None
+
+
+def _same_contents(
+    prime_file: Path,
+    filename: str,
+    base_layer_dir: Path,
+    base_index: RootfsIndex | None,
+) -> bool:
+    """Whether ``prime_file`` has the same contents as ``filename`` in the base."""
+    if prime_file.suffix == ".pc":
+        # pkg-config files are compared line by line, ignoring their prefix.
+        base_file = base_layer_dir / filename
+        if base_index is not None:
+            base_file = base_index.file_path(filename) or base_file
+        return _all_compatible_files([base_file, prime_file])
+
+    if base_index is not None:
+        base_sha256 = base_index.sha256(filename)
+    else:
+        base_sha256 = file_sha256(base_layer_dir / filename)
+    return base_sha256 == file_sha256(prime_file)
+
+
 def _get_permissions(filename: Path) -> Permissions:
     """Create a Permissions object for a given Path."""
     stat = filename.stat()
@@ -0,0 +1,57 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Rockcraft configuration model."""
+
+import pydantic
+from craft_application import ConfigModel
+
+from rockcraft.cache import DEFAULT_BLOB_CACHE_MAX_SIZE
+
+
+class RockcraftConfig(ConfigModel):
+    """Rockcraft's configuration items.
+
+    Each item can be set with a ``ROCKCRAFT_<ITEM>`` environment variable or,
+    for the snap, with ``snap set rockcraft <item>=<value>``.
+    """
+
+    image_cache_max_size: pydantic.NonNegativeInt = DEFAULT_BLOB_CACHE_MAX_SIZE
+    """The maximum size, in bytes, of the base image blobs shared by all projects.
+
+    The least recently used blobs are removed when the cache grows larger. Set
+    to 0 to disable the cache.
+    """
+
+    base_sources: str | None = None
+    """The comma-separated sources to obtain Ubuntu base images from, in order.
+
+    Each source is a registry (``docker://<host>/<path>``), a directory of OCI
+    layouts (``oci:<dir>``) or an OCI archive (``oci-archive:<file>``). Defaults
+    to the public Ubuntu registry.
+    """
+
+    update_lock: bool = False
+    """Whether to pin bases in an existing ``rockcraft.lock`` that doesn't pin them.
+
+    The lock file is only written without this when the project doesn't have one.
+    """
+
+    registry_username: str | None = None
+    """The username to authenticate to registries with, when pushing rocks."""
+
+    registry_password: str | None = None
+    """The password or token to authenticate to registries with, to push rocks."""
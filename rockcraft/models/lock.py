@@ -0,0 +1,65 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Lock file pinning the base images of a rock."""
+
+from pathlib import Path
+from typing import Annotated, Literal
+
+import pydantic
+from craft_application.models import CraftBaseModel
+
+LOCK_FILE_NAME = "rockcraft.lock"
+
+Digest = Annotated[str, pydantic.StringConstraints(pattern=r"^sha256:[0-9a-f]{64}$")]
+
+
+class Lock(CraftBaseModel):
+    """The resolved base images of a project, written next to rockcraft.yaml.
+
+    ``bases`` maps each base (like ``ubuntu@24.04``) and architecture to the
+    digest of the image manifest that builds for that architecture use.
+    """
+
+    version: Literal[1]
+    bases: dict[str, dict[str, Digest]] = pydantic.Field(default_factory=dict)
+
+    @classmethod
+    def load(cls, project_dir: Path) -> "Lock":
+        """Load the lock file of the project in ``project_dir``, if there is one.
+
+        :returns: The loaded lock, or an empty one if there is no lock file.
+        """
+        lock_file = project_dir / LOCK_FILE_NAME
+        if not lock_file.exists():
+            return cls(version=1)
+        return cls.from_yaml_file(lock_file)
+
+    def save(self, project_dir: Path) -> None:
+        """Write the lock file of the project in ``project_dir``."""
+        self.to_yaml_file(project_dir / LOCK_FILE_NAME)
+
+    def get_base_digest(self, base: str, build_for: str) -> str | None:
+        """Get the pinned manifest digest of ``base`` for ``build_for``, if any."""
+        return self.bases.get(base, {}).get(build_for)
+
+    def set_base_digest(self, base: str, build_for: str, digest: str) -> None:
+        """Pin the manifest digest of ``base`` for ``build_for``."""
+        # Assign a new mapping so that the change is validated.
+        self.bases = {
+            **self.bases,
+            base: {**self.bases.get(base, {}), build_for: digest},
+        }
@@ -26,6 +26,7 @@ import pydantic
 import spdx_lookup
 from craft_application.models import (
     Platform,
+    UniqueStrList,
 )
 from craft_application.models import Project as BaseProject
 from craft_application.models.base import alias_generator
@@ -39,6 +40,7 @@ from pydantic_core import core_schema
 from typing_extensions import override
 
 from rockcraft.architectures import SUPPORTED_ARCHS
+from rockcraft.compression import LayerCompression
 from rockcraft.parts import part_has_overlay
 from rockcraft.pebble import Check, Service
 from rockcraft.usernames import SUPPORTED_GLOBAL_USERNAMES
@@ -166,6 +168,39 @@ class Project(BaseProject):
 
     This key is mutually incompatible with the ``entrypoint-service`` key.
     """
+    compression: LayerCompression | None = pydantic.Field(
+        default=None,
+        description="The compression algorithm and level for the rock's layers.",
+        examples=[{"algorithm": "zstd", "level": 3}],
+    )
+    """The compression used for the layers that Rockcraft adds to the rock.
+
+    The ``algorithm`` is either ``gzip`` (the default) or ``zstd``. The optional
+    ``level`` ranges from 1 to 9 for gzip (default 6) and from 1 to 22 for zstd
+    (default 3). Layers are compressed using all available processors.
+
+    Rocks with zstd-compressed layers require a container runtime that supports
+    them, such as Docker 23.0 or containerd 1.5 and newer.
+
+    The ``--compression`` option of ``rockcraft pack`` takes precedence over this key.
+    """
+    layers: dict[str, UniqueStrList] | None = pydantic.Field(
+        default=None,
+        description="Groups of parts to pack as separate layers, in order.",
+        examples=[{"dependencies": ["python-deps"], "app": ["my-app"]}],
+    )
+    """Groups of parts whose primed contents are packed as separate layers.
+
+    Each key names a layer, and its value lists the parts whose primed files go into
+    it. The layers are added in the order they are listed, followed by a final layer
+    with the contents of all the other parts and the overlays. A part can only be in
+    one layer, and the parts that it runs after must be in the same layer or in an
+    earlier one.
+
+    Layers whose parts did not change between builds keep the same digest, so
+    registries and container runtimes don't have to transfer them again. If unset,
+    all the primed contents are packed as a single layer.
+    """
     base: BaseT = pydantic.Field(
         description="The base system image for the rock.",
     )
@@ -370,6 +405,41 @@ class Project(BaseProject):
 
         return entrypoint_command
 
+    @pydantic.field_validator("layers")
+    @classmethod
+    def _validate_layers(
+        cls, layers: dict[str, list[str]] | None, info: pydantic.ValidationInfo
+    ) -> dict[str, list[str]] | None:
+        """Check that the layers refer to existing parts, in dependency order."""
+        if not layers:
+            return layers
+
+        parts: dict[str, Any] = info.data.get("parts", {})
+        layer_of_part: dict[str, int] = {}
+        for position, (layer_name, part_names) in enumerate(layers.items()):
+            for part_name in part_names:
+                if part_name not in parts:
+                    raise ValueError(
+                        f"Layer '{layer_name}' refers to unknown part '{part_name}'."
+                    )
+                if part_name in layer_of_part:
+                    raise ValueError(
+                        f"Part '{part_name}' is listed in more than one layer."
+                    )
+                layer_of_part[part_name] = position
+
+        layer_names = list(layers)
+        for part_name, position in layer_of_part.items():
+            for dependency in parts[part_name].get("after", []):
+                dependency_position = layer_of_part.get(dependency, len(layers))
+                if dependency_position > position:
+                    raise ValueError(
+                        f"Part '{part_name}' in layer '{layer_names[position]}' "
+                        f"runs after part '{dependency}', which must be in the same "
+                        "layer or in an earlier one."
+                    )
+        return layers
+
     @pydantic.field_validator("environment")
     @classmethod
     def _forbid_env_var_bash_interpolation(
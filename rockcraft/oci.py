@@ -16,25 +16,36 @@
 
 """OCI image manipulation helpers."""
 
+import contextlib
+import dataclasses
 import hashlib
+import io
 import json
 import logging
 import os
+import re
+import shlex
 import shutil
 import subprocess
+import tarfile
 import tempfile
-from dataclasses import dataclass
+from collections.abc import Iterator, Sequence
+from collections.abc import Set as AbstractSet
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
+from typing import Any, BinaryIO, cast
 
 import yaml
 from craft_cli import emit
 
-from rockcraft import errors, layers
-from rockcraft.architectures import SUPPORTED_ARCHS
+from rockcraft import errors, layers, registry, timing, unpack
+from rockcraft.architectures import SUPPORTED_ARCHS, ArchitectureMapping
+from rockcraft.cache import BlobCache, LayerCache, link_or_copy
+from rockcraft.compression import LayerCompression
 from rockcraft.constants import ROCK_CONTROL_DIR
 from rockcraft.pebble import Pebble
+from rockcraft.rootfs import RootfsIndex
 from rockcraft.utils import get_snap_command_path
 
 logger = logging.getLogger(__name__)
@@ -45,11 +56,50 @@ ECR_URL = "public.ecr.aws/ubuntu"
 
 REGISTRY_URL = ECR_URL
 
-# The number of times to try downloading an image from `REGISTRY_URL`.
+DEFAULT_BASE_SOURCES = (f"docker://{REGISTRY_URL}",)
+
+_BASE_SOURCE_TRANSPORTS = ("docker", "oci", "oci-archive")
+
+# The number of times to retry a failed request to a registry.
 MAX_DOWNLOAD_RETRIES = 5
 
 MANIFEST_MEDIA_TYPE = "application/vnd.oci.image.manifest.v1+json"
 
+INDEX_MEDIA_TYPE = "application/vnd.oci.image.index.v1+json"
+
+LAYER_MEDIA_TYPE = LayerCompression().media_type
+
+# The annotation used in an OCI layout's index.json to name a manifest.
+REF_NAME_ANNOTATION = "org.opencontainers.image.ref.name"
+
+_BLOB_MEMBER_PATTERN = re.compile(r"^blobs/sha256/[0-9a-f]{64}$")
+
+_DOCKER_TO_OCI_MEDIA_TYPES = {
+    "application/vnd.docker.container.image.v1+json": (
+        "application/vnd.oci.image.config.v1+json"
+    ),
+    "application/vnd.docker.image.rootfs.diff.tar.gzip": LAYER_MEDIA_TYPE,
+    "application/vnd.docker.image.rootfs.diff.tar": (
+        "application/vnd.oci.image.layer.v1.tar"
+    ),
+}
+
+
+@dataclass(frozen=True)
+class LayerBlob:
+    """A compressed layer blob stored in an OCI layout.
+
+    :param digest: The digest of the compressed blob, in ``sha256:<hex>`` format.
+    :param size: The size of the compressed blob, in bytes.
+    :param diff_id: The digest of the uncompressed layer tarball.
+    :param media_type: The media type of the blob.
+    """
+
+    digest: str
+    size: int
+    diff_id: str
+    media_type: str = LAYER_MEDIA_TYPE
+
 
 @dataclass(frozen=True)
 class Image:
@@ -57,10 +107,14 @@ class Image:
 
     :param image_name: The name of this image in ``name:tag`` format.
     :param path: The path to this image in the local filesystem.
+    :param source_digest: The digest of the image's manifest in the registry it
+        was pulled from, if any. It differs from the local manifest's digest
+        when a Docker manifest is converted to an OCI one.
     """
 
     image_name: str
     path: Path
+    source_digest: str | None = field(default=None, compare=False)
 
     @classmethod
     def from_docker_registry(
@@ -69,6 +123,7 @@ class Image:
         *,
         image_dir: Path,
         arch: str,
+        blob_cache: BlobCache | None = None,
     ) -> tuple["Image", str]:
         """Obtain an image from a docker registry.
 
@@ -77,22 +132,58 @@ class Image:
         :param image_name: The image to retrieve, in ``name@tag`` format.
         :param image_dir: The directory to store local OCI images.
         :param arch: The architecture of the Docker image to fetch, in Debian format.
-        :param variant: The variant, if any, of the Docker image to fetch.
-
+        :param blob_cache: An optional cache of image blobs. Blobs already in the
+            cache are not downloaded again, and are hard-linked into ``image_dir``.
 
         :returns: The downloaded image and it's corresponding source image
         """
+        return cls.from_sources(
+            image_name,
+            sources=DEFAULT_BASE_SOURCES,
+            image_dir=image_dir,
+            arch=arch,
+            blob_cache=blob_cache,
+        )
+
+    @classmethod
+    def from_sources(
+        cls,
+        image_name: str,
+        *,
+        sources: Sequence[str],
+        image_dir: Path,
+        arch: str,
+        blob_cache: BlobCache | None = None,
+        digest: str | None = None,
+    ) -> tuple["Image", str]:
+        """Obtain an image from the first source that provides it.
+
+        Each source is a registry (``docker://<host>/<path>``), a directory of
+        OCI layouts (``oci:<dir>``) or an OCI archive (``oci-archive:<file>``).
+        See ``resolve_base_source()`` for how the image is found in a source.
+        Local sources that don't exist are skipped.
+
+        :param image_name: The image to retrieve, in ``name@tag`` format.
+        :param sources: The sources to try, in order.
+        :param image_dir: The directory to store local OCI images.
+        :param arch: The architecture of the image to fetch, in Debian format.
+        :param blob_cache: An optional cache of image blobs. Blobs already in the
+            cache are not copied again, and are hard-linked into ``image_dir``.
+        :param digest: The digest of the manifest to pull from registries, instead
+            of the one that the tag points to. Local sources are copied by tag.
+
+        :returns: The obtained image and its corresponding source image.
+        :raises RockcraftError: If no source provides the image.
+        """
         if "@" not in image_name:
             raise ValueError(f"Bad image name: {image_name}")
 
         image_name = image_name.replace("@", ":")
+        name, tag = image_name.split(":", 1)
 
         image_dir.mkdir(parents=True, exist_ok=True)
         image_target = image_dir / image_name
 
-        source_image = f"docker://{REGISTRY_URL}/{image_name}"
-        copy_params = ["--retry-times", str(MAX_DOWNLOAD_RETRIES)]
-
         mapping = SUPPORTED_ARCHS[arch]
 
         platform_params = [
@@ -102,14 +193,180 @@ class Image:
         if mapping.go_variant:
             platform_params += ["--override-variant", mapping.go_variant]
 
-        _copy_image(
-            source_image,
-            f"oci:{image_target}",
-            *platform_params,
-            copy_params=copy_params,
+        failures: list[errors.RockcraftError] = []
+        for source in sources:
+            source_image = resolve_base_source(source, name, tag)
+            transport, _, location = source_image.partition(":")
+            if transport != "docker" and not Path(location.rsplit(":", 1)[0]).exists():
+                emit.debug(f"Skipping base source {source_image}, as it doesn't exist")
+                continue
+
+            source_digest: str | None = None
+            try:
+                if transport == "docker":
+                    reference = source_image.removeprefix("docker://")
+                    if digest is not None:
+                        reference = str(
+                            dataclasses.replace(
+                                registry.ImageReference.parse(reference),
+                                reference=digest,
+                            )
+                        )
+                        source_image = f"docker://{reference}"
+                    source_digest = _pull_image(
+                        reference, image_target, mapping, blob_cache
+                    )
+                elif blob_cache is None:
+                    _copy_image(source_image, f"oci:{image_target}", *platform_params)
+                else:
+                    _copy_image_through_cache(
+                        source_image,
+                        image_target,
+                        blob_cache,
+                        *platform_params,
+                        copy_params=[],
+                    )
+            except errors.RockcraftError as err:
+                emit.debug(f"Cannot obtain {image_name} from {source_image}: {err}")
+                failures.append(err)
+                continue
+
+            image = cls(
+                image_name=image_name, path=image_dir, source_digest=source_digest
+            )
+            return image, source_image
+
+        if len(failures) == 1:
+            raise failures[0]
+        raise errors.RockcraftError(
+            f"Cannot obtain {image_name} from any of the base sources.",
+            details="\n".join(str(failure) for failure in failures) or None,
+            resolution="Check the 'base_sources' configuration.",
         )
 
-        return cls(image_name=image_name, path=image_dir), source_image
+    @classmethod
+    def from_local_blobs(
+        cls,
+        image_name: str,
+        *,
+        image_dir: Path,
+        digest: str,
+        blob_cache: BlobCache | None = None,
+    ) -> "Image | None":
+        """Obtain an image by manifest digest, without accessing the registry.
+
+        The image is found if ``image_dir`` already has it with that digest, or
+        if all of its blobs are in ``blob_cache``. The digest can also be the
+        one of the Docker manifest that the image was converted from when it
+        was pulled (see ``source_digest``).
+
+        :param image_name: The image to obtain, in ``name@tag`` format.
+        :param image_dir: The directory to store local OCI images.
+        :param digest: The digest of the image's manifest.
+        :param blob_cache: An optional cache of image blobs.
+
+        :returns: The image, or None if it is not available locally.
+        """
+        if "@" not in image_name:
+            raise ValueError(f"Bad image name: {image_name}")
+
+        image = cls(
+            image_name=image_name.replace("@", ":"),
+            path=image_dir,
+            source_digest=digest,
+        )
+        with contextlib.suppress(OSError, ValueError, errors.RockcraftError):
+            if image.manifest_digest() == digest:
+                return image
+
+        name, tag = image.image_name.split(":", 1)
+        layout_path = image_dir / name
+        algorithm, _, encoded = digest.partition(":")
+        blob_paths = [layout_path / "blobs" / algorithm / encoded]
+        if blob_cache is not None:
+            blob_paths.append(blob_cache.get_path(digest))
+        try:
+            source_content = next(p for p in blob_paths if p.is_file()).read_bytes()
+            content = _to_oci_manifest_content(source_content)
+            manifest = json.loads(content)
+            local_digest = f"sha256:{hashlib.sha256(content).hexdigest()}"
+            digests = [
+                manifest["config"]["digest"],
+                *(layer["digest"] for layer in manifest["layers"]),
+            ]
+        except (StopIteration, OSError, ValueError, KeyError, TypeError):
+            return None
+
+        with contextlib.suppress(OSError, ValueError, errors.RockcraftError):
+            if image.manifest_digest() == local_digest:
+                return image
+
+        if blob_cache is None or not all(
+            blob_cache.get_path(d).is_file() for d in digests
+        ):
+            return None
+
+        blob_cache.link_to([digest, *digests], layout_path / "blobs")
+        algorithm, _, encoded = local_digest.partition(":")
+        (layout_path / "blobs" / algorithm / encoded).write_bytes(content)
+        descriptor = {
+            "mediaType": MANIFEST_MEDIA_TYPE,
+            "digest": local_digest,
+            "size": len(content),
+        }
+        _add_to_layout(layout_path, descriptor, tag)
+        emit.debug(f"Linked {len(digests) + 1} cached blobs into {layout_path}")
+        return image
+
+    @classmethod
+    def from_oci_layout(cls, layout_path: Path) -> "Image":
+        """Get the image in an OCI layout with a single tagged image, like a rock's.
+
+        :param layout_path: The directory of the OCI layout.
+        :raises RockcraftError: If the layout doesn't have exactly one image,
+            or if the image isn't tagged.
+        """
+        try:
+            tl_index = json.loads((layout_path / "index.json").read_bytes())
+            (descriptor,) = tl_index["manifests"]
+            tag = descriptor["annotations"][REF_NAME_ANNOTATION]
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            raise errors.RockcraftError(
+                f"{layout_path} is not an OCI layout with a single tagged image."
+            ) from err
+
+        return cls(image_name=f"{layout_path.name}:{tag}", path=layout_path.parent)
+
+    @classmethod
+    def from_oci_archive(cls, archive: Path, *, image_dir: Path) -> "Image":
+        """Extract the image of an OCI archive with a single tagged image.
+
+        Only the layout's index and blobs are extracted.
+
+        :param archive: The OCI archive, like a ``.rock`` file.
+        :param image_dir: The directory to extract the archive's layout in.
+        :raises RockcraftError: If the archive is not a valid OCI archive.
+        """
+        layout_path = image_dir / archive.name.split(".", 1)[0]
+        try:
+            with tarfile.open(archive) as tar:
+                for member in tar:
+                    name = member.name.removeprefix("./")
+                    if not member.isfile() or not (
+                        name in ("oci-layout", "index.json")
+                        or _BLOB_MEMBER_PATTERN.match(name)
+                    ):
+                        continue
+                    destination = layout_path / name
+                    destination.parent.mkdir(parents=True, exist_ok=True)
+                    with destination.open("wb") as dest_file:
+                        shutil.copyfileobj(
+                            cast(BinaryIO, tar.extractfile(member)), dest_file
+                        )
+        except (OSError, tarfile.TarError) as err:
+            raise errors.RockcraftError(f"Cannot extract {archive}: {err}") from err
+
+        return cls.from_oci_layout(layout_path)
 
     @classmethod
     def new_oci_image(
@@ -173,32 +430,101 @@ class Image:
 
         return Image(image_name=image_name, path=image_dir)
 
-    def extract_to(self, bundle_dir: Path, *, rootless: bool = False) -> Path:
-        """Unpack the image to an OCI runtime bundle.
+    def extract_to(
+        self,
+        bundle_dir: Path,
+        *,
+        rootless: bool = False,
+        cache_key: str | None = None,
+        include: AbstractSet[str] | None = None,
+    ) -> Path:
+        """Unpack the image's root filesystem to a bundle directory.
+
+        The layers are applied in-process, like ``umoci unpack`` would (but
+        without writing the bundle's runtime configuration).
 
         :param bundle_dir: The directory to store runtime bundles.
         :param rootless: Whether the image should be unpacked even without
-            root; won't necessarily preserve ownership but is useful for
-            testing.
+            root; won't preserve ownership but is useful for testing.
+        :param cache_key: An optional key identifying the image contents, such as
+            its manifest digest. If the existing bundle was extracted with the
+            same key it is reused as is, so it must be treated as read-only.
+        :param include: The only entries to unpack, by their paths in the root
+            filesystem (see ``unpack.unpack_layers()``), or None to unpack all
+            of them. The entries are added to the ones unpacked before with the
+            same ``cache_key``.
         """
         bundle_dir.mkdir(parents=True, exist_ok=True)
         bundle_path = bundle_dir / self.image_name.replace(":", "-")
-        image_path = self.path / self.image_name
+        rootfs = bundle_path / "rootfs"
+        # The key is stored next to the bundle, and only once it is complete.
+        key_path = bundle_dir / f"{bundle_path.name}.extracted"
+        partial_key_path = bundle_dir / f"{bundle_path.name}.partial"
+        if cache_key is not None and rootfs.is_dir():
+            if _read_key(key_path) == cache_key:
+                emit.debug(f"Reusing {bundle_path}, extracted from {cache_key}")
+                return rootfs
+            if include is not None and _read_key(partial_key_path) == cache_key:
+                self._unpack(rootfs, rootless=rootless, include=include)
+                return rootfs
+
+        key_path.unlink(missing_ok=True)
+        partial_key_path.unlink(missing_ok=True)
         shutil.rmtree(bundle_path, ignore_errors=True)
-        command = ["umoci", "unpack"]
-        if rootless:
-            command.append("--rootless")
-        command.extend(["--image", str(image_path), str(bundle_path)])
-        _process_run(command)
+        self._unpack(rootfs, rootless=rootless, include=include)
+
+        if cache_key is not None:
+            (key_path if include is None else partial_key_path).write_text(cache_key)
+        return rootfs
 
-        return bundle_path / "rootfs"
+    def _unpack(
+        self, rootfs: Path, *, rootless: bool, include: AbstractSet[str] | None
+    ) -> None:
+        layer_archives = self.layer_archives()
+        with timing.span(
+            "unpack image",
+            "image",
+            image=self.image_name,
+            layers=len(layer_archives),
+            bytes=sum(layer.path.stat().st_size for layer in layer_archives),
+            entries=None if include is None else len(include),
+        ):
+            unpack.unpack_layers(
+                layer_archives, rootfs, rootless=rootless, include=include
+            )
+
+    def layer_archives(self) -> list[unpack.LayerArchive]:
+        """Get the layers of the image, from the bottom one up."""
+        descriptor, blob_paths = self._get_image_blobs(self.image_name.split(":", 1)[1])
+        manifest = json.loads(blob_paths[descriptor["digest"]].read_bytes())
+        return [
+            unpack.LayerArchive(blob_paths[layer["digest"]], layer["mediaType"])
+            for layer in manifest["layers"]
+        ]
+
+    def manifest_digest(self) -> str:
+        """Get the digest of the image's manifest, from its local layout.
+
+        :returns: The digest, in ``sha256:<hex>`` format.
+        """
+        name, tag = self.image_name.split(":", 1)
+        tl_index_path = self.path / name / "index.json"
+        tl_index = json.loads(tl_index_path.read_bytes())
+        idx = _get_manifest_index(tl_index, tag, tl_index_path)
+        return cast(str, tl_index["manifests"][idx]["digest"])
 
-    def add_layer(
+    def add_layer(  # noqa: PLR0913 (too many arguments)
         self,
         tag: str,
         new_layer_dir: Path,
         base_layer_dir: Path | None = None,
         comment: str | None = None,
+        *,
+        compression: LayerCompression | None = None,
+        base_index: RootfsIndex | None = None,
+        include: AbstractSet[str] | None = None,
+        exclude: AbstractSet[str] = frozenset(),
+        layer_cache: LayerCache | None = None,
     ) -> "Image":
         """Add a layer to the image.
 
@@ -207,23 +533,67 @@ class Image:
         :param base_layer_dir: An optional path to the extracted contents of the
           new layer's base layer. Used to preserve lower-layer symlinks.
         :param comment: An optional comment to add to the layer's history.
+        :param compression: How to compress the layer. Defaults to gzip.
+        :param base_index: An optional index of ``base_layer_dir``.
+        :param include: If set, only these paths in ``new_layer_dir`` (and their
+          parent directories) are added to the layer.
+        :param exclude: Paths in ``new_layer_dir`` not to add to the layer.
+        :param layer_cache: An optional cache to reuse the layer blob from, if
+          the layer's contents did not change since it was cached.
         """
-        image_path = self.path / self.image_name
-
-        temp_file = Path(self.path, f".temp_layer.{os.getpid()}.tar")
-        temp_file.unlink(missing_ok=True)
-
-        try:
-            layers.archive_layer(new_layer_dir, temp_file, base_layer_dir)
-            _add_layer_into_image(
-                image_path, temp_file, comment=comment, **{"--tag": tag}
-            )
-        finally:
-            temp_file.unlink(missing_ok=True)
+        self._add_layer(
+            new_layer_dir,
+            base_layer_dir,
+            comment=comment,
+            tag=tag,
+            compression=compression,
+            base_index=base_index,
+            include=include,
+            exclude=exclude,
+            layer_cache=layer_cache,
+        )
 
         name = self.image_name.split(":", 1)[0]
         return self.__class__(image_name=f"{name}:{tag}", path=self.path)
 
+    def _add_layer(  # noqa: PLR0913 (too many arguments)
+        self,
+        new_layer_dir: Path,
+        base_layer_dir: Path | None = None,
+        *,
+        comment: str | None = None,
+        tag: str | None = None,
+        compression: LayerCompression | None = None,
+        base_index: RootfsIndex | None = None,
+        include: AbstractSet[str] | None = None,
+        exclude: AbstractSet[str] = frozenset(),
+        layer_cache: LayerCache | None = None,
+    ) -> None:
+        """Archive ``new_layer_dir`` straight into the image's blob store.
+
+        The tar stream is compressed and hashed as it is produced, so no
+        intermediate tarball is written. The image's config, manifest and
+        index are then updated to reference the new layer.
+
+        :param tag: The tag pointing to the new image. If None, the current
+            tag is moved to it.
+        """
+        name, image_tag = self.image_name.split(":", 1)
+        layout_path = self.path / name
+
+        layer = _write_layer_blob(
+            layout_path / "blobs" / "sha256",
+            new_layer_dir,
+            base_layer_dir,
+            compression=compression or LayerCompression(),
+            base_index=base_index,
+            include=include,
+            exclude=exclude,
+            layer_cache=layer_cache,
+        )
+        emit.debug(f"Wrote layer blob {layer.digest} ({layer.size} bytes)")
+        _append_layer(layout_path, image_tag, layer, comment=comment, new_tag=tag)
+
     def add_user(
         self,
         prime_dir: Path,
@@ -231,6 +601,9 @@ class Image:
         tag: str,
         username: str,
         uid: int,
+        *,
+        compression: LayerCompression | None = None,
+        base_index: RootfsIndex | None = None,
     ) -> None:
         """Create a new rock user.
 
@@ -239,76 +612,92 @@ class Image:
         :param tag: The rock's image tag.
         :param username: Username to be created. Same as group name.
         :param uid: UID of the username to be created. Same as GID.
+        :param compression: How to compress the new layer.
+        :param base_index: An optional index of ``base_layer_dir``, used to check
+            which files exist in the base.
         """
-        # pylint: disable=too-many-arguments
-        user_files = {"passwd": "", "group": "", "shadow": ""}
-
-        prime_dir_etc = prime_dir / "etc"
-        base_layer_dir_etc = base_layer_dir / "etc"
-        # Being cautious about possible changes (edits or removals) in
-        # /etc/{passwd,group,shadow} done by the user through overlay scripts.
-        # Basically:
-        #  - if it exists in prime, use it,
-        #  - if it doesn't exist in prime AND isn't "whiteout", use the base,
-        #  - if it is "whiteout" or doesn't exist anywhere, use an empty file.
-        # NOTE: "shadow" is only modified if it already exists.
-        for u_file in user_files:
-            if (prime_dir_etc / u_file).exists():
-                user_files[u_file] = (prime_dir_etc / u_file).read_text()
-            elif (base_layer_dir_etc / u_file).exists() and not (
-                prime_dir_etc / f".wh.{u_file}"
-            ).exists():
-                user_files[u_file] = (base_layer_dir_etc / u_file).read_text()
-
-        if (  # pylint: disable=too-many-boolean-expressions
-            f"\n{username}:" in user_files["passwd"]
-            or user_files["passwd"].startswith(f"{username}:")
-            or f":{uid}:" in user_files["passwd"]
-            or f"\n{username}:" in user_files["group"]
-            or user_files["group"].startswith(f"{username}:")
-            or f":{uid}:" in user_files["group"]
-        ):
-            raise errors.RockcraftError(
-                str(
-                    f"Error while trying to create user {username}:{uid}, "
-                    f"with group {username}:{uid}...\n"
-                    " - conflict with existing user/group in the base filesystem"
-                )
-            )
-
-        user_files["passwd"] += (
-            f"{username}:x:{uid}:{uid}::/{Pebble.PEBBLE_PATH}:/usr/bin/false\n"
-        )
-        user_files["group"] += f"{username}:x:{uid}:\n"
-
         with tempfile.TemporaryDirectory() as tmpfs:
-            tmpfs_etc = Path(tmpfs) / "etc"
-            tmpfs_etc.mkdir(parents=True, exist_ok=True)
-            with (tmpfs_etc / "passwd").open("a+") as passwdf:
-                passwdf.write(user_files["passwd"])
-
-            with (tmpfs_etc / "group").open("a+") as groupf:
-                groupf.write(user_files["group"])
-
-            if user_files["shadow"]:
-                days_since_epoch = (
-                    datetime.now(timezone.utc)
-                    - datetime(1970, 1, 1, tzinfo=timezone.utc)
-                ).days
-
-                # only add the shadow file if there's already one in the base image
-                with (tmpfs_etc / "shadow").open("a+") as shadowf:
-                    shadowf.write(
-                        user_files["shadow"]
-                        + f"{username}:!:{days_since_epoch}::::::\n"
-                    )
-
+            _write_user_files(
+                Path(tmpfs),
+                prime_dir,
+                base_layer_dir,
+                username,
+                uid,
+                base_index=base_index,
+            )
             emit.progress(f"Adding user {username}:{uid} with group {username}:{uid}")
             self.add_layer(
                 tag,
                 Path(tmpfs),
                 comment=f"Add user {username}:{uid} with group {username}:{uid}",
+                compression=compression,
+            )
+
+    def add_generated_layer(  # noqa: PLR0913 (too many arguments)
+        self,
+        tag: str,
+        prime_dir: Path,
+        base_layer_dir: Path,
+        *,
+        metadata: dict[str, Any],
+        rock_name: str,
+        user: tuple[str, int] | None = None,
+        pebble_layer: dict[str, Any] | None = None,
+        compression: LayerCompression | None = None,
+        base_index: RootfsIndex | None = None,
+    ) -> None:
+        """Add the files generated by Rockcraft to the image, as a single layer.
+
+        This is the same as calling :meth:`add_user`, :meth:`set_pebble_layer`
+        and :meth:`set_control_data`, but the rock's user, Pebble layer and
+        control data end up in one layer instead of one layer each.
+
+        :param tag: The rock's image tag.
+        :param prime_dir: Path to the user-defined parts' primed content.
+        :param base_layer_dir: Path to the base layer's root filesystem.
+        :param metadata: Content for the rock's metadata YAML file.
+        :param rock_name: The name of the rock, for the Pebble layer file.
+        :param user: The name and UID of the rock's user to create, if any.
+        :param pebble_layer: The content of the rock's Pebble layer, if any.
+        :param compression: How to compress the new layer.
+        :param base_index: An optional index of ``base_layer_dir``.
+        """
+        contents: list[str] = []
+        with tempfile.TemporaryDirectory() as tmpfs:
+            tmpfs_path = Path(tmpfs)
+            if user is not None:
+                username, uid = user
+                _write_user_files(
+                    tmpfs_path,
+                    prime_dir,
+                    base_layer_dir,
+                    username,
+                    uid,
+                    base_index=base_index,
+                )
+                contents.append(f"user {username}:{uid} with group {username}:{uid}")
+
+            if pebble_layer is not None:
+                Pebble().define_pebble_layer(
+                    tmpfs_path,
+                    base_layer_dir,
+                    pebble_layer,
+                    rock_name,
+                    ref_index=base_index,
+                )
+                contents.append("Pebble layer file")
+
+            _write_control_data(tmpfs_path, metadata)
+            contents.append("rock control metadata")
+
+            emit.progress("Adding the rock's generated files")
+            self._add_layer(
+                tmpfs_path,
+                comment=f"Add {', '.join(contents)}",
+                tag=tag,
+                compression=compression,
             )
+        emit.progress("Generated files added")
 
     def stat(self) -> dict[str, Any]:
         """Obtain the image statistics, as reported by "umoci stat --json"."""
@@ -328,27 +717,6 @@ class Image:
         result: dict[str, Any] = json.loads(output)
         return result
 
-    @staticmethod
-    def digest(source_image: str) -> bytes:
-        """Obtain the image digest, given its full form name {transport}:{name}.
-
-        :param source_image: the source image name, it its full form (e.g. docker://ubuntu:22.04)
-        :returns: The image digest bytes.
-        """
-        output = subprocess.check_output(
-            [
-                get_snap_command_path("skopeo"),
-                "inspect",
-                "--format",
-                "{{.Digest}}",
-                "-n",
-                source_image,
-            ],
-            text=True,
-        )
-        parts = output.split(":", 1)
-        return bytes.fromhex(parts[-1])
-
     def to_docker_daemon(self, tag: str) -> None:
         """Export the current image to the local docker daemon.
 
@@ -361,11 +729,178 @@ class Image:
     def to_oci_archive(self, tag: str, filename: str) -> None:
         """Export the current image to a tar archive in OCI format.
 
+        The archive is written straight from the image's layout, and only has
+        the blobs of the manifest tagged ``tag``: other images in the layout
+        (like the base image) are left out.
+
         :param tag: The tag to export.
         """
+        descriptor, blob_paths = self._get_image_blobs(tag)
+
+        archive = Path(filename)
+        temp_archive = archive.with_name(f".{archive.name}.partial")
+        try:
+            with temp_archive.open("wb", buffering=0) as archive_file:
+                _write_tar_bytes(
+                    archive_file, "oci-layout", b'{"imageLayoutVersion": "1.0.0"}'
+                )
+                index = {"schemaVersion": 2, "manifests": [descriptor]}
+                _write_tar_bytes(
+                    archive_file, "index.json", json.dumps(index).encode("utf-8")
+                )
+                for digest, blob_path in blob_paths.items():
+                    _write_tar_file(archive_file, _blob_member(digest), blob_path)
+                # The end-of-archive marker: two zeroed blocks.
+                archive_file.write(tarfile.NUL * tarfile.BLOCKSIZE * 2)
+        except BaseException:
+            temp_archive.unlink(missing_ok=True)
+            raise
+
+        temp_archive.replace(archive)
+        emit.debug(f"Exported {len(blob_paths)} blobs of {tag} to {archive}")
+
+    def to_oci_layout(self, tag: str, dirname: str) -> None:
+        """Export the current image to an OCI image layout directory.
+
+        Like :meth:`to_oci_archive`, only the blobs of the manifest tagged
+        ``tag`` are exported. They are hard-linked from the image's layout
+        when possible, so no contents are copied.
+
+        :param tag: The tag to export.
+        :param dirname: The layout directory, which is replaced if it exists.
+        """
+        descriptor, blob_paths = self._get_image_blobs(tag)
+
+        layout_path = Path(dirname)
+        temp_layout_path = layout_path.with_name(f".{layout_path.name}.partial")
+        shutil.rmtree(temp_layout_path, ignore_errors=True)
+        try:
+            blobs_path = temp_layout_path / "blobs" / "sha256"
+            blobs_path.mkdir(parents=True)
+            for digest, blob_path in blob_paths.items():
+                link_or_copy(blob_path, blobs_path / digest.split(":", 1)[1])
+            (temp_layout_path / "oci-layout").write_bytes(
+                b'{"imageLayoutVersion": "1.0.0"}'
+            )
+            index = {"schemaVersion": 2, "manifests": [descriptor]}
+            (temp_layout_path / "index.json").write_bytes(
+                json.dumps(index).encode("utf-8")
+            )
+        except BaseException:
+            shutil.rmtree(temp_layout_path, ignore_errors=True)
+            raise
+
+        if layout_path.is_dir() and not layout_path.is_symlink():
+            shutil.rmtree(layout_path)
+        else:
+            layout_path.unlink(missing_ok=True)
+        temp_layout_path.replace(layout_path)
+        emit.debug(f"Exported {len(blob_paths)} blobs of {tag} to {layout_path}")
+
+    def _get_image_blobs(self, tag: str) -> tuple[dict[str, Any], dict[str, Path]]:
+        """Get the blobs of the manifest tagged ``tag`` in the image's layout.
+
+        :returns: The descriptor of the manifest in the layout's index, and the
+            paths of the manifest, config and layer blobs, by digest.
+        """
         name = self.image_name.split(":", 1)[0]
-        src_path = self.path / f"{name}:{tag}"
-        _copy_image(f"oci:{str(src_path)}", f"oci-archive:{filename}:{tag}")
+        layout_path = self.path / name
+        blobs_path = layout_path / "blobs" / "sha256"
+        tl_index_path = layout_path / "index.json"
+        tl_index = json.loads(tl_index_path.read_bytes())
+        descriptor: dict[str, Any] = tl_index["manifests"][
+            _get_manifest_index(tl_index, tag, tl_index_path)
+        ]
+        manifest = _read_json_blob(blobs_path, descriptor["digest"])
+        digests = [
+            descriptor["digest"],
+            manifest["config"]["digest"],
+            *(layer["digest"] for layer in manifest["layers"]),
+        ]
+        blob_paths = {
+            digest: blobs_path / digest.split(":", 1)[1] for digest in digests
+        }
+        return descriptor, blob_paths
+
+    def to_registry(
+        self,
+        tag: str,
+        destination: str,
+        *,
+        mount_from: str | None = None,
+        credentials: tuple[str, str] | None = None,
+    ) -> str:
+        """Push the current image to a registry.
+
+        The image's blobs are uploaded concurrently, skipping the blobs that the
+        registry already has. The image may be a multi-platform image index.
+
+        :param tag: The tag of the image to push.
+        :param destination: The image in the registry, like
+            ``registry.example.com/my-rock:1.0``.
+        :param mount_from: Another repository in the destination registry that
+            may have some of the blobs (like the base image's layers), to mount
+            them from instead of uploading them.
+        :param credentials: The username and password for the registry, if any.
+        :returns: The digest of the pushed manifest.
+        :raises RegistryError: If the image cannot be pushed.
+        """
+        name = self.image_name.split(":", 1)[0]
+        layout_path = self.path / name
+        tl_index_path = layout_path / "index.json"
+        tl_index = json.loads(tl_index_path.read_bytes())
+        descriptor = tl_index["manifests"][
+            _get_manifest_index(tl_index, tag, tl_index_path)
+        ]
+
+        reference = registry.ImageReference.parse(destination)
+        client = registry.RegistryClient(
+            reference.registry,
+            max_retries=MAX_DOWNLOAD_RETRIES,
+            credentials=credentials,
+        )
+        uploaded = _push_manifest(
+            client,
+            reference.repository,
+            layout_path / "blobs",
+            descriptor,
+            reference.reference,
+            mount_from=mount_from,
+        )
+        emit.debug(f"Uploaded {uploaded} blobs to {reference}")
+        return cast(str, descriptor["digest"])
+
+    @contextlib.contextmanager
+    def configure(self) -> Iterator["ImageConfig"]:
+        """Change the image's config and manifest in a single transaction.
+
+        The changes made through the yielded ``ImageConfig`` are written when
+        the context manager exits without errors: the config, the manifest and
+        the OCI index are each written once, however many changes were made.
+        """
+        name, tag = self.image_name.split(":", 1)
+        layout_path = self.path / name
+        blobs_path = layout_path / "blobs" / "sha256"
+        tl_index_path = layout_path / "index.json"
+        tl_index = json.loads(tl_index_path.read_bytes())
+        idx = _get_manifest_index(tl_index, tag, tl_index_path)
+
+        manifest = _read_json_blob(blobs_path, tl_index["manifests"][idx]["digest"])
+        image_config = _read_json_blob(blobs_path, manifest["config"]["digest"])
+        config = ImageConfig(image_config, manifest)
+
+        yield config
+
+        image_config["history"] = [
+            *(image_config.get("history") or []),
+            *config.history,
+        ]
+        config_digest, config_size = _write_json_blob(blobs_path, image_config)
+        manifest["config"]["digest"] = config_digest
+        manifest["config"]["size"] = config_size
+        manifest_digest, manifest_size = _write_json_blob(blobs_path, manifest)
+        _tag_manifest(tl_index, idx, tag, digest=manifest_digest, size=manifest_size)
+        tl_index_path.write_bytes(json.dumps(tl_index).encode("utf-8"))
 
     def set_default_user(self, userid: int, username: str) -> None:
         """Set the default runtime user for the OCI image.
@@ -373,58 +908,28 @@ class Image:
         :param userid: userid of the default user (must already exist)
         :param username: username of the default user (must already exist)
         """
-        image_path = self.path / self.image_name
-        params = ["--clear=config.entrypoint", "--config.user", str(userid)]
-        _config_image(image_path, params, comment="Set default user")
-        emit.progress(f"Default user set to {userid} ({username})")
+        with self.configure() as config:
+            config.set_default_user(userid, username)
 
     def set_entrypoint(self, entrypoint: list[str]) -> None:
         """Set the OCI image entrypoint. It is always Pebble."""
-        emit.progress("Configuring entrypoint...")
-        image_path = self.path / self.image_name
-
-        params = ["--clear=config.entrypoint"]
-        for entry in entrypoint:
-            params.extend(["--config.entrypoint", entry])
-
-        params.extend(["--clear=config.cmd"])
-        _config_image(image_path, params, comment="Set entrypoint")
-        emit.progress(f"Entrypoint set to {entrypoint}")
+        with self.configure() as config:
+            config.set_entrypoint(entrypoint)
 
     def set_cmd(self, command: list[str] | None = None) -> None:
         """Set the OCI image CMD.
 
         :param command: List of CMD arguments to set, or None to clear CMD without setting new values
         """
-        emit.progress("Configuring CMD...")
-        image_path = self.path / self.image_name
-        cmd_params = ["--clear=config.cmd"]
-
-        for arg in command or []:
-            cmd_params.extend(["--config.cmd", arg])
-        _config_image(image_path, cmd_params, comment="Set default commands")
-        emit.progress(f"CMD set to {command}")
+        with self.configure() as config:
+            config.set_cmd(command)
 
     def set_default_path(self, base: str) -> None:
         """Set the default PATH on the image (only for bare rocks)."""
-        if base != "bare":
-            emit.debug(f"Not setting a PATH on the image as base is {base!r}")
-            return
-
-        # Follow Pebble's lead here: if PATH is empty, use the standard one.
-        # This means that containers that bypass the pebble entrypoint will
-        # have the same behavior as PATH-less pebble services.
-        pebble_path = Pebble.DEFAULT_ENV_PATH
-        image_path = self.path / self.image_name
-
-        emit.debug(f"Setting bare-based rock PATH to {pebble_path!r}")
-        _config_image(
-            image_path,
-            ["--config.env", f"PATH={pebble_path}"],
-            comment="Set default PATH for bare-based rock",
-        )
+        with self.configure() as config:
+            config.set_default_path(base)
 
-    def set_pebble_layer(
+    def set_pebble_layer(  # noqa: PLR0913 (too many arguments)
         self,
         services: dict[str, Any],
         checks: dict[str, Any],
@@ -433,6 +938,9 @@ class Image:
         summary: str,
         description: str,
         base_layer_dir: Path,
+        *,
+        compression: LayerCompression | None = None,
+        base_index: RootfsIndex | None = None,
     ) -> None:
         """Write the provided services and checks into a Pebble layer in the filesystem.
 
@@ -443,32 +951,31 @@ class Image:
         :param summary: The summary for the Pebble layer
         :param description: The description for the Pebble layer
         :param base_layer_dir: Path to the base layer's root filesystem
+        :param compression: How to compress the new layer
+        :param base_index: An optional index of ``base_layer_dir``
         """
-        # pylint: disable=too-many-arguments
-        pebble_layer_content: dict[str, Any] = {
-            "summary": summary,
-            "description": description,
-        }
-
-        if services:
-            emit.progress(
-                f"Configuring Pebble services {', '.join(list(services.keys()))}"
-            )
-            pebble_layer_content["services"] = services
-
-        if checks:
-            emit.progress(f"Configuring Pebble checks {', '.join(list(checks.keys()))}")
-            pebble_layer_content["checks"] = checks
+        pebble_layer_content = Pebble.get_layer_content(
+            services=services, checks=checks, summary=summary, description=description
+        )
 
         pebble = Pebble()
         with tempfile.TemporaryDirectory() as tmpfs:
             tmpfs_path = Path(tmpfs)
             pebble.define_pebble_layer(
-                tmpfs_path, base_layer_dir, pebble_layer_content, name
+                tmpfs_path,
+                base_layer_dir,
+                pebble_layer_content,
+                name,
+                ref_index=base_index,
             )
 
             emit.progress("Writing new Pebble layer file")
-            self.add_layer(tag, tmpfs_path, comment="Add Pebble layer file")
+            self.add_layer(
+                tag,
+                tmpfs_path,
+                comment="Add Pebble layer file",
+                compression=compression,
+            )
 
     def set_environment(self, env: dict[str, str]) -> None:
         """Set the OCI image environment.
@@ -476,47 +983,29 @@ class Image:
         :param env: A dictionary mapping environment variables to
             their values.
         """
-        emit.progress("Configuring OCI environment...")
-        image_path = self.path / self.image_name
-        params: list[str] = []
-        env_list: list[str] = []
-
-        for name, value in env.items():
-            env_item = f"{name}={value}"
-            env_list.append(env_item)
-            params.extend(["--config.env", env_item])
-        _config_image(image_path, params, comment="Set environment variables")
-        emit.progress(f"Environment set to {env_list}")
+        with self.configure() as config:
+            config.set_environment(env)
 
-    def set_control_data(self, metadata: dict[str, Any]) -> None:
+    def set_control_data(
+        self,
+        metadata: dict[str, Any],
+        *,
+        compression: LayerCompression | None = None,
+    ) -> None:
         """Create and populate the rock's control data folder.
 
         :param metadata: content for the rock's metadata YAML file
+        :param compression: How to compress the new layer
         """
         emit.progress("Setting the rock's control data")
         local_control_data_path = Path(tempfile.mkdtemp())
+        _write_control_data(local_control_data_path, metadata)
 
-        # the rock control data structure starts with the folder ".rock"
-        control_data_rock_folder = local_control_data_path / ROCK_CONTROL_DIR
-        control_data_rock_folder.mkdir()
-
-        rock_metadata_file = control_data_rock_folder / "metadata.yaml"
-        with rock_metadata_file.open("w", encoding="utf-8") as rock_meta:
-            yaml.dump(metadata, rock_meta)
-        rock_metadata_file.chmod(0o644)
-
-        temp_tar_file = Path(self.path, f".temp_layer.control_data.{os.getpid()}.tar")
-        temp_tar_file.unlink(missing_ok=True)
-
-        try:
-            layers.archive_layer(local_control_data_path, temp_tar_file)
-            _add_layer_into_image(
-                self.path / self.image_name,
-                temp_tar_file,
-                comment="Add rock control metadata",
-            )
-        finally:
-            temp_tar_file.unlink(missing_ok=True)
+        self._add_layer(
+            local_control_data_path,
+            comment="Add rock control metadata",
+            compression=compression,
+        )
 
         emit.progress("Control data written")
         shutil.rmtree(local_control_data_path)
@@ -524,35 +1013,183 @@ class Image:
     def set_annotations(self, annotations: dict[str, Any]) -> None:
         """Add the given annotations to the final image.
 
+        :param annotations: A dictionary with each annotation/label and its value
+        """
+        with self.configure() as config:
+            config.set_annotations(annotations)
+
+    def set_media_type(self, arch: str) -> None:
+        """Set the media type in the target image's manifest."""
+        with self.configure() as config:
+            config.set_media_type(arch)
+
+
+class ImageConfig:
+    """Pending changes to the config and manifest of an image.
+
+    Obtained from ``Image.configure()``; each change is recorded in the
+    image's history, like ``umoci config`` does.
+
+    :param image_config: The image's config, changed in place.
+    :param manifest: The image's manifest, changed in place.
+    """
+
+    def __init__(self, image_config: dict[str, Any], manifest: dict[str, Any]) -> None:
+        self._image_config = image_config
+        self._manifest = manifest
+        self.history: list[dict[str, Any]] = []
+
+    @property
+    def _config(self) -> dict[str, Any]:
+        """The execution parameters ("config") of the image config."""
+        config: dict[str, Any] = self._image_config.setdefault("config", {})
+        return config
+
+    def set_default_user(self, userid: int, username: str) -> None:
+        """Set the default runtime user for the OCI image.
+
+        :param userid: userid of the default user (must already exist)
+        :param username: username of the default user (must already exist)
+        """
+        self._config.pop("Entrypoint", None)
+        self._config["User"] = str(userid)
+        self._add_history("Set default user")
+        emit.progress(f"Default user set to {userid} ({username})")
+
+    def set_entrypoint(self, entrypoint: list[str]) -> None:
+        """Set the OCI image entrypoint, clearing its CMD."""
+        emit.progress("Configuring entrypoint...")
+        self._set_list("Entrypoint", entrypoint)
+        self._config.pop("Cmd", None)
+        self._add_history("Set entrypoint")
+        emit.progress(f"Entrypoint set to {entrypoint}")
+
+    def set_cmd(self, command: list[str] | None = None) -> None:
+        """Set the OCI image CMD.
+
+        :param command: List of CMD arguments to set, or None to clear CMD without setting new values
+        """
+        emit.progress("Configuring CMD...")
+        self._set_list("Cmd", command or [])
+        self._add_history("Set default commands")
+        emit.progress(f"CMD set to {command}")
+
+    def set_default_path(self, base: str) -> None:
+        """Set the default PATH on the image (only for bare rocks)."""
+        if base != "bare":
+            emit.debug(f"Not setting a PATH on the image as base is {base!r}")
+            return
+
+        # Follow Pebble's lead here: if PATH is empty, use the standard one.
+        # This means that containers that bypass the pebble entrypoint will
+        # have the same behavior as PATH-less pebble services.
+        pebble_path = Pebble.DEFAULT_ENV_PATH
+        emit.debug(f"Setting bare-based rock PATH to {pebble_path!r}")
+        self._set_env("PATH", pebble_path)
+        self._add_history("Set default PATH for bare-based rock")
+
+    def set_environment(self, env: dict[str, str]) -> None:
+        """Set variables in the OCI image environment.
+
+        :param env: A dictionary mapping environment variables to
+            their values.
+        """
+        emit.progress("Configuring OCI environment...")
+        for name, value in env.items():
+            self._set_env(name, value)
+        self._add_history("Set environment variables")
+        env_list = [f"{name}={value}" for name, value in env.items()]
+        emit.progress(f"Environment set to {env_list}")
+
+    def set_annotations(self, annotations: dict[str, Any]) -> None:
+        """Set the image's labels, and the manifest's annotations as a copy of them.
+
         :param annotations: A dictionary with each annotation/label and its value
         """
         emit.progress("Configuring labels and annotations...")
-        image_path = self.path / self.image_name
-        label_params = ["--clear=config.labels"]
-        annotation_params = ["--clear=manifest.annotations"]
-
-        labels_list: list[str] = []
-        for label_key, label_value in annotations.items():
-            label_item = f"{label_key}={label_value}"
-            labels_list.append(label_item)
-            label_params.extend(["--config.label", label_item])
-            annotation_params.extend(["--manifest.annotation", label_item])
-        # Set the labels
-        _config_image(image_path, label_params, comment="Set labels")
-        # Set the annotations as a copy of these labels (for OCI compliance only)
-        _config_image(image_path, annotation_params, comment="Set annotations")
+        values = {key: str(value) for key, value in annotations.items()}
+        if values:
+            self._config["Labels"] = values
+            self._manifest["annotations"] = dict(values)
+        else:
+            self._config.pop("Labels", None)
+            self._manifest.pop("annotations", None)
+        self._add_history("Set labels")
+        # The annotations are a copy of the labels (for OCI compliance only).
+        self._add_history("Set annotations")
+        labels_list = [f"{key}={value}" for key, value in values.items()]
         emit.progress(f"Labels and annotations set to {labels_list}")
 
     def set_media_type(self, arch: str) -> None:
-        """Set the media type in the target image's manifest."""
-        image_path = self.path / self.image_name
-        mapping = SUPPORTED_ARCHS[arch]
-        _inject_oci_fields(
-            image_path,
-            arch_variant=mapping.go_variant,
+        """Set the manifest's media type and the image's architecture variant."""
+        self._manifest.setdefault("mediaType", MANIFEST_MEDIA_TYPE)
+        variant = SUPPORTED_ARCHS[arch].go_variant
+        if variant:
+            self._image_config["variant"] = variant
+
+    def _set_list(self, key: str, values: list[str]) -> None:
+        """Set a list in the config, removing it if it is empty."""
+        if values:
+            self._config[key] = list(values)
+        else:
+            self._config.pop(key, None)
+
+    def _set_env(self, name: str, value: str) -> None:
+        """Set an environment variable, replacing any previous value."""
+        env: list[str] = self._config.setdefault("Env", [])
+        item = f"{name}={value}"
+        for position, existing in enumerate(env):
+            if existing.split("=", 1)[0] == name:
+                env[position] = item
+                return
+        env.append(item)
+
+    def _add_history(self, comment: str) -> None:
+        """Record a change in the image's history, as an empty layer."""
+        self.history.append(
+            {
+                "created": datetime.now(timezone.utc).isoformat(),
+                "created_by": "rockcraft config",
+                "comment": comment,
+                "empty_layer": True,
+            }
         )
 
 
+def resolve_base_source(source: str, name: str, tag: str) -> str:
+    """Get the reference of an image in a base source, in skopeo's format.
+
+    The ``{name}`` and ``{tag}`` placeholders in ``source`` are replaced by the
+    image's name and tag. Sources without placeholders are completed as:
+
+    - ``docker://<host>/<path>``: ``docker://<host>/<path>/<name>:<tag>``
+    - ``oci:<dir>``: ``oci:<dir>/<name>:<tag>``, the layout in ``<dir>/<name>``
+    - ``oci-archive:<file>``: ``oci-archive:<file>:<tag>``
+
+    :param source: The base source.
+    :param name: The name of the image, like ``ubuntu``.
+    :param tag: The tag of the image, like ``24.04``.
+    :raises RockcraftError: If the source is not valid.
+    """
+    transport, sep, location = source.partition(":")
+    if not sep or not location or transport not in _BASE_SOURCE_TRANSPORTS:
+        raise errors.RockcraftError(
+            f"Invalid base source {source!r}.",
+            resolution=(
+                "Use a 'docker://<registry>', 'oci:<directory>' or "
+                "'oci-archive:<file>' source."
+            ),
+        )
+
+    if "{name}" in location or "{tag}" in location:
+        location = location.replace("{name}", name).replace("{tag}", tag)
+    elif transport == "oci-archive":
+        location = f"{location}:{tag}"
+    else:
+        location = f"{location.rstrip('/')}/{name}:{tag}"
+    return f"{transport}:{location}"
+
+
 def _copy_image(
     source: str,
     destination: str,
@@ -578,6 +1215,565 @@ def _copy_image(
     )
 
 
+def merge_oci_archives(
+    archives: Sequence[Path], destination: Path, *, tag: str
+) -> None:
+    """Combine single-platform OCI archives into one multi-platform archive.
+
+    The manifest tagged ``tag`` in each archive is added to an image index,
+    with the platform taken from its config. The new archive tags the index
+    with ``tag``, and stores the blobs that the archives share only once.
+
+    :param archives: The OCI archives to combine, one per platform.
+    :param destination: The path of the new archive.
+    :param tag: The tag of the images in ``archives``, and of the new index.
+    :raises RockcraftError: If an archive is missing the image, or if two
+        archives are for the same platform.
+    """
+    descriptors: list[dict[str, Any]] = []
+    written: set[str] = set()
+    temp_destination = destination.with_name(f".{destination.name}.partial")
+
+    try:
+        with tarfile.open(temp_destination, "w") as dest_tar:
+            _add_tar_json(dest_tar, "oci-layout", {"imageLayoutVersion": "1.0.0"})
+
+            for archive in archives:
+                descriptor = _copy_archive_image(archive, tag, dest_tar, written)
+                _check_new_platform(descriptors, descriptor)
+                descriptors.append(descriptor)
+
+            image_index = {
+                "schemaVersion": 2,
+                "mediaType": INDEX_MEDIA_TYPE,
+                "manifests": descriptors,
+            }
+            index_digest, index_size = _add_tar_json(dest_tar, None, image_index)
+            index_descriptor = {
+                "mediaType": INDEX_MEDIA_TYPE,
+                "digest": index_digest,
+                "size": index_size,
+                "annotations": {REF_NAME_ANNOTATION: tag},
+            }
+            _add_tar_json(
+                dest_tar,
+                "index.json",
+                {"schemaVersion": 2, "manifests": [index_descriptor]},
+            )
+    except BaseException:
+        temp_destination.unlink(missing_ok=True)
+        raise
+
+    temp_destination.replace(destination)
+
+
+def _check_new_platform(
+    descriptors: list[dict[str, Any]], descriptor: dict[str, Any]
+) -> None:
+    """Check that no descriptor in ``descriptors`` has the platform of ``descriptor``."""
+    platform = descriptor["platform"]
+    if any(d["platform"] == platform for d in descriptors):
+        raise errors.RockcraftError(f"More than one image for platform {platform}.")
+
+
+def _copy_archive_image(
+    archive: Path, tag: str, dest_tar: tarfile.TarFile, written: set[str]
+) -> dict[str, Any]:
+    """Copy the blobs of an OCI archive into another one.
+
+    :param archive: The OCI archive to copy the blobs of.
+    :param tag: The tag of the image in ``archive``.
+    :param dest_tar: The archive to copy the blobs to.
+    :param written: The blobs already in ``dest_tar``, which are not copied
+        again. Updated with the copied blobs.
+    :returns: The descriptor of the image's manifest, with its platform.
+    """
+    with tarfile.open(archive) as src_tar:
+        members = {
+            member.name.removeprefix("./"): member
+            for member in src_tar.getmembers()
+            if member.isfile()
+        }
+        try:
+            tl_index = _read_tar_json(src_tar, members["index.json"])
+            idx = _get_manifest_index(tl_index, tag, archive)
+            descriptor = tl_index["manifests"][idx]
+            manifest_member = members[_blob_member(descriptor["digest"])]
+            manifest = _read_tar_json(src_tar, manifest_member)
+            config_member = members[_blob_member(manifest["config"]["digest"])]
+            config = _read_tar_json(src_tar, config_member)
+        except KeyError as err:
+            raise errors.RockcraftError(
+                f"{archive} is not a valid OCI archive (missing {err})."
+            ) from err
+
+        for name, member in members.items():
+            if name.startswith("blobs/") and name not in written:
+                member.name = name
+                dest_tar.addfile(member, src_tar.extractfile(member))
+                written.add(name)
+
+    platform = {"architecture": config["architecture"], "os": config["os"]}
+    if config.get("variant"):
+        platform["variant"] = config["variant"]
+    emit.debug(f"Added {platform} image from {archive}")
+
+    return {
+        "mediaType": descriptor.get("mediaType", MANIFEST_MEDIA_TYPE),
+        "digest": descriptor["digest"],
+        "size": descriptor["size"],
+        "platform": platform,
+    }
+
+
+def _blob_member(digest: str) -> str:
+    """Get the name of the blob with ``digest`` in an OCI archive."""
+    algorithm, _, encoded = digest.partition(":")
+    return f"blobs/{algorithm}/{encoded}"
+
+
+def _read_tar_json(tar: tarfile.TarFile, member: tarfile.TarInfo) -> dict[str, Any]:
+    """Load a JSON file from an OCI archive."""
+    fileobj = cast(BinaryIO, tar.extractfile(member))
+    result: dict[str, Any] = json.load(fileobj)
+    return result
+
+
+def _add_tar_json(
+    tar: tarfile.TarFile, name: str | None, content: dict[str, Any]
+) -> tuple[str, int]:
+    """Add a JSON file to an OCI archive.
+
+    :param name: The name of the file, or None to add it as a blob.
+    :returns: The digest (in ``sha256:<hex>`` format) and size of the file.
+    """
+    content_bytes = json.dumps(content).encode("utf-8")
+    digest = f"sha256:{hashlib.sha256(content_bytes).hexdigest()}"
+    info = tarfile.TarInfo(name or _blob_member(digest))
+    info.size = len(content_bytes)
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(content_bytes))
+    return digest, len(content_bytes)
+
+
+def _write_tar_bytes(archive_file: BinaryIO, name: str, content: bytes) -> None:
+    """Write a regular file with ``content`` to an uncompressed tar stream."""
+    archive_file.write(_tar_header(name, len(content)))
+    archive_file.write(content)
+    archive_file.write(_tar_padding(len(content)))
+
+
+def _write_tar_file(archive_file: BinaryIO, name: str, path: Path) -> None:
+    """Write the file at ``path`` to an uncompressed tar stream, as ``name``.
+
+    The contents are copied in the kernel when possible, without passing
+    through Python buffers.
+
+    :param archive_file: The unbuffered tar stream.
+    """
+    with path.open("rb") as src:
+        size = os.fstat(src.fileno()).st_size
+        archive_file.write(_tar_header(name, size))
+        _copy_file_contents(src, archive_file, size)
+    archive_file.write(_tar_padding(size))
+
+
+def _copy_file_contents(src: BinaryIO, dest: BinaryIO, size: int) -> None:
+    """Copy ``size`` bytes from the start of ``src`` to the position of ``dest``."""
+    offset = 0
+    try:
+        while offset < size:
+            sent = os.sendfile(dest.fileno(), src.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    except (AttributeError, OSError) as err:
+        # sendfile() is not available for every platform and file system.
+        emit.debug(f"Cannot use sendfile ({err}), copying the file instead")
+
+    if offset < size:
+        src.seek(offset)
+        shutil.copyfileobj(src, dest)
+
+
+def _tar_header(name: str, size: int) -> bytes:
+    """Get the tar header of a regular file, with reproducible metadata."""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    return info.tobuf(tarfile.PAX_FORMAT)
+
+
+def _tar_padding(size: int) -> bytes:
+    """Get the padding for a tar member of ``size`` bytes."""
+    return tarfile.NUL * (-size % tarfile.BLOCKSIZE)
+
+
+def _pull_image(
+    source: str,
+    image_target: Path,
+    mapping: ArchitectureMapping,
+    blob_cache: BlobCache | None,
+) -> str:
+    """Download an image from a registry into an OCI layout.
+
+    The blobs of the image are downloaded concurrently, straight into
+    ``blob_cache`` if set (skipping the blobs it already has), and linked
+    into the destination layout. Docker manifests are converted to OCI ones,
+    and kept next to them so that the image can be found by either digest.
+
+    :param source: The image to download, like ``public.ecr.aws/ubuntu/ubuntu:24.04``
+        or ``public.ecr.aws/ubuntu/ubuntu@sha256:<hex>``.
+    :param image_target: The destination image, as ``<layout dir>:<tag>``.
+    :param mapping: The architecture of the image to download.
+    :param blob_cache: An optional cache to store the image's blobs in.
+    :returns: The digest of the manifest in the registry.
+    """
+    reference = registry.ImageReference.parse(source)
+    client = registry.RegistryClient(
+        reference.registry, max_retries=MAX_DOWNLOAD_RETRIES
+    )
+    content, media_type = client.get_manifest(
+        reference.repository,
+        reference.reference,
+        architecture=mapping.go_arch,
+        variant=mapping.go_variant,
+    )
+    source_content = content
+    content = _to_oci_manifest_content(source_content, media_type)
+    manifest = json.loads(content)
+
+    name, tag = image_target.name.split(":", 1)
+    layout_path = image_target.parent / name
+    layout_blobs_path = layout_path / "blobs"
+
+    def get_blob_path(digest: str) -> Path:
+        if blob_cache is not None:
+            return blob_cache.get_path(digest)
+        algorithm, _, encoded = digest.partition(":")
+        return layout_blobs_path / algorithm / encoded
+
+    blobs = [manifest["config"], *manifest["layers"]]
+    emit.progress(f"Downloading {len(blobs)} blobs of {reference}")
+    client.download_blobs(reference.repository, blobs, get_blob_path)
+
+    digest = f"sha256:{hashlib.sha256(content).hexdigest()}"
+    source_digest = f"sha256:{hashlib.sha256(source_content).hexdigest()}"
+    digests = [digest, *(blob["digest"] for blob in blobs)]
+    if source_digest != digest:
+        digests.append(source_digest)
+    for manifest_digest, manifest_content in (
+        (digest, content),
+        (source_digest, source_content),
+    ):
+        manifest_path = get_blob_path(manifest_digest)
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest_path.write_bytes(manifest_content)
+    if blob_cache is not None:
+        blob_cache.link_to(digests, layout_blobs_path)
+
+    descriptor = {
+        "mediaType": MANIFEST_MEDIA_TYPE,
+        "digest": digest,
+        "size": len(content),
+    }
+    _add_to_layout(layout_path, descriptor, tag)
+    emit.debug(f"Downloaded {reference} ({digest}) into {layout_path}")
+
+    if blob_cache is not None:
+        blob_cache.evict(keep=digests)
+    return source_digest
+
+
+def _push_manifest(
+    client: registry.RegistryClient,
+    repository: str,
+    blobs_path: Path,
+    descriptor: dict[str, Any],
+    reference: str,
+    *,
+    mount_from: str | None,
+) -> int:
+    """Push a manifest or index from an OCI layout, after everything it refers to.
+
+    :param blobs_path: The ``blobs`` directory of the OCI layout.
+    :param descriptor: The descriptor of the manifest.
+    :param reference: The tag or digest to push the manifest as.
+    :returns: The number of blobs that were uploaded.
+    """
+
+    def get_blob_path(digest: str) -> Path:
+        algorithm, _, encoded = digest.partition(":")
+        return blobs_path / algorithm / encoded
+
+    content = get_blob_path(descriptor["digest"]).read_bytes()
+    manifest = json.loads(content)
+    media_type = descriptor.get("mediaType") or manifest.get("mediaType")
+
+    uploaded = 0
+    if media_type == INDEX_MEDIA_TYPE:
+        for child in manifest["manifests"]:
+            uploaded += _push_manifest(
+                client,
+                repository,
+                blobs_path,
+                child,
+                child["digest"],
+                mount_from=mount_from,
+            )
+    else:
+        emit.progress(f"Uploading the blobs of {descriptor['digest']}")
+        uploaded += client.upload_blobs(
+            repository,
+            [manifest["config"], *manifest["layers"]],
+            get_blob_path,
+            mount_from=mount_from,
+        )
+
+    client.put_manifest(
+        repository, reference, content, media_type or MANIFEST_MEDIA_TYPE
+    )
+    return uploaded
+
+
+def _to_oci_manifest_content(content: bytes, media_type: str | None = None) -> bytes:
+    """Get the OCI manifest for a manifest from a registry, converting it if needed.
+
+    :param content: The manifest, as stored in the registry.
+    :param media_type: The media type of the manifest, if not the one it contains.
+    :returns: The OCI manifest, which is ``content`` unless it had to be converted.
+    """
+    manifest = json.loads(content)
+    if (media_type or manifest.get("mediaType")) != registry.DOCKER_MANIFEST_MEDIA_TYPE:
+        return content
+    return json.dumps(_to_oci_manifest(manifest)).encode("utf-8")
+
+
+def _to_oci_manifest(manifest: dict[str, Any]) -> dict[str, Any]:
+    """Convert a Docker image manifest to the equivalent OCI one.
+
+    The config and layer blobs are the same, only their media types change.
+    """
+
+    def convert(descriptor: dict[str, Any]) -> dict[str, Any]:
+        media_type = descriptor.get("mediaType", "")
+        return {
+            **descriptor,
+            "mediaType": _DOCKER_TO_OCI_MEDIA_TYPES.get(media_type, media_type),
+        }
+
+    return {
+        **manifest,
+        "mediaType": MANIFEST_MEDIA_TYPE,
+        "config": convert(manifest["config"]),
+        "layers": [convert(layer) for layer in manifest["layers"]],
+    }
+
+
+def _copy_image_through_cache(
+    source: str,
+    image_target: Path,
+    blob_cache: BlobCache,
+    *system_params: str,
+    copy_params: list[str],
+) -> None:
+    """Transfer an image into an OCI layout, storing its blobs in ``blob_cache``.
+
+    The image is first copied into a staging layout next to the cache, whose
+    blobs go straight to the cache, so that blobs already in it are not
+    transferred again. The blobs are then linked into the destination layout.
+
+    :param source: The source image, in skopeo's ``transport:name`` format.
+    :param image_target: The destination image, as ``<layout dir>:<tag>``.
+    :param blob_cache: The cache to store the blobs in.
+    """
+    name, tag = image_target.name.split(":", 1)
+    layout_path = image_target.parent / name
+    blob_cache.directory.mkdir(parents=True, exist_ok=True)
+
+    # Stage the layout on the cache's filesystem, so blobs can be moved in place.
+    with tempfile.TemporaryDirectory(
+        prefix=".layout-", dir=blob_cache.directory
+    ) as staging_dir:
+        staging_index_path = Path(staging_dir, "index.json")
+        _copy_image(
+            source,
+            f"oci:{staging_dir}:{tag}",
+            *system_params,
+            copy_params=[
+                *copy_params,
+                "--dest-shared-blob-directory",
+                str(blob_cache.directory),
+            ],
+        )
+        staging_index = json.loads(staging_index_path.read_bytes())
+        idx = _get_manifest_index(staging_index, tag, staging_index_path)
+        descriptor: dict[str, Any] = staging_index["manifests"][idx]
+
+    manifest = json.loads(blob_cache.get_path(descriptor["digest"]).read_bytes())
+    digests = [
+        descriptor["digest"],
+        manifest["config"]["digest"],
+        *(layer["digest"] for layer in manifest["layers"]),
+    ]
+    blob_cache.link_to(digests, layout_path / "blobs")
+    _add_to_layout(layout_path, descriptor, tag)
+    emit.debug(f"Linked {len(digests)} cached blobs into {layout_path}")
+
+    blob_cache.evict(keep=digests)
+
+
+def _add_to_layout(layout_path: Path, descriptor: dict[str, Any], tag: str) -> None:
+    """Tag a manifest in an OCI layout, creating the layout if needed.
+
+    :param layout_path: The directory of the OCI layout.
+    :param descriptor: The descriptor of the manifest, whose blob must already
+        be in the layout.
+    :param tag: The tag of the manifest, replacing any manifest with that tag.
+    """
+    layout_file = layout_path / "oci-layout"
+    if not layout_file.exists():
+        layout_file.write_text(json.dumps({"imageLayoutVersion": "1.0.0"}))
+
+    tl_index_path = layout_path / "index.json"
+    if tl_index_path.exists():
+        tl_index = json.loads(tl_index_path.read_bytes())
+    else:
+        tl_index = {"schemaVersion": 2, "manifests": []}
+
+    tl_index["manifests"] = [
+        m
+        for m in tl_index["manifests"]
+        if (m.get("annotations") or {}).get(REF_NAME_ANNOTATION) != tag
+    ] + [
+        {
+            **descriptor,
+            "annotations": {
+                **descriptor.get("annotations", {}),
+                REF_NAME_ANNOTATION: tag,
+            },
+        }
+    ]
+    tl_index_path.write_bytes(json.dumps(tl_index).encode("utf-8"))
+
+
+def _read_key(key_path: Path) -> str | None:
+    """Read the cache key of an extracted bundle, if any."""
+    try:
+        return key_path.read_text()
+    except OSError:
+        return None
+
+
+def _write_user_files(
+    target_dir: Path,
+    prime_dir: Path,
+    base_layer_dir: Path,
+    username: str,
+    uid: int,
+    *,
+    base_index: RootfsIndex | None = None,
+) -> None:
+    """Write the rock's /etc/{passwd,group,shadow} files, adding a new user.
+
+    :param target_dir: The root of the layer to write the files to.
+    :param prime_dir: Path to the user-defined parts' primed content.
+    :param base_layer_dir: Path to the base layer's root filesystem.
+    :param username: Username to be created. Same as group name.
+    :param uid: UID of the username to be created. Same as GID.
+    :param base_index: An optional index of ``base_layer_dir``, used to check
+        which files exist in the base and to read them.
+    """
+    user_files = {"passwd": "", "group": "", "shadow": ""}
+
+    prime_dir_etc = prime_dir / "etc"
+    base_layer_dir_etc = base_layer_dir / "etc"
+    # Being cautious about possible changes (edits or removals) in
+    # /etc/{passwd,group,shadow} done by the user through overlay scripts.
+    # Basically:
+    #  - if it exists in prime, use it,
+    #  - if it doesn't exist in prime AND isn't "whiteout", use the base,
+    #  - if it is "whiteout" or doesn't exist anywhere, use an empty file.
+    # NOTE: "shadow" is only modified if it already exists.
+    from_base: list[str] = []
+    for u_file in user_files:
+        if base_index is not None:
+            in_base = base_index.get(f"etc/{u_file}") is not None
+        else:
+            in_base = (base_layer_dir_etc / u_file).exists()
+
+        if (prime_dir_etc / u_file).exists():
+            user_files[u_file] = (prime_dir_etc / u_file).read_text()
+        elif in_base and not (prime_dir_etc / f".wh.{u_file}").exists():
+            from_base.append(u_file)
+
+    if base_index is not None:
+        # The base may be extracted lazily: extract the files in a single pass
+        # over its layers.
+        base_index.materialise(f"etc/{u_file}" for u_file in from_base)
+    for u_file in from_base:
+        base_file = base_layer_dir_etc / u_file
+        if base_index is not None:
+            base_file = base_index.file_path(f"etc/{u_file}") or base_file
+        user_files[u_file] = base_file.read_text()
+
+    if (  # pylint: disable=too-many-boolean-expressions
+        f"\n{username}:" in user_files["passwd"]
+        or user_files["passwd"].startswith(f"{username}:")
+        or f":{uid}:" in user_files["passwd"]
+        or f"\n{username}:" in user_files["group"]
+        or user_files["group"].startswith(f"{username}:")
+        or f":{uid}:" in user_files["group"]
+    ):
+        raise errors.RockcraftError(
+            str(
+                f"Error while trying to create user {username}:{uid}, "
+                f"with group {username}:{uid}...\n"
+                " - conflict with existing user/group in the base filesystem"
+            )
+        )
+
+    user_files["passwd"] += (
+        f"{username}:x:{uid}:{uid}::/{Pebble.PEBBLE_PATH}:/usr/bin/false\n"
+    )
+    user_files["group"] += f"{username}:x:{uid}:\n"
+
+    target_etc = target_dir / "etc"
+    target_etc.mkdir(parents=True, exist_ok=True)
+    with (target_etc / "passwd").open("a+") as passwdf:
+        passwdf.write(user_files["passwd"])
+
+    with (target_etc / "group").open("a+") as groupf:
+        groupf.write(user_files["group"])
+
+    if user_files["shadow"]:
+        days_since_epoch = (
+            datetime.now(timezone.utc) - datetime(1970, 1, 1, tzinfo=timezone.utc)
+        ).days
+
+        # only add the shadow file if there's already one in the base image
+        with (target_etc / "shadow").open("a+") as shadowf:
+            shadowf.write(
+                user_files["shadow"] + f"{username}:!:{days_since_epoch}::::::\n"
+            )
+
+
+def _write_control_data(target_dir: Path, metadata: dict[str, Any]) -> None:
+    """Write the rock's control data folder, with its metadata YAML file.
+
+    :param target_dir: The root of the layer to write the folder to.
+    :param metadata: Content for the rock's metadata YAML file.
+    """
+    # the rock control data structure starts with the folder ".rock"
+    control_data_rock_folder = target_dir / ROCK_CONTROL_DIR
+    control_data_rock_folder.mkdir()
+
+    rock_metadata_file = control_data_rock_folder / "metadata.yaml"
+    with rock_metadata_file.open("w", encoding="utf-8") as rock_meta:
+        yaml.dump(metadata, rock_meta)
+    rock_metadata_file.chmod(0o644)
+
+
 def _config_image(
     image_path: Path, params: list[str], comment: str | None = None
 ) -> None:
@@ -590,27 +1786,249 @@ def _config_image(
     _process_run(cmd)
 
 
-def _add_layer_into_image(
-    image_path: Path, archived_content: Path, comment: str | None = None, **kwargs: str
+class _DigestWriter:
+    """Write-only file object that hashes and counts the bytes going through it."""
+
+    def __init__(self, fileobj: BinaryIO) -> None:
+        self._fileobj = fileobj
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        """Hash ``data`` and forward it to the wrapped file object."""
+        self._hash.update(data)
+        self.size += len(data)
+        return self._fileobj.write(data)
+
+    def flush(self) -> None:
+        """Flush the wrapped file object."""
+        self._fileobj.flush()
+
+    @property
+    def digest(self) -> str:
+        """The digest of the data written so far, in ``sha256:<hex>`` format."""
+        return f"sha256:{self._hash.hexdigest()}"
+
+
+def _write_layer_blob(
+    blobs_path: Path,
+    new_layer_dir: Path,
+    base_layer_dir: Path | None = None,
+    *,
+    compression: LayerCompression,
+    base_index: RootfsIndex | None = None,
+    include: AbstractSet[str] | None = None,
+    exclude: AbstractSet[str] = frozenset(),
+    layer_cache: LayerCache | None = None,
+) -> LayerBlob:
+    """Archive a directory as a compressed layer blob, in a single pass.
+
+    The tarball is streamed through the compressor and both the uncompressed
+    (diff_id) and compressed (blob) digests are computed on the fly. If the
+    same contents were archived before with the same compression, the blob is
+    taken from ``layer_cache`` instead.
+
+    :param blobs_path: The ``blobs/sha256`` directory of the OCI layout.
+    :param new_layer_dir: The path to the new layer root filesystem.
+    :param base_layer_dir: An optional path to the extracted base layer.
+    :param compression: The compression algorithm and level to use.
+    :param base_index: An optional index of ``base_layer_dir``.
+    :param include: If set, only archive these paths of ``new_layer_dir``.
+    :param exclude: The paths of ``new_layer_dir`` not to archive.
+    :param layer_cache: An optional cache of previously built blobs.
+    :returns: The descriptor data of the new blob.
+    """
+    with timing.span(
+        "archive layer", "layer", compression=str(compression)
+    ) as span_args:
+        blobs_path.mkdir(parents=True, exist_ok=True)
+        layer_paths = layers.collect_layer_paths(
+            new_layer_dir,
+            base_layer_dir,
+            base_index=base_index,
+            include=include,
+            exclude=exclude,
+        )
+
+        cache_key: str | None = None
+        if layer_cache is not None:
+            fingerprint = layers.fingerprint_layer(layer_paths)
+            cache_key = hashlib.sha256(
+                f"{fingerprint}:{compression}".encode()
+            ).hexdigest()
+            cached = layer_cache.get(cache_key)
+            if cached is not None:
+                layer = LayerBlob(**cached.metadata)
+                blob_path = blobs_path / layer.digest.split(":", 1)[1]
+                if not blob_path.exists():
+                    link_or_copy(cached.path, blob_path)
+                emit.debug(f"Reusing cached layer blob {layer.digest}")
+                span_args.update(bytes=layer.size, cached=True)
+                return layer
+
+        temp_blob = blobs_path / f".temp_layer.{os.getpid()}"
+        temp_blob.unlink(missing_ok=True)
+
+        try:
+            with temp_blob.open("wb") as blob_file:
+                compressed = _DigestWriter(blob_file)
+                with compression.open_writer(
+                    cast(BinaryIO, compressed)
+                ) as compressed_writer:
+                    uncompressed = _DigestWriter(compressed_writer)
+                    layers.write_layer(layer_paths, cast(BinaryIO, uncompressed))
+
+            blob_path = blobs_path / compressed.digest.split(":", 1)[1]
+            temp_blob.rename(blob_path)
+        finally:
+            temp_blob.unlink(missing_ok=True)
+
+        emit.debug(f"Compressed layer with {compression}")
+        layer = LayerBlob(
+            digest=compressed.digest,
+            size=compressed.size,
+            diff_id=uncompressed.digest,
+            media_type=compression.media_type,
+        )
+        span_args.update(bytes=layer.size, uncompressed_bytes=uncompressed.size)
+        if layer_cache is not None and cache_key is not None:
+            layer_cache.put(cache_key, blob_path, dataclasses.asdict(layer))
+        return layer
+
+
+def _append_layer(
+    layout_path: Path,
+    image_tag: str,
+    layer: LayerBlob,
+    *,
+    comment: str | None = None,
+    new_tag: str | None = None,
 ) -> None:
-    """Add raw layer (archived) into the OCI image.
+    """Add a layer blob on top of the image tagged ``image_tag``.
+
+    This is the equivalent of ``umoci raw add-layer``: the layer is appended
+    to the manifest, its diff_id and history entry to the config, and the
+    new manifest is tagged in ``index.json``.
 
-    :param image_path: path of the OCI image, in the format <image>:<tar>
-    :param archived_content: path to the archived content to be added
-    :param comment: optional comment to add to the layer's history
+    :param layout_path: The path to the OCI layout directory.
+    :param image_tag: The tag of the image to add the layer to.
+    :param layer: The layer blob, already present in the layout.
+    :param comment: An optional comment to add to the layer's history.
+    :param new_tag: The tag for the new image. If None, ``image_tag`` is moved.
     """
-    cmd = [
-        "umoci",
-        "raw",
-        "add-layer",
-        "--image",
-        str(image_path),
-        str(archived_content),
-    ] + [arg_val for k, v in kwargs.items() for arg_val in [k, v]]
-    cmd.extend(["--history.created_by", " ".join(cmd)])
+    blobs_path = layout_path / "blobs" / "sha256"
+    tl_index_path = layout_path / "index.json"
+    tl_index = json.loads(tl_index_path.read_bytes())
+    idx = _get_manifest_index(tl_index, image_tag, tl_index_path)
+
+    manifest = _read_json_blob(blobs_path, tl_index["manifests"][idx]["digest"])
+    image_config = _read_json_blob(blobs_path, manifest["config"]["digest"])
+
+    rootfs = image_config.get("rootfs") or {"type": "layers", "diff_ids": []}
+    rootfs.setdefault("diff_ids", []).append(layer.diff_id)
+    image_config["rootfs"] = rootfs
+
+    history: dict[str, Any] = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "created_by": "rockcraft add-layer",
+    }
     if comment:
-        cmd.extend(["--history.comment", comment])
-    _process_run(cmd)
+        history["comment"] = comment
+    image_config["history"] = [*(image_config.get("history") or []), history]
+
+    config_digest, config_size = _write_json_blob(blobs_path, image_config)
+    manifest["config"]["digest"] = config_digest
+    manifest["config"]["size"] = config_size
+    manifest["layers"] = [
+        *(manifest.get("layers") or []),
+        {"mediaType": layer.media_type, "digest": layer.digest, "size": layer.size},
+    ]
+    manifest_digest, manifest_size = _write_json_blob(blobs_path, manifest)
+
+    _tag_manifest(
+        tl_index,
+        idx,
+        new_tag or image_tag,
+        digest=manifest_digest,
+        size=manifest_size,
+    )
+    tl_index_path.write_bytes(json.dumps(tl_index).encode("utf-8"))
+
+
+def _get_manifest_index(
+    tl_index: dict[str, Any], image_tag: str, tl_index_path: Path
+) -> int:
+    """Get the position in the OCI index of the manifest tagged ``image_tag``.
+
+    :raises RockcraftError: If there isn't exactly one manifest with that tag.
+    """
+    # The annotation "org.opencontainers.image.ref.name" here is set by umoci
+    # (and by Rockcraft when adding layers) to distinguish images with different
+    # tags within the same OCI directory. This annotation is irrelevant to the
+    # annotation field with the same name in the manifest of the target image.
+    indexes = [
+        i
+        for i, manifest in enumerate(tl_index["manifests"])
+        if (a := manifest.get("annotations"))
+        and a.get(REF_NAME_ANNOTATION) == image_tag
+    ]
+    if not indexes:
+        raise errors.RockcraftError(
+            f"Cannot find manifest for {image_tag} in {tl_index_path}"
+        )
+    if len(indexes) > 1:
+        raise errors.RockcraftError(
+            f"Found multiple manifests for {image_tag} in {tl_index_path}"
+        )
+    return indexes[0]
+
+
+def _tag_manifest(
+    tl_index: dict[str, Any], idx: int, tag: str, *, digest: str, size: int
+) -> None:
+    """Point ``tag`` in the OCI index to a manifest derived from entry ``idx``.
+
+    If ``tag`` is the tag of entry ``idx`` the entry is updated in place;
+    otherwise a new entry is added, replacing any other entry with that tag.
+    """
+    manifests: list[dict[str, Any]] = tl_index["manifests"]
+    descriptor = {
+        **manifests[idx],
+        "digest": digest,
+        "size": size,
+        "annotations": {
+            **manifests[idx].get("annotations", {}),
+            REF_NAME_ANNOTATION: tag,
+        },
+    }
+    if manifests[idx]["annotations"].get(REF_NAME_ANNOTATION) == tag:
+        manifests[idx] = descriptor
+        return
+
+    tl_index["manifests"] = [
+        m
+        for m in manifests
+        if (m.get("annotations") or {}).get(REF_NAME_ANNOTATION) != tag
+    ] + [descriptor]
+
+
+def _read_json_blob(blobs_path: Path, digest: str) -> dict[str, Any]:
+    """Load a JSON blob (config, manifest) from the layout's blob store."""
+    result: dict[str, Any] = json.loads(
+        (blobs_path / digest.split(":", 1)[1]).read_bytes()
+    )
+    return result
+
+
+def _write_json_blob(blobs_path: Path, content: dict[str, Any]) -> tuple[str, int]:
+    """Write a JSON blob into the layout's blob store.
+
+    :returns: The digest (in ``sha256:<hex>`` format) and size of the new blob.
+    """
+    content_bytes = json.dumps(content).encode("utf-8")
+    content_digest = hashlib.sha256(content_bytes).hexdigest()
+    (blobs_path / content_digest).write_bytes(content_bytes)
+    return f"sha256:{content_digest}", len(content_bytes)
 
 
 def _inject_oci_fields(image_path: Path, arch_variant: str | None = None) -> None:
@@ -629,25 +2047,8 @@ def _inject_oci_fields(image_path: Path, arch_variant: str | None = None) -> Non
     # The manifest of the image being built contains both the base image
     # and the target image. We need to find the manifest that matches the
     # tag of the target image, and ensure the tag is not ambiguous.
-    # The annotation "org.opencontainers.image.ref.name" here is set by umoci
-    # when calling the method `add_layer` to distinguish images with different
-    # tags within the same OCI directory. This annotation is irrelevant to the
-    # annotation field with the same name in the manifest of the target image.
-    manifest_digests: list[tuple[str, int]] = [
-        (manifest["digest"].split(":")[-1], i)
-        for i, manifest in enumerate(tl_index["manifests"])
-        if (a := manifest.get("annotations"))
-        and a.get("org.opencontainers.image.ref.name") == image_tag
-    ]
-    if not manifest_digests:
-        raise errors.RockcraftError(
-            f"Cannot find manifest for {image_tag} in {tl_index_path}"
-        )
-    if len(manifest_digests) > 1:
-        raise errors.RockcraftError(
-            f"Found multiple manifests for {image_tag} in {tl_index_path}"
-        )
-    manifest_digest, idx = manifest_digests[0]
+    idx = _get_manifest_index(tl_index, image_tag, tl_index_path)
+    manifest_digest = tl_index["manifests"][idx]["digest"].split(":")[-1]
     manifest_path = blobs_path / manifest_digest
     manifest_content = json.loads(manifest_path.read_bytes())
 
@@ -692,14 +2093,17 @@ def _process_run(command: list[str], **kwargs: Any) -> subprocess.CompletedProce
         emit.trace(f"Found command absolute path: {command[0]!r}")
 
     emit.trace(f"Execute process: {command!r}, kwargs={kwargs!r}")
+    # The span is named after the command and its subcommand, like "umoci config".
+    name = " ".join([Path(command[0]).name, *command[1:2]])
     try:
-        return subprocess.run(
-            command,
-            **kwargs,
-            capture_output=True,
-            check=True,
-            text=True,
-        )
+        with timing.span(name, "subprocess", command=shlex.join(command)):
+            return subprocess.run(
+                command,
+                **kwargs,
+                capture_output=True,
+                check=True,
+                text=True,
+            )
     except subprocess.CalledProcessError as err:
         msg = f"Failed to copy image: {err!s}"
         if err.stderr:
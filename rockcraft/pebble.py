@@ -30,6 +30,8 @@ from craft_application.models import CraftBaseModel
 from craft_application.util import ProServices
 from craft_cli import emit
 
+from rockcraft.rootfs import RootfsIndex
+
 
 class SuccessExitState(enum.Enum):
     """What to do on exit success."""
@@ -401,6 +403,8 @@ class Pebble:
         ref_fs: Path,
         layer_content: dict[str, Any],
         rock_name: str,
+        *,
+        ref_index: RootfsIndex | None = None,
     ) -> None:
         """Infers and defines a new Pebble layer file.
 
@@ -411,17 +415,26 @@ class Pebble:
         :param ref_fs: filesystem to use as a reference when inferring the layer name
         :param layer_content: the actual Pebble layer, in JSON
         :param rock_name: name of the rock where the layer will end up
+        :param ref_index: optional index of ref_fs, listed instead of the filesystem
         """
         # NOTE: the layer's filename prefix will always be "001-" when using
         # "bare" and "ubuntu" bases
-        pebble_layers_path_in_base = ref_fs / self.PEBBLE_LAYERS_PATH
-
-        existing_pebble_layers: list[Path] = [
-            *pebble_layers_path_in_base.glob("[0-9][0-9][0-9]-???*.yaml"),
-            *pebble_layers_path_in_base.glob("[0-9][0-9][0-9]-???*.yml"),
-        ]
-
-        prefixes = [Path(layer).name[:3] for layer in existing_pebble_layers]
+        patterns = ("[0-9][0-9][0-9]-???*.yaml", "[0-9][0-9][0-9]-???*.yml")
+        if ref_index is not None:
+            existing_pebble_layers = [
+                name
+                for pattern in patterns
+                for name in ref_index.glob(self.PEBBLE_LAYERS_PATH, pattern)
+            ]
+        else:
+            pebble_layers_path_in_base = ref_fs / self.PEBBLE_LAYERS_PATH
+            existing_pebble_layers = [
+                path.name
+                for pattern in patterns
+                for path in pebble_layers_path_in_base.glob(pattern)
+            ]
+
+        prefixes = [layer[:3] for layer in existing_pebble_layers]
         prefixes.sort()
         emit.progress(
             f"Found {len(existing_pebble_layers)} Pebble layers in the base's root filesystem"
@@ -472,6 +485,38 @@ class Pebble:
 
         return [f"/{pebble_path}", "enter"]
 
+    @staticmethod
+    def get_layer_content(
+        *,
+        services: dict[str, Any],
+        checks: dict[str, Any],
+        summary: str,
+        description: str,
+    ) -> dict[str, Any]:
+        """Get the content of the rock's Pebble layer.
+
+        :param services: The Pebble services
+        :param checks: The Pebble checks
+        :param summary: The summary for the Pebble layer
+        :param description: The description for the Pebble layer
+        """
+        layer_content: dict[str, Any] = {
+            "summary": summary,
+            "description": description,
+        }
+
+        if services:
+            emit.progress(
+                f"Configuring Pebble services {', '.join(list(services.keys()))}"
+            )
+            layer_content["services"] = services
+
+        if checks:
+            emit.progress(f"Configuring Pebble checks {', '.join(list(checks.keys()))}")
+            layer_content["checks"] = checks
+
+        return layer_content
+
     @staticmethod
     def _is_focal_or_jammy(build_base: str) -> bool:
         return build_base in ("ubuntu@20.04", "ubuntu@22.04")
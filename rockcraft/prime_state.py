@@ -0,0 +1,128 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""State of the processing done on the primed files after each prime step."""
+
+import json
+import os
+from collections.abc import Iterable
+from pathlib import Path
+from typing import cast
+
+from craft_cli import emit
+
+STATE_VERSION = 1
+
+# The identity of a primed file: its inode, size and modification time.
+_FileId = tuple[int, int, int]
+
+
+class PostPrimeState:
+    """The primed files that were already pruned and fixed after priming.
+
+    Files are identified by their path and ``lstat()`` identity, so the files
+    that a part primes again are processed again only if they changed, and
+    the files that were removed (like the pruned ones) are processed again if
+    they come back. The state only holds for the base it was processed with.
+
+    :param state_file: The file where the state is saved.
+    :param base_digest: The digest of the base the files are pruned against.
+    :param files: The processed files, with their identity once processed.
+    """
+
+    def __init__(
+        self,
+        state_file: Path,
+        base_digest: str,
+        files: dict[str, _FileId] | None = None,
+    ) -> None:
+        self.state_file = state_file
+        self.base_digest = base_digest
+        self._files = files if files is not None else {}
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    @classmethod
+    def load(cls, state_file: Path, base_digest: str) -> "PostPrimeState":
+        """Load the saved state, or an empty one if it is missing or outdated.
+
+        :param state_file: The file the state was saved to.
+        :param base_digest: The digest of the base the files are pruned against.
+        """
+        try:
+            data = json.loads(state_file.read_text())
+        except (OSError, ValueError) as err:
+            emit.debug(f"Cannot load post-prime state {state_file}: {err}")
+            return cls(state_file, base_digest)
+
+        if data.get("version") != STATE_VERSION or data.get("base") != base_digest:
+            emit.debug(f"Ignoring outdated post-prime state {state_file}")
+            return cls(state_file, base_digest)
+
+        files = {
+            path: cast(_FileId, tuple(file_id))
+            for path, file_id in data.get("files", {}).items()
+        }
+        return cls(state_file, base_digest, files)
+
+    def changed(self, prime_dir: Path, paths: Iterable[str]) -> set[str]:
+        """Get the primed files that changed since they were processed.
+
+        :param prime_dir: The prime directory.
+        :param paths: The candidate paths, relative to ``prime_dir``.
+        :returns: The paths that exist and were not processed as they are.
+        """
+        changed: set[str] = set()
+        for path in paths:
+            file_id = _get_file_id(prime_dir / path)
+            if file_id is not None and self._files.get(path) != file_id:
+                changed.add(path)
+        return changed
+
+    def mark_processed(self, prime_dir: Path, paths: Iterable[str]) -> None:
+        """Record that primed files were processed, as they are now.
+
+        :param prime_dir: The prime directory.
+        :param paths: The processed paths, relative to ``prime_dir``. The
+            ones that don't exist anymore are forgotten.
+        """
+        for path in paths:
+            file_id = _get_file_id(prime_dir / path)
+            if file_id is None:
+                self._files.pop(path, None)
+            else:
+                self._files[path] = file_id
+
+    def save(self) -> None:
+        """Write the state to its ``state_file``."""
+        data = {
+            "version": STATE_VERSION,
+            "base": self.base_digest,
+            "files": self._files,
+        }
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = self.state_file.with_name(f".{self.state_file.name}.{os.getpid()}")
+        temp_file.write_text(json.dumps(data, separators=(",", ":")))
+        temp_file.replace(self.state_file)
+
+
+def _get_file_id(path: Path) -> _FileId | None:
+    try:
+        path_stat = path.lstat()
+    except FileNotFoundError:
+        return None
+    return (path_stat.st_ino, path_stat.st_size, path_stat.st_mtime_ns)
@@ -0,0 +1,711 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Client for OCI distribution registries."""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import time
+import urllib.parse
+from collections.abc import Callable, Collection, Iterator, Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any
+
+import requests
+from craft_cli import emit
+
+from rockcraft import timing
+from rockcraft.errors import RegistryError
+
+OCI_MANIFEST_MEDIA_TYPE = "application/vnd.oci.image.manifest.v1+json"
+OCI_INDEX_MEDIA_TYPE = "application/vnd.oci.image.index.v1+json"
+DOCKER_MANIFEST_MEDIA_TYPE = "application/vnd.docker.distribution.manifest.v2+json"
+DOCKER_MANIFEST_LIST_MEDIA_TYPE = (
+    "application/vnd.docker.distribution.manifest.list.v2+json"
+)
+
+MANIFEST_MEDIA_TYPES = (OCI_MANIFEST_MEDIA_TYPE, DOCKER_MANIFEST_MEDIA_TYPE)
+INDEX_MEDIA_TYPES = (OCI_INDEX_MEDIA_TYPE, DOCKER_MANIFEST_LIST_MEDIA_TYPE)
+
+# The registry of images without an explicit registry, like "docker pull".
+DOCKER_HUB_REGISTRY = "docker.io"
+_DOCKER_HUB_API_HOST = "registry-1.docker.io"
+
+# Registries that are accessed over plain HTTP, like Docker does by default.
+_INSECURE_HOSTS = ("localhost", "127.0.0.1", "[::1]")
+
+MAX_RETRIES = 5
+MAX_CONCURRENT_DOWNLOADS = 4
+MAX_CONCURRENT_UPLOADS = 4
+# Blobs larger than this are uploaded in chunks of this size.
+UPLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+
+_DIGEST_PATTERN = re.compile(r"^sha256:[0-9a-f]{64}$")
+_REPOSITORY_PATTERN = re.compile(
+    r"^[a-z0-9]+(?:(?:[._]|__|-+)[a-z0-9]+)*(?:/[a-z0-9]+(?:(?:[._]|__|-+)[a-z0-9]+)*)*$"
+)
+_CHALLENGE_PARAM_PATTERN = re.compile(r'(\w+)="([^"]*)"')
+_RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+# Small enough that little is lost when a download is interrupted.
+_CHUNK_SIZE = 64 * 1024
+_TIMEOUT = 60
+# Seconds to wait before retrying, multiplied by the number of failed attempts.
+_RETRY_DELAY = 1.0
+
+
+@dataclass(frozen=True)
+class ImageReference:
+    """A reference to an image in a registry.
+
+    :param registry: The registry host, optionally with a port.
+    :param repository: The image's repository in the registry.
+    :param reference: The image's tag, or the digest of its manifest.
+    """
+
+    registry: str
+    repository: str
+    reference: str
+
+    @classmethod
+    def parse(cls, name: str) -> "ImageReference":
+        """Parse an image name, like ``public.ecr.aws/ubuntu/ubuntu:24.04``.
+
+        Like Docker, names without a registry are in Docker Hub, and names
+        without a tag or digest refer to the ``latest`` tag.
+
+        :raises RegistryError: If the name is not a valid image name.
+        """
+        registry, _, remainder = name.partition("/")
+        if not remainder or not (
+            "." in registry or ":" in registry or registry == "localhost"
+        ):
+            registry, remainder = DOCKER_HUB_REGISTRY, name
+            if "/" not in remainder:
+                remainder = f"library/{remainder}"
+
+        if "@" in remainder:
+            repository, _, reference = remainder.partition("@")
+        else:
+            repository, _, reference = remainder.rpartition(":")
+            if not repository or "/" in reference:
+                repository, reference = remainder, "latest"
+
+        if not _REPOSITORY_PATTERN.match(repository) or not reference:
+            raise RegistryError(f"Invalid image name: {name!r}")
+        return cls(registry=registry, repository=repository, reference=reference)
+
+    def __str__(self) -> str:
+        separator = "@" if self.reference.startswith("sha256:") else ":"
+        return f"{self.registry}/{self.repository}{separator}{self.reference}"
+
+
+class RegistryClient:
+    """A client of the OCI distribution API of a registry.
+
+    Requests that fail because of the network or of transient server errors
+    are retried, and downloads are resumed from where they stopped. Bearer
+    tokens are requested as the registry asks for them.
+
+    :param registry: The registry host, optionally with a port.
+    :param max_retries: The number of times to retry a failed request.
+    :param credentials: The username and password to authenticate with, if
+        any. Without credentials, anonymous tokens are requested.
+    """
+
+    def __init__(
+        self,
+        registry: str,
+        *,
+        max_retries: int = MAX_RETRIES,
+        credentials: tuple[str, str] | None = None,
+    ) -> None:
+        host = _DOCKER_HUB_API_HOST if registry == DOCKER_HUB_REGISTRY else registry
+        scheme = "http" if host.rsplit(":", 1)[0] in _INSECURE_HOSTS else "https"
+        self._base_url = f"{scheme}://{host}"
+        self._max_retries = max_retries
+        self._credentials = credentials
+        self._session = requests.Session()
+        self._tokens: dict[tuple[str, ...], str] = {}
+
+    def get_manifest(
+        self,
+        repository: str,
+        reference: str,
+        *,
+        architecture: str,
+        variant: str | None = None,
+    ) -> tuple[bytes, str]:
+        """Get the manifest of an image for a Linux platform.
+
+        If the reference points to an image index (or a Docker manifest list),
+        the manifest of the matching platform is fetched from it.
+
+        :param repository: The image's repository.
+        :param reference: The image's tag, or the digest of its manifest.
+        :param architecture: The platform's architecture, in Go format.
+        :param variant: The platform's architecture variant, if any.
+        :returns: The contents and the media type of the manifest.
+        :raises RegistryError: If the image is not found, or if it has no
+            manifest for the platform.
+        """
+        content, media_type = self._get_manifest(repository, reference)
+        if media_type in INDEX_MEDIA_TYPES:
+            descriptor = _select_platform(
+                json.loads(content)["manifests"], architecture, variant
+            )
+            content, media_type = self._get_manifest(repository, descriptor["digest"])
+
+        if media_type not in MANIFEST_MEDIA_TYPES:
+            raise RegistryError(
+                f"Unsupported manifest type {media_type!r} for {repository}."
+            )
+        return content, media_type
+
+    def download_blobs(
+        self,
+        repository: str,
+        descriptors: Sequence[Mapping[str, Any]],
+        get_path: Callable[[str], Path],
+    ) -> None:
+        """Download blobs concurrently, skipping the ones that already exist.
+
+        :param repository: The repository holding the blobs.
+        :param descriptors: The descriptors (with digest and size) of the blobs.
+        :param get_path: A function giving the path to store a blob at, by digest.
+        :raises RegistryError: If a blob cannot be downloaded.
+        """
+        pending = {
+            descriptor["digest"]: descriptor.get("size")
+            for descriptor in descriptors
+            if not get_path(_check_digest(descriptor["digest"])).is_file()
+        }
+        if not pending:
+            return
+
+        emit.debug(f"Downloading {len(pending)} blobs from {repository}")
+        workers = min(MAX_CONCURRENT_DOWNLOADS, len(pending))
+        with (
+            timing.span(
+                "download blobs",
+                "registry",
+                repository=repository,
+                blobs=len(pending),
+                bytes=sum(size or 0 for size in pending.values()),
+            ),
+            ThreadPoolExecutor(max_workers=workers) as executor,
+        ):
+            futures = [
+                executor.submit(
+                    self.download_blob, repository, digest, get_path(digest), size=size
+                )
+                for digest, size in pending.items()
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def download_blob(
+        self, repository: str, digest: str, path: Path, *, size: int | None = None
+    ) -> None:
+        """Download a blob, verifying its digest while it is written.
+
+        The blob is first written to a ``.partial`` file next to ``path``. If
+        the download is interrupted, it is resumed with an HTTP range request,
+        also in a later call. The partial file is locked while it is written,
+        so a process downloading the same blob waits for the other one.
+
+        :param repository: The repository holding the blob.
+        :param digest: The blob digest, in ``sha256:<hex>`` format.
+        :param path: The path to store the blob at.
+        :param size: The expected size of the blob, if known.
+        :raises RegistryError: If the blob cannot be downloaded, or if its
+            contents don't match the digest.
+        """
+        _check_digest(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(f"{path.name}.partial")
+        with _lock_partial(partial) as partial_file:
+            if path.is_file():
+                emit.debug(f"Skipping {digest}, which another process downloaded")
+                partial.unlink()
+                return
+            content_digest, offset = self._download_to(
+                repository, digest, partial_file, size
+            )
+            if content_digest != digest or size not in (None, offset):
+                partial.unlink()
+                raise RegistryError(
+                    f"The contents of blob {digest} from {repository} don't match "
+                    "its digest."
+                )
+            partial_file.flush()
+            partial.replace(path)
+        emit.debug(f"Downloaded {digest} ({offset} bytes)")
+
+    def _download_to(
+        self, repository: str, digest: str, partial_file: IO[bytes], size: int | None
+    ) -> tuple[str, int]:
+        """Download a blob to its locked partial file, resuming what it has.
+
+        Only the bodies of successful responses are written to the file.
+
+        :returns: The digest and size of the downloaded contents.
+        :raises RegistryError: If the blob cannot be downloaded.
+        """
+        hasher, offset = _resume_partial(partial_file, size)
+
+        failures = 0
+        while size is None or offset < size:
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with self._request(
+                    "GET",
+                    f"/v2/{repository}/blobs/{digest}",
+                    repository=repository,
+                    headers=headers,
+                    stream=True,
+                    expected=(416,),
+                ) as response:
+                    if response.status_code == 416:  # noqa: PLR2004
+                        if not offset:
+                            raise RegistryError(
+                                f"Cannot download {digest} from {repository}: "
+                                f"HTTP 416 {response.reason}"
+                            )
+                        if f"sha256:{hasher.hexdigest()}" == digest:
+                            # The partial download was complete.
+                            break
+                        emit.debug(f"Cannot resume download of {digest}")
+                        hasher, offset = hashlib.sha256(), 0
+                        partial_file.truncate(0)
+                        continue
+                    if response.status_code != 206:  # noqa: PLR2004
+                        if offset:
+                            # The server ignored the range: start over.
+                            emit.debug(f"Cannot resume download of {digest}")
+                        hasher, offset = hashlib.sha256(), 0
+                        partial_file.truncate(0)
+                    for chunk in response.iter_content(_CHUNK_SIZE):
+                        partial_file.write(chunk)
+                        hasher.update(chunk)
+                        offset += len(chunk)
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ) as err:
+                failures += 1
+                if failures > self._max_retries:
+                    raise RegistryError(
+                        f"Cannot download {digest} from {repository}: {err}",
+                        resolution="Check the connection to the registry.",
+                    ) from err
+                emit.debug(f"Resuming download of {digest} at byte {offset}: {err}")
+                time.sleep(_RETRY_DELAY * failures)
+                continue
+            break
+
+        return f"sha256:{hasher.hexdigest()}", offset
+
+    def blob_exists(self, repository: str, digest: str) -> bool:
+        """Check whether the repository has a blob."""
+        return self._blob_exists(repository, digest, scopes=())
+
+    def upload_blobs(
+        self,
+        repository: str,
+        descriptors: Sequence[Mapping[str, Any]],
+        get_path: Callable[[str], Path],
+        *,
+        mount_from: str | None = None,
+    ) -> int:
+        """Upload blobs concurrently, skipping the ones the repository has.
+
+        :param repository: The repository to upload the blobs to.
+        :param descriptors: The descriptors (with digest) of the blobs.
+        :param get_path: A function giving the path of a blob, by digest.
+        :param mount_from: Another repository in the registry that may have
+            the blobs, to mount them from instead of uploading them.
+        :returns: The number of blobs that were uploaded.
+        :raises RegistryError: If a blob cannot be uploaded.
+        """
+        digests = list(dict.fromkeys(d["digest"] for d in descriptors))
+        if not digests:
+            return 0
+
+        workers = min(MAX_CONCURRENT_UPLOADS, len(digests))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    self.upload_blob,
+                    repository,
+                    digest,
+                    get_path(_check_digest(digest)),
+                    mount_from=mount_from,
+                )
+                for digest in digests
+            ]
+            try:
+                return sum(future.result() for future in as_completed(futures))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def upload_blob(
+        self, repository: str, digest: str, path: Path, *, mount_from: str | None = None
+    ) -> bool:
+        """Upload a blob, unless the repository already has it.
+
+        Blobs larger than ``UPLOAD_CHUNK_SIZE`` are uploaded in chunks.
+
+        :param repository: The repository to upload the blob to.
+        :param digest: The blob digest, in ``sha256:<hex>`` format.
+        :param path: The path of the blob.
+        :param mount_from: Another repository in the registry that may have the
+            blob, to mount it from instead of uploading it.
+        :returns: Whether the blob was uploaded.
+        :raises RegistryError: If the blob cannot be uploaded.
+        """
+        _check_digest(digest)
+        # All the requests use the same token, which can push and mount.
+        scopes = _get_push_scopes(repository, mount_from)
+        if self._blob_exists(repository, digest, scopes=scopes):
+            emit.debug(f"Skipping {digest}, which {repository} already has")
+            return False
+
+        params = {"mount": digest, "from": mount_from} if mount_from else None
+        with self._request(
+            "POST",
+            f"/v2/{repository}/blobs/uploads/",
+            repository=repository,
+            scopes=scopes,
+            params=params,
+        ) as response:
+            if response.status_code == 201:  # noqa: PLR2004
+                emit.debug(f"Mounted {digest} from {mount_from}")
+                return False
+            location = self._get_location(response)
+
+        size = path.stat().st_size
+        headers = {"Content-Type": "application/octet-stream"}
+        if size > UPLOAD_CHUNK_SIZE:
+            offset = 0
+            with path.open("rb") as blob_file:
+                while chunk := blob_file.read(UPLOAD_CHUNK_SIZE):
+                    chunk_range = f"{offset}-{offset + len(chunk) - 1}"
+                    with self._request(
+                        "PATCH",
+                        location,
+                        repository=repository,
+                        scopes=scopes,
+                        headers={**headers, "Content-Range": chunk_range},
+                        data=chunk,
+                    ) as response:
+                        location = self._get_location(response)
+                    offset += len(chunk)
+            content = b""
+        else:
+            content = path.read_bytes()
+
+        with self._request(
+            "PUT",
+            location,
+            repository=repository,
+            scopes=scopes,
+            headers=headers,
+            params={"digest": digest},
+            data=content,
+        ):
+            pass
+        emit.debug(f"Uploaded {digest} ({size} bytes) to {repository}")
+        return True
+
+    def put_manifest(
+        self, repository: str, reference: str, content: bytes, media_type: str
+    ) -> str:
+        """Upload a manifest or index, tagging it if ``reference`` is a tag.
+
+        The blobs and manifests it refers to must already be in the repository.
+
+        :returns: The digest of the manifest.
+        """
+        with self._request(
+            "PUT",
+            f"/v2/{repository}/manifests/{reference}",
+            repository=repository,
+            scopes=_get_push_scopes(repository),
+            headers={"Content-Type": media_type},
+            data=content,
+        ):
+            pass
+        return f"sha256:{hashlib.sha256(content).hexdigest()}"
+
+    def _blob_exists(
+        self, repository: str, digest: str, *, scopes: Sequence[str]
+    ) -> bool:
+        """Check whether the repository has a blob, with a token for ``scopes``."""
+        with self._request(
+            "HEAD",
+            f"/v2/{repository}/blobs/{digest}",
+            repository=repository,
+            scopes=scopes,
+            expected=(404,),
+        ) as response:
+            return response.ok
+
+    def _get_location(self, response: requests.Response) -> str:
+        """Get the absolute URL of the upload session of a response."""
+        location = response.headers.get("Location")
+        if not location:
+            raise RegistryError(
+                f"The registry at {self._base_url} didn't return an upload location."
+            )
+        return urllib.parse.urljoin(response.url, location)
+
+    def _get_manifest(self, repository: str, reference: str) -> tuple[bytes, str]:
+        """Get a manifest or index, verifying its digest.
+
+        :returns: The contents and the media type of the manifest.
+        """
+        with self._request(
+            "GET",
+            f"/v2/{repository}/manifests/{reference}",
+            repository=repository,
+            headers={"Accept": ", ".join((*MANIFEST_MEDIA_TYPES, *INDEX_MEDIA_TYPES))},
+        ) as response:
+            content = response.content
+            media_type = response.headers.get("Content-Type", "").split(";")[0]
+            expected_digest = response.headers.get("Docker-Content-Digest")
+
+        if reference.startswith("sha256:"):
+            expected_digest = reference
+        digest = f"sha256:{hashlib.sha256(content).hexdigest()}"
+        if expected_digest and expected_digest != digest:
+            raise RegistryError(
+                f"The manifest {reference} of {repository} doesn't match its "
+                f"digest {expected_digest}."
+            )
+
+        if media_type not in (*MANIFEST_MEDIA_TYPES, *INDEX_MEDIA_TYPES):
+            # Some registries don't send the media type, which the content has.
+            media_type = json.loads(content).get("mediaType", media_type)
+        return content, media_type
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        *,
+        repository: str,
+        scopes: Sequence[str] = (),
+        headers: dict[str, str] | None = None,
+        stream: bool = False,
+        expected: Collection[int] = (),
+        **kwargs: Any,
+    ) -> requests.Response:
+        """Send a request to the registry, authenticating and retrying as needed.
+
+        :param path: The path of the request, relative to the registry's URL,
+            or an absolute URL given by the registry.
+        :param repository: The repository the request is about.
+        :param scopes: The token scopes the request needs, if the registry
+            doesn't tell them. By default, pulling from ``repository``. A
+            token is requested for each set of scopes.
+        :param expected: Error status codes to return instead of raising.
+        :raises RegistryError: If the request fails.
+        """
+        url = path if "://" in path else f"{self._base_url}{path}"
+        token_scopes = tuple(scopes) or (f"repository:{repository}:pull",)
+        authenticated = False
+        failures = 0
+        while True:
+            request_headers = dict(headers or {})
+            if token := self._tokens.get(token_scopes):
+                request_headers["Authorization"] = f"Bearer {token}"
+
+            try:
+                response = self._session.request(
+                    method,
+                    url,
+                    headers=request_headers,
+                    stream=stream,
+                    timeout=_TIMEOUT,
+                    **kwargs,
+                )
+            except (requests.ConnectionError, requests.Timeout) as err:
+                error = str(err)
+            else:
+                if response.status_code == 401 and not authenticated:  # noqa: PLR2004
+                    response.close()
+                    self._authenticate(response, token_scopes)
+                    authenticated = True
+                    continue
+                if response.ok or response.status_code in expected:
+                    return response
+                error = f"HTTP {response.status_code} {response.reason}"
+                response.close()
+                if response.status_code not in _RETRY_STATUS_CODES:
+                    raise RegistryError(f"Request {method} {url} failed: {error}")
+
+            failures += 1
+            if failures > self._max_retries:
+                raise RegistryError(
+                    f"Request {method} {url} failed: {error}",
+                    resolution="Check the connection to the registry.",
+                )
+            emit.debug(f"Retrying {method} {url} after failure: {error}")
+            time.sleep(_RETRY_DELAY * failures)
+
+    def _authenticate(
+        self, response: requests.Response, scopes: tuple[str, ...]
+    ) -> None:
+        """Authenticate for the challenge of a 401 response.
+
+        :param scopes: The scopes to request the token for, which the token is
+            stored by. A scope in the challenge replaces the first one, which
+            is the one of the request's repository.
+
+        :raises RegistryError: If the registry rejects the credentials, or if
+            it requires credentials but there are none.
+        """
+        challenge = response.headers.get("WWW-Authenticate", "")
+        scheme, _, params_text = challenge.partition(" ")
+        params = dict(_CHALLENGE_PARAM_PATTERN.findall(params_text))
+        if scheme.lower() == "basic" and self._credentials:
+            self._session.auth = self._credentials
+            return
+        if scheme.lower() != "bearer" or "realm" not in params:
+            raise RegistryError(
+                f"Cannot authenticate to {self._base_url}: unsupported challenge "
+                f"{challenge!r}.",
+                resolution="Set the credentials for the registry.",
+            )
+
+        requested = [params["scope"], *scopes[1:]] if "scope" in params else scopes
+        token_params = [("scope", scope) for scope in requested]
+        token_params.extend(
+            (key, value)
+            for key, value in params.items()
+            if key not in ("realm", "scope")
+        )
+        try:
+            token_response = self._session.get(
+                params["realm"],
+                params=token_params,
+                auth=self._credentials,
+                timeout=_TIMEOUT,
+            )
+            token_response.raise_for_status()
+            token_data = token_response.json()
+        except (requests.RequestException, ValueError) as err:
+            raise RegistryError(
+                f"Cannot authenticate to {self._base_url}: {err}"
+            ) from err
+
+        token = token_data.get("token") or token_data.get("access_token")
+        if not token:
+            raise RegistryError(f"Cannot authenticate to {self._base_url}: no token.")
+        self._tokens[scopes] = token
+
+
+def _select_platform(
+    manifests: list[dict[str, Any]], architecture: str, variant: str | None
+) -> dict[str, Any]:
+    """Get the descriptor of the Linux manifest for a platform in an index.
+
+    Manifests without a variant match any variant, but an exact match wins.
+    """
+    candidates = [
+        manifest
+        for manifest in manifests
+        if (platform := manifest.get("platform") or {}).get("os") == "linux"
+        and platform.get("architecture") == architecture
+        and platform.get("variant") in (None, variant)
+    ]
+    candidates.sort(key=lambda manifest: manifest["platform"].get("variant") is None)
+    if not candidates:
+        platform_name = "/".join(filter(None, ["linux", architecture, variant]))
+        raise RegistryError(f"The image has no manifest for {platform_name}.")
+    return candidates[0]
+
+
+def _get_push_scopes(repository: str, mount_from: str | None = None) -> list[str]:
+    """Get the token scopes to push to a repository, mounting blobs from another."""
+    scopes = [f"repository:{repository}:pull,push"]
+    if mount_from:
+        scopes.append(f"repository:{mount_from}:pull")
+    return scopes
+
+
+def _check_digest(digest: str) -> str:
+    """Check that ``digest`` is a valid sha256 digest, which is safe as a path."""
+    if not _DIGEST_PATTERN.match(digest):
+        raise RegistryError(f"Unsupported blob digest: {digest!r}")
+    return digest
+
+
+@contextlib.contextmanager
+def _lock_partial(partial: Path) -> Iterator[IO[bytes]]:
+    """Open the partial download of a blob for appending, holding a lock on it.
+
+    The process that held the lock before may have renamed or removed the
+    file, in which case the new file at ``partial`` is locked instead.
+    """
+    while True:
+        partial_file = partial.open("a+b")
+        fcntl.flock(partial_file, fcntl.LOCK_EX)
+        try:
+            if os.path.samestat(os.fstat(partial_file.fileno()), partial.stat()):
+                break
+        except FileNotFoundError:
+            pass
+        partial_file.close()
+
+    with partial_file:
+        yield partial_file
+
+
+def _resume_partial(
+    partial_file: IO[bytes], size: int | None
+) -> tuple["hashlib._Hash", int]:
+    """Get the hash and size of the partial download of a blob, if any.
+
+    Partial downloads that are larger than the blob are discarded.
+    """
+    hasher = hashlib.sha256()
+    if size is not None and os.fstat(partial_file.fileno()).st_size > size:
+        partial_file.truncate(0)
+        return hasher, 0
+
+    offset = 0
+    partial_file.seek(0)
+    while chunk := partial_file.read(_CHUNK_SIZE):
+        hasher.update(chunk)
+        offset += len(chunk)
+    if offset:
+        emit.debug(f"Found {offset} bytes of {Path(partial_file.name).name}")
+    return hasher, offset
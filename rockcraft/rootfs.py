@@ -0,0 +1,405 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Index of the files in an extracted base root filesystem."""
+
+import fnmatch
+import hashlib
+import json
+import os
+import stat
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from collections.abc import Set as AbstractSet
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import Any, Literal
+
+from craft_cli import emit
+
+INDEX_VERSION = 1
+
+# The maximum number of symlinks followed when resolving a path, as in Linux.
+_MAX_SYMLINKS = 40
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+EntryType = Literal["file", "dir", "symlink", "other"]
+
+
+@dataclass(frozen=True)
+class RootfsEntry:
+    """The metadata of a single path in a root filesystem.
+
+    :param type: The kind of filesystem object.
+    :param mode: The full ``st_mode``, including the file type bits.
+    :param uid: The numeric owner.
+    :param gid: The numeric group.
+    :param size: The size in bytes.
+    :param target: The symlink target, for symlinks. For regular files indexed
+        from an image's layers, the path of the file they are a hard link to.
+    """
+
+    type: EntryType
+    mode: int
+    uid: int
+    gid: int
+    size: int
+    target: str | None = None
+
+
+class RootfsIndex:
+    """A queryable snapshot of the metadata of a root filesystem.
+
+    Paths are relative to the root filesystem, in POSIX form. Symlinks are
+    resolved inside the root filesystem, like a container would see them.
+    Content hashes are computed on demand and kept in the index, so they are
+    only computed once per base image.
+
+    The root filesystem doesn't need to exist: an index built from an image's
+    layers can extract the files whose contents are read on demand (see
+    :meth:`extract_lazily`).
+
+    :param root: The directory containing the root filesystem.
+    :param digest: The digest of the image the root filesystem comes from.
+    :param entries: The entries of the root filesystem, keyed by their path.
+    :param hashes: The known SHA-256 content hashes, keyed by path.
+    :param index_file: The file where the index is saved, if any.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        root: Path,
+        digest: str,
+        entries: dict[str, RootfsEntry],
+        hashes: dict[str, str] | None = None,
+        *,
+        index_file: Path | None = None,
+    ) -> None:
+        self.root = root
+        self.digest = digest
+        self.index_file = index_file
+        self._entries = entries
+        self._hashes = hashes if hashes is not None else {}
+        self._children: dict[str, list[str]] | None = None
+        self._dirty = False
+        self._extract: Callable[[AbstractSet[str]], object] | None = None
+        self._extracted: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @classmethod
+    def build(
+        cls, root: Path, digest: str, *, index_file: Path | None = None
+    ) -> "RootfsIndex":
+        """Create the index of ``root`` by scanning it.
+
+        :param root: The directory containing the root filesystem.
+        :param digest: The digest of the image the root filesystem comes from.
+        :param index_file: The file where the index will be saved, if any.
+        """
+        entries = {".": _entry_from_stat(root.stat(), str(root))}
+        stack = [""]
+        while stack:
+            relative = stack.pop()
+            with os.scandir(root / relative) as dir_entries:
+                for dir_entry in dir_entries:
+                    path = (
+                        f"{relative}/{dir_entry.name}" if relative else dir_entry.name
+                    )
+                    entry = _entry_from_stat(
+                        dir_entry.stat(follow_symlinks=False), dir_entry.path
+                    )
+                    entries[path] = entry
+                    if entry.type == "dir":
+                        stack.append(path)
+
+        return cls(root, digest, entries, index_file=index_file)
+
+    @classmethod
+    def load(cls, index_file: Path, root: Path, digest: str) -> "RootfsIndex | None":
+        """Load a saved index, if it exists and matches ``digest``.
+
+        :param index_file: The file the index was saved to.
+        :param root: The directory containing the root filesystem.
+        :param digest: The digest of the image the root filesystem comes from.
+        :returns: The index, or None if it is missing, outdated or unreadable.
+        """
+        try:
+            data = json.loads(index_file.read_text())
+        except (OSError, ValueError) as err:
+            emit.debug(f"Cannot load rootfs index {index_file}: {err}")
+            return None
+
+        if data.get("version") != INDEX_VERSION or data.get("digest") != digest:
+            emit.debug(f"Ignoring outdated rootfs index {index_file}")
+            return None
+
+        entries: dict[str, RootfsEntry] = {}
+        hashes: dict[str, str] = {}
+        for path, (entry_type, mode, uid, gid, size, target, sha256) in data[
+            "entries"
+        ].items():
+            entries[path] = RootfsEntry(entry_type, mode, uid, gid, size, target)
+            if sha256:
+                hashes[path] = sha256
+
+        return cls(root, digest, entries, hashes, index_file=index_file)
+
+    @classmethod
+    def obtain(cls, root: Path, index_file: Path, digest: str) -> "RootfsIndex":
+        """Load the index of ``root`` from ``index_file``, creating it if needed.
+
+        :param root: The directory containing the root filesystem.
+        :param index_file: The file where the index is saved.
+        :param digest: The digest of the image the root filesystem comes from.
+        """
+        index = cls.load(index_file, root, digest)
+        if index is None:
+            emit.debug(f"Indexing the root filesystem in {root}")
+            index = cls.build(root, digest, index_file=index_file)
+            index.save()
+        emit.debug(f"Loaded rootfs index with {len(index)} entries")
+        return index
+
+    def save(self) -> None:
+        """Write the index to its ``index_file``, if it changed since it was loaded.
+
+        Indexes without an ``index_file`` are not saved.
+        """
+        index_file = self.index_file
+        if index_file is None or (index_file.exists() and not self._dirty):
+            return
+
+        data: dict[str, Any] = {
+            "version": INDEX_VERSION,
+            "digest": self.digest,
+            "entries": {
+                path: [
+                    entry.type,
+                    entry.mode,
+                    entry.uid,
+                    entry.gid,
+                    entry.size,
+                    entry.target,
+                    self._hashes.get(path),
+                ]
+                for path, entry in self._entries.items()
+            },
+        }
+
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = index_file.with_name(f".{index_file.name}.{os.getpid()}")
+        temp_file.write_text(json.dumps(data, separators=(",", ":")))
+        temp_file.replace(index_file)
+        self._dirty = False
+
+    def extract_lazily(self, extract: Callable[[AbstractSet[str]], object]) -> None:
+        """Extract the files of the root filesystem only when they are read.
+
+        :param extract: A function extracting the files with the given keys
+            (paths without symlinks) to ``root``. It is called with all the
+            files needed at once, and never with the same file twice.
+        """
+        self._extract = extract
+
+    def materialise(self, paths: Iterable[str | PurePosixPath]) -> None:
+        """Make sure the regular files in ``paths`` exist in ``root``.
+
+        This is a no-op for fully extracted root filesystems. With lazy
+        extraction, it extracts the files that were not extracted yet.
+
+        :param paths: The paths of the files, relative to the root filesystem.
+        """
+        if self._extract is None:
+            return
+
+        missing: set[str] = set()
+        for path in paths:
+            key = self.resolve(path, follow_symlinks=True)
+            if key is None or key in self._extracted:
+                continue
+            entry = self._entries[key]
+            if entry.type != "file":
+                continue
+            missing.add(key)
+            # Hard links can only be created along with the file they link to.
+            if entry.target is not None:
+                missing.add(entry.target)
+
+        if missing:
+            emit.debug(f"Extracting {len(missing)} files from the base image")
+            self._extract(missing)
+            self._extracted.update(missing)
+
+    def file_path(self, path: str | PurePosixPath) -> Path | None:
+        """Get where the contents of a regular file can be read.
+
+        :param path: The path of the file, relative to the root filesystem.
+        :returns: The path of the file in ``root`` (extracting it first, if
+            needed), or None if ``path`` is not a regular file.
+        """
+        key = self.resolve(path, follow_symlinks=True)
+        if key is None or self._entries[key].type != "file":
+            return None
+        self.materialise([key])
+        return self.root / key
+
+    def get(
+        self, path: str | PurePosixPath, *, follow_symlinks: bool = True
+    ) -> RootfsEntry | None:
+        """Get the entry for ``path``, like ``os.stat()`` or ``os.lstat()`` would.
+
+        :param path: The path to query, relative to the root filesystem.
+        :param follow_symlinks: Whether a symlink in the last component of
+            ``path`` should be followed.
+        :returns: The entry, or None if the path does not exist.
+        """
+        key = self.resolve(path, follow_symlinks=follow_symlinks)
+        if key is None:
+            return None
+        return self._entries[key]
+
+    def is_file(self, path: str | PurePosixPath) -> bool:
+        """Whether ``path`` is a regular file, after following symlinks."""
+        entry = self.get(path)
+        return entry is not None and entry.type == "file"
+
+    def readlink(self, path: str | PurePosixPath) -> str | None:
+        """Get the target of ``path`` if it is a symlink, or None otherwise."""
+        entry = self.get(path, follow_symlinks=False)
+        if entry is None or entry.type != "symlink":
+            return None
+        return entry.target
+
+    def symlinks(self) -> list[str]:
+        """Get the paths of all the symlinks, in sorted order."""
+        return sorted(
+            path for path, entry in self._entries.items() if entry.type == "symlink"
+        )
+
+    def glob(self, directory: str | PurePosixPath, pattern: str) -> list[str]:
+        """Get the names of the entries in ``directory`` matching ``pattern``.
+
+        :param directory: The directory to list, relative to the root filesystem.
+        :param pattern: A shell-style pattern (see ``fnmatch``).
+        :returns: The sorted matching names.
+        """
+        key = self.resolve(directory, follow_symlinks=True)
+        if key is None or self._entries[key].type != "dir":
+            return []
+        if self._children is None:
+            children: defaultdict[str, list[str]] = defaultdict(list)
+            for path in self._entries:
+                if path != ".":
+                    parent, _, name = path.rpartition("/")
+                    children[parent or "."].append(name)
+            self._children = dict(children)
+        return sorted(fnmatch.filter(self._children.get(key, []), pattern))
+
+    def sha256(self, path: str | PurePosixPath) -> str | None:
+        """Get the SHA-256 hash of the contents of a file, computing it if needed.
+
+        :param path: The path of the file, relative to the root filesystem.
+        :returns: The hex digest, or None if ``path`` is not a regular file.
+        """
+        key = self.resolve(path, follow_symlinks=True)
+        if key is None or self._entries[key].type != "file":
+            return None
+
+        if key not in self._hashes:
+            self.materialise([key])
+            self._hashes[key] = file_sha256(self.root / key)
+            self._dirty = True
+        return self._hashes[key]
+
+    def resolve(
+        self, path: str | PurePosixPath, *, follow_symlinks: bool = True
+    ) -> str | None:
+        """Get the key of the entry that ``path`` points to.
+
+        :param path: The path to resolve, relative to the root filesystem.
+        :param follow_symlinks: Whether a symlink in the last component of
+            ``path`` should be followed.
+        :returns: The path of the entry without symlinks, or None if the path
+            does not exist.
+        """
+        parts = list(PurePosixPath(path).parts)
+        current = ""
+        followed = 0
+
+        while parts:
+            name = parts.pop(0)
+            if name in ("/", "", "."):
+                continue
+            if name == "..":
+                current = current.rpartition("/")[0]
+                continue
+
+            candidate = f"{current}/{name}" if current else name
+            entry = self._entries.get(candidate)
+            if entry is None:
+                return None
+
+            if entry.type == "symlink" and (parts or follow_symlinks):
+                followed += 1
+                if followed > _MAX_SYMLINKS or entry.target is None:
+                    return None
+                target = PurePosixPath(entry.target)
+                if target.is_absolute():
+                    current = ""
+                parts[:0] = target.parts
+                continue
+
+            if parts and entry.type != "dir":
+                return None
+            current = candidate
+
+        return current or "."
+
+
+def file_sha256(path: Path) -> str:
+    """Compute the SHA-256 hex digest of the contents of ``path``."""
+    file_hash = hashlib.sha256()
+    with path.open("rb") as file:
+        while chunk := file.read(_HASH_CHUNK_SIZE):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _entry_from_stat(path_stat: os.stat_result, path: str) -> RootfsEntry:
+    mode = path_stat.st_mode
+    target: str | None = None
+    entry_type: EntryType
+    if stat.S_ISREG(mode):
+        entry_type = "file"
+    elif stat.S_ISDIR(mode):
+        entry_type = "dir"
+    elif stat.S_ISLNK(mode):
+        entry_type = "symlink"
+        target = str(Path(path).readlink())
+    else:
+        entry_type = "other"
+
+    return RootfsEntry(
+        type=entry_type,
+        mode=mode,
+        uid=path_stat.st_uid,
+        gid=path_stat.st_gid,
+        size=path_stat.st_size,
+        target=target,
+    )
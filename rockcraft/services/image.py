@@ -28,7 +28,12 @@ from craft_application import (
 )
 from craft_cli import emit
 
-from rockcraft import oci
+from rockcraft import oci, timing, unpack
+from rockcraft.cache import BlobCache
+from rockcraft.errors import BaseLockError
+from rockcraft.models.lock import LOCK_FILE_NAME, Lock
+from rockcraft.parts import part_has_overlay
+from rockcraft.rootfs import RootfsIndex
 
 
 @dataclass(frozen=True)
@@ -38,10 +43,20 @@ class ImageInfo:
     base_image: oci.Image
     base_layer_dir: Path
     base_digest: bytes
+    base_index: RootfsIndex | None = None
+    """The index of ``base_layer_dir``, if available.
+
+    When no part uses overlays, ``base_layer_dir`` is not extracted up front:
+    its files are extracted as they are read through the index.
+    """
 
 
 class RockcraftImageService(ProjectService):
-    """Service to fetch and cache OCI images."""
+    """Service to fetch and cache OCI images.
+
+    :param blob_cache_dir: An optional directory to share the blobs of the
+        fetched images in, across projects and builds.
+    """
 
     def __init__(  # pylint: disable=too-many-arguments
         self,
@@ -50,10 +65,12 @@ class RockcraftImageService(ProjectService):
         *,
         project_dir: Path,
         work_dir: Path,
+        blob_cache_dir: Path | None = None,
     ) -> None:
         super().__init__(app, services, project_dir=project_dir)
 
         self._work_dir = work_dir
+        self._blob_cache_dir = blob_cache_dir
         self._image_info: ImageInfo | None = None
 
     def obtain_image(self) -> ImageInfo:
@@ -76,32 +93,165 @@ class RockcraftImageService(ProjectService):
         project = self._services.get("project").get()
         base = cast(str, project.base)
         if base == "bare":
-            base_image, source_image = oci.Image.new_oci_image(
+            base_image, _ = oci.Image.new_oci_image(
                 f"{base}@latest",
                 image_dir=image_dir,
                 arch=build_for,
             )
         else:
-            emit.progress(f"Retrieving base {base} for {build_for}")
-            base_image, source_image = oci.Image.from_docker_registry(
-                base,
-                image_dir=image_dir,
-                arch=build_for,
-            )
-            emit.progress(f"Retrieved base {base} for {build_for}")
+            with timing.span("obtain base image", "image", base=base):
+                base_image = self._obtain_base_image(base, build_for, image_dir)
+
+        # The digest is resolved from the local layout, without a registry call.
+        # The rock records the digest that the base can be pulled by, which is
+        # the registry's if the local manifest was converted from a Docker one.
+        manifest_digest = base_image.manifest_digest()
+        source_digest = base_image.source_digest or manifest_digest
+        base_digest = bytes.fromhex(source_digest.split(":", 1)[1])
 
-        emit.progress(f"Extracting {base_image.image_name}")
-        rootfs = base_image.extract_to(bundle_dir)
-        emit.progress(f"Extracted {base_image.image_name}")
+        cache_key = f"{build_for}@{manifest_digest}"
+        # The index is kept next to the bundle, so it survives re-extractions
+        # of the same image.
+        bundle_name = base_image.image_name.replace(":", "-")
+        index_file = bundle_dir / f"{bundle_name}.index.json"
+        if any(part_has_overlay(part) for part in (project.parts or {}).values()):
+            # The extracted base is only read from, so it is reused across
+            # builds until the base image (for this architecture) changes.
+            emit.progress(f"Extracting {base_image.image_name}")
+            rootfs = base_image.extract_to(bundle_dir, cache_key=cache_key)
+            emit.progress(f"Extracted {base_image.image_name}")
+            base_index = RootfsIndex.obtain(
+                rootfs, index_file, digest=base_digest.hex()
+            )
+        else:
+            # Without overlays the base is only queried, so it is indexed from
+            # its layers and only the files that are read get extracted.
+            rootfs = bundle_dir / bundle_name / "rootfs"
+            base_index = self._index_base_image(
+                base_image, rootfs, index_file, base_digest.hex()
+            )
+            base_index.extract_lazily(
+                lambda paths: base_image.extract_to(
+                    bundle_dir, cache_key=cache_key, include=paths
+                )
+            )
 
         project_base_image = base_image.copy_to(
             f"{project.name}:rockcraft-base", image_dir=image_dir
         )
 
-        base_digest = project_base_image.digest(source_image)
-
         return ImageInfo(
             base_image=project_base_image,
             base_layer_dir=rootfs,
             base_digest=base_digest,
+            base_index=base_index,
         )
+
+    @staticmethod
+    def _index_base_image(
+        base_image: oci.Image, rootfs: Path, index_file: Path, digest: str
+    ) -> RootfsIndex:
+        """Load the index of the base image, or create it from the image's layers."""
+        base_index = RootfsIndex.load(index_file, rootfs, digest)
+        if base_index is None:
+            emit.progress(f"Indexing {base_image.image_name}")
+            layer_archives = base_image.layer_archives()
+            with timing.span(
+                "index image",
+                "image",
+                image=base_image.image_name,
+                layers=len(layer_archives),
+                bytes=sum(layer.path.stat().st_size for layer in layer_archives),
+            ):
+                base_index = unpack.index_layers(
+                    layer_archives, rootfs, digest, index_file=index_file
+                )
+            base_index.save()
+        emit.debug(f"Loaded rootfs index with {len(base_index)} entries")
+        return base_index
+
+    def _obtain_base_image(
+        self, base: str, build_for: str, image_dir: Path
+    ) -> oci.Image:
+        """Get the project's base image, as pinned by the project's lock file.
+
+        A pinned base that is available locally is used without accessing the
+        registry, and is otherwise pulled by its digest. The lock file pins the
+        digest of the manifest in the registry (or in the local source).
+
+        A base that isn't pinned is fetched by its tag, and pinned if the
+        project has no lock file yet or if ``update_lock`` is configured.
+
+        :raises BaseLockError: If the fetched base doesn't match the pinned one.
+        """
+        lock = Lock.load(self._project_dir)
+        locked_digest = lock.get_base_digest(base, build_for)
+        blob_cache = self._get_blob_cache()
+
+        if locked_digest is not None:
+            base_image = oci.Image.from_local_blobs(
+                base, image_dir=image_dir, digest=locked_digest, blob_cache=blob_cache
+            )
+            if base_image is not None:
+                emit.progress(f"Using base {base} for {build_for} pinned in lock file")
+                return base_image
+
+        emit.progress(f"Retrieving base {base} for {build_for}")
+        base_image, source_image = oci.Image.from_sources(
+            base,
+            sources=self._get_base_sources(),
+            image_dir=image_dir,
+            arch=build_for,
+            blob_cache=blob_cache,
+            digest=locked_digest,
+        )
+        emit.progress(f"Retrieved base {base} for {build_for} from {source_image}")
+
+        digest = base_image.source_digest or base_image.manifest_digest()
+        if locked_digest is None:
+            self._pin_base(lock, base, build_for, digest)
+        elif digest != locked_digest:
+            raise BaseLockError(
+                f"Base {base} for {build_for} is {digest}, but {LOCK_FILE_NAME} "
+                f"pins {locked_digest}.",
+                resolution=(
+                    f"Remove the base from {LOCK_FILE_NAME} and set ROCKCRAFT_UPDATE_LOCK=1 "
+                    "to pin the current image."
+                ),
+            )
+
+        return base_image
+
+    def _pin_base(self, lock: Lock, base: str, build_for: str, digest: str) -> None:
+        """Pin a base in the lock file, if it is missing or updates are enabled."""
+        lock_exists = (self._project_dir / LOCK_FILE_NAME).exists()
+        if lock_exists and not self._services.get("config").get("update_lock"):
+            emit.debug(
+                f"Not pinning base {base} for {build_for} to {digest}, as "
+                f"{LOCK_FILE_NAME} exists and 'update_lock' is not set"
+            )
+            return
+
+        lock.set_base_digest(base, build_for, digest)
+        lock.save(self._project_dir)
+        emit.debug(f"Pinned base {base} for {build_for} to {digest}")
+
+    def _get_blob_cache(self) -> BlobCache | None:
+        """Get the shared cache of image blobs, unless it is disabled."""
+        if self._blob_cache_dir is None:
+            return None
+
+        max_size = self._services.get("config").get("image_cache_max_size")
+        if not max_size:
+            emit.debug("The image blob cache is disabled")
+            return None
+
+        return BlobCache(self._blob_cache_dir, max_size=max_size)
+
+    def _get_base_sources(self) -> list[str]:
+        """Get the configured sources of base images, in order."""
+        sources = self._services.get("config").get("base_sources")
+        if not sources:
+            return list(oci.DEFAULT_BASE_SOURCES)
+
+        return [source.strip() for source in sources.split(",") if source.strip()]
@@ -16,18 +16,35 @@
 
 """Rockcraft Lifecycle service."""
 
+import os
 import re
+import time
+from collections.abc import Set as AbstractSet
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import cast
 
 import craft_platforms
 from craft_application import LifecycleService
+from craft_cli import emit
+from craft_parts import Step, callbacks
 from craft_parts.infos import StepInfo
+from craft_parts.parts import Part
 from craft_parts.plugins import Plugin
+from craft_parts.state_manager import states
 from typing_extensions import override
 
-from rockcraft import layers, plugins
+from rockcraft import layers, plugins, timing
 from rockcraft.plugins.python_common import get_python_plugins
+from rockcraft.prime_state import PostPrimeState
+
+# The state of the processing of the primed files, in the work directory.
+_POST_PRIME_STATE_FILE = "post-prime.json"
+
+# The longest shebang line that is checked, and the chunks the rest of a file
+# is moved in when its shebang is rewritten.
+_SHEBANG_MAX_SIZE = 4096
+_SHEBANG_COPY_SIZE = 1024 * 1024
 
 
 class RockcraftLifecycleService(LifecycleService):
@@ -64,21 +81,101 @@ class RockcraftLifecycleService(LifecycleService):
             usrmerged_by_default=usrmerged_by_default,
         )
         super().setup()
+        # Registered after post_prime(), so that the prime spans include it.
+        self._step_starts: dict[tuple[str, Step], int] = {}
+        callbacks.register_pre_step(self._start_step_timing)
+        callbacks.register_post_step(self._end_step_timing)
+
+    def _start_step_timing(self, step_info: StepInfo) -> bool:
+        """Record when a step of a part starts running."""
+        key = (step_info.part_name, step_info.step)
+        self._step_starts[key] = time.perf_counter_ns()
+        return True
+
+    def _end_step_timing(self, step_info: StepInfo) -> bool:
+        """Record the span of a step of a part that finished running."""
+        start_ns = self._step_starts.pop((step_info.part_name, step_info.step), None)
+        if start_ns is not None:
+            step_name = step_info.step.name.lower()
+            timing.add_span(
+                f"{step_name} {step_info.part_name}",
+                "lifecycle",
+                start_ns,
+                part=step_info.part_name,
+                step=step_name,
+            )
+        return True
+
+    def get_primed_paths(self, part_names: list[str]) -> set[str]:
+        """Get the paths in the prime directory that come from some parts.
+
+        :param part_names: The names of the parts.
+        :returns: The primed files and directories, relative to the prime
+            directory. Files that were pruned after priming are included.
+        """
+        paths: set[str] = set()
+        for part_name in part_names:
+            part = Part(part_name, {}, project_dirs=self.project_info.dirs)
+            state = states.load_step_state(part, Step.PRIME)
+            if state is None:
+                emit.debug(f"Part {part_name!r} has no prime state")
+                continue
+            paths.update(path.as_posix() for path in state.files)
+            paths.update(path.as_posix() for path in state.directories)
+        return paths
 
     @override
     def post_prime(self, step_info: StepInfo) -> bool:
         """Perform base-layer pruning on primed files."""
+        # pylint: disable=import-outside-toplevel
+        # This inner import is necessary to resolve a cyclic import
+        from rockcraft.services import RockcraftServiceFactory
+
         prime_dir = step_info.prime_dir
         base_layer_dir = step_info.rootfs_dir
-        files: set[str]
-
-        # Fix: overlay content is not included in step_info so we just list the prime_dir
-        files = {str(p.relative_to(prime_dir)) for p in prime_dir.rglob("*")}
+        dirs = step_info.project_info.dirs
 
-        layers.prune_prime_files(prime_dir, files, base_layer_dir)
+        services = cast(RockcraftServiceFactory, self._services)
+        image_info = services.image.obtain_image()
+        base_index = image_info.base_index
+
+        # Only the files primed by this step are processed, and only if they
+        # changed since they were last processed. The overlay's files are not
+        # in the step's state, but in the overlay migration state.
+        post_prime_state = PostPrimeState.load(
+            dirs.work_dir / _POST_PRIME_STATE_FILE, image_info.base_digest.hex()
+        )
+        primed: set[str] = set()
+        if step_info.state is not None:
+            primed.update(path.as_posix() for path in step_info.state.files)
+        overlay_state = states.load_overlay_migration_state(
+            dirs.overlay_dir, Step.PRIME
+        )
+        if overlay_state is not None:
+            primed.update(path.as_posix() for path in overlay_state.files)
+        files = post_prime_state.changed(prime_dir, primed)
+        emit.debug(f"Processing {len(files)} of {len(primed)} primed files")
+
+        with timing.span("prune", "lifecycle", part=step_info.part_name) as span:
+            stats = layers.prune_prime_files(
+                prime_dir, files, base_layer_dir, base_index=base_index
+            )
+            span.update(files=stats.files, bytes=stats.size, candidates=len(files))
+        if stats.files:
+            emit.progress(
+                f"Pruned {stats.files} files ({stats.size / 2**20:.1f} MiB) that "
+                f"already exist in the base in {stats.duration:.1f}s"
+            )
+        if base_index is not None:
+            # Keep the content hashes computed while pruning for the next builds.
+            base_index.save()
 
         _python_usrmerge_fix(step_info)
-        _python_v2_shebang_fix(step_info)
+        with timing.span("fix shebangs", "lifecycle", part=step_info.part_name):
+            _python_v2_shebang_fix(step_info, files)
+
+        post_prime_state.mark_processed(prime_dir, files)
+        post_prime_state.save()
 
         return True
 
@@ -126,7 +223,19 @@ def _python_usrmerge_fix(step_info: StepInfo) -> None:
         lib64.unlink()
 
 
-def _python_v2_shebang_fix(step_info: StepInfo) -> None:
+def _python_v2_shebang_fix(
+    step_info: StepInfo, files: AbstractSet[str] | None = None
+) -> None:
+    """Make the shebangs of primed Python scripts point to the rock's interpreter.
+
+    Only the first bytes of each file are read, concurrently, so binaries are
+    skipped without being decoded; the matching shebang lines are rewritten
+    in place. The caller records the files as processed by the post-prime
+    state once they are fixed, so unchanged files are not read again.
+
+    :param step_info: The information of the prime step.
+    :param files: The primed files to fix, if not all the ones of the step.
+    """
     build_base = step_info.project_info.build_base
     if build_base in ("ubuntu@20.04", "ubuntu@22.04", "ubuntu@24.04"):
         # The issue only affects rocks with 25.10 and newer build bases.
@@ -146,33 +255,61 @@ def _python_v2_shebang_fix(step_info: StepInfo) -> None:
 
     # The Python interpreter can come from either the part's install dir, or from the
     # stage.
-    install_dir = step_info.part_install_dir
-    install_re = re.compile(f"#!{install_dir}/.*/python3.*$")
-    stage_dir = step_info.stage_dir
-    stage_re = re.compile(f"#!{stage_dir}/.*/python3.*$")
-
-    regex_and_dirs = [(install_re, install_dir), (stage_re, stage_dir)]
-
-    for filename in state.files:
-        filepath = prime_dir / filename
-        if not filepath.is_file():
-            # File might have been pruned out
-            continue
-        newline = ""
-        remainder = ""
-        replaced = False
-        with filepath.open("r") as f:
-            # Read the first line and check whether it matches the install or stage dirs.
-            try:
-                line = f.readline()
-            except UnicodeDecodeError:
-                # File is not text; ignore it
-                continue
-            for base_re, base_dir in regex_and_dirs:
-                if base_re.match(line):
-                    newline = line.replace(str(base_dir), "")
-                    remainder = f.read()
-                    replaced = True
-                    break
-        if replaced:
-            filepath.write_text(newline + remainder)
+    shebangs = [
+        (
+            re.compile(b"#!" + re.escape(os.fsencode(base_dir)) + b"/.*/python3"),
+            os.fsencode(base_dir),
+        )
+        for base_dir in (step_info.part_install_dir, step_info.stage_dir)
+    ]
+
+    filenames = [
+        filename.as_posix()
+        for filename in state.files
+        if files is None or filename.as_posix() in files
+    ]
+    with ThreadPoolExecutor(thread_name_prefix="rockcraft-shebang") as executor:
+        fixed = executor.map(
+            lambda filename: _fix_shebang(prime_dir / filename, shebangs), filenames
+        )
+        rewritten = sum(fixed)
+
+    emit.debug(f"Fixed the shebangs of {rewritten} of {len(filenames)} files")
+
+
+def _fix_shebang(path: Path, shebangs: list[tuple[re.Pattern[bytes], bytes]]) -> bool:
+    """Remove a build directory from a file's Python shebang, if it has one.
+
+    :param path: The file to fix.
+    :param shebangs: The patterns of the shebangs to fix, and the directory
+        to remove from them.
+    :returns: Whether the file was rewritten.
+    """
+    if not path.is_file():
+        # File might have been pruned out
+        return False
+
+    with path.open("rb") as file:
+        head = os.pread(file.fileno(), _SHEBANG_MAX_SIZE, 0)
+    if not head.startswith(b"#!"):
+        return False
+
+    line = head.split(b"\n", 1)[0]
+    for shebang_re, base_dir in shebangs:
+        if shebang_re.match(line):
+            new_line = line.replace(base_dir, b"")
+            break
+    else:
+        return False
+
+    # The shebang line gets shorter: the rest of the file is moved back.
+    with path.open("r+b") as file:
+        fd = file.fileno()
+        os.pwrite(fd, new_line, 0)
+        read_offset, write_offset = len(line), len(new_line)
+        while data := os.pread(fd, _SHEBANG_COPY_SIZE, read_offset):
+            os.pwrite(fd, data, write_offset)
+            read_offset += len(data)
+            write_offset += len(data)
+        os.ftruncate(fd, write_offset)
+    return True
@@ -18,22 +18,66 @@
 
 import datetime
 import pathlib
+import time
 import typing
 from typing import cast
 
-from craft_application import PackageService, errors, models
+from craft_application import (
+    AppMetadata,
+    PackageService,
+    ServiceFactory,
+    errors,
+    models,
+)
 from craft_cli import emit
 from typing_extensions import override
 
-from rockcraft import oci
+from rockcraft import oci, timing
+from rockcraft.cache import LayerCache
+from rockcraft.compression import LayerCompression
+from rockcraft.errors import RockcraftError
 from rockcraft.models import Project
 from rockcraft.pebble import Pebble
+from rockcraft.rootfs import RootfsIndex
 from rockcraft.usernames import SUPPORTED_GLOBAL_USERNAMES
 from rockcraft.utils import parse_command
 
 
 class RockcraftPackageService(PackageService):
-    """Package service subclass for Rockcraft."""
+    """Package service subclass for Rockcraft.
+
+    :param layer_cache_dir: An optional directory to cache the rock's layers in,
+        so they are reused when their contents did not change.
+    """
+
+    _layer_compression: LayerCompression | None = None
+    _oci_layout: bool = False
+    _coalesce_layers: bool = False
+
+    def __init__(
+        self,
+        app: AppMetadata,
+        services: ServiceFactory,
+        *,
+        layer_cache_dir: pathlib.Path | None = None,
+    ) -> None:
+        super().__init__(app, services)
+        self._layer_cache_dir = layer_cache_dir
+
+    def set_layer_compression(self, compression: LayerCompression) -> None:
+        """Override the project's compression for the rock's layers.
+
+        :param compression: The compression to use, e.g. from the command line.
+        """
+        self._layer_compression = compression
+
+    def enable_oci_layout(self) -> None:
+        """Write the rock as an OCI image layout directory, instead of an archive."""
+        self._oci_layout = True
+
+    def enable_layer_coalescing(self) -> None:
+        """Add the rock's user, Pebble layer and control data as a single layer."""
+        self._coalesce_layers = True
 
     @override
     def pack(self, prime_dir: pathlib.Path, dest: pathlib.Path) -> list[pathlib.Path]:
@@ -44,7 +88,10 @@ class RockcraftPackageService(PackageService):
         """
         # This inner import is necessary to resolve a cyclic import
         # pylint: disable=import-outside-toplevel
-        from rockcraft.services import RockcraftImageService
+        from rockcraft.services import (
+            RockcraftImageService,
+            RockcraftLifecycleService,
+        )
 
         image_service = cast(RockcraftImageService, self._services.get("image"))
         image_info = image_service.obtain_image()
@@ -57,18 +104,70 @@ class RockcraftPackageService(PackageService):
         platform = build_plan[0].platform
         build_for = build_plan[0].build_for
 
+        project = cast(Project, self._services.get("project").get())
+        compression = (
+            self._layer_compression or project.compression or LayerCompression()
+        )
+        emit.debug(f"Using {compression} compression for the rock's layers")
+
+        part_layers: dict[str, set[str]] | None = None
+        if project.layers:
+            lifecycle = cast(RockcraftLifecycleService, self._services.get("lifecycle"))
+            part_layers = {
+                layer_name: lifecycle.get_primed_paths(part_names)
+                for layer_name, part_names in project.layers.items()
+            }
+
+        layer_cache = None
+        if self._layer_cache_dir is not None:
+            layer_cache = LayerCache(self._layer_cache_dir)
+
         archive_name = _pack(
             prime_dir=prime_dir,
-            project=cast(Project, self._services.get("project").get()),
+            dest=dest,
+            project=project,
             project_base_image=image_info.base_image,
             base_digest=image_info.base_digest,
             rock_suffix=platform,
             build_for=build_for,
             base_layer_dir=image_info.base_layer_dir,
+            base_index=image_info.base_index,
+            compression=compression,
+            part_layers=part_layers,
+            layer_cache=layer_cache,
+            oci_layout=self._oci_layout,
+            coalesce_layers=self._coalesce_layers,
         )
 
         return [dest / archive_name]
 
+    def pack_multi_arch(self, dest: pathlib.Path) -> pathlib.Path:
+        """Combine the rocks of all the platforms in the build plan into one rock.
+
+        The rock of each platform must already be in ``dest``, as packed by the
+        build of that platform: the bases of the platforms are not fetched or
+        extracted here. Blobs shared by the platforms' images are stored once
+        in the new rock.
+
+        :param dest: The directory with the rocks, and for the new rock.
+        :returns: The path to the multi-architecture rock.
+        """
+        project = cast(Project, self._services.get("project").get())
+        if not project.version:
+            raise RockcraftError(
+                "Cannot create a multi-architecture rock without a version.",
+                resolution="Set the 'version' key in the project file.",
+            )
+
+        build_plan = self._services.get("build_plan").plan()
+        prefix = f"{project.name}_{project.version}"
+        archives = [dest / f"{prefix}_{build.platform}.rock" for build in build_plan]
+        archive = dest / f"{prefix}.rock"
+
+        emit.progress(f"Combining {len(archives)} rocks into {archive.name}")
+        oci.merge_oci_archives(archives, archive, tag=project.version)
+        return archive
+
     @override
     def write_metadata(self, path: pathlib.Path) -> None:
         """Write the project metadata to metadata.yaml in the given directory.
@@ -84,20 +183,29 @@ class RockcraftPackageService(PackageService):
         return models.BaseMetadata()
 
 
-def _pack(
+def _pack(  # noqa: PLR0913 (too many arguments)
     *,
     prime_dir: pathlib.Path,
+    dest: pathlib.Path = pathlib.Path(),
     project: Project,
     project_base_image: oci.Image,
     base_digest: bytes,
     rock_suffix: str,
     build_for: str,
     base_layer_dir: pathlib.Path,
+    base_index: RootfsIndex | None = None,
+    compression: LayerCompression | None = None,
+    part_layers: dict[str, set[str]] | None = None,
+    layer_cache: LayerCache | None = None,
+    oci_layout: bool = False,
+    coalesce_layers: bool = False,
 ) -> str:
     """Create the rock image for a given architecture.
 
     :param lifecycle:
       The lifecycle object containing the primed payload for the rock.
+    :param dest:
+      The directory to write the rock to.
     :param project_base_image:
       The Image for the base over which the payload was primed.
     :param base_digest:
@@ -108,31 +216,167 @@ def _pack(
       The architecture of the built rock, to add as metadata.
     :param base_layer_dir:
       The directory where the rock's base image was extracted.
+    :param base_index:
+      The index of ``base_layer_dir``, if available.
+    :param compression:
+      The compression for the rock's new layers (gzip by default).
+    :param part_layers:
+      The primed paths of each group of parts to pack as a separate layer, in
+      order. The rest of the prime directory is packed as a final layer.
+    :param layer_cache:
+      An optional cache of layer blobs, to reuse the layers of the prime
+      directory when their contents did not change.
+    :param oci_layout:
+      Whether to write the rock as an OCI image layout directory, with its blobs
+      hard-linked from the work directory, instead of as an archive.
+    :param coalesce_layers:
+      Whether to add the rock's user, Pebble layer and control data as a single
+      layer, instead of one layer each.
+    :returns: The name of the rock's archive or layout directory, in ``dest``.
     """
-    emit.progress("Creating new layer")
-
     # At this point the version must be set, otherwise it would have failed earlier.
     version = cast(str, project.version)
 
-    new_image = project_base_image.add_layer(
-        tag=version,
-        new_layer_dir=prime_dir,
-        base_layer_dir=base_layer_dir,
-    )
+    new_image = project_base_image
+    layered_paths: set[str] = set()
+    for layer_name, paths in (part_layers or {}).items():
+        emit.progress(f"Creating new layer '{layer_name}'")
+        with timing.span(f"layer {layer_name}", "pack", paths=len(paths)):
+            new_image = new_image.add_layer(
+                tag=version,
+                new_layer_dir=prime_dir,
+                base_layer_dir=base_layer_dir,
+                comment=f"Layer '{layer_name}'",
+                compression=compression,
+                base_index=base_index,
+                include=paths,
+                layer_cache=layer_cache,
+            )
+        layered_paths.update(paths)
+
+    emit.progress("Creating new layer")
+    with timing.span("layer", "pack"):
+        new_image = new_image.add_layer(
+            tag=version,
+            new_layer_dir=prime_dir,
+            base_layer_dir=base_layer_dir,
+            compression=compression,
+            base_index=base_index,
+            exclude=layered_paths,
+            layer_cache=layer_cache,
+        )
     emit.progress("Created new layer")
+    user: tuple[str, int] | None = None
     if project.run_user:
-        emit.progress(f"Creating new user {project.run_user}")
-        userid = SUPPORTED_GLOBAL_USERNAMES[project.run_user]["uid"]
-        new_image.add_user(
-            prime_dir=prime_dir,
-            base_layer_dir=base_layer_dir,
-            tag=version,
-            username=project.run_user,
-            uid=userid,
+        user = (project.run_user, SUPPORTED_GLOBAL_USERNAMES[project.run_user]["uid"])
+
+    dumped = project.marshal()
+    services = cast(dict[str, typing.Any], dumped.get("services", {}))
+    checks = cast(dict[str, typing.Any], dumped.get("checks", {}))
+
+    # Set annotations and metadata, both dynamic and the ones based on user-provided properties
+    # Also include the "created" timestamp, just before packing the image
+    emit.progress("Adding metadata")
+    metadata_start = time.perf_counter_ns()
+    oci_annotations, rock_metadata = project.generate_metadata(
+        datetime.datetime.now(datetime.timezone.utc).isoformat(), base_digest, build_for
+    )
+
+    if coalesce_layers:
+        pebble_layer = None
+        if services or checks:
+            pebble_layer = Pebble.get_layer_content(
+                services=services,
+                checks=checks,
+                summary=project.summary,
+                description=project.description,
+            )
+        new_image.add_generated_layer(
+            version,
+            prime_dir,
+            base_layer_dir,
+            metadata=rock_metadata,
+            rock_name=project.name,
+            user=user,
+            pebble_layer=pebble_layer,
+            compression=compression,
+            base_index=base_index,
+        )
+    else:
+        if user is not None:
+            username, userid = user
+            emit.progress(f"Creating new user {username}")
+            new_image.add_user(
+                prime_dir=prime_dir,
+                base_layer_dir=base_layer_dir,
+                tag=version,
+                username=username,
+                uid=userid,
+                compression=compression,
+                base_index=base_index,
+            )
+
+        if services or checks:
+            new_image.set_pebble_layer(
+                services=services,
+                checks=checks,
+                name=project.name,
+                tag=version,
+                summary=project.summary,
+                description=project.description,
+                base_layer_dir=base_layer_dir,
+                compression=compression,
+                base_index=base_index,
+            )
+
+        new_image.set_control_data(rock_metadata, compression=compression)
+    # All the changes to the image's config and manifest are written at once.
+    with new_image.configure() as config:
+        _configure_image(
+            config,
+            project,
+            annotations=oci_annotations,
+            build_for=build_for,
         )
+    timing.add_span("metadata", "pack", metadata_start)
+    emit.progress("Metadata added")
+
+    dest.mkdir(parents=True, exist_ok=True)
+    if oci_layout:
+        emit.progress("Exporting to OCI layout")
+        layout_name = f"{project.name}_{project.version}_{rock_suffix}"
+        with timing.span("export", "pack", format="oci-layout"):
+            new_image.to_oci_layout(tag=version, dirname=str(dest / layout_name))
+        emit.progress(f"Exported to OCI layout '{layout_name}'")
+        return layout_name
+
+    emit.progress("Exporting to OCI archive")
+    archive_name = f"{project.name}_{project.version}_{rock_suffix}.rock"
+    with timing.span("export", "pack", format="oci-archive"):
+        new_image.to_oci_archive(tag=version, filename=str(dest / archive_name))
+    emit.progress(f"Exported to OCI archive '{archive_name}'")
 
+    return archive_name
+
+
+def _configure_image(
+    config: oci.ImageConfig,
+    project: Project,
+    *,
+    annotations: dict[str, typing.Any],
+    build_for: str,
+) -> None:
+    """Set the rock's runtime configuration and annotations.
+
+    :param config: The pending changes to the image's config.
+    :param project: The rock's project.
+    :param annotations: The annotations (and labels) of the image.
+    :param build_for: The architecture of the built rock.
+    """
+    if project.run_user:
         emit.progress(f"Setting the default OCI user to be {project.run_user}")
-        new_image.set_default_user(userid, project.run_user)
+        userid = SUPPORTED_GLOBAL_USERNAMES[project.run_user]["uid"]
+        config.set_default_user(userid, project.run_user)
 
     if project.entrypoint_command:
         emit.progress("Setting OCI entrypoint")
@@ -150,48 +394,17 @@ def _pack(
             command = project.services[project.entrypoint_service].command
             cmd = parse_command(command or "")[1]
 
-    new_image.set_entrypoint(entrypoint)
-    new_image.set_cmd(cmd)
-    new_image.set_default_path(project.base)
-
-    dumped = project.marshal()
-    services = cast(dict[str, typing.Any], dumped.get("services", {}))
-    checks = cast(dict[str, typing.Any], dumped.get("checks", {}))
-
-    if services or checks:
-        new_image.set_pebble_layer(
-            services=services,
-            checks=checks,
-            name=project.name,
-            tag=version,
-            summary=project.summary,
-            description=project.description,
-            base_layer_dir=base_layer_dir,
-        )
+    config.set_entrypoint(entrypoint)
+    config.set_cmd(cmd)
+    config.set_default_path(project.base)
 
     if project.environment:
-        new_image.set_environment(project.environment)
+        config.set_environment(project.environment)
 
-    # Set annotations and metadata, both dynamic and the ones based on user-provided properties
-    # Also include the "created" timestamp, just before packing the image
-    emit.progress("Adding metadata")
-    oci_annotations, rock_metadata = project.generate_metadata(
-        datetime.datetime.now(datetime.timezone.utc).isoformat(), base_digest, build_for
-    )
-    new_image.set_annotations(oci_annotations)
-    new_image.set_control_data(rock_metadata)
-    emit.progress("Metadata added")
+    config.set_annotations(annotations)
 
     # Set the media type in the target images's manifest.
     # This is different than calling _inject_oci_fields in oci.Image.new_oci_image,
     # since _inject_oci_fields is called in the context of creating the base image.
     emit.progress("Adding manifest media type")
-    new_image.set_media_type(arch=build_for)
-    emit.progress("Manifest media type added")
-
-    emit.progress("Exporting to OCI archive")
-    archive_name = f"{project.name}_{project.version}_{rock_suffix}.rock"
-    new_image.to_oci_archive(tag=version, filename=archive_name)
-    emit.progress(f"Exported to OCI archive '{archive_name}'")
-
-    return archive_name
+    config.set_media_type(arch=build_for)
@@ -0,0 +1,161 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Timing of the phases of a build, written as a Chrome trace."""
+
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+from craft_cli import emit
+
+
+class Tracer:
+    """The spans of time taken by the phases of a build.
+
+    Spans are recorded as complete events of the Chrome trace event format,
+    which can be loaded in ``chrome://tracing`` or Perfetto. Each span has
+    its duration, the peak resident set size (RSS) of Rockcraft and of its
+    finished subprocesses when it ends, and the arguments set by the code it
+    times, like the number of bytes processed.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._events: list[dict[str, Any]] = []
+        self._threads: set[int] = set()
+        self._pid = os.getpid()
+
+    def __len__(self) -> int:
+        return sum(1 for event in self._events if event["ph"] == "X")
+
+    def add(
+        self,
+        name: str,
+        category: str,
+        start_ns: int,
+        end_ns: int,
+        args: dict[str, Any],
+    ) -> None:
+        """Record a span.
+
+        :param name: The name of the span.
+        :param category: The kind of span, like ``"subprocess"`` or ``"pack"``.
+        :param start_ns: When the span started, from ``time.perf_counter_ns()``.
+        :param end_ns: When the span ended, from ``time.perf_counter_ns()``.
+        :param args: The arguments of the span.
+        """
+        thread_id = threading.get_native_id()
+        # On Linux, the maximum RSS is in KiB.
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start_ns / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": self._pid,
+            "tid": thread_id,
+            "args": {
+                **args,
+                "peak_rss": peak_rss,
+                "children_peak_rss": children_rss,
+            },
+        }
+        with self._lock:
+            if thread_id not in self._threads:
+                self._threads.add(thread_id)
+                self._events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": self._pid,
+                        "tid": thread_id,
+                        "args": {"name": threading.current_thread().name},
+                    }
+                )
+            self._events.append(event)
+
+    def write(self, path: Path) -> None:
+        """Write the spans to ``path``, in the Chrome trace JSON object format."""
+        with self._lock:
+            data = {"traceEvents": list(self._events), "displayTimeUnit": "ms"}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(data, indent=1))
+
+
+_tracer: Tracer | None = None
+
+
+def enable() -> Tracer:
+    """Start recording spans, if not recording them yet."""
+    global _tracer  # noqa: PLW0603 (the process-wide tracer)
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def disable() -> None:
+    """Stop recording spans, discarding the recorded ones."""
+    global _tracer  # noqa: PLW0603 (the process-wide tracer)
+    _tracer = None
+
+
+def write(path: Path) -> None:
+    """Write the recorded spans to ``path`` as a Chrome trace, if any were recorded.
+
+    :param path: The file to write.
+    """
+    if _tracer is None:
+        return
+    _tracer.write(path)
+    emit.debug(f"Wrote {len(_tracer)} timing spans to {path}")
+
+
+@contextlib.contextmanager
+def span(name: str, category: str, **args: Any) -> Iterator[dict[str, Any]]:
+    """Time a block of code, if spans are being recorded.
+
+    :param name: The name of the span.
+    :param category: The kind of span, like ``"subprocess"`` or ``"pack"``.
+    :param args: The arguments of the span. More can be set in the yielded
+        dictionary, like the number of bytes processed.
+    """
+    start_ns = time.perf_counter_ns()
+    try:
+        yield args
+    finally:
+        add_span(name, category, start_ns, **args)
+
+
+def add_span(name: str, category: str, start_ns: int, **args: Any) -> None:
+    """Record a span that ends now, for code that can't be timed with ``span()``.
+
+    :param name: The name of the span.
+    :param category: The kind of span.
+    :param start_ns: When the span started, from ``time.perf_counter_ns()``.
+    :param args: The arguments of the span.
+    """
+    tracer = _tracer
+    if tracer is not None:
+        tracer.add(name, category, start_ns, time.perf_counter_ns(), args)
@@ -0,0 +1,712 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unpacking of OCI image layers into a root filesystem."""
+
+import contextlib
+import hashlib
+import os
+import posixpath
+import queue
+import shutil
+import stat
+import tarfile
+import threading
+import time
+import zlib
+from collections.abc import Iterator, Sequence
+from collections.abc import Set as AbstractSet
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, BinaryIO, cast
+
+import zstandard
+from craft_cli import emit
+
+from rockcraft import errors
+from rockcraft.rootfs import EntryType, RootfsEntry, RootfsIndex
+
+# The size of the reads and writes of layer contents.
+_BUFFER_SIZE = 1024 * 1024
+
+# The number of buffers that each layer is decompressed ahead of being applied.
+_READ_AHEAD = 64
+
+# The number of small files that are written concurrently, while the next
+# entries of the layer are read.
+_WRITE_AHEAD = 256
+
+# The maximum number of symlinks followed to resolve a single path, like Linux.
+_MAX_SYMLINKS = 40
+
+_WHITEOUT_PREFIX = ".wh."
+
+_OPAQUE_WHITEOUT = ".wh..wh..opq"
+
+_XATTR_PREFIX = "SCHILY.xattr."
+
+
+@dataclass(frozen=True)
+class LayerArchive:
+    """A layer blob of an OCI image.
+
+    :param path: The path to the blob.
+    :param media_type: The media type of the blob, which sets its compression.
+    """
+
+    path: Path
+    media_type: str
+
+
+def unpack_layers(
+    layers: Sequence[LayerArchive],
+    rootfs: Path,
+    *,
+    rootless: bool = False,
+    include: AbstractSet[str] | None = None,
+) -> None:
+    """Apply the layers of an image, in order, to an empty root filesystem.
+
+    The layers are decompressed in parallel, each one a bounded amount ahead of
+    the one being applied, and applied like ``umoci unpack`` does: whiteouts
+    remove the entries of the layers below, and opaque directories hide their
+    lower contents. Entries are written within ``rootfs`` even if their paths
+    (or the symlinks along them) point out of it.
+
+    :param layers: The image's layers, from the bottom one up.
+    :param rootfs: The directory to unpack the layers into.
+    :param rootless: Whether to unpack without root: the entries are owned by
+        the current user instead of their owners in the layers, and device
+        nodes are skipped.
+    :param include: The only entries to unpack, by their paths in the final
+        root filesystem (the keys of a ``RootfsIndex``), or None to unpack all
+        of them. Their missing parent directories are created with default
+        metadata, and entries unpacked before are kept.
+    :raises ImageExtractionError: If a layer cannot be read or applied.
+    """
+    start = time.monotonic()
+    rootfs.mkdir(parents=True, exist_ok=True)
+    readers = [_LayerReader() for _ in layers]
+    with (
+        ThreadPoolExecutor(
+            max_workers=min(len(layers), os.cpu_count() or 1) or 1,
+            thread_name_prefix="rockcraft-unpack",
+        ) as executor,
+        ThreadPoolExecutor(thread_name_prefix="rockcraft-write") as writers,
+    ):
+        # Layers are decompressed in order, so the one being applied always
+        # has a thread, even if the others are blocked waiting to be read.
+        for layer, reader in zip(layers, readers, strict=True):
+            executor.submit(reader.decompress, layer)
+        try:
+            for layer, reader in zip(layers, readers, strict=True):
+                emit.debug(f"Applying layer {layer.path.name}")
+                applier = _LayerApplier(
+                    rootfs, rootless=rootless, writers=writers, include=include
+                )
+                try:
+                    with tarfile.open(
+                        fileobj=cast(BinaryIO, reader), mode="r|"
+                    ) as tar_file:
+                        applier.apply(tar_file)
+                except (
+                    OSError,
+                    tarfile.TarError,
+                    zlib.error,
+                    zstandard.ZstdError,
+                ) as err:
+                    raise errors.ImageExtractionError(
+                        f"Cannot unpack layer {layer.path.name}: {err}"
+                    ) from err
+                # The end of the layer (its padding) doesn't need to be read.
+                reader.close()
+        finally:
+            for reader in readers:
+                reader.close()
+
+    emit.debug(
+        f"Unpacked {len(layers)} layers to {rootfs} in {time.monotonic() - start:.2f}s"
+    )
+
+
+def index_layers(
+    layers: Sequence[LayerArchive],
+    root: Path,
+    digest: str,
+    *,
+    index_file: Path | None = None,
+) -> RootfsIndex:
+    """Index the root filesystem of an image from its layers, without unpacking it.
+
+    The entries come from the headers in the layers, which are applied like
+    by :func:`unpack_layers`, and the contents of the regular files are hashed
+    as the layers are read. The files can then be extracted to ``root`` only
+    when they are needed (see :meth:`RootfsIndex.extract_lazily`).
+
+    :param layers: The image's layers, from the bottom one up.
+    :param root: The directory the files would be extracted to.
+    :param digest: The digest of the image.
+    :param index_file: The file where the index will be saved, if any.
+    :raises ImageExtractionError: If a layer cannot be read.
+    """
+    start = time.monotonic()
+    entries = {".": RootfsEntry("dir", stat.S_IFDIR | 0o755, 0, 0, 0)}
+    hashes: dict[str, str] = {}
+    index = RootfsIndex(root, digest, entries, hashes, index_file=index_file)
+    for layer in layers:
+        added: set[str] = set()
+        with _open_layer(layer) as tar_file:
+            for member in tar_file:
+                parent, _, basename = _normalize(member.name).rpartition("/")
+                # Entries under symlinked directories are in the symlinks'
+                # targets, as when unpacking.
+                parent_entry = entries.get(parent or ".")
+                if parent_entry is None or parent_entry.type != "dir":
+                    parent = index.resolve(parent) or parent
+                parent = "" if parent == "." else parent
+                name = posixpath.join(parent, basename) or "."
+                if basename == _OPAQUE_WHITEOUT:
+                    _remove_indexed(entries, hashes, f"{parent}/", keep=added)
+                elif basename.startswith(_WHITEOUT_PREFIX):
+                    whiteout = posixpath.join(parent, basename[len(_WHITEOUT_PREFIX) :])
+                    _remove_indexed(entries, hashes, whiteout)
+                else:
+                    added.add(name)
+                    link_target = None
+                    if member.islnk():
+                        link_target = _normalize(member.linkname)
+                        link_target = (
+                            index.resolve(link_target, follow_symlinks=False)
+                            or link_target
+                        )
+                    _index_member(tar_file, member, name, entries, hashes, link_target)
+
+    emit.debug(
+        f"Indexed {len(entries)} entries from {len(layers)} layers "
+        f"in {time.monotonic() - start:.2f}s"
+    )
+    return index
+
+
+@contextlib.contextmanager
+def _open_layer(layer: LayerArchive) -> Iterator[tarfile.TarFile]:
+    """Read a layer as a stream, decompressed by another thread."""
+    reader = _LayerReader()
+    thread = threading.Thread(
+        target=reader.decompress, args=(layer,), name="rockcraft-index", daemon=True
+    )
+    thread.start()
+    try:
+        with tarfile.open(fileobj=cast(BinaryIO, reader), mode="r|") as tar_file:
+            yield tar_file
+    except (OSError, tarfile.TarError, zlib.error, zstandard.ZstdError) as err:
+        raise errors.ImageExtractionError(
+            f"Cannot read layer {layer.path.name}: {err}"
+        ) from err
+    finally:
+        reader.close()
+        thread.join()
+
+
+def _index_member(
+    tar_file: tarfile.TarFile,
+    member: tarfile.TarInfo,
+    name: str,
+    entries: dict[str, RootfsEntry],
+    hashes: dict[str, str],
+    link_target: str | None,
+) -> None:
+    """Add the entry of a layer member to the index, replacing the existing one.
+
+    :param link_target: The key of the entry that a hard link points to.
+    """
+    previous = entries.get(name)
+    if previous is not None and previous.type == "dir" and not member.isdir():
+        _remove_indexed(entries, hashes, f"{name}/")
+    hashes.pop(name, None)
+
+    # Like when unpacking, the missing parents are created as directories.
+    parent = posixpath.dirname(name)
+    while parent and parent not in entries:
+        entries[parent] = RootfsEntry("dir", stat.S_IFDIR | 0o755, 0, 0, 0)
+        parent = posixpath.dirname(parent)
+
+    if link_target is not None:
+        linked = entries.get(link_target)
+        if linked is not None and linked.type == "file":
+            entries[name] = RootfsEntry(
+                "file",
+                linked.mode,
+                linked.uid,
+                linked.gid,
+                linked.size,
+                linked.target or link_target,
+            )
+            if link_target in hashes:
+                hashes[name] = hashes[link_target]
+            return
+
+    mode = stat.S_IMODE(member.mode)
+    entry_type: EntryType = "other"
+    target = None
+    if member.isreg():
+        entry_type, mode = "file", mode | stat.S_IFREG
+        hashes[name] = _hash_member(tar_file, member)
+    elif member.isdir():
+        entry_type, mode = "dir", mode | stat.S_IFDIR
+    elif member.issym():
+        entry_type, mode, target = "symlink", 0o777 | stat.S_IFLNK, member.linkname
+    elif member.isfifo():
+        mode |= stat.S_IFIFO
+    elif member.ischr():
+        mode |= stat.S_IFCHR
+    elif member.isblk():
+        mode |= stat.S_IFBLK
+
+    entries[name] = RootfsEntry(
+        entry_type, mode, member.uid, member.gid, member.size, target
+    )
+
+
+def _hash_member(tar_file: tarfile.TarFile, member: tarfile.TarInfo) -> str:
+    """Compute the SHA-256 hex digest of the contents of a regular file member."""
+    file_hash = hashlib.sha256()
+    source = tar_file.extractfile(member)
+    if source is not None:
+        with source:
+            while data := source.read(_BUFFER_SIZE):
+                file_hash.update(data)
+    return file_hash.hexdigest()
+
+
+def _remove_indexed(
+    entries: dict[str, RootfsEntry],
+    hashes: dict[str, str],
+    name: str,
+    *,
+    keep: AbstractSet[str] = frozenset(),
+) -> None:
+    """Remove an entry and its children from the index.
+
+    :param name: The entry to remove, or only its children if it ends with
+        a slash.
+    :param keep: The entries not to remove.
+    """
+    prefix = name.rstrip("/") + "/" if name.strip("/") else ""
+    removed = [
+        path
+        for path in entries
+        if (path == name or path.startswith(prefix))
+        and path not in keep
+        and path != "."
+    ]
+    for path in removed:
+        del entries[path]
+        hashes.pop(path, None)
+
+
+class _LayerReader:
+    """A file-like object to read a layer as it is decompressed by another thread."""
+
+    def __init__(self) -> None:
+        self._chunks: queue.Queue[bytes | BaseException | None] = queue.Queue(
+            maxsize=_READ_AHEAD
+        )
+        self._closed = threading.Event()
+        self._chunk = b""
+        self._offset = 0
+        self._eof = False
+
+    def decompress(self, layer: LayerArchive) -> None:
+        """Decompress the layer's blob, until it is read or the reader is closed."""
+        try:
+            with layer.path.open("rb") as blob:
+                for chunk in _decompress(blob, layer.media_type):
+                    if not self._put(chunk):
+                        return
+            self._put(None)
+        except Exception as err:  # noqa: BLE001 (raised by the reader)
+            self._put(err)
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to ``size`` bytes of the decompressed layer (all if negative)."""
+        parts: list[bytes] = []
+        while size != 0 and not self._eof:
+            if self._offset >= len(self._chunk):
+                item = self._chunks.get()
+                if isinstance(item, BaseException):
+                    raise item
+                if item is None:
+                    self._eof = True
+                    break
+                self._chunk, self._offset = item, 0
+                continue
+
+            end = len(self._chunk) if size < 0 else self._offset + size
+            part = self._chunk[self._offset : end]
+            self._offset += len(part)
+            if size > 0:
+                size -= len(part)
+            parts.append(part)
+        return b"".join(parts)
+
+    def close(self) -> None:
+        """Stop decompressing the layer, as it is not read anymore."""
+        self._closed.set()
+
+    def _put(self, item: bytes | BaseException | None) -> bool:
+        while not self._closed.is_set():
+            with contextlib.suppress(queue.Full):
+                self._chunks.put(item, timeout=0.1)
+                return True
+        return False
+
+
+def _decompress(blob: BinaryIO, media_type: str) -> Iterator[bytes]:
+    """Yield the contents of a layer blob, decompressed according to its type."""
+    if media_type.endswith(("+gzip", ".gzip")):
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        while data := blob.read(_BUFFER_SIZE):
+            while data:
+                # The output is bounded, as layers can be very compressible.
+                yield decompressor.decompress(data, _BUFFER_SIZE)
+                if decompressor.eof:
+                    # Concatenated gzip members are part of the same stream.
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+                else:
+                    data = decompressor.unconsumed_tail
+        yield decompressor.flush()
+    elif media_type.endswith("+zstd"):
+        with zstandard.ZstdDecompressor().stream_reader(
+            blob, read_size=_BUFFER_SIZE, read_across_frames=True, closefd=False
+        ) as reader:
+            while data := reader.read(_BUFFER_SIZE):
+                yield data
+    elif media_type.endswith(("tar", ".tar")):
+        while data := blob.read(_BUFFER_SIZE):
+            yield data
+    else:
+        raise errors.ImageExtractionError(
+            f"Unsupported layer media type {media_type!r}"
+        )
+
+
+def _copy_data(source: IO[bytes], target: IO[bytes] | None, size: int) -> None:
+    """Copy ``size`` bytes from ``source`` to ``target`` (or discard them)."""
+    while size > 0 and (data := source.read(min(size, _BUFFER_SIZE))):
+        if target is not None:
+            target.write(data)
+        size -= len(data)
+
+
+def _make_tree_writable(path: Path) -> None:
+    """Make a directory and its subdirectories writable, to remove them."""
+    path.chmod(stat.S_IRWXU)
+    for child in path.iterdir():
+        if child.is_dir() and not child.is_symlink():
+            _make_tree_writable(child)
+
+
+def _normalize(name: str) -> str:
+    """Get a path in the root filesystem, relative to its root.
+
+    Leading ``..`` components are dropped, as they would point above the root.
+    """
+    return posixpath.normpath("/" + name).lstrip("/")
+
+
+class _LayerApplier:
+    """Apply the entries of a single layer to a root filesystem.
+
+    Small files are written by a pool of threads, as creating files is mostly
+    waiting on the filesystem. The entries that replace, remove or link to a
+    path first wait for its pending write.
+
+    Without root, the directories that are not writable by their owner (like
+    with ``umoci --rootless``) are made writable while the layer changes their
+    contents, and their modes are restored afterwards.
+
+    :param rootfs: The root filesystem.
+    :param rootless: Whether to keep the entries owned by the current user.
+    :param writers: The threads that write the small files.
+    :param include: The only entries to apply, or None to apply all of them.
+    """
+
+    def __init__(
+        self,
+        rootfs: Path,
+        *,
+        rootless: bool,
+        writers: ThreadPoolExecutor,
+        include: AbstractSet[str] | None = None,
+    ) -> None:
+        self._rootfs = rootfs
+        self._rootless = rootless
+        self._writers = writers
+        self._include = include
+        # The writes in progress, oldest first.
+        self._pending: dict[Path, Future[None]] = {}
+        # The names of the entries added by this layer, which opaque whiteouts
+        # don't remove.
+        self._added: set[str] = set()
+        # The directories of this layer, whose metadata is set once their
+        # contents are written.
+        self._dirs: list[tuple[Path, tarfile.TarInfo]] = []
+        # The directories in the root filesystem, by their (unresolved) names.
+        self._resolved: dict[str, str] = {}
+        # The directories made writable without root, and their original modes.
+        self._writable: dict[Path, int | None] = {}
+
+    def apply(self, tar_file: tarfile.TarFile) -> None:
+        """Apply the layer in ``tar_file``, which is read as a stream."""
+        for member in tar_file:
+            name = _normalize(member.name)
+            parent, _, basename = name.rpartition("/")
+            if self._include is not None:
+                self._extract_included(tar_file, member, name)
+            elif basename == _OPAQUE_WHITEOUT:
+                self._make_opaque(parent)
+            elif basename.startswith(_WHITEOUT_PREFIX):
+                whiteout = posixpath.join(parent, basename[len(_WHITEOUT_PREFIX) :])
+                self._remove(self._get_path(whiteout))
+            else:
+                self._added.add(name)
+                self._extract(tar_file, member, self._get_path(name))
+
+        self._wait_all()
+        for path, mode in self._writable.items():
+            if mode is not None:
+                with contextlib.suppress(FileNotFoundError):
+                    path.chmod(mode)
+        # Children are set up before their parents, as writing them would
+        # update the parents' modification times.
+        for path, member in reversed(self._dirs):
+            self._set_metadata(path, member)
+
+    def _extract_included(
+        self, tar_file: tarfile.TarFile, member: tarfile.TarInfo, name: str
+    ) -> None:
+        """Extract a member if it is included, when only some entries are unpacked.
+
+        The directories and symlinks are always extracted, so that the other
+        entries are written where their (resolved) paths point to.
+        The included entries are in the final root filesystem, so no whiteout
+        above their last version applies to them, and whiteouts are ignored:
+        they could remove the entries unpacked before.
+        """
+        if posixpath.basename(name).startswith(_WHITEOUT_PREFIX):
+            return
+        path = self._get_path(name)
+        if (
+            member.isdir()
+            or member.issym()
+            or path.relative_to(self._rootfs).as_posix() in (self._include or ())
+        ):
+            self._extract(tar_file, member, path)
+
+    def _extract(
+        self, tar_file: tarfile.TarFile, member: tarfile.TarInfo, path: Path
+    ) -> None:
+        self._make_writable(path.parent)
+        if member.isdir():
+            if not path.is_dir() or path.is_symlink():
+                self._remove(path)
+                path.mkdir(mode=0o700)
+            self._dirs.append((path, member))
+            return
+
+        self._remove(path)
+        if member.islnk():
+            target = self._get_path(_normalize(member.linkname))
+            self._wait(target)
+            os.link(target, path, follow_symlinks=False)
+            return
+
+        if member.isreg():
+            # Also sets the file's metadata, once it is written.
+            self._write_file(tar_file, member, path)
+            return
+
+        if member.issym():
+            path.symlink_to(member.linkname)
+        elif member.isfifo():
+            os.mkfifo(path, 0o600)
+        elif member.ischr() or member.isblk():
+            if self._rootless:
+                emit.debug(f"Skipping device node {member.name} without root")
+                return
+            file_type = stat.S_IFCHR if member.ischr() else stat.S_IFBLK
+            os.mknod(
+                path, 0o600 | file_type, os.makedev(member.devmajor, member.devminor)
+            )
+        else:
+            emit.debug(f"Skipping {member.name} of unsupported type {member.type!r}")
+            return
+
+        self._set_metadata(path, member)
+
+    def _write_file(
+        self, tar_file: tarfile.TarFile, member: tarfile.TarInfo, path: Path
+    ) -> None:
+        source = tar_file.extractfile(member)
+        if source is None:  # pragma: no cover (regular files always have data)
+            return
+        if member.sparse is None and member.size <= _BUFFER_SIZE:
+            with source:
+                data = source.read()
+            if len(self._pending) >= _WRITE_AHEAD:
+                self._wait(next(iter(self._pending)))
+            self._pending[path] = self._writers.submit(
+                self._write_small_file, path, data, member
+            )
+            return
+
+        with source, path.open("xb", buffering=0) as target:
+            if member.sparse is None:
+                shutil.copyfileobj(source, target, _BUFFER_SIZE)
+            else:
+                # Keep the holes of sparse files, by only writing their data
+                # regions (as offset and size pairs). The holes are read past,
+                # as the layer is read as a stream.
+                regions = cast(list[tuple[int, int]], member.sparse)
+                position = 0
+                for offset, size in regions:
+                    _copy_data(source, None, offset - position)
+                    target.seek(offset)
+                    _copy_data(source, target, size)
+                    position = offset + size
+                target.truncate(member.size)
+        self._set_metadata(path, member)
+
+    def _write_small_file(
+        self, path: Path, data: bytes, member: tarfile.TarInfo
+    ) -> None:
+        with path.open("xb", buffering=0) as target:
+            target.write(data)
+        self._set_metadata(path, member)
+
+    def _wait(self, path: Path) -> None:
+        """Wait for the pending write of ``path``, if any."""
+        future = self._pending.pop(path, None)
+        if future is not None:
+            future.result()
+
+    def _wait_all(self) -> None:
+        while self._pending:
+            self._wait(next(iter(self._pending)))
+
+    def _set_metadata(self, path: Path, member: tarfile.TarInfo) -> None:
+        """Set the ownership, extended attributes, mode and times of an entry."""
+        if not self._rootless:
+            os.chown(path, member.uid, member.gid, follow_symlinks=False)
+        # Set after changing the owner, which drops the file capabilities.
+        for key, value in member.pax_headers.items():
+            if key.startswith(_XATTR_PREFIX):
+                try:
+                    os.setxattr(
+                        path,
+                        key[len(_XATTR_PREFIX) :],
+                        value.encode("utf-8", "surrogateescape"),
+                        follow_symlinks=False,
+                    )
+                except OSError as err:
+                    if not self._rootless:
+                        raise
+                    emit.debug(f"Cannot set {key} on {member.name}: {err}")
+        if not member.issym():
+            # Also set after changing the owner, which drops setuid bits.
+            path.chmod(member.mode)
+        os.utime(path, (member.mtime, member.mtime), follow_symlinks=False)
+
+    def _make_opaque(self, name: str) -> None:
+        """Remove the contents of a directory that come from lower layers."""
+        path = self._rootfs / self._resolve_dir(name)
+        with contextlib.suppress(FileNotFoundError, NotADirectoryError):
+            self._make_writable(path)
+            for child in path.iterdir():
+                if posixpath.join(name, child.name) not in self._added:
+                    self._remove(child)
+
+    def _remove(self, path: Path) -> None:
+        """Remove an entry, if it exists."""
+        self._wait(path)
+        try:
+            mode = path.lstat().st_mode
+        except FileNotFoundError:
+            return
+        self._make_writable(path.parent)
+        if stat.S_ISDIR(mode):
+            # The pending writes could be in the directory.
+            self._wait_all()
+            if self._rootless:
+                _make_tree_writable(path)
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+        # The resolved paths could go through the removed entry.
+        if stat.S_ISDIR(mode) or stat.S_ISLNK(mode):
+            self._resolved.clear()
+
+    def _make_writable(self, path: Path) -> None:
+        """Let the current user change the contents of a directory, without root."""
+        if not self._rootless or path in self._writable:
+            return
+        mode = stat.S_IMODE(path.stat().st_mode)
+        if mode & stat.S_IRWXU == stat.S_IRWXU:
+            self._writable[path] = None
+        else:
+            path.chmod(mode | stat.S_IRWXU)
+            self._writable[path] = mode
+
+    def _get_path(self, name: str) -> Path:
+        """Get the path of an entry, following the symlinks in its parents."""
+        parent, _, basename = name.rpartition("/")
+        return self._rootfs / self._resolve_dir(parent) / basename
+
+    def _resolve_dir(self, name: str, depth: int = 0) -> str:
+        """Get the path of a directory in the root filesystem, relative to its root.
+
+        Symlinks are followed as if the root filesystem was the actual root, so
+        the path never points out of it. Missing directories are created.
+        """
+        if not name:
+            return ""
+        resolved = self._resolved.get(name)
+        if resolved is not None:
+            return resolved
+        if depth > _MAX_SYMLINKS:
+            raise errors.ImageExtractionError(
+                f"Too many levels of symbolic links in {name!r}"
+            )
+
+        parent, _, basename = name.rpartition("/")
+        resolved = posixpath.join(self._resolve_dir(parent, depth), basename)
+        path = self._rootfs / resolved
+        if path.is_symlink():
+            target = str(path.readlink())
+            resolved = self._resolve_dir(
+                _normalize(posixpath.join(posixpath.dirname(resolved), target)),
+                depth + 1,
+            )
+        elif not path.is_dir():
+            # Layers don't need to have entries for all their parents.
+            self._remove(path)
+            self._make_writable(path.parent)
+            path.mkdir(mode=0o755)
+        self._resolved[name] = resolved
+        return resolved
@@ -15,7 +15,6 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import json
 import os
-import subprocess
 import tarfile
 import textwrap
 from collections.abc import Callable
@@ -23,6 +22,7 @@ from pathlib import Path
 
 import pytest
 from rockcraft import oci
+from rockcraft.cache import BlobCache
 from rockcraft.services.image import ImageInfo
 
 pytestmark = [
@@ -36,8 +36,8 @@ def create_base_image(
     """Create a base image with content provided by a callable.
 
     This function will create an empty image, extract it to a bundle and then
-    call ``populate_base_layer(dir)`` to populate its rootfs. Then the image
-    is repacked.
+    call ``populate_base_layer(dir)`` to populate its rootfs. Then the rootfs
+    is added to the image as its sole layer.
 
     :param work_dir: The directory where the image metadata should be stored
     :param populate_base_layer: A callable to create the desired filesystem
@@ -59,16 +59,8 @@ def create_base_image(
     # Call the client function to populate the empty layer
     populate_base_layer(base_layer_dir)
 
-    # Repack the image with the new contents overwriting the existing layer
-    subprocess.check_output(
-        [
-            "umoci",
-            "repack",
-            "--image",
-            f"{image_dir}/bare:original",
-            f"{extracted_dir}/bare-original",
-        ]
-    )
+    # Add the new contents to the (empty) image, keeping its tag
+    image = image.add_layer("original", base_layer_dir)
 
     return image, base_layer_dir
 
@@ -266,3 +258,26 @@ def test_image_manifest_has_arch_variant(arch, expected_arch, expected_variant):
     config = json.loads(output)
     assert config["architecture"] == expected_arch
     assert config.get("variant") == expected_variant
+
+
+@pytest.mark.usefixtures("new_dir")
+def test_from_sources_local_layout():
+    """A directory of OCI layouts can stand in for the registry."""
+    oci.Image.new_oci_image(
+        image_name="ubuntu@24.04", image_dir=Path("mirror"), arch="amd64"
+    )
+    blob_cache = BlobCache(Path("cache"))
+
+    image, source_image = oci.Image.from_sources(
+        "ubuntu@24.04",
+        sources=["oci-archive:missing.tar", "oci:mirror"],
+        image_dir=Path("images"),
+        arch="amd64",
+        blob_cache=blob_cache,
+    )
+
+    assert source_image == "oci:mirror/ubuntu:24.04"
+    assert (
+        image.get_manifest() == oci.Image("ubuntu:24.04", Path("mirror")).get_manifest()
+    )
+    assert blob_cache.get_path(image.manifest_digest()).is_file()
@@ -0,0 +1,118 @@
+#  This file is part of Rockcraft.
+#
+#  Copyright 2026 Canonical Ltd.
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License version 3, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+#  SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""OCI-related utility functions for testing."""
+
+import hashlib
+import json
+import tarfile
+from pathlib import Path
+from typing import Any
+
+from rockcraft import oci
+
+
+def write_blob(layout_dir: Path, content: bytes) -> str:
+    """Write ``content`` as a blob in ``layout_dir``, returning its digest."""
+    digest = hashlib.sha256(content).hexdigest()
+    blobs_dir = layout_dir / "blobs" / "sha256"
+    blobs_dir.mkdir(parents=True, exist_ok=True)
+    (blobs_dir / digest).write_bytes(content)
+    return f"sha256:{digest}"
+
+
+def create_image(
+    image_dir: Path, image_name: str, *, architecture: str = "amd64"
+) -> oci.Image:
+    """Create an empty OCI image, like ``umoci init`` followed by ``umoci new``.
+
+    :param image_dir: The directory holding the OCI layouts.
+    :param image_name: The image name, in ``name:tag`` format.
+    """
+    name, tag = image_name.split(":", 1)
+    layout_dir = image_dir / name
+    layout_dir.mkdir(parents=True, exist_ok=True)
+    (layout_dir / "oci-layout").write_text('{"imageLayoutVersion": "1.0.0"}')
+
+    config = {
+        "architecture": architecture,
+        "os": "linux",
+        "config": {},
+        "rootfs": {"type": "layers", "diff_ids": []},
+        "history": [],
+    }
+    config_bytes = json.dumps(config).encode()
+    manifest = {
+        "schemaVersion": 2,
+        "mediaType": oci.MANIFEST_MEDIA_TYPE,
+        "config": {
+            "mediaType": "application/vnd.oci.image.config.v1+json",
+            "digest": write_blob(layout_dir, config_bytes),
+            "size": len(config_bytes),
+        },
+        "layers": [],
+    }
+    manifest_bytes = json.dumps(manifest).encode()
+    index = {
+        "schemaVersion": 2,
+        "manifests": [
+            {
+                "mediaType": oci.MANIFEST_MEDIA_TYPE,
+                "digest": write_blob(layout_dir, manifest_bytes),
+                "size": len(manifest_bytes),
+                "annotations": {oci.REF_NAME_ANNOTATION: tag},
+            }
+        ],
+    }
+    (layout_dir / "index.json").write_text(json.dumps(index))
+
+    return oci.Image(image_name=image_name, path=image_dir)
+
+
+def read_index(image: oci.Image) -> dict[str, Any]:
+    """Load the ``index.json`` of the layout containing ``image``."""
+    name = image.image_name.split(":", 1)[0]
+    return json.loads((image.path / name / "index.json").read_text())
+
+
+def read_blob(image: oci.Image, digest: str) -> bytes:
+    """Read a blob from the layout containing ``image``."""
+    name = image.image_name.split(":", 1)[0]
+    return (
+        image.path / name / "blobs" / "sha256" / digest.split(":", 1)[1]
+    ).read_bytes()
+
+
+def read_manifest(image: oci.Image) -> dict[str, Any]:
+    """Load the manifest of ``image`` from its layout."""
+    tag = image.image_name.split(":", 1)[1]
+    for descriptor in read_index(image)["manifests"]:
+        if descriptor["annotations"][oci.REF_NAME_ANNOTATION] == tag:
+            return json.loads(read_blob(image, descriptor["digest"]))
+    raise KeyError(tag)
+
+
+def read_config(image: oci.Image) -> dict[str, Any]:
+    """Load the image config of ``image`` from its layout."""
+    return json.loads(read_blob(image, read_manifest(image)["config"]["digest"]))
+
+
+def get_layer_names(image: oci.Image, layer_number: int = -1) -> list[str]:
+    """Get the names of the entries in one of the layers of ``image``."""
+    name = image.image_name.split(":", 1)[0]
+    digest = read_manifest(image)["layers"][layer_number]["digest"]
+    layer_path = image.path / name / "blobs" / "sha256" / digest.split(":", 1)[1]
+    with tarfile.open(layer_path) as tar_file:
+        return tar_file.getnames()
@@ -0,0 +1,349 @@
+#  This file is part of Rockcraft.
+#
+#  Copyright 2026 Canonical Ltd.
+#
+#  This program is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU General Public License version 3, as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranties of MERCHANTABILITY,
+#  SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License along
+#  with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""A local stand-in of an OCI distribution registry, for testing."""
+
+import hashlib
+import json
+import re
+import threading
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from rockcraft import registry
+
+_BLOB_PATH = re.compile(r"^/v2/(?P<repository>.+)/blobs/(?P<digest>[^/]+)$")
+_MANIFEST_PATH = re.compile(r"^/v2/(?P<repository>.+)/manifests/(?P<reference>[^/]+)$")
+_UPLOADS_PATH = re.compile(r"^/v2/(?P<repository>.+)/blobs/uploads/$")
+_UPLOAD_PATH = re.compile(r"^/v2/(?P<repository>.+)/blobs/uploads/(?P<upload>[^/]+)$")
+
+
+class FakeRegistry:
+    """An HTTP server implementing the distribution API, for pulls and pushes.
+
+    :ivar requests: The method, path and headers of each request received.
+    :ivar repositories: The digests of the blobs each repository has, for
+        existence checks, mounts and pushed manifests.
+    :ivar fail_after: The number of bytes to send of a blob, by digest, before
+        dropping the connection. Each failure happens once.
+    :ivar token: If set, requests must have this bearer token, which is issued
+        by the ``/token`` endpoint.
+    :ivar support_range: Whether blob downloads can be resumed.
+    """
+
+    def __init__(self) -> None:
+        self.manifests: dict[tuple[str, str], tuple[str, bytes]] = {}
+        self.blobs: dict[str, bytes] = {}
+        self.repositories: dict[str, set[str]] = {}
+        self.uploads: dict[str, bytearray] = {}
+        self.requests: list[tuple[str, str, dict[str, str]]] = []
+        self.fail_after: dict[str, int] = {}
+        self.token: str | None = None
+        self.support_range = True
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={"poll_interval": 0.01}
+        )
+
+    @property
+    def host(self) -> str:
+        """The host and port of the registry."""
+        return f"127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def add_blob(
+        self,
+        content: bytes,
+        media_type: str = "application/octet-stream",
+        *,
+        repository: str | None = None,
+    ) -> dict[str, Any]:
+        """Add a blob, returning its descriptor.
+
+        :param repository: A repository to add the blob to, for existence checks.
+        """
+        digest = f"sha256:{hashlib.sha256(content).hexdigest()}"
+        self.blobs[digest] = content
+        if repository is not None:
+            self.repositories.setdefault(repository, set()).add(digest)
+        return {"mediaType": media_type, "digest": digest, "size": len(content)}
+
+    def add_manifest(
+        self, repository: str, reference: str | None, manifest: dict[str, Any]
+    ) -> dict[str, Any]:
+        """Add a manifest or index, tagged ``reference`` if set.
+
+        :returns: The descriptor of the manifest.
+        """
+        content = json.dumps(manifest).encode()
+        digest = f"sha256:{hashlib.sha256(content).hexdigest()}"
+        media_type = manifest["mediaType"]
+        self.manifests[repository, digest] = (media_type, content)
+        if reference is not None:
+            self.manifests[repository, reference] = (media_type, content)
+        return {"mediaType": media_type, "digest": digest, "size": len(content)}
+
+    def add_image(
+        self,
+        repository: str,
+        tag: str,
+        platforms: list[tuple[str, str | None]],
+        *,
+        docker: bool = False,
+    ) -> dict[tuple[str, str | None], dict[str, Any]]:
+        """Add a multi-platform image, with one layer per platform.
+
+        :param platforms: The architecture and variant of each platform.
+        :param docker: Whether to use Docker media types instead of OCI ones.
+        :returns: The manifest of each platform.
+        """
+        if docker:
+            manifest_type = registry.DOCKER_MANIFEST_MEDIA_TYPE
+            index_type = registry.DOCKER_MANIFEST_LIST_MEDIA_TYPE
+            config_type = "application/vnd.docker.container.image.v1+json"
+            layer_type = "application/vnd.docker.image.rootfs.diff.tar.gzip"
+        else:
+            manifest_type = registry.OCI_MANIFEST_MEDIA_TYPE
+            index_type = registry.OCI_INDEX_MEDIA_TYPE
+            config_type = "application/vnd.oci.image.config.v1+json"
+            layer_type = "application/vnd.oci.image.layer.v1.tar+gzip"
+
+        manifests: dict[tuple[str, str | None], dict[str, Any]] = {}
+        descriptors: list[dict[str, Any]] = []
+        for architecture, variant in platforms:
+            platform = {"architecture": architecture, "os": "linux"}
+            if variant:
+                platform["variant"] = variant
+            config = {**platform, "rootfs": {"type": "layers", "diff_ids": []}}
+            manifest = {
+                "schemaVersion": 2,
+                "mediaType": manifest_type,
+                "config": self.add_blob(json.dumps(config).encode(), config_type),
+                "layers": [
+                    self.add_blob(f"layer {platform}".encode() * 1000, layer_type)
+                ],
+            }
+            manifests[architecture, variant] = manifest
+            descriptor = self.add_manifest(repository, None, manifest)
+            descriptors.append({**descriptor, "platform": platform})
+
+        self.add_manifest(
+            repository,
+            tag,
+            {"schemaVersion": 2, "mediaType": index_type, "manifests": descriptors},
+        )
+        return manifests
+
+    def count_requests(self, path: str) -> int:
+        """Get the number of requests received for ``path``."""
+        return sum(1 for _, request_path, _ in self.requests if request_path == path)
+
+
+def _make_handler(fake: FakeRegistry) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+            pass
+
+        def do_GET(self) -> None:
+            fake.requests.append(("GET", self.path, dict(self.headers)))
+            if self.path.startswith("/token"):
+                self._send(200, b'{"token": "%s"}' % (fake.token or "").encode())
+                return
+            if not self._is_authorized():
+                return
+
+            if match := _MANIFEST_PATH.match(self.path):
+                manifest = fake.manifests.get((match["repository"], match["reference"]))
+                if manifest is None:
+                    self._send(404, b"")
+                else:
+                    self._send(200, manifest[1], {"Content-Type": manifest[0]})
+            elif (match := _BLOB_PATH.match(self.path)) and (
+                match["digest"] in fake.blobs
+            ):
+                self._send_blob(match["digest"])
+            else:
+                self._send(404, b"")
+
+        def do_HEAD(self) -> None:
+            fake.requests.append(("HEAD", self.path, dict(self.headers)))
+            if not self._is_authorized():
+                return
+            match = _BLOB_PATH.match(self.path)
+            if match and match["digest"] in fake.repositories.get(
+                match["repository"], set()
+            ):
+                self._send(200, b"")
+            else:
+                self._send(404, b"")
+
+        def do_POST(self) -> None:
+            url = urllib.parse.urlsplit(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            fake.requests.append(("POST", self.path, dict(self.headers)))
+            self._read_body()
+            if not self._is_authorized():
+                return
+            if not (match := _UPLOADS_PATH.match(url.path)):
+                self._send(404, b"")
+                return
+
+            repository = match["repository"]
+            digest = query.get("mount")
+            if digest and digest in fake.repositories.get(query.get("from", ""), ()):
+                fake.repositories.setdefault(repository, set()).add(digest)
+                self._send(201, b"")
+                return
+
+            upload = uuid.uuid4().hex
+            fake.uploads[upload] = bytearray()
+            location = f"/v2/{repository}/blobs/uploads/{upload}?_state=0"
+            self._send(202, b"", {"Location": location})
+
+        def do_PATCH(self) -> None:
+            url = urllib.parse.urlsplit(self.path)
+            fake.requests.append(("PATCH", self.path, dict(self.headers)))
+            body = self._read_body()
+            if not self._is_authorized():
+                return
+            match = _UPLOAD_PATH.match(url.path)
+            if not match or match["upload"] not in fake.uploads:
+                self._send(404, b"")
+                return
+
+            upload = fake.uploads[match["upload"]]
+            start = int(self.headers.get("Content-Range", "0-").split("-")[0])
+            if start != len(upload):
+                self._send(416, b"")
+                return
+            upload.extend(body)
+            location = f"{url.path}?_state={len(upload)}"
+            self._send(
+                202, b"", {"Location": location, "Range": f"0-{len(upload) - 1}"}
+            )
+
+        def do_PUT(self) -> None:
+            url = urllib.parse.urlsplit(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            fake.requests.append(("PUT", self.path, dict(self.headers)))
+            body = self._read_body()
+            if not self._is_authorized():
+                return
+
+            if match := _MANIFEST_PATH.match(url.path):
+                self._put_manifest(
+                    match["repository"],
+                    match["reference"],
+                    self.headers.get("Content-Type", ""),
+                    body,
+                )
+                return
+
+            match = _UPLOAD_PATH.match(url.path)
+            if not match or match["upload"] not in fake.uploads:
+                self._send(404, b"")
+                return
+            content = bytes(fake.uploads.pop(match["upload"]) + body)
+            digest = f"sha256:{hashlib.sha256(content).hexdigest()}"
+            if query.get("digest") != digest:
+                self._send(400, b'{"errors": [{"code": "DIGEST_INVALID"}]}')
+                return
+            fake.add_blob(content, repository=match["repository"])
+            self._send(
+                201, b"", {"Location": f"/v2/{match['repository']}/blobs/{digest}"}
+            )
+
+        def _put_manifest(
+            self, repository: str, reference: str, media_type: str, content: bytes
+        ) -> None:
+            manifest = json.loads(content)
+            known = fake.repositories.get(repository, set())
+            referenced = [d["digest"] for d in manifest.get("manifests", [])]
+            if "config" in manifest:
+                referenced += [manifest["config"]["digest"]]
+                referenced += [layer["digest"] for layer in manifest["layers"]]
+            if not set(referenced) <= known:
+                self._send(400, b'{"errors": [{"code": "MANIFEST_BLOB_UNKNOWN"}]}')
+                return
+
+            digest = f"sha256:{hashlib.sha256(content).hexdigest()}"
+            fake.manifests[repository, digest] = (media_type, content)
+            fake.manifests[repository, reference] = (media_type, content)
+            fake.repositories.setdefault(repository, set()).add(digest)
+            self._send(201, b"")
+
+        def _is_authorized(self) -> bool:
+            """Check the request's token, sending a challenge if it's wrong."""
+            if not fake.token or self.headers.get("Authorization") == (
+                f"Bearer {fake.token}"
+            ):
+                return True
+            realm = f"http://{fake.host}/token"
+            self._send(
+                401,
+                b"",
+                {"WWW-Authenticate": f'Bearer realm="{realm}",service="fake"'},
+            )
+            return False
+
+        def _read_body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        def _send_blob(self, digest: str) -> None:
+            content = fake.blobs[digest]
+            start = 0
+            range_header = self.headers.get("Range")
+            if range_header and fake.support_range:
+                start = int(range_header.removeprefix("bytes=").rstrip("-"))
+                if start >= len(content):
+                    self._send(416, b'{"errors": [{"code": "RANGE_INVALID"}]}')
+                    return
+            status = 206 if start else 200
+
+            fail_after = fake.fail_after.pop(digest, None)
+            if fail_after is None:
+                self._send(status, content[start:])
+                return
+
+            # Announce the whole blob, but drop the connection part way.
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(content) - start))
+            self.end_headers()
+            self.wfile.write(content[start : start + fail_after])
+            self.wfile.flush()
+            self.close_connection = True
+
+        def _send(
+            self, status: int, content: bytes, headers: dict[str, str] | None = None
+        ) -> None:
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    return Handler
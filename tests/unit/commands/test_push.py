@@ -0,0 +1,73 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import argparse
+from pathlib import Path
+
+import pytest
+from rockcraft import oci
+from rockcraft.commands import PushCommand
+
+from tests.testing import oci as testing_oci
+
+
+@pytest.fixture
+def mock_to_registry(mocker):
+    return mocker.patch.object(
+        oci.Image, "to_registry", autospec=True, return_value="sha256:1234"
+    )
+
+
+def test_push_oci_layout(emitter, fake_app_config, mock_to_registry, new_dir):
+    image = testing_oci.create_image(Path("images"), "my-rock:1.0")
+    command = PushCommand(fake_app_config)
+
+    command.run(
+        argparse.Namespace(
+            rock=Path("images/my-rock"),
+            destination="docker://localhost:5000/my-rock:1.0",
+            mount_from="ubuntu",
+        )
+    )
+
+    mock_to_registry.assert_called_once_with(
+        image,
+        "1.0",
+        "localhost:5000/my-rock:1.0",
+        mount_from="ubuntu",
+        credentials=None,
+    )
+    emitter.assert_message("Pushed my-rock to localhost:5000/my-rock:1.0 (sha256:1234)")
+
+
+def test_push_rock_credentials(fake_app_config, mock_to_registry, monkeypatch, new_dir):
+    monkeypatch.setenv("ROCKCRAFT_REGISTRY_USERNAME", "user")
+    monkeypatch.setenv("ROCKCRAFT_REGISTRY_PASSWORD", "secret")
+    image = testing_oci.create_image(Path("images"), "my-rock:1.0")
+    image.to_oci_archive("1.0", Path("my-rock_1.0_amd64.rock"))
+    command = PushCommand(fake_app_config)
+
+    command.run(
+        argparse.Namespace(
+            rock=Path("my-rock_1.0_amd64.rock"),
+            destination="localhost:5000/my-rock:1.0",
+            mount_from=None,
+        )
+    )
+
+    (pushed, tag, destination), kwargs = mock_to_registry.call_args
+    assert pushed.image_name == "my-rock_1:1.0"
+    assert (tag, destination) == ("1.0", "localhost:5000/my-rock:1.0")
+    assert kwargs == {"mount_from": None, "credentials": ("user", "secret")}
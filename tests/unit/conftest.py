@@ -101,3 +101,18 @@ def fake_provider(mock_instance):
             pass
 
     return FakeProvider()
+
+
+@pytest.fixture
+def fake_registry(monkeypatch):
+    """Provide a local stand-in of an OCI registry, and retry without delays."""
+    from rockcraft import registry
+
+    from tests.testing.registry import FakeRegistry
+
+    monkeypatch.setattr(registry, "_RETRY_DELAY", 0)
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1")
+    fake = FakeRegistry()
+    fake.start()
+    yield fake
+    fake.stop()
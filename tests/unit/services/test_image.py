@@ -14,9 +14,24 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import json
 from typing import cast
 
+import pytest
+from rockcraft import oci
+from rockcraft.architectures import SUPPORTED_ARCHS
+from rockcraft.cache import DEFAULT_BLOB_CACHE_MAX_SIZE
+from rockcraft.errors import BaseLockError
+from rockcraft.models.lock import Lock
+from rockcraft.rootfs import RootfsEntry, RootfsIndex
 from rockcraft.services import RockcraftImageService
+from rockcraft.services import image as image_service_module
+
+# Keep a reference to the real method, as the fake_services fixture mocks it.
+_create_image_info = RockcraftImageService._create_image_info
+
+_DIGEST = "sha256:" + "ab" * 32
 
 
 def test_image_service_cache(default_image_info, mocker, fake_services):
@@ -33,3 +48,284 @@ def test_image_service_cache(default_image_info, mocker, fake_services):
     assert info2 is default_image_info
 
     mock_create.assert_called_once_with()
+
+
+@pytest.mark.usefixtures("configured_project")
+def test_create_image_info_index(mocker, fake_services, in_project_path):
+    """The base rootfs is indexed once per base digest."""
+    image_service = cast(RockcraftImageService, fake_services.get("image"))
+    base_image = oci.Image("ubuntu:24.04", in_project_path / "images")
+    mock_fetch = mocker.patch.object(
+        oci.Image,
+        "from_sources",
+        return_value=(base_image, "docker://ubuntu:24.04"),
+    )
+    rootfs = in_project_path / "bundles/ubuntu-24.04/rootfs"
+
+    def fake_extract_to(_image, _bundle_dir, *, cache_key):
+        (rootfs / "etc").mkdir(parents=True, exist_ok=True)
+        (rootfs / "etc/passwd").write_text("root:x:0:0::/root:/bin/bash\n")
+        return rootfs
+
+    mock_extract = mocker.patch.object(
+        oci.Image, "extract_to", autospec=True, side_effect=fake_extract_to
+    )
+    mocker.patch.object(oci.Image, "manifest_digest", return_value=_DIGEST)
+    mocker.patch.object(oci.Image, "copy_to", return_value=base_image)
+    spy_build = mocker.spy(RootfsIndex, "build")
+
+    info = _create_image_info(image_service)
+    _create_image_info(image_service)
+
+    assert info.base_index is not None
+    assert info.base_index.is_file("etc/passwd")
+    assert (in_project_path / "bundles/ubuntu-24.04.index.json").is_file()
+    assert spy_build.call_count == 1
+    # The extracted base is keyed by architecture and manifest digest.
+    build_for = fake_services.get("build_plan").plan()[0].build_for
+    assert mock_extract.call_args.kwargs == {"cache_key": f"{build_for}@{_DIGEST}"}
+    # The digest comes from the local layout, and the second build uses the
+    # base pinned by the first one.
+    assert info.base_digest == bytes.fromhex("ab" * 32)
+    mock_fetch.assert_called_once()
+
+
+@pytest.mark.usefixtures("configured_project")
+def test_create_image_info_lazy(mocker, fake_services, in_project_path):
+    """Without overlays, the base is indexed from its layers instead of extracted."""
+    image_service = cast(RockcraftImageService, fake_services.get("image"))
+    base_image = oci.Image("ubuntu:24.04", in_project_path / "images")
+    mocker.patch.object(
+        oci.Image, "from_sources", return_value=(base_image, "docker://ubuntu:24.04")
+    )
+    mocker.patch.object(oci.Image, "manifest_digest", return_value=_DIGEST)
+    mocker.patch.object(oci.Image, "copy_to", return_value=base_image)
+    mocker.patch.object(oci.Image, "layer_archives", return_value=[])
+    mocker.patch("rockcraft.services.image.part_has_overlay", return_value=False)
+    rootfs = in_project_path / "bundles/ubuntu-24.04/rootfs"
+    index = RootfsIndex(
+        rootfs,
+        _DIGEST,
+        {
+            ".": RootfsEntry("dir", 0o40755, 0, 0, 0),
+            "etc": RootfsEntry("dir", 0o40755, 0, 0, 0),
+            "etc/passwd": RootfsEntry("file", 0o100644, 0, 0, 28),
+        },
+    )
+    mock_index = mocker.patch.object(
+        image_service_module.unpack, "index_layers", return_value=index
+    )
+    mock_extract = mocker.patch.object(oci.Image, "extract_to", autospec=True)
+
+    info = _create_image_info(image_service)
+
+    assert info.base_layer_dir == rootfs
+    assert info.base_index is index
+    mock_index.assert_called_once_with(
+        [],
+        rootfs,
+        "ab" * 32,
+        index_file=in_project_path / "bundles/ubuntu-24.04.index.json",
+    )
+    mock_extract.assert_not_called()
+
+    # The files are extracted once read.
+    index.file_path("etc/passwd")
+    build_for = fake_services.get("build_plan").plan()[0].build_for
+    mock_extract.assert_called_once_with(
+        base_image,
+        in_project_path / "bundles",
+        cache_key=f"{build_for}@{_DIGEST}",
+        include={"etc/passwd"},
+    )
+
+
+@pytest.mark.usefixtures("configured_project")
+def test_create_image_info_docker_digest(
+    mocker, monkeypatch, fake_services, fake_registry, in_project_path
+):
+    """Rocks record the registry digest of a base converted from a Docker manifest."""
+    image_service = cast(RockcraftImageService, fake_services.get("image"))
+    build_for = fake_services.get("build_plan").plan()[0].build_for
+    mapping = SUPPORTED_ARCHS[build_for]
+    manifests = fake_registry.add_image(
+        "ubuntu", "24.04", [(mapping.go_arch, mapping.go_variant)], docker=True
+    )
+    registry_digest = hashlib.sha256(
+        json.dumps(manifests[mapping.go_arch, mapping.go_variant]).encode()
+    ).hexdigest()
+    monkeypatch.setenv("ROCKCRAFT_BASE_SOURCES", f"docker://{fake_registry.host}")
+    mocker.patch("rockcraft.services.image.part_has_overlay", return_value=False)
+    mocker.patch.object(oci.Image, "layer_archives", return_value=[])
+    mocker.patch.object(image_service_module.unpack, "index_layers")
+    mocker.patch.object(oci.Image, "copy_to")
+
+    info = _create_image_info(image_service)
+
+    assert info.base_digest.hex() == registry_digest
+    project = fake_services.get("project").get()
+    annotations, metadata = project.generate_metadata(
+        "now", info.base_digest, build_for
+    )
+    assert annotations["org.opencontainers.image.base.digest"] == registry_digest
+    assert metadata["base-digest"] == registry_digest
+    # The local manifest, converted to OCI, has another digest.
+    local_image = oci.Image("ubuntu:24.04", in_project_path / "images")
+    assert local_image.manifest_digest() != f"sha256:{registry_digest}"
+
+
+@pytest.mark.parametrize(
+    ("max_size", "expected_max_size"),
+    [(None, DEFAULT_BLOB_CACHE_MAX_SIZE), ("1000", 1000), ("0", None)],
+)
+def test_get_blob_cache(
+    fake_services, monkeypatch, in_project_path, max_size, expected_max_size
+):
+    if max_size is not None:
+        monkeypatch.setenv("ROCKCRAFT_IMAGE_CACHE_MAX_SIZE", max_size)
+    fake_services.update_kwargs(
+        "image",
+        project_dir=in_project_path,
+        work_dir=in_project_path,
+        blob_cache_dir=in_project_path / "blobs",
+    )
+    image_service = cast(RockcraftImageService, fake_services.get("image"))
+
+    blob_cache = image_service._get_blob_cache()
+
+    if expected_max_size is None:
+        assert blob_cache is None
+    else:
+        assert blob_cache is not None
+        assert blob_cache.directory.parent == in_project_path / "blobs"
+        assert blob_cache.max_size == expected_max_size
+
+
+@pytest.fixture
+def image_service(fake_services, in_project_path):
+    return cast(RockcraftImageService, fake_services.get("image"))
+
+
+def test_obtain_base_image_pins_base(mocker, image_service, in_project_path):
+    base_image = oci.Image(
+        "ubuntu:24.04", in_project_path / "images", source_digest=_DIGEST
+    )
+    mock_fetch = mocker.patch.object(
+        oci.Image, "from_sources", return_value=(base_image, "")
+    )
+    # The lock pins the digest in the registry, not the one of the local manifest.
+    mocker.patch.object(
+        oci.Image, "manifest_digest", return_value="sha256:" + "cd" * 32
+    )
+
+    image = image_service._obtain_base_image(
+        "ubuntu@24.04", "amd64", in_project_path / "images"
+    )
+
+    assert image is base_image
+    mock_fetch.assert_called_once()
+    assert mock_fetch.call_args.kwargs["digest"] is None
+    lock = Lock.load(in_project_path)
+    assert lock.get_base_digest("ubuntu@24.04", "amd64") == _DIGEST
+
+
+@pytest.mark.parametrize("update_lock", [None, "1"])
+def test_obtain_base_image_existing_lock(
+    mocker, monkeypatch, image_service, in_project_path, update_lock
+):
+    """An existing lock file is only updated if enabled."""
+    if update_lock is not None:
+        monkeypatch.setenv("ROCKCRAFT_UPDATE_LOCK", update_lock)
+    lock = Lock(version=1)
+    lock.set_base_digest("ubuntu@24.04", "arm64", _DIGEST)
+    lock.save(in_project_path)
+    base_image = oci.Image(
+        "ubuntu:24.04", in_project_path / "images", source_digest=_DIGEST
+    )
+    mocker.patch.object(oci.Image, "from_sources", return_value=(base_image, ""))
+
+    image_service._obtain_base_image(
+        "ubuntu@24.04", "amd64", in_project_path / "images"
+    )
+
+    lock = Lock.load(in_project_path)
+    assert lock.get_base_digest("ubuntu@24.04", "arm64") == _DIGEST
+    if update_lock:
+        assert lock.get_base_digest("ubuntu@24.04", "amd64") == _DIGEST
+    else:
+        assert lock.get_base_digest("ubuntu@24.04", "amd64") is None
+
+
+def test_obtain_base_image_pinned_pull(mocker, image_service, in_project_path):
+    """A pinned base that isn't available locally is pulled by digest."""
+    lock = Lock(version=1)
+    lock.set_base_digest("ubuntu@24.04", "amd64", _DIGEST)
+    lock.save(in_project_path)
+    base_image = oci.Image(
+        "ubuntu:24.04", in_project_path / "images", source_digest=_DIGEST
+    )
+    mocker.patch.object(oci.Image, "from_local_blobs", return_value=None)
+    mock_fetch = mocker.patch.object(
+        oci.Image, "from_sources", return_value=(base_image, "")
+    )
+
+    image = image_service._obtain_base_image(
+        "ubuntu@24.04", "amd64", in_project_path / "images"
+    )
+
+    assert image is base_image
+    assert mock_fetch.call_args.kwargs["digest"] == _DIGEST
+
+
+def test_obtain_base_image_pinned_local(mocker, image_service, in_project_path):
+    lock = Lock(version=1)
+    lock.set_base_digest("ubuntu@24.04", "amd64", _DIGEST)
+    lock.save(in_project_path)
+    base_image = oci.Image("ubuntu:24.04", in_project_path / "images")
+    mocker.patch.object(oci.Image, "from_local_blobs", return_value=base_image)
+    mock_fetch = mocker.patch.object(oci.Image, "from_sources")
+
+    image = image_service._obtain_base_image(
+        "ubuntu@24.04", "amd64", in_project_path / "images"
+    )
+
+    assert image is base_image
+    mock_fetch.assert_not_called()
+
+
+def test_obtain_base_image_pinned_mismatch(mocker, image_service, in_project_path):
+    lock = Lock(version=1)
+    lock.set_base_digest("ubuntu@24.04", "amd64", _DIGEST)
+    lock.save(in_project_path)
+    base_image = oci.Image("ubuntu:24.04", in_project_path / "images")
+    mocker.patch.object(oci.Image, "from_local_blobs", return_value=None)
+    mocker.patch.object(oci.Image, "from_sources", return_value=(base_image, ""))
+    mocker.patch.object(
+        oci.Image, "manifest_digest", return_value="sha256:" + "cd" * 32
+    )
+
+    with pytest.raises(BaseLockError, match="but rockcraft.lock pins"):
+        image_service._obtain_base_image(
+            "ubuntu@24.04", "amd64", in_project_path / "images"
+        )
+
+
+@pytest.mark.parametrize(
+    ("base_sources", "expected"),
+    [
+        (None, ["docker://public.ecr.aws/ubuntu"]),
+        (
+            "oci:/srv/images, oci-archive:/srv/ubuntu.tar,docker://mirror/ubuntu",
+            [
+                "oci:/srv/images",
+                "oci-archive:/srv/ubuntu.tar",
+                "docker://mirror/ubuntu",
+            ],
+        ),
+    ],
+)
+def test_get_base_sources(image_service, monkeypatch, base_sources, expected):
+    if base_sources is not None:
+        monkeypatch.setenv("ROCKCRAFT_BASE_SOURCES", base_sources)
+
+    assert image_service._get_base_sources() == expected
@@ -34,9 +34,12 @@ from craft_parts import (
     StepInfo,
     callbacks,
 )
+from craft_parts.state_manager import MigrationState
 from craft_parts.state_manager.prime_state import PrimeState
+from rockcraft import timing
 from rockcraft.plugins.python_common import get_python_plugins
 from rockcraft.services import lifecycle as lifecycle_module
+from rockcraft.services.image import ImageInfo
 
 
 @pytest.fixture
@@ -205,10 +208,149 @@ def test_python_v2_shebang_fix(tmp_path, monkeypatch, source_file):
     assert step_info.state is not None
     step_info.state.files.update(files)
 
+    original = script.read_text()
     lifecycle_module._python_v2_shebang_fix(step_info)
 
     contents = script.read_text()
     assert contents.startswith("#!/usr/bin/python3\n")
+    assert contents.split("\n", 1)[1] == original.split("\n", 1)[1]
+    assert bin_file.read_bytes() == b"\x81"
+
+
+def test_python_v2_shebang_fix_large_files(tmp_path, monkeypatch):
+    """Only the shebang line is rewritten, and only in the given files."""
+    monkeypatch.setattr(lifecycle_module, "_SHEBANG_COPY_SIZE", 7)
+    step_info, prime_dir = _create_step_info(
+        tmp_path, "python", "ubuntu@25.10", "devel"
+    )
+    shebang = f"#!{step_info.part_install_dir}/usr/bin/python3 -s\n"
+    body = "".join(f"print({i})\n" for i in range(1000))
+    bin_dir = prime_dir / "usr/bin"
+    bin_dir.mkdir(parents=True)
+    for name in ["script", "other-script", "read-only"]:
+        (bin_dir / name).write_text(shebang + body)
+    (bin_dir / "read-only").write_text("#!/bin/sh\n")
+    (bin_dir / "read-only").chmod(0o444)
+    assert step_info.state is not None
+    step_info.state.files.update(
+        Path("usr/bin", name) for name in ["script", "other-script", "read-only"]
+    )
+
+    lifecycle_module._python_v2_shebang_fix(
+        step_info, {"usr/bin/script", "usr/bin/read-only"}
+    )
+
+    assert (bin_dir / "script").read_text() == "#!/usr/bin/python3 -s\n" + body
+    assert (bin_dir / "other-script").read_text() == shebang + body
+    assert (bin_dir / "read-only").read_text() == "#!/bin/sh\n"
+
+
+@pytest.mark.usefixtures("configured_project")
+def test_get_primed_paths(tmp_path, default_image_info, mocker, fake_services):
+    mocker.patch.object(
+        fake_services.get("image"), "obtain_image", return_value=default_image_info
+    )
+    mocker.patch.object(LifecycleManager, "__init__", return_value=None)
+    dirs = ProjectDirs(work_dir=tmp_path)
+    mocker.patch.object(
+        lifecycle_module.RockcraftLifecycleService,
+        "project_info",
+        new_callable=mock.PropertyMock,
+        return_value=mock.Mock(dirs=dirs),
+    )
+
+    for part_name, files, directories in [
+        ("p1", {Path("usr/bin/p1")}, {Path("usr"), Path("usr/bin")}),
+        ("p2", {Path("etc/p2.conf")}, {Path("etc")}),
+    ]:
+        state = PrimeState(files=files, directories=directories)
+        state_dir = dirs.parts_dir / part_name / "state"
+        state_dir.mkdir(parents=True)
+        state.write(state_dir / "prime")
+
+    lifecycle_service = cast(
+        lifecycle_module.RockcraftLifecycleService, fake_services.get("lifecycle")
+    )
+
+    assert lifecycle_service.get_primed_paths(["p1", "p3"]) == {
+        "usr",
+        "usr/bin",
+        "usr/bin/p1",
+    }
+    assert lifecycle_service.get_primed_paths(["p1", "p2"]) == {
+        "usr",
+        "usr/bin",
+        "usr/bin/p1",
+        "etc",
+        "etc/p2.conf",
+    }
+
+
+@pytest.mark.usefixtures("configured_project")
+def test_post_prime_incremental(tmp_path, mocker, fake_services):
+    """Only the files primed by the step that changed are processed."""
+    base_dir = tmp_path / "base"
+    (base_dir / "etc").mkdir(parents=True)
+    for name in ["base.txt", "overlay.txt"]:
+        (base_dir / "etc" / name).write_text("base")
+    mocker.patch.object(
+        fake_services.get("image"),
+        "obtain_image",
+        return_value=ImageInfo(
+            base_image=mocker.Mock(), base_layer_dir=base_dir, base_digest=b"\x01"
+        ),
+    )
+    mocker.patch.object(LifecycleManager, "__init__", return_value=None)
+    lifecycle_service = cast(
+        lifecycle_module.RockcraftLifecycleService, fake_services.get("lifecycle")
+    )
+    spy_prune = mocker.spy(lifecycle_module.layers, "prune_prime_files")
+
+    dirs = ProjectDirs(work_dir=tmp_path)
+    project_info = ProjectInfo(
+        project_dirs=dirs,
+        application_name="test",
+        cache_dir=tmp_path,
+        base="ubuntu@24.04",
+        build_base="ubuntu@24.04",
+        rootfs_dir=base_dir,
+    )
+    part = Part("p1", {"source": ".", "plugin": "nil"})
+    step_info = StepInfo(PartInfo(project_info=project_info, part=part), Step.PRIME)
+    step_info.state = PrimeState(
+        part_properties=part.spec.marshal(),
+        files={Path("etc/base.txt"), Path("etc/new.txt")},
+    )
+    (dirs.prime_dir / "etc").mkdir(parents=True)
+    for name in ["base.txt", "overlay.txt", "new.txt", "other-part.txt"]:
+        (dirs.prime_dir / "etc" / name).write_text("base")
+    # The overlay's files are not in the step's state.
+    dirs.overlay_dir.mkdir()
+    MigrationState(files={Path("etc/overlay.txt")}).write(
+        dirs.overlay_dir / "prime_overlay"
+    )
+    (base_dir / "etc/new.txt").write_text("not the same")
+
+    lifecycle_service.post_prime(step_info)
+
+    assert spy_prune.mock_calls[0].args[1] == {
+        "etc/base.txt",
+        "etc/new.txt",
+        "etc/overlay.txt",
+    }
+    assert sorted(p.name for p in (dirs.prime_dir / "etc").iterdir()) == [
+        "new.txt",
+        "other-part.txt",
+    ]
+
+    # Priming again only processes the files that changed.
+    lifecycle_service.post_prime(step_info)
+    assert spy_prune.mock_calls[1].args[1] == set()
+
+    (dirs.prime_dir / "etc/new.txt").write_text("changed")
+    (dirs.prime_dir / "etc/base.txt").write_text("base")
+    lifecycle_service.post_prime(step_info)
+    assert spy_prune.mock_calls[2].args[1] == {"etc/base.txt", "etc/new.txt"}
 
 
 @pytest.mark.usefixtures("configured_project", "project_keys")
@@ -254,3 +396,33 @@ def test_usrmerged_by_default(
     assert mock_lifecycle.called
     call = mock_lifecycle.mock_calls[0]
     assert call.kwargs["usrmerged_by_default"] == expected_default
+
+
+@pytest.mark.usefixtures("configured_project")
+def test_step_timing(tmp_path, default_image_info, mocker, fake_services):
+    mocker.patch.object(
+        fake_services.get("image"), "obtain_image", return_value=default_image_info
+    )
+    mocker.patch.object(LifecycleManager, "__init__", return_value=None)
+    fake_services.get("lifecycle")
+
+    project_info = ProjectInfo(
+        project_dirs=ProjectDirs(work_dir=tmp_path),
+        application_name="test",
+        cache_dir=tmp_path,
+    )
+    part = Part("p1", {"source": ".", "plugin": "nil"})
+    step_info = StepInfo(PartInfo(project_info=project_info, part=part), Step.BUILD)
+    tracer = timing.enable()
+    try:
+        callbacks.run_pre_step(step_info)
+        callbacks.run_post_step(step_info)
+    finally:
+        timing.disable()
+
+    assert len(tracer) == 1
+    event = tracer._events[-1]
+    assert event["name"] == "build p1"
+    assert event["cat"] == "lifecycle"
+    assert event["args"]["part"] == "p1"
+    assert event["args"]["step"] == "build"
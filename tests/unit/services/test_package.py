@@ -19,9 +19,15 @@ from typing import cast
 import pytest
 from craft_application import ServiceFactory
 from craft_platforms import DebianArchitecture
+from rockcraft.cache import LayerCache
+from rockcraft.compression import LayerCompression
 from rockcraft.models import Project
 from rockcraft.oci import Image
-from rockcraft.services import RockcraftImageService, package
+from rockcraft.services import (
+    RockcraftImageService,
+    RockcraftLifecycleService,
+    package,
+)
 
 
 @pytest.mark.usefixtures("fake_project_file", "project_keys")
@@ -47,7 +53,7 @@ def test_pack(fake_services: ServiceFactory, default_image_info, mocker):
     mock_inner_pack = mocker.patch.object(package, "_pack")
 
     fake_services.get("project").configure(platform="bob", build_for="s390x")
-    fake_services.get("package").pack(prime_dir=Path("prime"), dest=Path())
+    rocks = fake_services.get("package").pack(prime_dir=Path("prime"), dest=Path("out"))
 
     # Check that the image service was queried for the ImageInfo
     mock_obtain_image.assert_called_once_with()
@@ -59,10 +65,111 @@ def test_pack(fake_services: ServiceFactory, default_image_info, mocker):
         base_layer_dir=Path(),
         build_for="s390x",
         prime_dir=Path("prime"),
+        dest=Path("out"),
         project=fake_services.get("project").get(),
         project_base_image=default_image_info.base_image,
         rock_suffix="bob",
+        base_index=None,
+        compression=LayerCompression(),
+        part_layers=None,
+        layer_cache=None,
+        oci_layout=False,
+        coalesce_layers=False,
     )
+    assert rocks == [Path("out") / mock_inner_pack.return_value]
+
+
+@pytest.mark.usefixtures("fake_project_file", "project_keys")
+@pytest.mark.parametrize(
+    ("project_keys", "override", "expected"),
+    [
+        ({"compression": {"algorithm": "zstd"}}, None, LayerCompression("zstd")),
+        (
+            {"compression": {"algorithm": "zstd"}},
+            LayerCompression("gzip", 9),
+            LayerCompression("gzip", 9),
+        ),
+        ({}, LayerCompression("zstd", 19), LayerCompression("zstd", 19)),
+    ],
+)
+def test_pack_compression(
+    fake_services: ServiceFactory, default_image_info, mocker, override, expected
+):
+    image_service = cast(RockcraftImageService, fake_services.get("image"))
+    mocker.patch.object(image_service, "obtain_image", return_value=default_image_info)
+    mock_inner_pack = mocker.patch.object(package, "_pack")
+
+    package_service = cast(
+        package.RockcraftPackageService, fake_services.get("package")
+    )
+    if override:
+        package_service.set_layer_compression(override)
+
+    fake_services.get("project").configure(platform=None, build_for=None)
+    package_service.pack(prime_dir=Path("prime"), dest=Path())
+
+    assert mock_inner_pack.call_args.kwargs["compression"] == expected
+
+
+@pytest.mark.usefixtures("fake_project_file")
+def test_pack_layer_cache(
+    fake_services: ServiceFactory, default_image_info, mocker, tmp_path
+):
+    image_service = cast(RockcraftImageService, fake_services.get("image"))
+    mocker.patch.object(image_service, "obtain_image", return_value=default_image_info)
+    mock_inner_pack = mocker.patch.object(package, "_pack")
+
+    fake_services.update_kwargs("package", layer_cache_dir=tmp_path / "cache")
+    fake_services.get("project").configure(platform=None, build_for=None)
+    fake_services.get("package").pack(prime_dir=Path("prime"), dest=Path())
+
+    layer_cache = mock_inner_pack.call_args.kwargs["layer_cache"]
+    assert isinstance(layer_cache, LayerCache)
+    assert layer_cache.directory.parent == tmp_path / "cache"
+
+
+@pytest.mark.usefixtures("fake_project_file", "project_keys")
+@pytest.mark.parametrize(
+    "project_keys",
+    [
+        {
+            "parts": {
+                "deps": {"plugin": "nil"},
+                "app": {"plugin": "nil", "after": ["deps"]},
+                "extra": {"plugin": "nil"},
+            },
+            "layers": {"deps-layer": ["deps"], "app-layer": ["app", "extra"]},
+        }
+    ],
+)
+def test_pack_part_layers(fake_services: ServiceFactory, default_image_info, mocker):
+    image_service = cast(RockcraftImageService, fake_services.get("image"))
+    mocker.patch.object(image_service, "obtain_image", return_value=default_image_info)
+    mock_inner_pack = mocker.patch.object(package, "_pack")
+    mocker.patch.object(RockcraftLifecycleService, "setup")
+    primed_paths = {
+        "deps": {"lib", "lib/libdeps.so"},
+        "app": {"bin", "bin/app"},
+        "extra": {"etc", "etc/app.conf"},
+    }
+    mock_get_primed_paths = mocker.patch.object(
+        RockcraftLifecycleService,
+        "get_primed_paths",
+        side_effect=lambda names: set().union(*(primed_paths[n] for n in names)),
+    )
+
+    fake_services.get("project").configure(platform=None, build_for=None)
+    fake_services.get("package").pack(prime_dir=Path("prime"), dest=Path())
+
+    assert mock_get_primed_paths.mock_calls == [
+        mocker.call(["deps"]),
+        mocker.call(["app", "extra"]),
+    ]
+    part_layers = mock_inner_pack.call_args.kwargs["part_layers"]
+    assert list(part_layers.items()) == [
+        ("deps-layer", {"lib", "lib/libdeps.so"}),
+        ("app-layer", {"bin", "bin/app", "etc", "etc/app.conf"}),
+    ]
 
 
 @pytest.mark.usefixtures("fake_project_file", "project_keys")
@@ -172,6 +279,8 @@ def test_inner_pack(
     prime_dir = Path("prime")
     annotations = {"annotation": "foo"}
     metadata = {"metadata": "bar"}
+    compression = LayerCompression("zstd")
+    base_index = mocker.sentinel.base_index
 
     # Mock the resulting image and the functions called
     image = mocker.create_autospec(Image, instance=True)
@@ -191,11 +300,19 @@ def test_inner_pack(
         project=project,
         project_base_image=image,
         rock_suffix="test-rock",
+        base_index=base_index,
+        compression=compression,
     )
 
     # Assertions
     image.add_layer.assert_called_once_with(
-        tag=tag, new_layer_dir=prime_dir, base_layer_dir=base_layer_dir
+        tag=tag,
+        new_layer_dir=prime_dir,
+        base_layer_dir=base_layer_dir,
+        compression=compression,
+        base_index=base_index,
+        exclude=set(),
+        layer_cache=None,
     )
 
     image.add_user.assert_called_once_with(
@@ -204,11 +321,9 @@ def test_inner_pack(
         tag=tag,
         username=project.run_user,
         uid=584792,
+        compression=compression,
+        base_index=base_index,
     )
-    image.set_default_user.assert_called_once_with(584792, project.run_user)
-    image.set_entrypoint.assert_called_once_with(expected_entrypoint)
-    image.set_cmd.assert_called_once_with(expected_cmd)
-    image.set_default_path.assert_called_once_with(project.base)
     image.set_pebble_layer.assert_called_once_with(
         services=project.marshal().get("services", {}),
         checks=project.marshal().get("checks", {}),
@@ -217,11 +332,195 @@ def test_inner_pack(
         summary=project.summary,
         description=project.description,
         base_layer_dir=base_layer_dir,
+        compression=compression,
+        base_index=base_index,
     )
-    image.set_environment.assert_called_once_with(project.environment)
-    image.set_annotations.assert_called_once_with(annotations)
-    image.set_control_data.assert_called_once_with(metadata)
-    image.set_media_type.assert_called_once_with(arch="amd64")
+    image.set_control_data.assert_called_once_with(metadata, compression=compression)
+
+    # The image config is changed in a single transaction
+    image.configure.assert_called_once_with()
+    config = image.configure.return_value.__enter__.return_value
+    config.set_default_user.assert_called_once_with(584792, project.run_user)
+    config.set_entrypoint.assert_called_once_with(expected_entrypoint)
+    config.set_cmd.assert_called_once_with(expected_cmd)
+    config.set_default_path.assert_called_once_with(project.base)
+    config.set_environment.assert_called_once_with(project.environment)
+    config.set_annotations.assert_called_once_with(annotations)
+    config.set_media_type.assert_called_once_with(arch="amd64")
     image.to_oci_archive.assert_called_once_with(
         tag=project.version, filename=f"{project.name}_{project.version}_test-rock.rock"
     )
+
+
+@pytest.mark.usefixtures("fake_project_file")
+def test_inner_pack_part_layers(fake_services: ServiceFactory, mocker):
+    fake_services.get("project").configure(platform=None, build_for=None)
+    project = cast(Project, fake_services.get("project").get())
+    tag = cast(str, project.version)
+    prime_dir = Path("prime")
+
+    image = mocker.create_autospec(Image, instance=True)
+    image.add_layer.return_value = image
+    mocker.patch.object(Project, "generate_metadata", return_value=({}, {}))
+
+    package._pack(
+        base_digest=b"deadbeef",
+        base_layer_dir=Path(),
+        build_for="amd64",
+        prime_dir=prime_dir,
+        project=project,
+        project_base_image=image,
+        rock_suffix="test-rock",
+        part_layers={"deps": {"lib", "lib/libdeps.so"}, "app": {"bin", "bin/app"}},
+    )
+
+    # One layer per group of parts, in order, and then the rest of the prime dir.
+    common = {
+        "tag": tag,
+        "new_layer_dir": prime_dir,
+        "base_layer_dir": Path(),
+        "compression": None,
+        "base_index": None,
+        "layer_cache": None,
+    }
+    assert image.add_layer.mock_calls == [
+        mocker.call(
+            comment="Layer 'deps'", include={"lib", "lib/libdeps.so"}, **common
+        ),
+        mocker.call(comment="Layer 'app'", include={"bin", "bin/app"}, **common),
+        mocker.call(exclude={"lib", "lib/libdeps.so", "bin", "bin/app"}, **common),
+    ]
+
+
+@pytest.mark.usefixtures("fake_project_file")
+def test_inner_pack_oci_layout(fake_services: ServiceFactory, mocker):
+    fake_services.get("project").configure(platform=None, build_for=None)
+    project = cast(Project, fake_services.get("project").get())
+
+    image = mocker.create_autospec(Image, instance=True)
+    image.add_layer.return_value = image
+    mocker.patch.object(Project, "generate_metadata", return_value=({}, {}))
+
+    name = package._pack(
+        base_digest=b"deadbeef",
+        base_layer_dir=Path(),
+        build_for="amd64",
+        prime_dir=Path("prime"),
+        project=project,
+        project_base_image=image,
+        rock_suffix="test-rock",
+        oci_layout=True,
+    )
+
+    assert name == f"{project.name}_{project.version}_test-rock"
+    image.to_oci_layout.assert_called_once_with(tag=project.version, dirname=name)
+    image.to_oci_archive.assert_not_called()
+
+
+@pytest.mark.usefixtures("fake_project_file")
+@pytest.mark.parametrize("oci_layout", [False, True])
+def test_inner_pack_dest(fake_services: ServiceFactory, mocker, new_dir, oci_layout):
+    """The rock is written to the destination directory, not the current one."""
+    fake_services.get("project").configure(platform=None, build_for=None)
+    project = cast(Project, fake_services.get("project").get())
+
+    image = mocker.create_autospec(Image, instance=True)
+    image.add_layer.return_value = image
+    mocker.patch.object(Project, "generate_metadata", return_value=({}, {}))
+    dest = Path("out/rocks")
+
+    name = package._pack(
+        base_digest=b"deadbeef",
+        base_layer_dir=Path(),
+        build_for="amd64",
+        prime_dir=Path("prime"),
+        dest=dest,
+        project=project,
+        project_base_image=image,
+        rock_suffix="test-rock",
+        oci_layout=oci_layout,
+    )
+
+    assert dest.is_dir()
+    if oci_layout:
+        image.to_oci_layout.assert_called_once_with(
+            tag=project.version, dirname=str(dest / name)
+        )
+    else:
+        image.to_oci_archive.assert_called_once_with(
+            tag=project.version, filename=str(dest / name)
+        )
+
+
+@pytest.mark.usefixtures("fake_project_file", "project_keys")
+@pytest.mark.parametrize(
+    "project_keys",
+    [
+        {
+            "run_user": "_daemon_",
+            "services": {"test": {"override": "replace", "command": "echo foo"}},
+        }
+    ],
+)
+def test_inner_pack_coalesce_layers(fake_services: ServiceFactory, mocker):
+    fake_services.get("project").configure(platform=None, build_for=None)
+    project = cast(Project, fake_services.get("project").get())
+    compression = LayerCompression("zstd")
+    base_index = mocker.sentinel.base_index
+    metadata = {"metadata": "bar"}
+
+    image = mocker.create_autospec(Image, instance=True)
+    image.add_layer.return_value = image
+    mocker.patch.object(Project, "generate_metadata", return_value=({}, metadata))
+
+    package._pack(
+        base_digest=b"deadbeef",
+        base_layer_dir=Path(),
+        build_for="amd64",
+        prime_dir=Path("prime"),
+        project=project,
+        project_base_image=image,
+        rock_suffix="test-rock",
+        base_index=base_index,
+        compression=compression,
+        coalesce_layers=True,
+    )
+
+    image.add_generated_layer.assert_called_once_with(
+        project.version,
+        Path("prime"),
+        Path(),
+        metadata=metadata,
+        rock_name=project.name,
+        user=("_daemon_", 584792),
+        pebble_layer={
+            "summary": project.summary,
+            "description": project.description,
+            "services": project.marshal()["services"],
+        },
+        compression=compression,
+        base_index=base_index,
+    )
+    image.add_user.assert_not_called()
+    image.set_pebble_layer.assert_not_called()
+    image.set_control_data.assert_not_called()
+
+
+@pytest.mark.usefixtures("configured_project")
+def test_pack_multi_arch(fake_services, mocker, tmp_path):
+    package_service = cast(
+        package.RockcraftPackageService, fake_services.get("package")
+    )
+    project = cast(Project, fake_services.get("project").get())
+    build_plan = fake_services.get("build_plan").plan()
+    mock_merge = mocker.patch.object(package.oci, "merge_oci_archives")
+
+    rock = package_service.pack_multi_arch(tmp_path)
+
+    prefix = f"{project.name}_{project.version}"
+    assert rock == tmp_path / f"{prefix}.rock"
+    mock_merge.assert_called_once_with(
+        [tmp_path / f"{prefix}_{build.platform}.rock" for build in build_plan],
+        rock,
+        tag=project.version,
+    )
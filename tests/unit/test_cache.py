@@ -0,0 +1,112 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+
+import pytest
+from rockcraft.cache import BlobCache, LayerCache
+
+
+def _write_blob(tmp_path, name: str, size: int):
+    blob = tmp_path / name
+    blob.write_bytes(b"x" * size)
+    return blob
+
+
+def test_layer_cache_get_put(tmp_path):
+    layer_cache = LayerCache(tmp_path / "cache")
+    blob = _write_blob(tmp_path, "blob", 10)
+
+    assert layer_cache.get("key") is None
+
+    layer_cache.put("key", blob, {"digest": "sha256:abc"})
+
+    cached = layer_cache.get("key")
+    assert cached is not None
+    assert cached.path.read_bytes() == blob.read_bytes()
+    assert cached.metadata == {"digest": "sha256:abc"}
+    assert layer_cache.get("other-key") is None
+
+
+def test_layer_cache_incomplete_entry(tmp_path):
+    layer_cache = LayerCache(tmp_path / "cache")
+    layer_cache.put("key", _write_blob(tmp_path, "blob", 10), {})
+
+    (layer_cache.directory / "key" / "blob").unlink()
+
+    assert layer_cache.get("key") is None
+
+
+def test_layer_cache_evict_lru(tmp_path):
+    layer_cache = LayerCache(tmp_path / "cache", max_size=25)
+    layer_cache.put("first", _write_blob(tmp_path, "first", 10), {})
+    layer_cache.put("second", _write_blob(tmp_path, "second", 10), {})
+    # Make "second" the least recently used entry.
+    os.utime(layer_cache.directory / "second" / "metadata.json", (0, 0))
+
+    layer_cache.put("third", _write_blob(tmp_path, "third", 10), {})
+
+    assert layer_cache.get("first") is not None
+    assert layer_cache.get("second") is None
+    assert layer_cache.get("third") is not None
+
+
+def test_layer_cache_too_large(tmp_path):
+    layer_cache = LayerCache(tmp_path / "cache", max_size=5)
+
+    layer_cache.put("key", _write_blob(tmp_path, "blob", 10), {})
+
+    assert layer_cache.get("key") is None
+
+
+def test_blob_cache_link_to(tmp_path):
+    blob_cache = BlobCache(tmp_path / "cache")
+    cached = blob_cache.get_path("sha256:abc")
+    cached.parent.mkdir(parents=True)
+    cached.write_bytes(b"content")
+    os.utime(cached, (0, 0))
+
+    blob_cache.link_to(["sha256:abc"], tmp_path / "layout/blobs")
+
+    linked = tmp_path / "layout/blobs/sha256/abc"
+    assert linked.read_bytes() == b"content"
+    assert linked.stat().st_ino == cached.stat().st_ino
+    # Linking a blob marks it as recently used.
+    assert cached.stat().st_mtime > 0
+
+
+def test_blob_cache_evict_lru(tmp_path):
+    blob_cache = BlobCache(tmp_path / "cache", max_size=25)
+    for used, digest in enumerate(["sha256:first", "sha256:second", "sha256:third"]):
+        blob = blob_cache.get_path(digest)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        blob.write_bytes(b"x" * 10)
+        os.utime(blob, (used, used))
+    # A staging layout of a copy in progress is never touched.
+    (blob_cache.directory / ".layout-123").mkdir()
+
+    blob_cache.evict(keep=["sha256:first"])
+
+    assert blob_cache.get_path("sha256:first").exists()
+    assert not blob_cache.get_path("sha256:second").exists()
+    assert blob_cache.get_path("sha256:third").exists()
+    assert (blob_cache.directory / ".layout-123").is_dir()
+
+
+def test_blob_cache_invalid_digest(tmp_path):
+    blob_cache = BlobCache(tmp_path / "cache")
+
+    with pytest.raises(ValueError, match="Invalid blob digest"):
+        blob_cache.get_path("sha256:../../etc/passwd")
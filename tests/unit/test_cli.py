@@ -13,6 +13,7 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
 import pathlib
 import sys
 import textwrap
@@ -26,6 +27,7 @@ from craft_application.services import StateService
 from craft_cli import emit
 from rockcraft import cli, extensions, services
 from rockcraft.application import APP_METADATA, Rockcraft
+from rockcraft.compression import LayerCompression
 from rockcraft.models import project
 
 DATA_DIR = pathlib.Path(__file__).parent.parent / "data"
@@ -80,6 +82,178 @@ def test_run_pack_services(mocker, monkeypatch, tmp_path):
     assert log_path.is_file()
 
 
+@pytest.mark.skip_overlay_enable
+@pytest.mark.usefixtures("fake_project_file")
+def test_run_pack_compression(mocker, monkeypatch, tmp_path):
+    monkeypatch.setenv("CRAFT_MANAGED_MODE", "1")
+    mocker.patch.object(Rockcraft, "log_path", new=tmp_path / "rockcraft.log")
+    state_dir = tmp_path / "craft-state"
+    state_dir.mkdir()
+    mocker.patch.object(StateService, "_get_state_dir", return_value=state_dir)
+    mocker.patch.multiple(
+        services.RockcraftLifecycleService,
+        setup=DEFAULT,
+        prime_dir=Path("/fake/prime/dir"),
+        run=DEFAULT,
+        project_info=DEFAULT,
+    )
+    package_mocks = mocker.patch.multiple(
+        services.RockcraftPackageService,
+        write_metadata=DEFAULT,
+        pack=DEFAULT,
+        set_layer_compression=DEFAULT,
+    )
+    package_mocks["pack"].return_value = [tmp_path / "project/my-rock.rock"]
+    mocker.patch.object(sys, "argv", ["rockcraft", "pack", "--compression", "zstd:19"])
+
+    cli.run()
+
+    package_mocks["set_layer_compression"].assert_called_once_with(
+        LayerCompression("zstd", 19)
+    )
+    package_mocks["pack"].assert_called_once()
+
+
+@pytest.mark.skip_overlay_enable
+@pytest.mark.usefixtures("fake_project_file")
+def test_run_pack_oci_layout(mocker, monkeypatch, tmp_path):
+    monkeypatch.setenv("CRAFT_MANAGED_MODE", "1")
+    mocker.patch.object(Rockcraft, "log_path", new=tmp_path / "rockcraft.log")
+    state_dir = tmp_path / "craft-state"
+    state_dir.mkdir()
+    mocker.patch.object(StateService, "_get_state_dir", return_value=state_dir)
+    mocker.patch.multiple(
+        services.RockcraftLifecycleService,
+        setup=DEFAULT,
+        prime_dir=Path("/fake/prime/dir"),
+        run=DEFAULT,
+        project_info=DEFAULT,
+    )
+    package_mocks = mocker.patch.multiple(
+        services.RockcraftPackageService,
+        write_metadata=DEFAULT,
+        pack=DEFAULT,
+        enable_oci_layout=DEFAULT,
+    )
+    package_mocks["pack"].return_value = [tmp_path / "project/my-rock"]
+    mocker.patch.object(sys, "argv", ["rockcraft", "pack", "--oci-layout"])
+
+    cli.run()
+
+    package_mocks["enable_oci_layout"].assert_called_once_with()
+    package_mocks["pack"].assert_called_once()
+
+
+@pytest.mark.skip_overlay_enable
+@pytest.mark.usefixtures("fake_project_file")
+def test_run_pack_coalesce_layers(mocker, monkeypatch, tmp_path):
+    monkeypatch.setenv("CRAFT_MANAGED_MODE", "1")
+    mocker.patch.object(Rockcraft, "log_path", new=tmp_path / "rockcraft.log")
+    state_dir = tmp_path / "craft-state"
+    state_dir.mkdir()
+    mocker.patch.object(StateService, "_get_state_dir", return_value=state_dir)
+    mocker.patch.multiple(
+        services.RockcraftLifecycleService,
+        setup=DEFAULT,
+        prime_dir=Path("/fake/prime/dir"),
+        run=DEFAULT,
+        project_info=DEFAULT,
+    )
+    package_mocks = mocker.patch.multiple(
+        services.RockcraftPackageService,
+        write_metadata=DEFAULT,
+        pack=DEFAULT,
+        enable_layer_coalescing=DEFAULT,
+    )
+    package_mocks["pack"].return_value = [tmp_path / "project/my-rock.rock"]
+    mocker.patch.object(sys, "argv", ["rockcraft", "pack", "--coalesce-layers"])
+
+    cli.run()
+
+    package_mocks["enable_layer_coalescing"].assert_called_once_with()
+    package_mocks["pack"].assert_called_once()
+
+
+@pytest.mark.skip_overlay_enable
+@pytest.mark.usefixtures("fake_project_file")
+def test_run_pack_timings(mocker, monkeypatch, tmp_path):
+    monkeypatch.setenv("CRAFT_MANAGED_MODE", "1")
+    mocker.patch.object(Rockcraft, "log_path", new=tmp_path / "rockcraft.log")
+    state_dir = tmp_path / "craft-state"
+    state_dir.mkdir()
+    mocker.patch.object(StateService, "_get_state_dir", return_value=state_dir)
+    mocker.patch.multiple(
+        services.RockcraftLifecycleService,
+        setup=DEFAULT,
+        prime_dir=Path("/fake/prime/dir"),
+        run=DEFAULT,
+        project_info=DEFAULT,
+    )
+    package_mocks = mocker.patch.multiple(
+        services.RockcraftPackageService,
+        write_metadata=DEFAULT,
+        pack=DEFAULT,
+    )
+    package_mocks["pack"].return_value = [tmp_path / "project/my-rock.rock"]
+    trace_file = tmp_path / "trace.json"
+    mocker.patch.object(
+        sys, "argv", ["rockcraft", "pack", "--timings", str(trace_file)]
+    )
+
+    cli.run()
+
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    assert [event["name"] for event in events if event["ph"] == "X"] == ["pack"]
+
+
+@pytest.mark.skip_overlay_enable
+@pytest.mark.usefixtures("fake_project_file")
+@pytest.mark.parametrize("managed", [True, False])
+@pytest.mark.parametrize(
+    ("output_args", "output"),
+    [([], Path()), (["--output", "out/rocks"], Path("out/rocks"))],
+)
+def test_run_pack_multi_arch(
+    mocker, monkeypatch, tmp_path, managed, output_args, output
+):
+    if managed:
+        monkeypatch.setenv("CRAFT_MANAGED_MODE", "1")
+    mocker.patch.object(Rockcraft, "log_path", new=tmp_path / "rockcraft.log")
+    state_dir = tmp_path / "craft-state"
+    state_dir.mkdir()
+    mocker.patch.object(StateService, "_get_state_dir", return_value=state_dir)
+    mocker.patch.multiple(
+        services.RockcraftLifecycleService,
+        setup=DEFAULT,
+        prime_dir=Path("/fake/prime/dir"),
+        run=DEFAULT,
+        project_info=DEFAULT,
+    )
+    package_mocks = mocker.patch.multiple(
+        services.RockcraftPackageService,
+        write_metadata=DEFAULT,
+        pack=DEFAULT,
+        pack_multi_arch=DEFAULT,
+    )
+    package_mocks["pack"].return_value = [tmp_path / "project/my-rock.rock"]
+    package_mocks["pack_multi_arch"].return_value = tmp_path / "project/my-rock.rock"
+    mocker.patch.object(
+        sys,
+        "argv",
+        ["rockcraft", "pack", "--multi-arch", "--destructive-mode", *output_args],
+    )
+
+    cli.run()
+
+    # The rocks are packed to, and combined from, the output directory.
+    assert package_mocks["pack"].call_args.args[1] == output
+    # Only the process that packs every platform combines the rocks.
+    if managed:
+        package_mocks["pack_multi_arch"].assert_not_called()
+    else:
+        package_mocks["pack_multi_arch"].assert_called_once_with(output)
+
+
 @pytest.fixture
 def valid_dir(new_dir, monkeypatch):
     valid = pathlib.Path(new_dir) / "valid"
@@ -0,0 +1,131 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import gzip
+import io
+import os
+
+import pytest
+import zstandard
+from rockcraft.compression import LayerCompression, ParallelGzipWriter
+
+
+@pytest.fixture
+def payload() -> bytes:
+    """Some partially compressible data, spanning several gzip blocks."""
+    text = b"".join(b"line %d: foo bar baz\n" % i for i in range(100_000))
+    return text + os.urandom(300_000) + text
+
+
+def _compress(compression: LayerCompression, data: bytes, threads: int) -> bytes:
+    output = io.BytesIO()
+    with compression.open_writer(output, threads=threads) as writer:
+        # Write in uneven chunks to exercise the block splitting.
+        for offset in range(0, len(data), 100_003):
+            writer.write(data[offset : offset + 100_003])
+    return output.getvalue()
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        ("gzip", LayerCompression("gzip")),
+        ("gzip:1", LayerCompression("gzip", 1)),
+        ("zstd", LayerCompression("zstd")),
+        ("zstd:19", LayerCompression("zstd", 19)),
+    ],
+)
+def test_from_string(value, expected):
+    assert LayerCompression.from_string(value) == expected
+
+
+@pytest.mark.parametrize(
+    ("value", "message"),
+    [
+        ("bzip2", "unknown compression algorithm 'bzip2'"),
+        ("gzip:10", "gzip compression level must be between 1 and 9, got 10"),
+        ("zstd:0", "zstd compression level must be between 1 and 22, got 0"),
+        ("zstd:max", "invalid compression level 'max'"),
+    ],
+)
+def test_from_string_error(value, message):
+    with pytest.raises(ValueError, match=message):
+        LayerCompression.from_string(value)
+
+
+def test_defaults():
+    assert str(LayerCompression()) == "gzip:6"
+    assert str(LayerCompression("zstd")) == "zstd:3"
+    assert (
+        LayerCompression().media_type == "application/vnd.oci.image.layer.v1.tar+gzip"
+    )
+    assert (
+        LayerCompression("zstd").media_type
+        == "application/vnd.oci.image.layer.v1.tar+zstd"
+    )
+
+
+@pytest.mark.parametrize("level", [1, 6, 9])
+def test_gzip_roundtrip(payload, level):
+    compressed = _compress(LayerCompression("gzip", level), payload, threads=4)
+
+    assert gzip.decompress(compressed) == payload
+
+
+def test_gzip_empty():
+    compressed = _compress(LayerCompression("gzip"), b"", threads=2)
+
+    assert gzip.decompress(compressed) == b""
+
+
+@pytest.mark.parametrize("algorithm", ["gzip", "zstd"])
+def test_output_independent_of_threads(payload, algorithm):
+    """The same input always produces the same blob (and so the same digest)."""
+    compression = LayerCompression(algorithm)
+
+    outputs = {_compress(compression, payload, threads=n) for n in (1, 2, 4)}
+
+    assert len(outputs) == 1
+
+
+def test_zstd_roundtrip(payload):
+    compressed = _compress(LayerCompression("zstd", 19), payload, threads=2)
+
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    assert decompressor.decompress(compressed) == payload
+
+
+def test_parallel_gzip_writer_closed():
+    writer = ParallelGzipWriter(io.BytesIO(), level=6, threads=1)
+    writer.close()
+
+    with pytest.raises(ValueError, match="write to closed file"):
+        writer.write(b"foo")
+
+
+def test_parallel_gzip_writer_error():
+    """Pending blocks are discarded if the writer exits with an error."""
+    writer = ParallelGzipWriter(io.BytesIO(), level=6, threads=2, block_size=16)
+
+    def _fail() -> None:
+        with writer:
+            writer.write(b"x" * 1024)
+            raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        _fail()
+
+    with pytest.raises(ValueError, match="write to closed file"):
+        writer.write(b"foo")
@@ -23,6 +23,7 @@ from pathlib import Path
 import pytest
 from craft_parts.overlays import overlays
 from rockcraft import errors, layers
+from rockcraft.rootfs import RootfsIndex
 
 
 def get_tar_contents(tar_path: Path) -> list[str]:
@@ -111,6 +112,205 @@ def test_archive_layer_symlinks(tmp_path):
     assert temp_tar_contents == expected_tar_contents
 
 
+def test_collect_layer_paths_deep_tree(tmp_path):
+    """The streamed walk of a large tree has the same output as a sorted walk."""
+    layer_dir = tmp_path / "layer_dir"
+    for i in range(20):
+        subdir = layer_dir / f"dir{i % 4}" / f"sub{i}" / "deeper"
+        subdir.mkdir(parents=True)
+        (subdir / "file.txt").touch()
+        (subdir.parent / f"link{i}").symlink_to("deeper")
+        (subdir.parent / f"dangling{i}").symlink_to("nowhere")
+    # Names that sort between a directory and its contents.
+    (layer_dir / "dir0-x").touch()
+    (layer_dir / "dir0.d").mkdir()
+
+    expected: list[tuple[str, Path]] = []
+    for dirpath, subdirs, filenames in os.walk(layer_dir):
+        for name in [*subdirs, *filenames]:
+            path = Path(dirpath, name)
+            expected.append((str(path.relative_to(layer_dir)), path))
+
+    assert list(layers.collect_layer_paths(layer_dir)) == sorted(expected)
+
+
+def test_collect_layer_paths_is_lazy(tmp_path):
+    """Entries are yielded before the rest of the tree is scanned."""
+    layer_dir = tmp_path / "layer_dir"
+    (layer_dir / "a").mkdir(parents=True)
+    (layer_dir / "b" / "c").mkdir(parents=True)
+
+    paths = iter(layers.collect_layer_paths(layer_dir))
+    assert next(paths) == ("a", layer_dir / "a")
+    (layer_dir / "b" / "c" / "late.txt").touch()
+
+    assert [name for name, _ in paths] == ["b", "b/c", "b/c/late.txt"]
+
+
+def test_archive_layer_include_exclude(tmp_path):
+    """Partial layers only contain the selected paths and their parents."""
+    layer_dir = tmp_path / "layer_dir"
+    (layer_dir / "usr/lib/deps").mkdir(parents=True)
+    (layer_dir / "usr/lib/deps/libdeps.so").write_text("deps")
+    (layer_dir / "usr/bin").mkdir(parents=True)
+    (layer_dir / "usr/bin/app").write_text("app")
+    (layer_dir / "etc").mkdir()
+    (layer_dir / "etc/app.conf").write_text("conf")
+
+    # Like in a part's prime state, the directories are also listed.
+    deps_paths = {"usr", "usr/lib", "usr/lib/deps", "usr/lib/deps/libdeps.so"}
+    deps_tar = tmp_path / "deps.tar"
+    layers.archive_layer(layer_dir, deps_tar, include=deps_paths - {"usr/lib"})
+    assert get_tar_contents(deps_tar) == [
+        "usr",
+        "usr/lib",
+        "usr/lib/deps",
+        "usr/lib/deps/libdeps.so",
+    ]
+
+    # Excluded directories are still added if they are needed as parents.
+    rest_tar = tmp_path / "rest.tar"
+    layers.archive_layer(layer_dir, rest_tar, exclude=deps_paths)
+    assert get_tar_contents(rest_tar) == [
+        "etc",
+        "etc/app.conf",
+        "usr",
+        "usr/bin",
+        "usr/bin/app",
+    ]
+
+
+def test_archive_layer_include_reproducible(tmp_path):
+    """Partial layers don't change when other paths are added to their directories."""
+    layer_dir = tmp_path / "layer_dir"
+    (layer_dir / "usr/lib").mkdir(parents=True)
+    (layer_dir / "usr/lib/libdeps.so").write_text("deps")
+    os.utime(layer_dir / "usr/lib/libdeps.so", (1000, 1000))
+    include = {"usr/lib/libdeps.so"}
+
+    first_tar = tmp_path / "first.tar"
+    layers.archive_layer(layer_dir, first_tar, include=include)
+
+    (layer_dir / "usr/lib/libapp.so").write_text("app")
+    second_tar = tmp_path / "second.tar"
+    layers.archive_layer(layer_dir, second_tar, include=include)
+
+    assert first_tar.read_bytes() == second_tar.read_bytes()
+    with tarfile.open(first_tar) as tar_file:
+        assert [member.mtime for member in tar_file.getmembers()] == [1000] * 3
+
+
+def test_fingerprint_layer(tmp_path):
+    layer_dir = tmp_path / "layer_dir"
+    (layer_dir / "usr/bin").mkdir(parents=True)
+    (layer_dir / "usr/bin/app").write_text("app")
+    (layer_dir / "usr/bin/link").symlink_to("app")
+
+    def fingerprint() -> str:
+        return layers.fingerprint_layer(layers.collect_layer_paths(layer_dir))
+
+    original = fingerprint()
+    assert fingerprint() == original
+
+    # Timestamps are ignored.
+    os.utime(layer_dir / "usr/bin/app", (0, 0))
+    assert fingerprint() == original
+
+    # Contents, modes and symlink targets are not.
+    (layer_dir / "usr/bin/app").write_text("new")
+    changed_contents = fingerprint()
+    assert changed_contents != original
+
+    (layer_dir / "usr/bin/app").chmod(0o700)
+    changed_mode = fingerprint()
+    assert changed_mode not in (original, changed_contents)
+
+    (layer_dir / "usr/bin/link").unlink()
+    (layer_dir / "usr/bin/link").symlink_to("other")
+    assert fingerprint() not in (original, changed_contents, changed_mode)
+
+
+def test_fingerprint_layer_base_symlinks(tmp_path):
+    """The fingerprint depends on how the base layer's symlinks map the paths."""
+    layer_dir, rootfs_dir = duplicate_dirs_setup(tmp_path)
+
+    without_base = layers.fingerprint_layer(layers.collect_layer_paths(layer_dir))
+    with_base = layers.fingerprint_layer(
+        layers.collect_layer_paths(layer_dir, rootfs_dir)
+    )
+
+    assert without_base != with_base
+
+
+def test_fingerprint_layer_hardlinks(tmp_path):
+    layer_dir = tmp_path / "layer_dir"
+    layer_dir.mkdir()
+    (layer_dir / "a").write_text("content")
+    (layer_dir / "b").write_text("content")
+
+    def fingerprint() -> str:
+        return layers.fingerprint_layer(layers.collect_layer_paths(layer_dir))
+
+    copies = fingerprint()
+    (layer_dir / "b").unlink()
+    (layer_dir / "b").hardlink_to(layer_dir / "a")
+
+    assert fingerprint() != copies
+
+
+def test_archive_layer_hardlinks(tmp_path):
+    """Regression test: hard links in a layer are archived as link entries.
+
+    tarfile already does so, as the layer is written by a single TarFile.
+    """
+    layer_dir = tmp_path / "layer_dir"
+    (layer_dir / "lib").mkdir(parents=True)
+    (layer_dir / "lib/libfoo.so.1").write_bytes(b"\x7fELF" * 1024)
+    (layer_dir / "bin").mkdir()
+    (layer_dir / "bin/foo").hardlink_to(layer_dir / "lib/libfoo.so.1")
+    (layer_dir / "lib/libfoo.so").hardlink_to(layer_dir / "lib/libfoo.so.1")
+    tar_path = tmp_path / "layer.tar"
+
+    layers.archive_layer(layer_dir, tar_path)
+
+    # The contents are stored once, in the first entry of the inode.
+    with tarfile.open(tar_path) as tar_file:
+        members = {m.name: m for m in tar_file.getmembers()}
+    assert members["bin/foo"].isreg()
+    assert members["bin/foo"].size == 4096
+    assert members["lib/libfoo.so"].islnk()
+    assert members["lib/libfoo.so"].linkname == "bin/foo"
+    assert members["lib/libfoo.so.1"].islnk()
+    assert members["lib/libfoo.so.1"].linkname == "bin/foo"
+
+
+def test_archive_layer_sparse_files(tmp_path):
+    layer_dir = tmp_path / "layer_dir"
+    layer_dir.mkdir()
+    sparse_file = layer_dir / "sparse.img"
+    with sparse_file.open("wb") as file:
+        file.seek(1024 * 1024)
+        file.write(b"data" * 1024)
+        file.truncate(4 * 1024 * 1024)
+    if sparse_file.stat().st_blocks * 512 >= sparse_file.stat().st_size:
+        pytest.skip("The filesystem does not support sparse files")
+    (layer_dir / "regular.txt").write_text("regular")
+    tar_path = tmp_path / "layer.tar"
+
+    layers.archive_layer(layer_dir, tar_path)
+
+    # Only the data is stored, and the holes are restored when reading it.
+    assert tar_path.stat().st_size < 64 * 1024
+    with tarfile.open(tar_path) as tar_file:
+        assert tar_file.getnames() == ["regular.txt", "sparse.img"]
+        member = tar_file.getmember("sparse.img")
+        assert member.size == 4 * 1024 * 1024
+        assert member.sparse is not None
+        extracted = tar_file.extractfile(member)
+        assert extracted is not None
+        assert extracted.read() == sparse_file.read_bytes()
+
+
 def test_archive_layer_with_base_layer_dir(tmp_path):
     """Test creating a layer with a base layer dir for reference."""
     layer_dir = tmp_path / "layer_dir"
@@ -331,7 +531,104 @@ def test_archive_layer_duplicate_identical_files(tmp_path):
     assert temp_tar_contents == expected_tar_contents
 
 
-def test_prune_prime_files(tmp_path):
+def _redirect_setup(tmp_path) -> tuple[Path, Path]:
+    """A base where "var/run" points to "/run", and a layer with both dirs."""
+    rootfs_dir = tmp_path / "rootfs"
+    (rootfs_dir / "run").mkdir(parents=True)
+    (rootfs_dir / "var").mkdir()
+    (rootfs_dir / "var/run").symlink_to("/run")
+
+    layer_dir = tmp_path / "layer_dir"
+    (layer_dir / "run").mkdir(parents=True)
+    (layer_dir / "run/a.pid").write_text("a")
+    (layer_dir / "srv").mkdir()
+    (layer_dir / "srv/data").write_text("data")
+    (layer_dir / "var/run").mkdir(parents=True)
+    (layer_dir / "var/run/b.pid").write_text("b")
+    return layer_dir, rootfs_dir
+
+
+@pytest.mark.parametrize("use_index", [False, True])
+def test_archive_layer_redirect_sorted(tmp_path, use_index):
+    """Entries of a directory that points back in the walk are merged in order."""
+    layer_dir, rootfs_dir = _redirect_setup(tmp_path)
+    base_index = RootfsIndex.build(rootfs_dir, "digest") if use_index else None
+
+    temp_tar_path = tmp_path / "layer.tar"
+    layers.archive_layer(
+        layer_dir, temp_tar_path, base_layer_dir=rootfs_dir, base_index=base_index
+    )
+
+    assert get_tar_contents(temp_tar_path) == [
+        "run",
+        "run/a.pid",
+        "run/b.pid",
+        "srv",
+        "srv/data",
+        "var",
+    ]
+
+
+def test_archive_layer_redirect_excluded(tmp_path):
+    """A redirected entry is added even if the one it merges with is excluded."""
+    layer_dir, rootfs_dir = _redirect_setup(tmp_path)
+    (layer_dir / "run/b.pid").write_text("b")
+
+    temp_tar_path = tmp_path / "layer.tar"
+    layers.archive_layer(
+        layer_dir,
+        temp_tar_path,
+        base_layer_dir=rootfs_dir,
+        exclude={"run/a.pid", "run/b.pid"},
+    )
+
+    layer_paths = layers.collect_layer_paths(
+        layer_dir, rootfs_dir, exclude={"run/a.pid", "run/b.pid"}
+    )
+    assert get_tar_contents(temp_tar_path) == [
+        "run",
+        "run/b.pid",
+        "srv",
+        "srv/data",
+        "var",
+    ]
+    assert dict(layer_paths)["run/b.pid"] == layer_dir / "var/run/b.pid"
+
+
+def test_archive_layer_redirect_added_last(tmp_path, monkeypatch):
+    """Redirects only found while walking are added last, without duplicates."""
+    # Without aliases, "lib/run" is only found when "usr/lib" is walked.
+    monkeypatch.setattr(layers, "_MAX_ALIAS_DEPTH", 0)
+    rootfs_dir = tmp_path / "rootfs"
+    (rootfs_dir / "run").mkdir(parents=True)
+    (rootfs_dir / "usr/lib").mkdir(parents=True)
+    (rootfs_dir / "lib").symlink_to("usr/lib")
+    (rootfs_dir / "usr/lib/run").symlink_to("/run")
+
+    layer_dir = tmp_path / "layer_dir"
+    (layer_dir / "lib/run").mkdir(parents=True)
+    (layer_dir / "lib/run/a.pid").write_text("a")
+    (layer_dir / "lib/run/b.pid").write_text("b")
+    (layer_dir / "run").mkdir()
+    (layer_dir / "run/a.pid").write_text("a")
+    (layer_dir / "run/b.pid").write_text("b")
+    (layer_dir / "srv").mkdir()
+
+    layer_paths = layers.collect_layer_paths(
+        layer_dir, rootfs_dir, exclude={"run/b.pid"}
+    )
+
+    # "run/a.pid" was already added, but "run/b.pid" was excluded.
+    assert list(layer_paths) == [
+        ("run", layer_dir / "run"),
+        ("run/a.pid", layer_dir / "run/a.pid"),
+        ("srv", layer_dir / "srv"),
+        ("run/b.pid", layer_dir / "lib/run/b.pid"),
+    ]
+
+
+@pytest.mark.parametrize("use_index", [False, True])
+def test_prune_prime_files(tmp_path, use_index):
     base_layer_dir = tmp_path / "base"
     base_layer_dir.mkdir()
 
@@ -352,7 +649,63 @@ def test_prune_prime_files(tmp_path):
     (prime_dir / "file3.txt").chmod(0o444)
 
     files = {"file1.txt", "file2.txt", "file3.txt"}
-    layers.prune_prime_files(prime_dir, files, base_layer_dir)
+    base_index = RootfsIndex.build(base_layer_dir, "digest") if use_index else None
+    layers.prune_prime_files(prime_dir, files, base_layer_dir, base_index=base_index)
 
     # "file1.txt" gets pruned, the other files remain.
     assert sorted(os.listdir(prime_dir)) == ["file2.txt", "file3.txt"]  # noqa: PTH208 (use Path.iterdir())
+
+
+def test_prune_prime_files_index(tmp_path):
+    """Pruning with an index resolves the base's symlinks and reuses its hashes."""
+    base_layer_dir = tmp_path / "base"
+    (base_layer_dir / "usr/bin").mkdir(parents=True)
+    (base_layer_dir / "bin").symlink_to("usr/bin")
+    (base_layer_dir / "usr/bin/tool").write_text("tool")
+    (base_layer_dir / "usr/bin/link").symlink_to("tool")
+    (base_layer_dir / "usr/bin/same-size").write_text("aaaa")
+
+    prime_dir = tmp_path / "prime"
+    (prime_dir / "bin").mkdir(parents=True)
+    (prime_dir / "bin/tool").write_text("tool")
+    (prime_dir / "bin/link").symlink_to("tool")
+    (prime_dir / "bin/same-size").write_text("bbbb")
+    for name in ("tool", "same-size"):
+        (prime_dir / "bin" / name).chmod(
+            (base_layer_dir / "usr/bin" / name).stat().st_mode
+        )
+
+    base_index = RootfsIndex.build(base_layer_dir, "digest")
+    files = {"bin/tool", "bin/link", "bin/same-size"}
+    layers.prune_prime_files(prime_dir, files, base_layer_dir, base_index=base_index)
+
+    assert sorted(os.listdir(prime_dir / "bin")) == ["same-size"]  # noqa: PTH208 (use Path.iterdir())
+    assert base_index.sha256("bin/tool") is not None
+
+
+def test_prune_prime_files_stats(tmp_path, mocker):
+    """Files with different metadata are not hashed, and the pruning is reported."""
+    base_layer_dir = tmp_path / "base"
+    base_layer_dir.mkdir()
+    (base_layer_dir / "same.txt").write_text("same")
+    (base_layer_dir / "size.txt").write_text("size")
+    (base_layer_dir / "link").symlink_to("same.txt")
+
+    prime_dir = tmp_path / "prime"
+    prime_dir.mkdir()
+    (prime_dir / "same.txt").write_text("same")
+    (prime_dir / "size.txt").write_text("different size")
+    (prime_dir / "link").symlink_to("same.txt")
+    (prime_dir / "new.txt").write_text("new")
+
+    spied_sha256 = mocker.spy(layers, "file_sha256")
+    files = {"same.txt", "size.txt", "link", "new.txt"}
+    stats = layers.prune_prime_files(prime_dir, files, base_layer_dir)
+
+    assert sorted(os.listdir(prime_dir)) == ["new.txt", "size.txt"]  # noqa: PTH208 (use Path.iterdir())
+    hashed = {call.args[0].name for call in spied_sha256.call_args_list}
+    assert "size.txt" not in hashed
+    assert "link" not in hashed
+    assert stats.files == 2
+    assert stats.size == len("same") + len("same.txt")
+    assert stats.duration >= 0
@@ -0,0 +1,55 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pydantic
+import pytest
+from craft_application.errors import CraftValidationError
+from rockcraft.models.lock import Lock
+
+DIGEST = "sha256:" + "0" * 64
+
+
+def test_lock_load_missing(tmp_path):
+    lock = Lock.load(tmp_path)
+
+    assert lock.get_base_digest("ubuntu@24.04", "amd64") is None
+
+
+def test_lock_save_load(tmp_path):
+    lock = Lock(version=1)
+    lock.set_base_digest("ubuntu@24.04", "amd64", DIGEST)
+    lock.save(tmp_path)
+
+    loaded = Lock.load(tmp_path)
+
+    assert loaded.get_base_digest("ubuntu@24.04", "amd64") == DIGEST
+    assert loaded.get_base_digest("ubuntu@24.04", "arm64") is None
+    assert (tmp_path / "rockcraft.lock").read_text() == (
+        f"version: 1\nbases:\n  ubuntu@24.04:\n    amd64: {DIGEST}\n"
+    )
+
+
+def test_lock_invalid_digest(tmp_path):
+    lock = Lock(version=1)
+
+    with pytest.raises(pydantic.ValidationError):
+        lock.set_base_digest("ubuntu@24.04", "amd64", "sha256:bad")
+
+    (tmp_path / "rockcraft.lock").write_text(
+        "version: 1\nbases:\n  ubuntu@24.04:\n    amd64: latest\n"
+    )
+    with pytest.raises(CraftValidationError):
+        Lock.load(tmp_path)
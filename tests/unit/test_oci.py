@@ -14,20 +14,26 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import datetime
+import gzip
 import hashlib
 import json
 import os
 import tarfile
 from pathlib import Path
-from typing import NamedTuple, cast
+from typing import IO, cast
 from unittest.mock import ANY, call, mock_open, patch
 
 import pytest
-from rockcraft import errors, oci
+import zstandard
+from rockcraft import errors, layers, oci, timing
 from rockcraft.architectures import SUPPORTED_ARCHS
+from rockcraft.cache import BlobCache, LayerCache
+from rockcraft.compression import LayerCompression
 from rockcraft.pebble import Pebble
+from rockcraft.rootfs import RootfsIndex
 
 import tests
+from tests.testing import oci as testing_oci
 
 MOCK_NEW_USER = {
     "user": "foo",
@@ -47,11 +53,6 @@ def mock_run(mocker):
     return mocker.patch("rockcraft.oci._process_run")
 
 
-@pytest.fixture
-def mock_archive_layer(mocker):
-    return mocker.patch("rockcraft.layers.archive_layer")
-
-
 @pytest.fixture
 def mock_rmtree(mocker):
     return mocker.patch("shutil.rmtree")
@@ -106,92 +107,241 @@ class TestImage:
         assert image.image_name == "a:b"
         assert image.path == Path("/c")
 
-    def test_from_docker_registry(self, mock_run, new_dir):
+    def test_from_docker_registry(self, mocker, mock_run, new_dir):
+        mock_pull = mocker.patch.object(oci, "_pull_image")
+
         image, source_image = oci.Image.from_docker_registry(
-            "a@b", image_dir=Path("images/dir"), arch="amd64"
+            "a@b", image_dir=Path("images/dir"), arch="arm64"
         )
+
         assert Path("images/dir").is_dir()
         assert image.image_name == "a:b"
         assert source_image == f"docker://{oci.REGISTRY_URL}/a:b"
         assert image.path == Path("images/dir")
-        assert mock_run.mock_calls == [
-            call(
-                [
-                    "skopeo",
-                    "--insecure-policy",
-                    "--override-arch",
-                    "amd64",
-                    "copy",
-                    "--retry-times",
-                    str(oci.MAX_DOWNLOAD_RETRIES),
-                    f"docker://{oci.REGISTRY_URL}/a:b",
-                    "oci:images/dir/a:b",
-                ]
+        mock_pull.assert_called_once_with(
+            f"{oci.REGISTRY_URL}/a:b",
+            Path("images/dir/a:b"),
+            SUPPORTED_ARCHS["arm64"],
+            None,
+        )
+        # Images are downloaded without skopeo.
+        assert mock_run.mock_calls == []
+
+    # The archs here were taken from the supported architectures in the registry
+    # that we currently use (https://gallery.ecr.aws/ubuntu/ubuntu)
+    @pytest.mark.parametrize("docker", [False, True])
+    @pytest.mark.parametrize(
+        "deb_arch", ["amd64", "arm64", "armhf", "ppc64el", "s390x"]
+    )
+    def test_pull_image(self, fake_registry, new_dir, docker, deb_arch):
+        platforms = [("amd64", None), ("arm64", "v8"), ("arm", "v7")]
+        platforms += [("ppc64le", None), ("s390x", None)]
+        manifests = fake_registry.add_image("ubuntu", "b", platforms, docker=docker)
+        mapping = SUPPORTED_ARCHS[deb_arch]
+
+        oci._pull_image(
+            f"{fake_registry.host}/ubuntu:b", Path("images/a:b"), mapping, None
+        )
+
+        image = oci.Image("a:b", Path("images"))
+        manifest = testing_oci.read_manifest(image)
+        expected = manifests[mapping.go_arch, mapping.go_variant]
+        assert manifest["mediaType"] == oci.MANIFEST_MEDIA_TYPE
+        assert manifest["layers"][0]["digest"] == expected["layers"][0]["digest"]
+        assert manifest["layers"][0]["mediaType"] == oci.LAYER_MEDIA_TYPE
+        assert manifest["config"]["mediaType"] == (
+            "application/vnd.oci.image.config.v1+json"
+        )
+        assert testing_oci.read_config(image)["architecture"] == mapping.go_arch
+        if not docker:
+            # OCI manifests are stored unchanged, with the registry's digest.
+            assert manifest == expected
+
+    def test_pull_image_blob_cache(self, fake_registry, new_dir):
+        fake_registry.add_image("ubuntu", "b", [("amd64", None)])
+        blob_cache = BlobCache(Path("cache"))
+        mapping = SUPPORTED_ARCHS["amd64"]
+        source = f"{fake_registry.host}/ubuntu:b"
+
+        oci._pull_image(source, Path("images/a:b"), mapping, blob_cache)
+        oci._pull_image(source, Path("other/a:b"), mapping, blob_cache)
+
+        # The blobs are downloaded once, and linked from the cache.
+        blob_requests = [p for _, p, _ in fake_registry.requests if "/blobs/" in p]
+        assert len(blob_requests) == 2
+        image = oci.Image("a:b", Path("other"))
+        layer_digest = testing_oci.read_manifest(image)["layers"][0]["digest"]
+        linked_layer = Path("other/a/blobs/sha256", layer_digest.split(":", 1)[1])
+        cached_layer = blob_cache.get_path(layer_digest)
+        assert linked_layer.stat().st_ino == cached_layer.stat().st_ino
+        assert (
+            image.manifest_digest()
+            == oci.Image("a:b", Path("images")).manifest_digest()
+        )
+
+    @pytest.mark.parametrize("docker", [False, True])
+    def test_pull_image_source_digest(self, fake_registry, new_dir, docker):
+        """Images pulled from a registry are found again by the registry's digest."""
+        manifests = fake_registry.add_image(
+            "ubuntu", "b", [("amd64", None)], docker=docker
+        )
+        blob_cache = BlobCache(Path("cache"))
+        mapping = SUPPORTED_ARCHS["amd64"]
+        source = f"{fake_registry.host}/ubuntu:b"
+
+        digest = oci._pull_image(source, Path("images/a:b"), mapping, blob_cache)
+
+        registry_manifest = json.dumps(manifests["amd64", None]).encode()
+        assert digest == f"sha256:{hashlib.sha256(registry_manifest).hexdigest()}"
+        image = oci.Image("a:b", Path("images"))
+        assert (image.manifest_digest() == digest) is not docker
+        # By digest, the image is found in its layout or rebuilt from the cache.
+        local_image = oci.Image.from_local_blobs(
+            "a@b", image_dir=Path("images"), digest=digest
+        )
+        assert local_image == image
+        assert local_image is not None
+        assert local_image.source_digest == digest
+        cached_image = oci.Image.from_local_blobs(
+            "a@b", image_dir=Path("other"), digest=digest, blob_cache=blob_cache
+        )
+        assert cached_image == oci.Image("a:b", Path("other"))
+        assert cached_image.manifest_digest() == image.manifest_digest()
+
+        # Pulling by digest gets the same image.
+        digest_source = f"{fake_registry.host}/ubuntu@{digest}"
+        assert (
+            oci._pull_image(digest_source, Path("third/a:b"), mapping, None) == digest
+        )
+
+    def test_from_local_blobs_layout(self, mock_run, new_dir):
+        image = testing_oci.create_image(Path("images"), "a:b")
+        digest = image.manifest_digest()
+
+        assert (
+            oci.Image.from_local_blobs("a@b", image_dir=Path("images"), digest=digest)
+            == image
+        )
+        assert (
+            oci.Image.from_local_blobs(
+                "a@b", image_dir=Path("images"), digest=f"sha256:{'0' * 64}"
             )
-        ]
-        mock_run.reset_mock()
-        _ = oci.Image.from_docker_registry(
-            "a@b", image_dir=Path("images/dir"), arch="arm64"
+            is None
         )
-        assert mock_run.mock_calls == [
-            call(
-                [
-                    "skopeo",
-                    "--insecure-policy",
-                    "--override-arch",
-                    "arm64",
-                    "--override-variant",
-                    "v8",
-                    "copy",
-                    "--retry-times",
-                    str(oci.MAX_DOWNLOAD_RETRIES),
-                    f"docker://{oci.REGISTRY_URL}/a:b",
-                    "oci:images/dir/a:b",
-                ]
+        assert mock_run.mock_calls == []
+
+    def test_from_local_blobs_cache(self, mock_run, new_dir):
+        blob_cache = BlobCache(Path("cache"))
+        source = testing_oci.create_image(Path("source"), "a:b")
+        source_blobs = Path("source/a/blobs/sha256")
+        for blob in source_blobs.iterdir():
+            cached = blob_cache.get_path(f"sha256:{blob.name}")
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            cached.write_bytes(blob.read_bytes())
+        digest = source.manifest_digest()
+
+        image = oci.Image.from_local_blobs(
+            "a@b", image_dir=Path("images"), digest=digest, blob_cache=blob_cache
+        )
+
+        assert image == oci.Image("a:b", Path("images"))
+        assert image.manifest_digest() == digest
+        assert testing_oci.read_config(image) == testing_oci.read_config(source)
+        assert mock_run.mock_calls == []
+
+        # Images with missing blobs are not available.
+        blob_cache.get_path(
+            testing_oci.read_manifest(source)["config"]["digest"]
+        ).unlink()
+        assert (
+            oci.Image.from_local_blobs(
+                "a@b", image_dir=Path("other"), digest=digest, blob_cache=blob_cache
             )
+            is None
+        )
+
+    def test_from_sources(self, mocker, mock_run, new_dir):
+        Path("layouts/a").mkdir(parents=True)
+        mock_run.side_effect = errors.RockcraftError("no such tag")
+        mock_pull = mocker.patch.object(oci, "_pull_image")
+
+        image, source_image = oci.Image.from_sources(
+            "a@b",
+            sources=[
+                "oci-archive:missing.tar",
+                "oci:layouts",
+                "docker://mirror.local:5000/ubuntu",
+                "docker://unused",
+            ],
+            image_dir=Path("images"),
+            arch="amd64",
+        )
+
+        assert image == oci.Image("a:b", Path("images"))
+        assert source_image == "docker://mirror.local:5000/ubuntu/a:b"
+        # The missing archive is skipped, and the layout doesn't have the image.
+        assert [c.args[0][-2:] for c in mock_run.mock_calls] == [
+            ["oci:layouts/a:b", "oci:images/a:b"],
         ]
+        mock_pull.assert_called_once_with(
+            "mirror.local:5000/ubuntu/a:b",
+            Path("images/a:b"),
+            SUPPORTED_ARCHS["amd64"],
+            None,
+        )
+
+    def test_from_sources_digest(self, mocker, mock_run, new_dir):
+        digest = f"sha256:{'0' * 64}"
+        mock_pull = mocker.patch.object(oci, "_pull_image", return_value=digest)
 
-    def _get_arch_from_call(self, mock_call):
-        class ArchData(NamedTuple):
-            override_arch: str
-            override_variant: str | None
+        image, source_image = oci.Image.from_sources(
+            "a@b",
+            sources=["oci:layouts", "docker://mirror.local:5000/ubuntu"],
+            image_dir=Path("images"),
+            arch="amd64",
+            digest=digest,
+        )
 
-        call_args = mock_call.args[0]
-        override_arch_index = call_args.index("--override-arch")
-        override_arch = call_args[override_arch_index + 1]
+        assert image.source_digest == digest
+        assert source_image == f"docker://mirror.local:5000/ubuntu/a@{digest}"
+        mock_run.assert_not_called()
+        mock_pull.assert_called_once_with(
+            f"mirror.local:5000/ubuntu/a@{digest}",
+            Path("images/a:b"),
+            SUPPORTED_ARCHS["amd64"],
+            None,
+        )
 
-        override_variant = None
-        try:
-            override_variant_index = call_args.index("--override-variant")
-            override_variant = call_args[override_variant_index + 1]
-        except ValueError:
-            pass
+    def test_from_sources_error(self, mocker, new_dir):
+        mocker.patch.object(
+            oci, "_pull_image", side_effect=errors.RegistryError("unreachable")
+        )
 
-        return ArchData(override_arch, override_variant)
+        with pytest.raises(errors.RockcraftError, match="any of the base sources"):
+            oci.Image.from_sources(
+                "a@b",
+                sources=["docker://first", "docker://second"],
+                image_dir=Path("images"),
+                arch="amd64",
+            )
 
-    # The archs here were taken from the supported architectures in the registry
-    # that we currently use (https://gallery.ecr.aws/ubuntu/ubuntu)
     @pytest.mark.parametrize(
-        ("deb_arch", "expected_arch", "expected_variant"),
+        ("source", "expected"),
         [
-            ("amd64", "amd64", None),
-            ("arm64", "arm64", "v8"),
-            ("armhf", "arm", "v7"),
-            ("ppc64el", "ppc64le", None),
-            ("s390x", "s390x", None),
+            ("docker://public.ecr.aws/ubuntu", "docker://public.ecr.aws/ubuntu/a:b"),
+            ("docker://mirror:5000/", "docker://mirror:5000/a:b"),
+            ("oci:/srv/images", "oci:/srv/images/a:b"),
+            ("oci-archive:/srv/a.tar", "oci-archive:/srv/a.tar:b"),
+            ("oci:/srv/{name}-{tag}:latest", "oci:/srv/a-b:latest"),
         ],
     )
-    def test_from_docker_registry_arch(
-        self, mock_run, new_dir, deb_arch, expected_arch, expected_variant
-    ):
-        """Test that the correct arch-related parameters are passed to skopeo."""
-        oci.Image.from_docker_registry(
-            "a@b", image_dir=Path("images/dir"), arch=deb_arch
-        )
-        arch_data = self._get_arch_from_call(mock_run.mock_calls[0])
+    def test_resolve_base_source(self, source, expected):
+        assert oci.resolve_base_source(source, "a", "b") == expected
 
-        assert arch_data.override_arch == expected_arch
-        assert arch_data.override_variant == expected_variant
+    @pytest.mark.parametrize("source", ["/srv/images", "http://mirror", "oci:"])
+    def test_resolve_base_source_invalid(self, source):
+        with pytest.raises(errors.RockcraftError, match="Invalid base source"):
+            oci.resolve_base_source(source, "a", "b")
 
     @pytest.mark.parametrize("deb_arch", list(SUPPORTED_ARCHS))
     def test_new_oci_image(self, mock_inject_oci_fields, mock_run, deb_arch):
@@ -242,73 +392,234 @@ class TestImage:
             )
         ]
 
-    def test_extract_to(self, mock_run, new_dir):
-        image = oci.Image("a:b", Path("/c"))
+    def test_extract_to(self, new_dir):
+        image = testing_oci.create_image(Path("c"), "a:b")
+        Path("layer_dir/etc").mkdir(parents=True)
+        Path("layer_dir/etc/foo.txt").write_text("foo")
+        image = image.add_layer("b", Path("layer_dir"))
+
         bundle_path = image.extract_to(Path("bundle/dir"))
-        assert Path("bundle/dir").is_dir()
+
         assert bundle_path == Path("bundle/dir/a-b/rootfs")
-        assert mock_run.mock_calls == [
-            call(["umoci", "unpack", "--image", "/c/a:b", "bundle/dir/a-b"])
-        ]
+        assert Path("bundle/dir/a-b/rootfs/etc/foo.txt").read_text() == "foo"
+
+    def test_extract_to_rootless(self, mocker, new_dir):
+        mock_unpack = mocker.patch.object(oci.unpack, "unpack_layers")
+        image = testing_oci.create_image(Path("c"), "a:b")
+        Path("layer_dir").mkdir()
+        image = image.add_layer("b", Path("layer_dir"))
+        layer = testing_oci.read_manifest(image)["layers"][0]
 
-    def test_extract_to_rootless(self, mock_run, new_dir):
-        image = oci.Image("a:b", Path("/c"))
         bundle_path = image.extract_to(Path("bundle/dir"), rootless=True)
-        assert Path("bundle/dir").is_dir()
+
         assert bundle_path == Path("bundle/dir/a-b/rootfs")
-        assert mock_run.mock_calls == [
+        assert mock_unpack.mock_calls == [
             call(
                 [
-                    "umoci",
-                    "unpack",
-                    "--rootless",
-                    "--image",
-                    "/c/a:b",
-                    "bundle/dir/a-b",
-                ]
+                    oci.unpack.LayerArchive(
+                        Path("c/a/blobs/sha256", layer["digest"].split(":")[1]),
+                        layer["mediaType"],
+                    )
+                ],
+                bundle_path,
+                rootless=True,
+                include=None,
             )
         ]
 
-    def test_extract_to_existing_dir(self, mock_run, new_dir):
-        image = oci.Image("a:b", Path("c"))
+    def test_extract_to_existing_dir(self, new_dir):
+        image = testing_oci.create_image(Path("c"), "a:b")
         Path("bundle/dir/a-b").mkdir(parents=True)
         Path("bundle/dir/a-b/foo.txt").touch()
 
         bundle_path = image.extract_to(Path("bundle/dir"))
         assert Path("bundle/dir/a-b/foo.txt").exists() is False
         assert bundle_path == Path("bundle/dir/a-b/rootfs")
+        assert bundle_path.is_dir()
+
+    def test_extract_to_cache_key(self, mocker, new_dir):
+        spy_unpack = mocker.spy(oci.unpack, "unpack_layers")
+        image = testing_oci.create_image(Path("c"), "a:b")
+
+        image.extract_to(Path("bundle/dir"), cache_key="amd64@sha256:1")
+        assert Path("bundle/dir/a-b.extracted").read_text() == "amd64@sha256:1"
+        assert spy_unpack.call_count == 1
+
+        # The same key reuses the bundle.
+        bundle_path = image.extract_to(Path("bundle/dir"), cache_key="amd64@sha256:1")
+        assert bundle_path == Path("bundle/dir/a-b/rootfs")
+        assert spy_unpack.call_count == 1
+
+        # A different key extracts the image again.
+        image.extract_to(Path("bundle/dir"), cache_key="amd64@sha256:2")
+        assert Path("bundle/dir/a-b.extracted").read_text() == "amd64@sha256:2"
+        assert spy_unpack.call_count == 2
+
+        # Extracting without a key forgets the previous one.
+        image.extract_to(Path("bundle/dir"))
+        assert not Path("bundle/dir/a-b.extracted").exists()
+
+    def test_extract_to_include(self, new_dir):
+        image = testing_oci.create_image(Path("c"), "a:b")
+        Path("layer_dir/etc").mkdir(parents=True)
+        Path("layer_dir/etc/foo.txt").write_text("foo")
+        Path("layer_dir/etc/bar.txt").write_text("bar")
+        image = image.add_layer("b", Path("layer_dir"))
+
+        rootfs = image.extract_to(
+            Path("bundle"), cache_key="amd64@sha256:1", include={"etc/foo.txt"}
+        )
+        assert sorted(p.name for p in (rootfs / "etc").iterdir()) == ["foo.txt"]
+        assert Path("bundle/a-b.partial").read_text() == "amd64@sha256:1"
+        assert not Path("bundle/a-b.extracted").exists()
+
+        # Partial extractions with the same key add to the previous ones.
+        image.extract_to(
+            Path("bundle"), cache_key="amd64@sha256:1", include={"etc/bar.txt"}
+        )
+        assert sorted(p.name for p in (rootfs / "etc").iterdir()) == [
+            "bar.txt",
+            "foo.txt",
+        ]
+
+        # But not with a different key.
+        image.extract_to(
+            Path("bundle"), cache_key="amd64@sha256:2", include={"etc/bar.txt"}
+        )
+        assert sorted(p.name for p in (rootfs / "etc").iterdir()) == ["bar.txt"]
+
+        # A full extraction replaces the partial one.
+        image.extract_to(Path("bundle"), cache_key="amd64@sha256:2")
+        assert not Path("bundle/a-b.partial").exists()
+        assert Path("bundle/a-b.extracted").read_text() == "amd64@sha256:2"
+        assert (rootfs / "etc/foo.txt").read_text() == "foo"
+
+    def test_manifest_digest(self, new_dir):
+        image = testing_oci.create_image(Path("c"), "a:b")
+
+        digest = image.manifest_digest()
+
+        assert digest == testing_oci.read_index(image)["manifests"][0]["digest"]
+        assert digest.startswith("sha256:")
 
     def test_add_layer(self, mocker, mock_run, new_dir):
-        image = oci.Image("a:b", new_dir / "c")
-        Path("c").mkdir()
+        image = testing_oci.create_image(Path("c"), "a:b")
         Path("layer_dir").mkdir()
-        Path("layer_dir/foo.txt").touch()
-        pid = os.getpid()
+        Path("layer_dir/foo.txt").write_text("foo")
 
-        spy_add = mocker.spy(tarfile.TarFile, "add")
+        spy_addfile = mocker.spy(tarfile.TarFile, "addfile")
 
-        image.add_layer("tag", Path("layer_dir"))
-        # The `Tarfile.add()` on the directory ends up calling the method multiple
-        # times (due to the recursion), but we're mainly interested that the first
-        # call was to add `layer_dir`.
-        assert spy_add.mock_calls[0] == call(
-            ANY, Path("layer_dir/foo.txt"), arcname="foo.txt", recursive=False
-        )
+        new_image = image.add_layer("tag", Path("layer_dir"), comment="A comment")
+
+        assert new_image == oci.Image("a:tag", Path("c"))
+        ((_, tar_info, fileobj),) = [c.args for c in spy_addfile.mock_calls]
+        assert tar_info.name == "foo.txt"
+        assert fileobj.name == str(Path("layer_dir/foo.txt"))
+        # No external tool is involved and no temporary tarball is left behind.
+        assert mock_run.mock_calls == []
+        assert not list(Path("c").glob("**/.temp_layer*"))
 
-        expected_cmd = [
-            "umoci",
-            "raw",
-            "add-layer",
-            "--image",
-            str(new_dir / "c/a:b"),
-            str(new_dir / f"c/.temp_layer.{pid}.tar"),
-            "--tag",
-            "tag",
+        # The original tag is untouched and the new one has the extra layer.
+        tags = [
+            m["annotations"][oci.REF_NAME_ANNOTATION]
+            for m in testing_oci.read_index(new_image)["manifests"]
         ]
-        assert mock_run.mock_calls == [
-            call([*expected_cmd, "--history.created_by", " ".join(expected_cmd)])
+        assert tags == ["b", "tag"]
+        assert testing_oci.read_manifest(image)["layers"] == []
+
+        (layer,) = testing_oci.read_manifest(new_image)["layers"]
+        blob = testing_oci.read_blob(new_image, layer["digest"])
+        assert layer["mediaType"] == oci.LAYER_MEDIA_TYPE
+        assert layer["size"] == len(blob)
+        assert layer["digest"] == f"sha256:{hashlib.sha256(blob).hexdigest()}"
+
+        config = testing_oci.read_config(new_image)
+        diff_id = hashlib.sha256(gzip.decompress(blob)).hexdigest()
+        assert config["rootfs"]["diff_ids"] == [f"sha256:{diff_id}"]
+        assert config["history"] == [
+            {
+                "created": ANY,
+                "created_by": "rockcraft add-layer",
+                "comment": "A comment",
+            }
+        ]
+        assert testing_oci.get_layer_names(new_image) == ["foo.txt"]
+
+    def test_add_layer_reproducible(self, new_dir):
+        Path("layer_dir").mkdir()
+        Path("layer_dir/foo.txt").write_text("foo")
+        image = testing_oci.create_image(Path("c"), "a:b")
+
+        first = image.add_layer("first", Path("layer_dir"))
+        second = image.add_layer("second", Path("layer_dir"))
+
+        first_layers = testing_oci.read_manifest(first)["layers"]
+        second_layers = testing_oci.read_manifest(second)["layers"]
+        assert first_layers == second_layers
+
+    def test_add_layer_zstd(self, new_dir):
+        Path("layer_dir").mkdir()
+        Path("layer_dir/foo.txt").write_text("foo")
+        image = testing_oci.create_image(Path("c"), "a:b")
+
+        new_image = image.add_layer(
+            "tag", Path("layer_dir"), compression=LayerCompression("zstd", 19)
+        )
+
+        (layer,) = testing_oci.read_manifest(new_image)["layers"]
+        assert layer["mediaType"] == "application/vnd.oci.image.layer.v1.tar+zstd"
+        blob = testing_oci.read_blob(new_image, layer["digest"])
+        tarball = zstandard.ZstdDecompressor().decompressobj().decompress(blob)
+        diff_id = hashlib.sha256(tarball).hexdigest()
+        assert testing_oci.read_config(new_image)["rootfs"]["diff_ids"] == [
+            f"sha256:{diff_id}"
         ]
 
+    def test_add_layer_cache(self, mocker, new_dir):
+        """Layers with the same contents are reused from the cache."""
+        Path("layer_dir").mkdir()
+        Path("layer_dir/foo.txt").write_text("foo")
+        layer_cache = LayerCache(Path("cache"))
+        image = testing_oci.create_image(Path("c"), "a:b")
+        spy_write_layer = mocker.spy(layers, "write_layer")
+
+        first = image.add_layer("first", Path("layer_dir"), layer_cache=layer_cache)
+        assert spy_write_layer.call_count == 1
+
+        # Only the timestamps changed, so the cached blob is used, even in
+        # another layout.
+        os.utime("layer_dir/foo.txt", (0, 0))
+        other_image = testing_oci.create_image(Path("d"), "a:b")
+        second = other_image.add_layer(
+            "second", Path("layer_dir"), layer_cache=layer_cache
+        )
+        assert spy_write_layer.call_count == 1
+        (layer,) = testing_oci.read_manifest(second)["layers"]
+        assert testing_oci.read_manifest(first)["layers"] == [layer]
+        assert testing_oci.read_blob(second, layer["digest"])
+
+        # Different contents or compression mean a new blob.
+        Path("layer_dir/foo.txt").write_text("bar")
+        image.add_layer("third", Path("layer_dir"), layer_cache=layer_cache)
+        image.add_layer(
+            "fourth",
+            Path("layer_dir"),
+            layer_cache=layer_cache,
+            compression=LayerCompression("zstd"),
+        )
+        assert spy_write_layer.call_count == 3
+
+    def test_add_layer_no_tag(self, new_dir):
+        """Adding a layer without a new tag moves the image's own tag."""
+        Path("layer_dir").mkdir()
+        Path("layer_dir/foo.txt").touch()
+        image = testing_oci.create_image(Path("c"), "a:b")
+
+        image._add_layer(Path("layer_dir"))
+
+        assert len(testing_oci.read_index(image)["manifests"]) == 1
+        assert len(testing_oci.read_manifest(image)["layers"]) == 1
+
     def test_add_new_user(
         self,
         check,
@@ -340,7 +651,10 @@ class TestImage:
 
         check.is_false((fake_tmpfs / "etc/shadow").exists())
         mock_add_layer.assert_called_once_with(
-            "mock-tag", fake_tmpfs, comment="Add user foo:585287 with group foo:585287"
+            "mock-tag",
+            fake_tmpfs,
+            comment="Add user foo:585287 with group foo:585287",
+            compression=None,
         )
 
         # Test with a conflicting user or ID.
@@ -369,6 +683,31 @@ class TestImage:
             "conflict with existing user/group in the base filesystem", str(err)
         )
 
+    def test_add_user_lazy_base(self, mocker, mock_tmpdir, mock_add_layer, tmp_path):
+        """The user files of a lazily extracted base are extracted at once."""
+        base_dir = tmp_path / "base"
+        (base_dir / "etc").mkdir(parents=True)
+        for filename in ["passwd", "group", "shadow"]:
+            (base_dir / "etc" / filename).write_text(f"{filename}\n")
+        base_index = RootfsIndex.build(base_dir, "digest")
+        mock_extract = mocker.Mock()
+        base_index.extract_lazily(mock_extract)
+        fake_tmpfs = tmp_path / "mock-tmp"
+        mock_tmpdir.return_value.__enter__.return_value = str(fake_tmpfs)
+
+        image = oci.Image("a:b", Path("/c"))
+        image.add_user(
+            tmp_path / "prime",
+            base_dir,
+            "mock-tag",
+            cast(str, MOCK_NEW_USER["user"]),
+            cast(int, MOCK_NEW_USER["uid"]),
+            base_index=base_index,
+        )
+
+        mock_extract.assert_called_once_with({"etc/passwd", "etc/group", "etc/shadow"})
+        assert (fake_tmpfs / "etc/passwd").read_text().startswith("passwd\n")
+
     @pytest.mark.parametrize(
         (
             "base_user_files",
@@ -481,6 +820,7 @@ class TestImage:
             "mock-tag",
             fake_tmp_new_layer,
             comment="Add user foo:585287 with group foo:585287",
+            compression=None,
         )
         check.equal(
             (fake_tmp_new_layer / "etc/passwd").read_text(),
@@ -496,6 +836,52 @@ class TestImage:
                 expected_user_files["shadow"],
             )
 
+    def test_add_generated_layer(self, new_dir):
+        image = testing_oci.create_image(Path("c"), "a:b")
+        base_dir = Path("base")
+        (base_dir / "etc").mkdir(parents=True)
+        (base_dir / "etc/passwd").write_text("root:x:0:0::/root:/bin/bash\n")
+
+        image.add_generated_layer(
+            "b",
+            Path("prime"),
+            base_dir,
+            metadata={"name": "rock-name"},
+            rock_name="rock-name",
+            user=(cast(str, MOCK_NEW_USER["user"]), cast(int, MOCK_NEW_USER["uid"])),
+            pebble_layer={"summary": "summary", "description": "description"},
+        )
+
+        # The user, the Pebble layer and the control data are in a single layer.
+        manifest = testing_oci.read_manifest(image)
+        assert len(manifest["layers"]) == 1
+        assert set(testing_oci.get_layer_names(image)) >= {
+            "etc/passwd",
+            "etc/group",
+            "var/lib/pebble/default/layers/001-rockcraft-rock-name.yaml",
+            ".rock/metadata.yaml",
+        }
+        history = testing_oci.read_config(image)["history"]
+        assert history[-1]["comment"] == (
+            "Add user foo:585287 with group foo:585287, Pebble layer file, "
+            "rock control metadata"
+        )
+
+    def test_add_generated_layer_metadata_only(self, new_dir):
+        image = testing_oci.create_image(Path("c"), "a:b")
+
+        image.add_generated_layer(
+            "b",
+            Path("prime"),
+            Path("base"),
+            metadata={"name": "rock-name"},
+            rock_name="rock-name",
+        )
+
+        assert testing_oci.get_layer_names(image) == [".rock", ".rock/metadata.yaml"]
+        history = testing_oci.read_config(image)["history"]
+        assert history[-1]["comment"] == "Add rock control metadata"
+
     def test_to_docker_daemon(self, mock_run):
         image = oci.Image("a:b", Path("/c"))
         image.to_docker_daemon("tag")
@@ -511,76 +897,117 @@ class TestImage:
             )
         ]
 
-    def test_to_oci_archive(self, mock_run):
-        image = oci.Image("a:b", Path("/c"))
+    def test_to_oci_archive(self, new_dir, mocker):
+        """The archive only has the blobs of the exported image."""
+        base_image = testing_oci.create_image(Path("images"), "a:base")
+        layer_dir = Path("layer")
+        layer_dir.mkdir()
+        (layer_dir / "file.txt").write_text("content")
+        image = base_image.add_layer("tag", layer_dir)
+        mock_copy = mocker.patch.object(oci, "_copy_image")
+        spy_sendfile = mocker.spy(os, "sendfile")
+
         image.to_oci_archive("tag", filename="foobar")
-        assert mock_run.mock_calls == [
-            call(
-                [
-                    "skopeo",
-                    "--insecure-policy",
-                    "copy",
-                    "oci:/c/a:tag",
-                    "oci-archive:foobar:tag",
-                ]
-            )
+
+        mock_copy.assert_not_called()
+        assert spy_sendfile.called
+        assert not Path(".foobar.partial").exists()
+        manifest = testing_oci.read_manifest(image)
+        digests = {
+            testing_oci.read_index(image)["manifests"][-1]["digest"],
+            manifest["config"]["digest"],
+            manifest["layers"][0]["digest"],
+        }
+        base_manifest_digest = testing_oci.read_index(base_image)["manifests"][0][
+            "digest"
         ]
+        assert base_manifest_digest not in digests
 
-    def test_digest(self, mocker):
-        source_image = "docker://ubuntu:22.04"
-        image = oci.Image("a:b", Path("/c"))
-        mock_output = mocker.patch(
-            "subprocess.check_output",
-            return_value="000102030405060708090a0b0c0d0e0f",
-        )
-        mock_skopeo = mocker.patch(
-            "shutil.which",
-            return_value="/usr/bin/skopeo",
-        )
+        with tarfile.open("foobar") as tar:
+            assert sorted(tar.getnames()) == sorted(
+                ["oci-layout", "index.json"]
+                + [oci._blob_member(digest) for digest in digests]
+            )
+            index = json.load(cast(IO[bytes], tar.extractfile("index.json")))
+            assert [m["annotations"] for m in index["manifests"]] == [
+                {oci.REF_NAME_ANNOTATION: "tag"}
+            ]
+            for digest in digests:
+                blob = cast(IO[bytes], tar.extractfile(oci._blob_member(digest)))
+                assert f"sha256:{hashlib.sha256(blob.read()).hexdigest()}" == digest
 
-        digest = image.digest(source_image)
-        assert mock_skopeo.mock_calls == [call("skopeo")]
-        assert mock_output.mock_calls == [
-            call(
-                [
-                    "/usr/bin/skopeo",
-                    "inspect",
-                    "--format",
-                    "{{.Digest}}",
-                    "-n",
-                    source_image,
-                ],
-                text=True,
+    def test_to_oci_archive_no_sendfile(self, new_dir, mocker):
+        """The blobs are copied if sendfile() is not supported."""
+        image = testing_oci.create_image(Path("images"), "a:tag")
+        mocker.patch.object(os, "sendfile", side_effect=OSError("unsupported"))
+
+        image.to_oci_archive("tag", filename="foobar")
+
+        with tarfile.open("foobar") as tar:
+            manifest_digest = testing_oci.read_index(image)["manifests"][0]["digest"]
+            manifest = cast(
+                IO[bytes], tar.extractfile(oci._blob_member(manifest_digest))
             )
+            assert json.load(manifest) == testing_oci.read_manifest(image)
+
+    def test_to_oci_layout(self, new_dir):
+        """The layout only has the blobs of the exported image, hard-linked."""
+        base_image = testing_oci.create_image(Path("images"), "a:base")
+        layer_dir = Path("layer")
+        layer_dir.mkdir()
+        (layer_dir / "file.txt").write_text("content")
+        image = base_image.add_layer("tag", layer_dir)
+        layout = Path("foobar")
+        (layout / "stale").mkdir(parents=True)
+
+        image.to_oci_layout("tag", dirname="foobar")
+
+        assert not Path(".foobar.partial").exists()
+        assert sorted(p.name for p in layout.iterdir()) == [
+            "blobs",
+            "index.json",
+            "oci-layout",
         ]
-        assert digest == bytes([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15])
+        index = json.loads((layout / "index.json").read_text())
+        assert index == {
+            "schemaVersion": 2,
+            "manifests": [testing_oci.read_index(image)["manifests"][-1]],
+        }
+        exported = oci.Image("foobar:tag", Path())
+        manifest = testing_oci.read_manifest(exported)
+        assert manifest == testing_oci.read_manifest(image)
+        digests = {
+            index["manifests"][0]["digest"],
+            manifest["config"]["digest"],
+            manifest["layers"][0]["digest"],
+        }
+        blobs = layout / "blobs/sha256"
+        assert {f"sha256:{p.name}" for p in blobs.iterdir()} == digests
+        layer_blob = blobs / manifest["layers"][0]["digest"].split(":", 1)[1]
+        assert layer_blob.stat().st_nlink == 2
 
-    def test_set_default_user(self, mock_run):
-        image = oci.Image("a:b", Path("/c"))
+    def test_to_oci_archive_missing_tag(self, new_dir):
+        image = testing_oci.create_image(Path("images"), "a:tag")
 
-        image.set_default_user(584792, "_daemon_")
+        with pytest.raises(errors.RockcraftError, match="Cannot find manifest"):
+            image.to_oci_archive("other", filename="foobar")
 
-        expected_cmd = [
-            "umoci",
-            "config",
-            "--image",
-            "/c/a:b",
-            "--clear=config.entrypoint",
-            "--config.user",
-            "584792",
-        ]
+        assert not Path("foobar").exists()
 
-        assert mock_run.mock_calls == [
-            call(
-                [
-                    *expected_cmd,
-                    "--history.created_by",
-                    " ".join(expected_cmd),
-                    "--history.comment",
-                    "Set default user",
-                ]
-            )
-        ]
+    def test_set_default_user(self, new_dir):
+        image = testing_oci.create_image(Path("c"), "a:b")
+        image.set_entrypoint(["foo"])
+
+        image.set_default_user(584792, "_daemon_")
+
+        image_config = testing_oci.read_config(image)
+        assert image_config["config"] == {"User": "584792"}
+        assert image_config["history"][-1] == {
+            "created": ANY,
+            "created_by": "rockcraft config",
+            "comment": "Set default user",
+            "empty_layer": True,
+        }
 
     @pytest.mark.parametrize(
         "entrypoint",
@@ -591,65 +1018,79 @@ class TestImage:
             [],
         ],
     )
-    def test_set_entrypoint_default(self, mock_run, entrypoint):
-        image = oci.Image("a:b", Path("/tmp"))
+    def test_set_entrypoint_default(self, new_dir, entrypoint):
+        image = testing_oci.create_image(Path("c"), "a:b")
+        image.set_cmd(["foo"])
 
         image.set_entrypoint(entrypoint)
 
-        arg_list = [
-            "umoci",
-            "config",
-            "--image",
-            "/tmp/a:b",
-            "--clear=config.entrypoint",
-        ]
-
-        for e in entrypoint:
-            arg_list.extend(["--config.entrypoint", e])
+        config = testing_oci.read_config(image)["config"]
+        assert config.get("Entrypoint", []) == entrypoint
+        assert "Cmd" not in config
 
-        arg_list.append("--clear=config.cmd")
+    @pytest.mark.parametrize(("cmd"), [(["echo", "Test"]), ([])])
+    def test_set_cmd(self, new_dir, cmd):
+        image = testing_oci.create_image(Path("c"), "a:b")
 
-        arg_list.extend(
-            [
-                "--history.created_by",
-                " ".join(arg_list),
-                "--history.comment",
-                "Set entrypoint",
-            ]
-        )
+        image.set_cmd(cmd)
 
-        assert mock_run.mock_calls == [
-            call(arg_list),
+        image_config = testing_oci.read_config(image)
+        assert image_config["config"].get("Cmd", []) == cmd
+        assert image_config["history"][-1]["comment"] == "Set default commands"
+
+    def test_configure(self, new_dir, mock_run):
+        """All the changes in a transaction are written at once."""
+        image = testing_oci.create_image(Path("c"), "a:b")
+        Path("empty").mkdir()
+        other_image = image.add_layer("other", Path("empty"))
+
+        with image.configure() as config:
+            config.set_entrypoint(["pebble", "enter"])
+            config.set_cmd(["--args", "foo"])
+            config.set_environment({"NAME": "VALUE"})
+            config.set_annotations({"label": "value"})
+            config.set_media_type(arch="arm64")
+
+            # Nothing is written until the transaction ends.
+            assert testing_oci.read_config(image)["config"] == {}
+
+        image_config = testing_oci.read_config(image)
+        assert image_config["config"] == {
+            "Entrypoint": ["pebble", "enter"],
+            "Cmd": ["--args", "foo"],
+            "Env": ["NAME=VALUE"],
+            "Labels": {"label": "value"},
+        }
+        assert image_config["variant"] == "v8"
+        assert [entry["comment"] for entry in image_config["history"]] == [
+            "Set entrypoint",
+            "Set default commands",
+            "Set environment variables",
+            "Set labels",
+            "Set annotations",
         ]
+        manifest = testing_oci.read_manifest(image)
+        assert manifest["annotations"] == {"label": "value"}
+        assert manifest["mediaType"] == oci.MANIFEST_MEDIA_TYPE
 
-    @pytest.mark.parametrize(("cmd"), [(["echo", "Test"]), ([])])
-    def test_set_cmd(self, mock_run, cmd):
-        image = oci.Image("a:b", Path("/c"))
-        image.set_cmd(cmd)
+        # Other tags in the layout are untouched, and no process is run.
+        assert testing_oci.read_config(other_image)["config"] == {}
+        assert mock_run.mock_calls == []
 
-        arg_list = [
-            "umoci",
-            "config",
-            "--image",
-            "/c/a:b",
-            "--clear=config.cmd",
-        ]
+    def test_configure_error(self, new_dir):
+        """Nothing is written if the transaction fails."""
+        image = testing_oci.create_image(Path("c"), "a:b")
+        index = testing_oci.read_index(image)
 
-        for arg in cmd:
-            arg_list.extend(["--config.cmd", arg])
+        def configure_and_fail():
+            with image.configure() as config:
+                config.set_cmd(["foo"])
+                raise RuntimeError
 
-        arg_list.extend(
-            [
-                "--history.created_by",
-                " ".join(arg_list),
-                "--history.comment",
-                "Set default commands",
-            ]
-        )
+        with pytest.raises(RuntimeError):
+            configure_and_fail()
 
-        assert mock_run.mock_calls == [
-            call(arg_list),
-        ]
+        assert testing_oci.read_index(image) == index
 
     @pytest.mark.parametrize(
         ("mock_services", "mock_checks"),
@@ -736,49 +1177,35 @@ class TestImage:
 
         mock_tmpdir.assert_called_once()
         mock_add_layer.assert_called_once_with(
-            mock_tag, fake_tmpfs, comment="Add Pebble layer file"
+            mock_tag, fake_tmpfs, comment="Add Pebble layer file", compression=None
         )
         mock_define_pebble_layer.assert_called_once_with(
-            fake_tmpfs, mock_base_layer_dir, expected_layer, mock_name
+            fake_tmpfs, mock_base_layer_dir, expected_layer, mock_name, ref_index=None
         )
 
-    def test_set_environment(self, mock_run):
-        image = oci.Image("a:b", Path("/c"))
+    def test_set_environment(self, new_dir):
+        image = testing_oci.create_image(Path("c"), "a:b")
+        image.set_environment({"NAME1": "OLD", "NAME3": "VALUE3"})
 
         image.set_environment({"NAME1": "VALUE1", "NAME2": "VALUE2"})
 
-        expected_cmd = [
-            "umoci",
-            "config",
-            "--image",
-            "/c/a:b",
-            "--config.env",
+        image_config = testing_oci.read_config(image)
+        assert image_config["config"]["Env"] == [
             "NAME1=VALUE1",
-            "--config.env",
+            "NAME3=VALUE3",
             "NAME2=VALUE2",
         ]
-
-        assert mock_run.mock_calls == [
-            call(
-                [
-                    *expected_cmd,
-                    "--history.created_by",
-                    " ".join(expected_cmd),
-                    "--history.comment",
-                    "Set environment variables",
-                ]
-            )
-        ]
+        assert image_config["history"][-1]["comment"] == "Set environment variables"
 
     def test_set_control_data(
         self,
-        mock_archive_layer,
+        mocker,
         mock_rmtree,
         mock_mkdir,
         mock_mkdtemp,
-        mock_run,
     ):
         image = oci.Image("a:b", Path("/c"))
+        mock_add_layer = mocker.patch.object(oci.Image, "_add_layer")
 
         mock_control_data_path = "layer_dir"
         mock_mkdtemp.return_value = mock_control_data_path
@@ -805,87 +1232,26 @@ class TestImage:
         assert mocked_data["writes"] == expected
         mock_mkdtemp.assert_called_once()
         mock_mkdir.assert_called_once()
-        mock_archive_layer.assert_called_once_with(
+        mock_add_layer.assert_called_once_with(
             Path(mock_control_data_path),
-            Path(f"/c/.temp_layer.control_data.{os.getpid()}.tar"),
+            comment="Add rock control metadata",
+            compression=None,
         )
-        expected_cmd = [
-            "umoci",
-            "raw",
-            "add-layer",
-            "--image",
-            "/c/a:b",
-            str(f"/c/.temp_layer.control_data.{os.getpid()}.tar"),
-        ]
-        assert mock_run.mock_calls == [
-            call(
-                [
-                    *expected_cmd,
-                    "--history.created_by",
-                    " ".join(expected_cmd),
-                    "--history.comment",
-                    "Add rock control metadata",
-                ],
-            )
-        ]
         mock_rmtree.assert_called_once_with(Path(mock_control_data_path))
 
-    def test_set_annotations(self, mocker):
-        mocker.patch("rockcraft.utils.get_host_command").return_value = "umoci"
-        mock_run = mocker.patch("subprocess.run")
-        image = oci.Image("a:b", Path("/c"))
+    def test_set_annotations(self, new_dir):
+        image = testing_oci.create_image(Path("c"), "a:b")
+        image.set_annotations({"OLD": "VALUE"})
 
         image.set_annotations({"NAME1": "VALUE1", "NAME2": "VALUE2"})
 
-        expected_label_cmd = [
-            "umoci",
-            "config",
-            "--image",
-            "/c/a:b",
-            "--clear=config.labels",
-            "--config.label",
-            "NAME1=VALUE1",
-            "--config.label",
-            "NAME2=VALUE2",
-        ]
-
-        expected_anno_cmd = [
-            "umoci",
-            "config",
-            "--image",
-            "/c/a:b",
-            "--clear=manifest.annotations",
-            "--manifest.annotation",
-            "NAME1=VALUE1",
-            "--manifest.annotation",
-            "NAME2=VALUE2",
-        ]
-
-        assert mock_run.mock_calls == [
-            call(
-                [
-                    *expected_label_cmd,
-                    "--history.created_by",
-                    " ".join(expected_label_cmd),
-                    "--history.comment",
-                    "Set labels",
-                ],
-                capture_output=True,
-                check=True,
-                text=True,
-            ),
-            call(
-                [
-                    *expected_anno_cmd,
-                    "--history.created_by",
-                    " ".join(expected_anno_cmd),
-                    "--history.comment",
-                    "Set annotations",
-                ],
-                capture_output=True,
-                check=True,
-                text=True,
-            ),
+        expected = {"NAME1": "VALUE1", "NAME2": "VALUE2"}
+        image_config = testing_oci.read_config(image)
+        assert image_config["config"]["Labels"] == expected
+        assert testing_oci.read_manifest(image)["annotations"] == expected
+        assert [entry["comment"] for entry in image_config["history"][-2:]] == [
+            "Set labels",
+            "Set annotations",
         ]
 
     def test_inject_oci_fields(self, mock_read_bytes, mock_write_bytes, mock_unlink):
@@ -1012,40 +1378,189 @@ class TestImage:
         ]
         assert mock_loads.called
 
-    def test_set_path_bare(self, mock_run):
-        image = oci.Image("a:b", Path("/c"))
+    def test_set_path_bare(self, new_dir):
+        image = testing_oci.create_image(Path("c"), "a:b")
 
         image.set_default_path("bare")
 
         expected_path = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
-        expected_cmd = [
-            "umoci",
-            "config",
-            "--image",
-            "/c/a:b",
-            "--config.env",
-            f"PATH={expected_path}",
-        ]
-
-        assert mock_run.mock_calls == [
-            call(
-                [
-                    *expected_cmd,
-                    "--history.created_by",
-                    " ".join(expected_cmd),
-                    "--history.comment",
-                    "Set default PATH for bare-based rock",
-                ]
-            )
-        ]
+        image_config = testing_oci.read_config(image)
+        assert image_config["config"]["Env"] == [f"PATH={expected_path}"]
+        assert (
+            image_config["history"][-1]["comment"]
+            == "Set default PATH for bare-based rock"
+        )
 
     @pytest.mark.parametrize(
         "base",
         ["ubuntu@24.04", "ubuntu@22.04", "ubuntu@20.04"],
     )
-    def test_set_path_non_bare(self, mock_run, base):
-        image = oci.Image("a:b", Path("/c"))
+    def test_set_path_non_bare(self, new_dir, base):
+        image = testing_oci.create_image(Path("c"), "a:b")
 
         image.set_default_path(base)
 
-        assert not mock_run.called
+        image_config = testing_oci.read_config(image)
+        assert image_config["config"] == {}
+        assert image_config["history"] == []
+
+
+def _create_rock(new_dir, arch: str, layer_dir: Path) -> Path:
+    """Create a single-platform rock with one layer, like "rockcraft pack"."""
+    image = testing_oci.create_image(Path(arch), "rock:1.0", architecture=arch)
+    image.add_layer("1.0", layer_dir)
+    rock = Path(f"rock_1.0_{arch}.rock")
+    with tarfile.open(rock, "w") as tar:
+        tar.add(Path(arch, "rock"), arcname=".")
+    return rock
+
+
+@pytest.mark.usefixtures("mock_run")
+def test_merge_oci_archives(new_dir):
+    layer_dir = Path("layer")
+    layer_dir.mkdir()
+    (layer_dir / "file.txt").write_text("shared")
+    os.utime(layer_dir / "file.txt", (0, 0))
+    os.utime(layer_dir, (0, 0))
+    rocks = [_create_rock(new_dir, arch, layer_dir) for arch in ("amd64", "arm64")]
+
+    oci.merge_oci_archives(rocks, Path("rock_1.0.rock"), tag="1.0")
+
+    with tarfile.open("rock_1.0.rock") as tar:
+        names = tar.getnames()
+
+        def read_json(name: str):
+            return json.load(tar.extractfile(name))
+
+        tl_index = read_json("index.json")
+        (index_descriptor,) = tl_index["manifests"]
+        assert index_descriptor["mediaType"] == oci.INDEX_MEDIA_TYPE
+        assert index_descriptor["annotations"] == {oci.REF_NAME_ANNOTATION: "1.0"}
+        image_index = read_json(
+            "blobs/sha256/" + index_descriptor["digest"].split(":")[1]
+        )
+        manifests = {
+            m["platform"]["architecture"]: read_json(
+                "blobs/sha256/" + m["digest"].split(":")[1]
+            )
+            for m in image_index["manifests"]
+        }
+
+    assert "oci-layout" in names
+    assert len(names) == len(set(names))
+    assert set(manifests) == {"amd64", "arm64"}
+    # The identical layer is shared by both platforms.
+    assert manifests["amd64"]["layers"] == manifests["arm64"]["layers"]
+    assert not Path(".rock_1.0.rock.partial").exists()
+
+
+@pytest.mark.usefixtures("mock_run")
+def test_merge_oci_archives_same_platform(new_dir):
+    Path("layer").mkdir()
+    rock = _create_rock(new_dir, "amd64", Path("layer"))
+
+    with pytest.raises(errors.RockcraftError, match="More than one image"):
+        oci.merge_oci_archives([rock, rock], Path("rock_1.0.rock"), tag="1.0")
+
+    assert list(Path().glob("*rock_1.0.rock*")) == []
+
+
+@pytest.mark.usefixtures("mock_run")
+def test_to_registry(fake_registry, new_dir):
+    base_image = testing_oci.create_image(Path("images"), "rock:base")
+    layer_dir = Path("layer")
+    layer_dir.mkdir()
+    (layer_dir / "file.txt").write_text("content")
+    image = base_image.add_layer("1.0", layer_dir)
+    destination = f"{fake_registry.host}/my-rock:1.0"
+
+    digest = image.to_registry("1.0", destination)
+
+    manifest = testing_oci.read_manifest(image)
+    assert digest == testing_oci.read_index(image)["manifests"][-1]["digest"]
+    media_type, content = fake_registry.manifests["my-rock", "1.0"]
+    assert media_type == oci.MANIFEST_MEDIA_TYPE
+    assert json.loads(content) == manifest
+    assert fake_registry.repositories["my-rock"] >= {
+        manifest["config"]["digest"],
+        manifest["layers"][0]["digest"],
+    }
+
+    # Pushing again doesn't upload any blob.
+    fake_registry.requests.clear()
+    image.to_registry("1.0", destination)
+    assert {method for method, _, _ in fake_registry.requests} == {"HEAD", "PUT"}
+    assert [path for method, path, _ in fake_registry.requests if method == "PUT"] == [
+        "/v2/my-rock/manifests/1.0"
+    ]
+
+
+@pytest.mark.usefixtures("mock_run")
+def test_to_registry_multi_arch(fake_registry, new_dir):
+    layer_dir = Path("layer")
+    layer_dir.mkdir()
+    (layer_dir / "file.txt").write_text("shared")
+    rocks = [_create_rock(new_dir, arch, layer_dir) for arch in ("amd64", "arm64")]
+    oci.merge_oci_archives(rocks, Path("rock_1.0.rock"), tag="1.0")
+    image = oci.Image.from_oci_archive(Path("rock_1.0.rock"), image_dir=Path("tmp"))
+
+    image.to_registry("1.0", f"{fake_registry.host}/rock:1.0")
+
+    media_type, content = fake_registry.manifests["rock", "1.0"]
+    assert media_type == oci.INDEX_MEDIA_TYPE
+    for descriptor in json.loads(content)["manifests"]:
+        assert ("rock", descriptor["digest"]) in fake_registry.manifests
+
+
+def test_from_oci_archive(new_dir):
+    image = testing_oci.create_image(Path("images"), "rock:1.0")
+    layout_files = [
+        path.relative_to("images/rock")
+        for path in Path("images/rock").rglob("*")
+        if path.is_file()
+    ]
+    Path("evil").write_text("evil")
+    with tarfile.open("rock_1.0_amd64.rock", "w") as tar:
+        for path in layout_files:
+            tar.add(Path("images/rock", path), arcname=f"./{path}")
+        tar.add("evil", arcname="../evil")
+        tar.add("evil", arcname="blobs/sha256/../../evil")
+
+    extracted = oci.Image.from_oci_archive(
+        Path("rock_1.0_amd64.rock"), image_dir=Path("extracted")
+    )
+
+    assert extracted == oci.Image("rock_1:1.0", Path("extracted"))
+    assert testing_oci.read_manifest(extracted) == testing_oci.read_manifest(image)
+    assert sorted(
+        str(p.relative_to("extracted/rock_1"))
+        for p in Path("extracted/rock_1").rglob("*")
+        if p.is_file()
+    ) == sorted(str(p) for p in layout_files)
+    assert not Path("extracted/evil").exists()
+
+
+def test_from_oci_layout_multiple_images(new_dir):
+    image = testing_oci.create_image(Path("images"), "rock:1.0")
+    index = testing_oci.read_index(image)
+    other = {**index["manifests"][0], "annotations": {oci.REF_NAME_ANNOTATION: "2.0"}}
+    index["manifests"].append(other)
+    Path("images/rock/index.json").write_text(json.dumps(index))
+
+    with pytest.raises(errors.RockcraftError, match="single tagged image"):
+        oci.Image.from_oci_layout(Path("images/rock"))
+
+
+def test_process_run_timing(mocker):
+    mocker.patch("subprocess.run")
+    tracer = timing.enable()
+    try:
+        oci._process_run(["/usr/bin/umoci", "config", "--image", "a:b"])
+    finally:
+        timing.disable()
+
+    assert len(tracer) == 1
+    event = tracer._events[-1]
+    assert event["name"] == "umoci config"
+    assert event["cat"] == "subprocess"
+    assert event["args"]["command"] == "/usr/bin/umoci config --image a:b"
@@ -31,6 +31,7 @@ from rockcraft.pebble import (
     TcpCheckOptions,
     add_pebble_part,
 )
+from rockcraft.rootfs import RootfsIndex
 
 import tests
 
@@ -161,10 +162,12 @@ class TestPebble:
             ),
         ],
     )
+    @pytest.mark.parametrize("use_index", [False, True])
     def test_define_pebble_layer(
         self,
         check,
         tmp_path,
+        use_index,
         existing_layers,
         expected_new_layer_prefix,
         layer_content,
@@ -178,12 +181,17 @@ class TestPebble:
         for layer in existing_layers:
             (tmp_base_layer_dir / layer).touch()
 
+        ref_index = (
+            RootfsIndex.build(mock_base_layer_dir, "digest") if use_index else None
+        )
+
         pebble_obj = Pebble()
         pebble_obj.define_pebble_layer(
             tmp_path,
             mock_base_layer_dir,
             layer_content,
             "my-rock",
+            ref_index=ref_index,
         )
 
         out_pebble_layer = (
@@ -0,0 +1,85 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+
+import pytest
+from rockcraft.prime_state import PostPrimeState
+
+
+@pytest.fixture
+def prime_dir(tmp_path):
+    prime = tmp_path / "prime"
+    (prime / "usr/bin").mkdir(parents=True)
+    (prime / "usr/bin/hello").write_text("hello")
+    (prime / "etc").mkdir()
+    (prime / "etc/hello.conf").write_text("conf")
+    return prime
+
+
+def test_changed(prime_dir, tmp_path):
+    state = PostPrimeState(tmp_path / "state.json", "sha256:1")
+    paths = {"usr/bin/hello", "etc/hello.conf", "missing"}
+
+    assert state.changed(prime_dir, paths) == {"usr/bin/hello", "etc/hello.conf"}
+
+    state.mark_processed(prime_dir, paths)
+    assert len(state) == 2
+    assert state.changed(prime_dir, paths) == set()
+
+    # Changed files are processed again.
+    os.utime(prime_dir / "etc/hello.conf", ns=(0, 0))
+    assert state.changed(prime_dir, paths) == {"etc/hello.conf"}
+
+    # So are removed files (like pruned ones) that come back.
+    (prime_dir / "usr/bin/hello").unlink()
+    state.mark_processed(prime_dir, {"usr/bin/hello"})
+    assert len(state) == 1
+    (prime_dir / "usr/bin/hello").write_text("hello")
+    assert "usr/bin/hello" in state.changed(prime_dir, paths)
+
+
+def test_save_load(prime_dir, tmp_path):
+    state_file = tmp_path / "work/state.json"
+    state = PostPrimeState(state_file, "sha256:1")
+    state.mark_processed(prime_dir, {"usr/bin/hello"})
+    state.save()
+
+    loaded = PostPrimeState.load(state_file, "sha256:1")
+
+    assert len(loaded) == 1
+    assert loaded.changed(prime_dir, {"usr/bin/hello", "etc/hello.conf"}) == {
+        "etc/hello.conf"
+    }
+
+
+@pytest.mark.parametrize("content", ["", "{}", '{"version": 1, "base": "sha256:1"}'])
+def test_load_invalid(tmp_path, content):
+    state_file = tmp_path / "state.json"
+    state_file.write_text(content)
+
+    assert len(PostPrimeState.load(state_file, "sha256:1")) == 0
+
+
+def test_load_other_base(prime_dir, tmp_path):
+    """Files processed against another base are processed again."""
+    state_file = tmp_path / "state.json"
+    state = PostPrimeState(state_file, "sha256:1")
+    state.mark_processed(prime_dir, {"usr/bin/hello"})
+    state.save()
+
+    loaded = PostPrimeState.load(state_file, "sha256:2")
+
+    assert loaded.changed(prime_dir, {"usr/bin/hello"}) == {"usr/bin/hello"}
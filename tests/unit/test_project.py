@@ -646,6 +646,49 @@ def test_project_bare_overlay(yaml_loaded_data, packages, script):
     assert str(err.value) == expected
 
 
+def test_project_layers(yaml_loaded_data):
+    yaml_loaded_data["parts"]["bar"] = {"plugin": "nil", "after": ["foo"]}
+    yaml_loaded_data["layers"] = {"first": ["foo"], "second": ["bar"]}
+
+    project = load_project_yaml(yaml_loaded_data)
+
+    assert project.layers == {"first": ["foo"], "second": ["bar"]}
+
+
+@pytest.mark.parametrize(
+    ("layers", "message"),
+    [
+        ({"first": ["baz"]}, "layer 'first' refers to unknown part 'baz'."),
+        (
+            {"first": ["foo"], "second": ["foo"]},
+            "part 'foo' is listed in more than one layer.",
+        ),
+        (
+            {"first": ["bar"], "second": ["foo"]},
+            (
+                "part 'bar' in layer 'first' runs after part 'foo', which must be "
+                "in the same layer or in an earlier one."
+            ),
+        ),
+        (
+            {"first": ["bar"]},
+            (
+                "part 'bar' in layer 'first' runs after part 'foo', which must be "
+                "in the same layer or in an earlier one."
+            ),
+        ),
+    ],
+)
+def test_project_layers_invalid(yaml_loaded_data, layers, message):
+    yaml_loaded_data["parts"]["bar"] = {"plugin": "nil", "after": ["foo"]}
+    yaml_loaded_data["layers"] = layers
+
+    with pytest.raises(CraftValidationError) as err:
+        load_project_yaml(yaml_loaded_data)
+
+    assert message in str(err.value)
+
+
 @pytest.mark.usefixtures("fake_project_file", "configured_project")
 @pytest.mark.parametrize(
     "fake_project_yaml", [pytest.param(ROCKCRAFT_YAML, id="default")]
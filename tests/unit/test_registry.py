@@ -0,0 +1,449 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from rockcraft import registry
+from rockcraft.errors import RegistryError
+
+_CHUNK = registry._CHUNK_SIZE
+_CONTENT = bytes(range(256)) * (10 * _CHUNK // 256)
+
+
+@pytest.mark.parametrize(
+    ("name", "expected"),
+    [
+        (
+            "public.ecr.aws/ubuntu/ubuntu:24.04",
+            ("public.ecr.aws", "ubuntu/ubuntu", "24.04"),
+        ),
+        ("ubuntu:22.04", ("docker.io", "library/ubuntu", "22.04")),
+        ("canonical/chiseled", ("docker.io", "canonical/chiseled", "latest")),
+        ("localhost/rock", ("localhost", "rock", "latest")),
+        ("mirror:5000/a/b:c", ("mirror:5000", "a/b", "c")),
+        (
+            f"mirror:5000/a@sha256:{'0' * 64}",
+            ("mirror:5000", "a", f"sha256:{'0' * 64}"),
+        ),
+    ],
+)
+def test_image_reference_parse(name, expected):
+    reference = registry.ImageReference.parse(name)
+
+    assert (reference.registry, reference.repository, reference.reference) == expected
+
+
+@pytest.mark.parametrize("name", ["", "mirror:5000/", "a@"])
+def test_image_reference_parse_invalid(name):
+    with pytest.raises(RegistryError, match="Invalid image name"):
+        registry.ImageReference.parse(name)
+
+
+@pytest.mark.parametrize("docker", [False, True])
+@pytest.mark.parametrize(
+    ("architecture", "variant"), [("amd64", None), ("arm64", "v8"), ("arm", "v7")]
+)
+def test_get_manifest_platform(fake_registry, docker, architecture, variant):
+    manifests = fake_registry.add_image(
+        "ubuntu",
+        "24.04",
+        [("amd64", None), ("arm64", None), ("arm", "v6"), ("arm", "v7")],
+        docker=docker,
+    )
+    client = registry.RegistryClient(fake_registry.host)
+
+    content, media_type = client.get_manifest(
+        "ubuntu", "24.04", architecture=architecture, variant=variant
+    )
+
+    # Manifests without a variant match any variant.
+    expected_variant = variant if architecture == "arm" else None
+    assert json.loads(content) == manifests[architecture, expected_variant]
+    assert media_type in registry.MANIFEST_MEDIA_TYPES
+
+
+def test_get_manifest_missing_platform(fake_registry):
+    fake_registry.add_image("ubuntu", "24.04", [("amd64", None)])
+    client = registry.RegistryClient(fake_registry.host)
+
+    with pytest.raises(RegistryError, match="no manifest for linux/s390x"):
+        client.get_manifest("ubuntu", "24.04", architecture="s390x")
+
+
+def test_get_manifest_not_found(fake_registry):
+    client = registry.RegistryClient(fake_registry.host)
+
+    with pytest.raises(RegistryError, match="HTTP 404"):
+        client.get_manifest("ubuntu", "24.04", architecture="amd64")
+
+
+def test_get_manifest_digest_mismatch(fake_registry):
+    manifest = fake_registry.add_manifest(
+        "ubuntu", None, {"mediaType": registry.OCI_MANIFEST_MEDIA_TYPE}
+    )
+    other = fake_registry.add_manifest(
+        "ubuntu", None, {"mediaType": registry.OCI_MANIFEST_MEDIA_TYPE, "layers": []}
+    )
+    # The registry serves the wrong content for a digest.
+    fake_registry.manifests["ubuntu", manifest["digest"]] = fake_registry.manifests[
+        "ubuntu", other["digest"]
+    ]
+    client = registry.RegistryClient(fake_registry.host)
+
+    with pytest.raises(RegistryError, match="doesn't match its digest"):
+        client.get_manifest("ubuntu", manifest["digest"], architecture="amd64")
+
+
+def test_token_authentication(fake_registry):
+    fake_registry.token = "fake-token"  # noqa: S105 (not a real token)
+    fake_registry.add_image("ubuntu", "24.04", [("amd64", None)])
+    client = registry.RegistryClient(fake_registry.host)
+
+    client.get_manifest("ubuntu", "24.04", architecture="amd64")
+    client.get_manifest("ubuntu", "24.04", architecture="amd64")
+
+    token_requests = [path for _, path, _ in fake_registry.requests if "token" in path]
+    assert token_requests == ["/token?scope=repository%3Aubuntu%3Apull&service=fake"]
+
+
+@pytest.mark.parametrize("mount_from", [None, "ubuntu"])
+def test_token_authentication_push(fake_registry, tmp_path, mount_from):
+    """Uploads request a token that can push, and pull from the mounted repository."""
+    fake_registry.token = "fake-token"  # noqa: S105 (not a real token)
+    digest, path = _write_blob(tmp_path, b"content")
+    client = registry.RegistryClient(fake_registry.host)
+
+    client.upload_blob("rock", digest, path, mount_from=mount_from)
+
+    token_requests = [path for _, path, _ in fake_registry.requests if "token" in path]
+    scope = "scope=repository%3Arock%3Apull%2Cpush"
+    if mount_from:
+        scope += "&scope=repository%3Aubuntu%3Apull"
+    assert token_requests == [f"/token?{scope}&service=fake"]
+
+
+def test_token_authentication_challenge_scope(mocker):
+    """The scope in the challenge replaces the one of the request's repository."""
+    client = registry.RegistryClient("registry.example.com")
+    response = mocker.Mock(
+        headers={
+            "WWW-Authenticate": (
+                'Bearer realm="https://auth.example.com/token",'
+                'service="registry",scope="repository:rock:push,pull"'
+            )
+        }
+    )
+    mock_get = mocker.patch.object(client._session, "get")
+    mock_get.return_value.json.return_value = {"token": "fake-token"}
+
+    client._authenticate(
+        response, ("repository:rock:pull,push", "repository:ubuntu:pull")
+    )
+
+    assert mock_get.call_args.kwargs["params"] == [
+        ("scope", "repository:rock:push,pull"),
+        ("scope", "repository:ubuntu:pull"),
+        ("service", "registry"),
+    ]
+
+
+def test_download_blobs(fake_registry, tmp_path):
+    blobs = [fake_registry.add_blob(f"blob {i}".encode() * 1000) for i in range(6)]
+    existing = tmp_path / blobs[0]["digest"]
+    existing.write_bytes(b"already there")
+    client = registry.RegistryClient(fake_registry.host)
+
+    client.download_blobs("ubuntu", blobs, lambda digest: tmp_path / digest)
+
+    for i, blob in enumerate(blobs[1:], start=1):
+        assert (tmp_path / blob["digest"]).read_bytes() == f"blob {i}".encode() * 1000
+    # Existing blobs are not downloaded again.
+    assert existing.read_bytes() == b"already there"
+    assert fake_registry.count_requests(f"/v2/ubuntu/blobs/{blobs[0]['digest']}") == 0
+    assert not list(tmp_path.glob("*.partial"))
+
+
+def test_download_blob_resume(fake_registry, tmp_path):
+    content = _CONTENT
+    blob = fake_registry.add_blob(content)
+    fake_registry.fail_after[blob["digest"]] = 5 * _CHUNK
+    client = registry.RegistryClient(fake_registry.host)
+    path = tmp_path / "blob"
+
+    client.download_blob("ubuntu", blob["digest"], path, size=blob["size"])
+
+    assert path.read_bytes() == content
+    ranges = [
+        headers.get("Range")
+        for _, request_path, headers in fake_registry.requests
+        if request_path.endswith(blob["digest"])
+    ]
+    # The download resumes after the last chunk that was fully received.
+    assert ranges[0] is None
+    assert len(ranges) == 2
+    resumed_at = int(ranges[1].removeprefix("bytes=").rstrip("-"))
+    assert 0 < resumed_at <= 5 * _CHUNK
+
+
+def test_download_blob_resume_later(fake_registry, tmp_path):
+    """A partial download from an earlier call is resumed."""
+    content = _CONTENT
+    blob = fake_registry.add_blob(content)
+    path = tmp_path / "blob"
+    (tmp_path / "blob.partial").write_bytes(content[:3000])
+    client = registry.RegistryClient(fake_registry.host)
+
+    client.download_blob("ubuntu", blob["digest"], path, size=blob["size"])
+
+    assert path.read_bytes() == content
+    assert fake_registry.requests[-1][2]["Range"] == "bytes=3000-"
+
+
+@pytest.mark.parametrize("extra", [b"", b"stale"])
+def test_download_blob_resume_range_error(fake_registry, tmp_path, extra):
+    """The body of a range error is never written to the partial download."""
+    content = _CONTENT
+    blob = fake_registry.add_blob(content)
+    path = tmp_path / "blob"
+    (tmp_path / "blob.partial").write_bytes(content + extra)
+    client = registry.RegistryClient(fake_registry.host)
+
+    client.download_blob("ubuntu", blob["digest"], path)
+
+    assert path.read_bytes() == content
+    # A complete partial download is kept, and a stale one is downloaded again.
+    requests = fake_registry.count_requests(f"/v2/ubuntu/blobs/{blob['digest']}")
+    assert requests == (2 if extra else 1)
+
+
+def test_download_blob_locked(fake_registry, tmp_path):
+    """A blob that another process is downloading is waited for."""
+    blob = fake_registry.add_blob(_CONTENT)
+    path = tmp_path / "blob"
+    client = registry.RegistryClient(fake_registry.host)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with registry._lock_partial(tmp_path / "blob.partial") as partial_file:
+            future = executor.submit(
+                client.download_blob, "ubuntu", blob["digest"], path
+            )
+            time.sleep(0.1)
+            assert not future.done()
+            partial_file.write(_CONTENT)
+            partial_file.flush()
+            (tmp_path / "blob.partial").replace(path)
+        future.result()
+
+    assert path.read_bytes() == _CONTENT
+    assert fake_registry.count_requests(f"/v2/ubuntu/blobs/{blob['digest']}") == 0
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_download_blob_no_range_support(fake_registry, tmp_path):
+    content = _CONTENT
+    blob = fake_registry.add_blob(content)
+    fake_registry.support_range = False
+    fake_registry.fail_after[blob["digest"]] = 5 * _CHUNK
+    client = registry.RegistryClient(fake_registry.host)
+    path = tmp_path / "blob"
+
+    client.download_blob("ubuntu", blob["digest"], path, size=blob["size"])
+
+    assert path.read_bytes() == content
+
+
+def test_download_blob_retries_exhausted(fake_registry, tmp_path):
+    blob = fake_registry.add_blob(_CONTENT)
+    fake_registry.fail_after[blob["digest"]] = 5 * _CHUNK
+    client = registry.RegistryClient(fake_registry.host, max_retries=0)
+    path = tmp_path / "blob"
+
+    with pytest.raises(RegistryError, match="Cannot download"):
+        client.download_blob("ubuntu", blob["digest"], path, size=blob["size"])
+
+    # The partial download is kept, to resume later.
+    assert 0 < (tmp_path / "blob.partial").stat().st_size <= 5 * _CHUNK
+    assert not path.exists()
+
+
+def test_download_blob_digest_mismatch(fake_registry, tmp_path):
+    blob = fake_registry.add_blob(b"content")
+    fake_registry.blobs[blob["digest"]] = b"corrupt"
+    client = registry.RegistryClient(fake_registry.host)
+    path = tmp_path / "blob"
+
+    with pytest.raises(RegistryError, match="don't match its digest"):
+        client.download_blob("ubuntu", blob["digest"], path, size=blob["size"])
+
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("digest", ["sha256:../../etc/passwd", "md5:abc"])
+def test_download_blob_invalid_digest(tmp_path, digest):
+    client = registry.RegistryClient("localhost")
+
+    with pytest.raises(RegistryError, match="Unsupported blob digest"):
+        client.download_blob("ubuntu", digest, tmp_path / "blob")
+
+
+def test_request_retry(fake_registry, mocker):
+    fake_registry.add_image("ubuntu", "24.04", [("amd64", None)])
+    client = registry.RegistryClient(fake_registry.host)
+    original_request = client._session.request
+    responses = iter([503])
+
+    def flaky_request(*args, **kwargs):
+        response = original_request(*args, **kwargs)
+        if (status := next(responses, None)) is not None:
+            response.status_code = status
+        return response
+
+    mocker.patch.object(client._session, "request", side_effect=flaky_request)
+
+    client.get_manifest("ubuntu", "24.04", architecture="amd64")
+
+    assert fake_registry.count_requests("/v2/ubuntu/manifests/24.04") == 2
+
+
+def _write_blob(tmp_path, content: bytes) -> tuple[str, Path]:
+    digest = f"sha256:{hashlib.sha256(content).hexdigest()}"
+    path = tmp_path / digest
+    path.write_bytes(content)
+    return digest, path
+
+
+def _methods(fake_registry) -> list[str]:
+    return [method for method, _, _ in fake_registry.requests]
+
+
+def test_upload_blob(fake_registry, tmp_path):
+    digest, path = _write_blob(tmp_path, b"content")
+    client = registry.RegistryClient(fake_registry.host)
+
+    assert client.upload_blob("rock", digest, path)
+
+    assert fake_registry.blobs[digest] == b"content"
+    assert client.blob_exists("rock", digest)
+    assert _methods(fake_registry) == ["HEAD", "POST", "PUT", "HEAD"]
+
+
+def test_upload_blob_exists(fake_registry, tmp_path):
+    digest, path = _write_blob(tmp_path, b"content")
+    fake_registry.add_blob(b"content", repository="rock")
+    client = registry.RegistryClient(fake_registry.host)
+
+    assert not client.upload_blob("rock", digest, path)
+
+    assert _methods(fake_registry) == ["HEAD"]
+
+
+def test_upload_blob_mount(fake_registry, tmp_path):
+    digest, path = _write_blob(tmp_path, b"content")
+    fake_registry.add_blob(b"content", repository="ubuntu")
+    client = registry.RegistryClient(fake_registry.host)
+
+    assert not client.upload_blob("rock", digest, path, mount_from="ubuntu")
+
+    assert _methods(fake_registry) == ["HEAD", "POST"]
+    assert "mount=sha256" in fake_registry.requests[1][1]
+    assert digest in fake_registry.repositories["rock"]
+
+
+def test_upload_blob_mount_missing(fake_registry, tmp_path):
+    """Blobs that cannot be mounted are uploaded."""
+    digest, path = _write_blob(tmp_path, b"content")
+    client = registry.RegistryClient(fake_registry.host)
+
+    assert client.upload_blob("rock", digest, path, mount_from="ubuntu")
+
+    assert fake_registry.blobs[digest] == b"content"
+
+
+def test_upload_blob_chunked(fake_registry, tmp_path, monkeypatch):
+    monkeypatch.setattr(registry, "UPLOAD_CHUNK_SIZE", 1000)
+    content = bytes(range(256)) * 10
+    digest, path = _write_blob(tmp_path, content)
+    client = registry.RegistryClient(fake_registry.host)
+
+    assert client.upload_blob("rock", digest, path)
+
+    assert fake_registry.blobs[digest] == content
+    assert _methods(fake_registry) == ["HEAD", "POST", "PATCH", "PATCH", "PATCH", "PUT"]
+    ranges = [h["Content-Range"] for m, _, h in fake_registry.requests if m == "PATCH"]
+    assert ranges == ["0-999", "1000-1999", "2000-2559"]
+
+
+def test_upload_blobs(fake_registry, tmp_path):
+    blobs = [_write_blob(tmp_path, f"blob {i}".encode()) for i in range(6)]
+    fake_registry.add_blob(b"blob 0", repository="rock")
+    paths = dict(blobs)
+    client = registry.RegistryClient(fake_registry.host)
+
+    uploaded = client.upload_blobs(
+        "rock", [{"digest": digest} for digest, _ in blobs], paths.__getitem__
+    )
+
+    assert uploaded == 5
+    assert fake_registry.repositories["rock"] == set(paths)
+
+
+def test_put_manifest(fake_registry, tmp_path):
+    fake_registry.token = "fake-token"  # noqa: S105 (not a real token)
+    config = fake_registry.add_blob(b"{}", repository="rock")
+    manifest = {
+        "schemaVersion": 2,
+        "mediaType": registry.OCI_MANIFEST_MEDIA_TYPE,
+        "config": config,
+        "layers": [],
+    }
+    content = json.dumps(manifest).encode()
+    client = registry.RegistryClient(
+        fake_registry.host, credentials=("user", "password")
+    )
+
+    digest = client.put_manifest(
+        "rock", "1.0", content, registry.OCI_MANIFEST_MEDIA_TYPE
+    )
+
+    assert fake_registry.manifests["rock", "1.0"] == (
+        registry.OCI_MANIFEST_MEDIA_TYPE,
+        content,
+    )
+    assert digest == f"sha256:{hashlib.sha256(content).hexdigest()}"
+    # The token is requested with the credentials.
+    token_request = next(h for _, p, h in fake_registry.requests if "token" in p)
+    assert token_request["Authorization"].startswith("Basic ")
+
+
+def test_put_manifest_missing_blobs(fake_registry):
+    manifest = {
+        "mediaType": registry.OCI_MANIFEST_MEDIA_TYPE,
+        "config": {"digest": f"sha256:{'0' * 64}"},
+        "layers": [],
+    }
+    client = registry.RegistryClient(fake_registry.host)
+
+    with pytest.raises(RegistryError, match="HTTP 400"):
+        client.put_manifest(
+            "rock",
+            "1.0",
+            json.dumps(manifest).encode(),
+            registry.OCI_MANIFEST_MEDIA_TYPE,
+        )
@@ -0,0 +1,192 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+import json
+
+import pytest
+from rockcraft.rootfs import RootfsIndex
+
+
+@pytest.fixture
+def rootfs(tmp_path):
+    """A small usrmerged root filesystem."""
+    root = tmp_path / "rootfs"
+    (root / "usr/bin").mkdir(parents=True)
+    (root / "usr/lib/os-release").parent.mkdir(parents=True)
+    (root / "usr/lib/os-release").write_text("NAME=Ubuntu\n")
+    (root / "usr/bin/hello").write_text("#!/bin/sh\necho hello\n")
+    (root / "usr/bin/hello").chmod(0o755)
+    (root / "bin").symlink_to("usr/bin")
+    (root / "etc").mkdir()
+    (root / "etc/os-release").symlink_to("../usr/lib/os-release")
+    (root / "etc/absolute").symlink_to("/usr/lib/os-release")
+    (root / "etc/dangling").symlink_to("nowhere")
+    (root / "etc/loop").symlink_to("loop")
+    return root
+
+
+def test_build(rootfs):
+    index = RootfsIndex.build(rootfs, "sha256:digest")
+
+    entry = index.get("usr/bin/hello")
+    assert entry is not None
+    assert entry.type == "file"
+    assert entry.mode & 0o777 == 0o755
+    assert entry.size == len("#!/bin/sh\necho hello\n")
+    assert index.get(".") is not None
+    assert index.get("missing") is None
+
+
+@pytest.mark.parametrize(
+    ("path", "is_file"),
+    [
+        ("usr/bin/hello", True),
+        ("bin/hello", True),
+        ("/bin/hello", True),
+        ("usr/bin/../bin/hello", True),
+        ("etc/os-release", True),
+        ("etc/absolute", True),
+        ("bin", False),
+        ("etc/dangling", False),
+        ("etc/loop", False),
+        ("usr/bin/hello/foo", False),
+    ],
+)
+def test_is_file(rootfs, path, is_file):
+    index = RootfsIndex.build(rootfs, "sha256:digest")
+
+    assert index.is_file(path) == is_file
+
+
+def test_readlink(rootfs):
+    index = RootfsIndex.build(rootfs, "sha256:digest")
+
+    assert index.readlink("bin") == "usr/bin"
+    assert index.readlink("etc/absolute") == "/usr/lib/os-release"
+    assert index.readlink("bin/hello") is None
+    assert index.readlink("missing") is None
+    assert index.get("bin", follow_symlinks=False).type == "symlink"  # type: ignore[union-attr]
+    assert index.get("bin").type == "dir"  # type: ignore[union-attr]
+
+
+def test_symlinks(rootfs):
+    index = RootfsIndex.build(rootfs, "sha256:digest")
+
+    assert index.symlinks() == [
+        "bin",
+        "etc/absolute",
+        "etc/dangling",
+        "etc/loop",
+        "etc/os-release",
+    ]
+
+
+def test_glob(rootfs):
+    index = RootfsIndex.build(rootfs, "sha256:digest")
+
+    assert index.glob("etc", "*-release") == ["os-release"]
+    assert index.glob("bin", "*") == ["hello"]
+    assert index.glob(".", "[eu]*") == ["etc", "usr"]
+    assert index.glob("missing", "*") == []
+    assert index.glob("usr/bin/hello", "*") == []
+
+
+def test_sha256(rootfs, mocker):
+    index = RootfsIndex.build(rootfs, "sha256:digest")
+    spy_open = mocker.spy(type(rootfs), "open")
+
+    expected = hashlib.sha256(b"NAME=Ubuntu\n").hexdigest()
+    assert index.sha256("etc/os-release") == expected
+    assert index.sha256("usr/lib/os-release") == expected
+    assert index.sha256("usr") is None
+    # The hash is only computed once.
+    assert spy_open.call_count == 1
+
+
+def test_resolve(rootfs):
+    index = RootfsIndex.build(rootfs, "sha256:digest")
+
+    assert index.resolve("bin/hello") == "usr/bin/hello"
+    assert index.resolve("etc/os-release") == "usr/lib/os-release"
+    assert index.resolve("etc/os-release", follow_symlinks=False) == "etc/os-release"
+    assert index.resolve("/") == "."
+    assert index.resolve("etc/dangling") is None
+
+
+def test_extract_lazily(rootfs, mocker):
+    """Files are only extracted when they are read, and only once."""
+    index = RootfsIndex.build(rootfs, "sha256:digest")
+    mock_extract = mocker.Mock()
+    index.extract_lazily(mock_extract)
+
+    assert index.get("bin/hello") is not None
+    assert index.glob("bin", "*") == ["hello"]
+    assert index.file_path("usr") is None
+    mock_extract.assert_not_called()
+
+    assert index.file_path("bin/hello") == rootfs / "usr/bin/hello"
+    index.materialise(["etc/os-release", "bin/hello", "etc/dangling", "etc"])
+    assert index.sha256("usr/lib/os-release") is not None
+    assert mock_extract.mock_calls == [
+        mocker.call({"usr/bin/hello"}),
+        mocker.call({"usr/lib/os-release"}),
+    ]
+
+
+def test_save_load(rootfs, tmp_path):
+    index_file = tmp_path / "index.json"
+    index = RootfsIndex.build(rootfs, "sha256:digest", index_file=index_file)
+    index.save()
+    index.sha256("usr/bin/hello")
+    index.save()
+
+    loaded = RootfsIndex.load(index_file, rootfs, "sha256:digest")
+
+    assert loaded is not None
+    assert len(loaded) == len(index)
+    assert loaded.get("etc/absolute") == index.get("etc/absolute")
+    assert loaded.readlink("bin") == "usr/bin"
+    saved = json.loads(index_file.read_text())
+    assert saved["entries"]["usr/bin/hello"][-1] == index.sha256("usr/bin/hello")
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        None,
+        "not json",
+        '{"version": 1, "digest": "sha256:other", "entries": {}}',
+        '{"version": 0, "digest": "sha256:digest", "entries": {}}',
+    ],
+)
+def test_load_invalid(rootfs, tmp_path, content):
+    index_file = tmp_path / "index.json"
+    if content is not None:
+        index_file.write_text(content)
+
+    assert RootfsIndex.load(index_file, rootfs, "sha256:digest") is None
+
+
+def test_obtain(rootfs, tmp_path, mocker):
+    index_file = tmp_path / "index.json"
+    spy_build = mocker.spy(RootfsIndex, "build")
+
+    first = RootfsIndex.obtain(rootfs, index_file, "sha256:digest")
+    second = RootfsIndex.obtain(rootfs, index_file, "sha256:digest")
+    RootfsIndex.obtain(rootfs, index_file, "sha256:other")
+
+    assert len(first) == len(second)
+    assert spy_build.call_count == 2
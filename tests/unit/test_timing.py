@@ -0,0 +1,95 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import threading
+import time
+
+import pytest
+from rockcraft import timing
+
+
+@pytest.fixture
+def tracer():
+    tracer = timing.enable()
+    yield tracer
+    timing.disable()
+
+
+def test_span(tracer):
+    with timing.span("unpack image", "image", layers=2) as args:
+        args["bytes"] = 1024
+
+    assert len(tracer) == 1
+    metadata, event = tracer._events
+    assert metadata["ph"] == "M"
+    assert metadata["tid"] == threading.get_native_id()
+    assert event["name"] == "unpack image"
+    assert event["cat"] == "image"
+    assert event["ph"] == "X"
+    assert event["tid"] == threading.get_native_id()
+    assert event["dur"] >= 0
+    assert event["args"]["layers"] == 2
+    assert event["args"]["bytes"] == 1024
+    assert event["args"]["peak_rss"] > 0
+
+
+def test_span_error(tracer):
+    with pytest.raises(ValueError, match="failed"), timing.span("prune", "lifecycle"):
+        raise ValueError("failed")
+
+    assert len(tracer) == 1
+
+
+def test_add_span_threads(tracer):
+    start_ns = time.perf_counter_ns()
+
+    def _add_span() -> None:
+        timing.add_span("archive layer", "layer", start_ns)
+
+    thread = threading.Thread(target=_add_span, name="rockcraft-test")
+    thread.start()
+    thread.join()
+    timing.add_span("layer", "pack", start_ns)
+
+    assert len(tracer) == 2
+    thread_names = [
+        event["args"]["name"] for event in tracer._events if event["ph"] == "M"
+    ]
+    assert thread_names == ["rockcraft-test", threading.current_thread().name]
+
+
+def test_write(tracer, tmp_path):
+    with timing.span("pack", "command"):
+        pass
+    trace_file = tmp_path / "out/trace.json"
+
+    timing.write(trace_file)
+
+    data = json.loads(trace_file.read_text())
+    assert data["displayTimeUnit"] == "ms"
+    assert [event["name"] for event in data["traceEvents"]] == ["thread_name", "pack"]
+
+
+def test_disabled(tmp_path):
+    timing.disable()
+    with timing.span("pack", "command") as args:
+        args["bytes"] = 1
+    trace_file = tmp_path / "trace.json"
+
+    timing.write(trace_file)
+
+    assert not trace_file.exists()
@@ -0,0 +1,404 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import io
+import os
+import stat
+import tarfile
+from pathlib import Path
+
+import pytest
+from rockcraft import errors, unpack
+from rockcraft.compression import LayerCompression
+from rockcraft.rootfs import RootfsIndex, file_sha256
+
+_Entry = tuple[str, str, bytes | str | int | None]
+
+
+def _write_layer(
+    path: Path, entries: list[_Entry], *, compression: str | None = "gzip"
+) -> unpack.LayerArchive:
+    """Write a layer blob with ``entries`` of (name, type, content or target).
+
+    The content of directories is their mode, if not the default one.
+    """
+    output = io.BytesIO()
+    with tarfile.open(fileobj=output, mode="w", format=tarfile.PAX_FORMAT) as tar:
+        for name, entry_type, content in entries:
+            info = tarfile.TarInfo(name)
+            info.mtime = 1000
+            info.uid = info.gid = 1234
+            if entry_type == "dir":
+                info.type = tarfile.DIRTYPE
+                info.mode = content if isinstance(content, int) else 0o751
+                tar.addfile(info)
+            elif entry_type == "file":
+                assert isinstance(content, bytes)
+                info.mode = 0o4755
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+            else:
+                assert isinstance(content, str)
+                info.type = (
+                    tarfile.SYMTYPE if entry_type == "symlink" else tarfile.LNKTYPE
+                )
+                info.linkname = content
+                tar.addfile(info)
+
+    if compression is None:
+        path.write_bytes(output.getvalue())
+        return unpack.LayerArchive(path, "application/vnd.oci.image.layer.v1.tar")
+
+    layer_compression = LayerCompression(compression)  # type: ignore[arg-type]
+    with path.open("wb") as blob, layer_compression.open_writer(blob) as writer:
+        writer.write(output.getvalue())
+    return unpack.LayerArchive(path, layer_compression.media_type)
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd", None])
+def test_unpack_layers(tmp_path, compression):
+    layer = _write_layer(
+        tmp_path / "layer",
+        [
+            ("etc", "dir", None),
+            ("etc/hello.txt", "file", b"hello"),
+            ("usr/bin/tool", "file", b"#!/bin/sh\n"),
+            ("etc/link", "symlink", "hello.txt"),
+            ("etc/hardlink", "hardlink", "etc/hello.txt"),
+        ],
+        compression=compression,
+    )
+    rootfs = tmp_path / "rootfs"
+
+    unpack.unpack_layers([layer], rootfs)
+
+    assert (rootfs / "etc/hello.txt").read_bytes() == b"hello"
+    assert (rootfs / "usr/bin/tool").read_bytes() == b"#!/bin/sh\n"
+    assert (rootfs / "etc/link").readlink() == Path("hello.txt")
+    assert (rootfs / "etc/hardlink").stat().st_ino == (
+        rootfs / "etc/hello.txt"
+    ).stat().st_ino
+
+    etc_stat = (rootfs / "etc").stat()
+    assert stat.S_IMODE(etc_stat.st_mode) == 0o751
+    assert etc_stat.st_mtime == 1000
+    hello_stat = (rootfs / "etc/hello.txt").stat()
+    assert stat.S_IMODE(hello_stat.st_mode) == 0o4755
+    assert hello_stat.st_mtime == 1000
+    if os.geteuid() == 0:
+        assert (hello_stat.st_uid, hello_stat.st_gid) == (1234, 1234)
+        assert (etc_stat.st_uid, etc_stat.st_gid) == (1234, 1234)
+
+
+def test_unpack_layers_rootless(tmp_path):
+    layer = _write_layer(tmp_path / "layer", [("hello.txt", "file", b"hello")])
+    rootfs = tmp_path / "rootfs"
+
+    unpack.unpack_layers([layer], rootfs, rootless=True)
+
+    hello_stat = (rootfs / "hello.txt").stat()
+    assert (hello_stat.st_uid, hello_stat.st_gid) == (os.getuid(), os.getgid())
+
+
+def test_unpack_layers_rootless_read_only_dir(tmp_path, mocker):
+    """Without root, read-only directories are made writable to change them."""
+    layers = [
+        _write_layer(
+            tmp_path / "layer0",
+            [
+                ("ro", "dir", 0o555),
+                ("ro/lower.txt", "file", b"lower"),
+                ("ro/removed.txt", "file", b"removed"),
+                ("ro/sub", "dir", 0o555),
+                ("ro/sub/file.txt", "file", b"sub"),
+            ],
+        ),
+        _write_layer(
+            tmp_path / "layer1",
+            [
+                ("ro/upper.txt", "file", b"upper"),
+                ("ro/.wh.removed.txt", "file", b""),
+                ("ro/.wh.sub", "file", b""),
+            ],
+        ),
+    ]
+    rootfs = tmp_path / "rootfs"
+    spy_chmod = mocker.spy(unpack.Path, "chmod")
+
+    unpack.unpack_layers(layers, rootfs, rootless=True)
+
+    assert sorted(p.name for p in (rootfs / "ro").iterdir()) == [
+        "lower.txt",
+        "upper.txt",
+    ]
+    assert stat.S_IMODE((rootfs / "ro").stat().st_mode) == 0o555
+    # The directory was writable while the second layer was applied (which
+    # only matters when not running as root).
+    assert mocker.call(rootfs / "ro", 0o755) in spy_chmod.mock_calls
+
+
+def test_unpack_layers_whiteouts(tmp_path):
+    layers = [
+        _write_layer(
+            tmp_path / "layer0",
+            [
+                ("keep.txt", "file", b"keep"),
+                ("remove.txt", "file", b"remove"),
+                ("removed_dir/file.txt", "file", b"remove"),
+                ("opaque/lower.txt", "file", b"lower"),
+                ("replaced", "dir", None),
+                ("replaced/file.txt", "file", b"lower"),
+            ],
+        ),
+        _write_layer(
+            tmp_path / "layer1",
+            [
+                (".wh.remove.txt", "file", b""),
+                (".wh.removed_dir", "file", b""),
+                ("opaque/upper.txt", "file", b"upper"),
+                ("opaque/.wh..wh..opq", "file", b""),
+                ("replaced", "file", b"now a file"),
+            ],
+        ),
+    ]
+    rootfs = tmp_path / "rootfs"
+
+    unpack.unpack_layers(layers, rootfs)
+
+    assert sorted(str(p.relative_to(rootfs)) for p in rootfs.rglob("*")) == [
+        "keep.txt",
+        "opaque",
+        "opaque/upper.txt",
+        "replaced",
+    ]
+    assert (rootfs / "replaced").read_bytes() == b"now a file"
+
+
+def test_unpack_layers_symlinked_parents(tmp_path):
+    """Entries under symlinked directories are written to the symlinks' targets."""
+    layers = [
+        _write_layer(
+            tmp_path / "layer0",
+            [
+                ("usr/bin", "dir", None),
+                ("bin", "symlink", "usr/bin"),
+                ("escape", "symlink", "/../../.."),
+            ],
+        ),
+        _write_layer(
+            tmp_path / "layer1",
+            [
+                ("bin/tool", "file", b"tool"),
+                ("escape/etc/passwd", "file", b"inside"),
+                ("../outside.txt", "file", b"inside too"),
+            ],
+        ),
+    ]
+    rootfs = tmp_path / "rootfs"
+
+    unpack.unpack_layers(layers, rootfs)
+
+    assert (rootfs / "usr/bin/tool").read_bytes() == b"tool"
+    assert (rootfs / "bin").is_symlink()
+    assert (rootfs / "etc/passwd").read_bytes() == b"inside"
+    assert (rootfs / "outside.txt").read_bytes() == b"inside too"
+    assert not (tmp_path / "outside.txt").exists()
+
+
+def test_unpack_layers_sparse_file(tmp_path):
+    """Sparse files are unpacked with their holes."""
+    sparse_path = tmp_path / "sparse.img"
+    with sparse_path.open("wb") as sparse_file:
+        sparse_file.truncate(64 * 1024 * 1024)
+        sparse_file.write(b"data")
+
+    blob = io.BytesIO()
+    with tarfile.open(fileobj=blob, mode="w", format=tarfile.PAX_FORMAT) as tar:
+        info = tar.gettarinfo(sparse_path, "sparse.img")
+        # The GNU sparse 1.0 format, as written by ``layers.archive_layer()``.
+        info.name = "GNUSparseFile.0/sparse.img"
+        info.size = 512 + 512
+        info.pax_headers = {
+            "GNU.sparse.major": "1",
+            "GNU.sparse.minor": "0",
+            "GNU.sparse.name": "sparse.img",
+            "GNU.sparse.realsize": str(64 * 1024 * 1024),
+        }
+        data = b"2\n0\n4\n67108864\n0\n".ljust(512, b"\0") + b"data".ljust(512, b"\0")
+        tar.addfile(info, io.BytesIO(data))
+    layer_path = tmp_path / "layer"
+    layer_path.write_bytes(blob.getvalue())
+    rootfs = tmp_path / "rootfs"
+
+    unpack.unpack_layers(
+        [unpack.LayerArchive(layer_path, "application/vnd.oci.image.layer.v1.tar")],
+        rootfs,
+    )
+
+    unpacked = rootfs / "sparse.img"
+    assert unpacked.stat().st_size == 64 * 1024 * 1024
+    with unpacked.open("rb") as unpacked_file:
+        assert unpacked_file.read(4) == b"data"
+    assert unpacked.stat().st_blocks * 512 < 1024 * 1024
+
+
+def test_unpack_layers_many_layers(tmp_path, monkeypatch):
+    """Layers are applied in order, however many are decompressed ahead."""
+    monkeypatch.setattr(unpack, "_READ_AHEAD", 1)
+    layers = [
+        _write_layer(tmp_path / f"layer{i}", [("file.txt", "file", b"%d" % i * 5000)])
+        for i in range(10)
+    ]
+    rootfs = tmp_path / "rootfs"
+
+    unpack.unpack_layers(layers, rootfs)
+
+    assert (rootfs / "file.txt").read_bytes() == b"9" * 5000
+
+
+def test_unpack_layers_error(tmp_path):
+    layers = [
+        _write_layer(tmp_path / "layer0", [("file.txt", "file", b"foo")]),
+        unpack.LayerArchive(
+            tmp_path / "missing", "application/vnd.oci.image.layer.v1.tar+gzip"
+        ),
+    ]
+
+    with pytest.raises(
+        errors.ImageExtractionError, match="Cannot unpack layer missing"
+    ):
+        unpack.unpack_layers(layers, tmp_path / "rootfs")
+
+
+def test_unpack_layers_media_type(tmp_path):
+    (tmp_path / "layer").write_bytes(b"")
+    layer = unpack.LayerArchive(tmp_path / "layer", "application/x-foo")
+
+    with pytest.raises(errors.ImageExtractionError, match="'application/x-foo'"):
+        unpack.unpack_layers([layer], tmp_path / "rootfs")
+
+
+def _index_layers(tmp_path: Path) -> list[unpack.LayerArchive]:
+    return [
+        _write_layer(
+            tmp_path / "layer0",
+            [
+                ("etc", "dir", 0o755),
+                ("etc/hello.txt", "file", b"hello"),
+                ("etc/removed.txt", "file", b"removed"),
+                ("opaque/lower.txt", "file", b"lower"),
+                ("usr/bin", "dir", 0o755),
+                ("bin", "symlink", "usr/bin"),
+                ("replaced", "dir", None),
+                ("replaced/file.txt", "file", b"lower"),
+            ],
+        ),
+        _write_layer(
+            tmp_path / "layer1",
+            [
+                ("etc/.wh.removed.txt", "file", b""),
+                ("etc/hardlink", "hardlink", "etc/hello.txt"),
+                ("opaque/upper.txt", "file", b"upper"),
+                ("opaque/.wh..wh..opq", "file", b""),
+                ("bin/tool", "file", b"tool"),
+                ("replaced", "file", b"now a file"),
+            ],
+            compression="zstd",
+        ),
+    ]
+
+
+def test_index_layers(tmp_path):
+    """The index from the layers is the one of the unpacked root filesystem."""
+    layers = _index_layers(tmp_path)
+    rootfs = tmp_path / "rootfs"
+    unpack.unpack_layers(layers, rootfs)
+    expected = RootfsIndex.build(rootfs, "sha256:1")
+
+    index = unpack.index_layers(layers, tmp_path / "lazy", "sha256:1")
+
+    assert sorted(index.glob("", "*")) == sorted(expected.glob("", "*"))
+    for path in [
+        "etc/hello.txt",
+        "etc/hardlink",
+        "usr/bin/tool",
+        "bin/tool",
+        "opaque/upper.txt",
+        "replaced",
+    ]:
+        entry, expected_entry = index.get(path), expected.get(path)
+        assert entry is not None
+        assert expected_entry is not None
+        assert (entry.type, entry.mode, entry.size) == (
+            expected_entry.type,
+            expected_entry.mode,
+            expected_entry.size,
+        )
+        assert index.sha256(path) == file_sha256(rootfs / path)
+    assert index.readlink("bin") == "usr/bin"
+    assert index.glob("opaque", "*") == ["upper.txt"]
+    assert index.glob("etc", "*") == ["hardlink", "hello.txt"]
+    assert index.get("replaced/file.txt") is None
+    # Nothing was extracted to compute the hashes.
+    assert not (tmp_path / "lazy").exists()
+
+
+def test_index_layers_extract_lazily(tmp_path):
+    layers = _index_layers(tmp_path)
+    root = tmp_path / "lazy"
+    index = unpack.index_layers(layers, root, "sha256:1")
+    index.extract_lazily(
+        lambda paths: unpack.unpack_layers(layers, root, include=paths)
+    )
+
+    tool_path = index.file_path("bin/tool")
+    assert tool_path == root / "usr/bin/tool"
+    assert tool_path.read_bytes() == b"tool"
+    assert not (root / "etc/hello.txt").exists()
+
+    # Hard links are extracted along with the file they link to.
+    hardlink_path = index.file_path("etc/hardlink")
+    assert hardlink_path is not None
+    assert hardlink_path.read_bytes() == b"hello"
+    assert sorted(p.name for p in (root / "etc").iterdir()) == [
+        "hardlink",
+        "hello.txt",
+    ]
+    # The files extracted before are kept.
+    assert tool_path.read_bytes() == b"tool"
+
+
+def test_unpack_layers_include(tmp_path):
+    """Only the included entries are unpacked, where they end up in the rootfs."""
+    layers = _index_layers(tmp_path)
+    rootfs = tmp_path / "rootfs"
+
+    unpack.unpack_layers(layers, rootfs, include={"usr/bin/tool", "replaced"})
+
+    assert (rootfs / "usr/bin/tool").read_bytes() == b"tool"
+    assert (rootfs / "replaced").read_bytes() == b"now a file"
+    assert not (rootfs / "etc/hello.txt").exists()
+    assert not (rootfs / "opaque/lower.txt").exists()
+    assert not (rootfs / "opaque/upper.txt").exists()
+
+
+def test_index_layers_error(tmp_path):
+    (tmp_path / "layer").write_bytes(b"not a layer")
+    layer = unpack.LayerArchive(
+        tmp_path / "layer", "application/vnd.oci.image.layer.v1.tar+gzip"
+    )
+
+    with pytest.raises(errors.ImageExtractionError, match="Cannot read layer layer"):
+        unpack.index_layers([layer], tmp_path / "rootfs", "sha256:1")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+#
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark the unpacking of a base image.
+
+Compares ``umoci unpack``, which Rockcraft used to run, with the in-process
+unpacker of ``Image.extract_to()``, on an image in a local OCI layout. The
+Ubuntu bases can be copied to a layout with, for example:
+
+    skopeo copy docker://public.ecr.aws/ubuntu/ubuntu:24.04 oci:images/ubuntu:24.04
+
+Run as root to also compare the handling of ownership.
+
+Usage: tools/benchmarks/image_unpack.py [--rootless] [--runs N] IMAGE_DIR NAME:TAG...
+"""
+
+import argparse
+import subprocess
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from craft_cli import EmitterMode, emit
+from rockcraft import oci
+
+
+def _run(name: str, runs: int, unpack: Callable[[Path], object]) -> float:
+    """Unpack ``runs`` times to a new directory, returning the best time."""
+    times: list[float] = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            unpack(Path(tmp, "bundle"))
+            times.append(time.perf_counter() - start)
+    best = min(times)
+    print(f"{name:<24} {best:8.2f}s")
+    return best
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rootless", action="store_true", help="Unpack without preserving owners."
+    )
+    parser.add_argument("--runs", type=int, default=3, help="Runs of each unpacker.")
+    parser.add_argument("image_dir", type=Path, help="Directory of the OCI layouts.")
+    parser.add_argument("images", nargs="+", help="Images to unpack, as NAME:TAG.")
+    args = parser.parse_args()
+
+    emit.init(
+        EmitterMode.QUIET,
+        "image-unpack",
+        "",
+        log_filepath=Path(tempfile.gettempdir(), "image-unpack.log"),
+    )
+
+    rootless = ["--rootless"] if args.rootless else []
+    print(f"{'unpacker':<24} {'time':>9}")
+    for image_name in args.images:
+        image = oci.Image(image_name, args.image_dir)
+        print(image_name)
+        baseline = _run(
+            "umoci unpack",
+            args.runs,
+            lambda bundle, i=image_name: subprocess.run(
+                [
+                    "umoci",
+                    "unpack",
+                    *rootless,
+                    "--image",
+                    str(args.image_dir / i),
+                    str(bundle),
+                ],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            ),
+        )
+        elapsed = _run(
+            "Image.extract_to()",
+            args.runs,
+            lambda bundle, i=image: i.extract_to(bundle, rootless=args.rootless),
+        )
+        print(f"{'':<24} speedup: {baseline / elapsed:.1f}x")
+
+    emit.ended_ok()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+#
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2026 Canonical Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark the compression of a rock layer.
+
+Creates a synthetic prime directory (2GiB by default) made of text-like and
+incompressible files, and compares the single-threaded gzip compression that
+Rockcraft used to apply with the multi-threaded gzip and zstd writers.
+
+Usage: tools/benchmarks/layer_compression.py [--size MIB] [--threads N]
+    [--compression ALGORITHM[:LEVEL]]... [DIR]
+"""
+
+import argparse
+import gzip
+import os
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import BinaryIO
+
+from craft_cli import EmitterMode, emit
+from rockcraft import layers
+from rockcraft.compression import LayerCompression
+
+_FILE_SIZE = 4 * 1024 * 1024
+
+
+class _CountingWriter:
+    """Discard the compressed data, only counting it."""
+
+    def __init__(self) -> None:
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+def _create_prime_dir(prime_dir: Path, size: int) -> None:
+    """Fill ``prime_dir`` with ``size`` bytes of files, 3/4 of them compressible."""
+    text = b"".join(b"line %d: the quick brown fox\n" % i for i in range(200_000))
+    written = 0
+    index = 0
+    while written < size:
+        subdir = prime_dir / f"usr/lib/dir{index // 64}"
+        subdir.mkdir(parents=True, exist_ok=True)
+        if index % 4 == 3:  # noqa: PLR2004 (magic value)
+            content = os.urandom(_FILE_SIZE)
+        else:
+            content = (text * (_FILE_SIZE // len(text) + 1))[:_FILE_SIZE]
+        (subdir / f"file{index}").write_bytes(content)
+        written += len(content)
+        index += 1
+
+
+def _run(
+    name: str,
+    prime_dir: Path,
+    size: int,
+    open_writer: Callable[[BinaryIO], BinaryIO],
+) -> float:
+    output = _CountingWriter()
+    start = time.perf_counter()
+    with open_writer(output) as writer:  # type: ignore[arg-type]
+        layers.archive_layer(prime_dir, writer)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:<24} {elapsed:8.2f}s {size / elapsed / 2**20:9.1f} MiB/s "
+        f"{output.size / size:7.1%}"
+    )
+    return elapsed
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=2048, help="Layer size in MiB.")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--compression",
+        action="append",
+        type=LayerCompression.from_string,
+        help="Compression to compare with stdlib gzip (default: gzip:6 and zstd:3).",
+    )
+    parser.add_argument(
+        "dir", nargs="?", type=Path, help="Existing prime directory to compress."
+    )
+    args = parser.parse_args()
+
+    # archive_layer() logs every file it adds.
+    emit.init(
+        EmitterMode.QUIET,
+        "layer-compression",
+        "",
+        log_filepath=Path(tempfile.gettempdir(), "layer-compression.log"),
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prime_dir = args.dir
+        if prime_dir is None:
+            prime_dir = Path(tmp)
+            print(f"Creating {args.size}MiB of files in {prime_dir}...")
+            _create_prime_dir(prime_dir, args.size * 2**20)
+        size = sum(p.stat().st_size for p in prime_dir.rglob("*") if p.is_file())
+
+        print(f"{'compression':<24} {'time':>9} {'throughput':>15} {'ratio':>7}")
+        baseline = _run(
+            "gzip:6 (stdlib)",
+            prime_dir,
+            size,
+            lambda out: gzip.GzipFile(fileobj=out, mode="wb", compresslevel=6),
+        )
+        for compression in args.compression or [
+            LayerCompression("gzip"),
+            LayerCompression("zstd"),
+        ]:
+            elapsed = _run(
+                f"{compression} ({args.threads} threads)",
+                prime_dir,
+                size,
+                lambda out, c=compression: c.open_writer(out, threads=args.threads),
+            )
+            print(f"{'':<24} speedup: {baseline / elapsed:.1f}x")
+
+    emit.ended_ok()
+
+
+if __name__ == "__main__":
+    main()